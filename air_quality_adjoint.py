@@ -0,0 +1,195 @@
+###############################################################################
+# ADJOINT SENSITIVITIES
+###############################################################################
+
+# How much does the percentage change at a receptor move with each input? For
+# a receptor (one box of the street output, or weights over several) this
+# works out the gradient of its percentage change with respect to the
+# obstruction of the barriers, the new barrier's height and position, the
+# emissions and the backgrounds, for NO2 and PM2.5.
+#
+# The street output is a frequency-weighted combination of the percentage
+# changes of the 4 wind cases, each from an existing conditions system
+# A1 C1 = d1 and a new barrier one A2 C2 = d2. With the adjoint of each system
+# (one transposed solve with its LU factorisation, both pollutants together)
+# the derivative for any parameter p is
+#     sum over the systems of  lambda . (dd/dp - dA/dp C)
+# so no further solves are needed: dA/dp and dd/dp come from assembling the
+# systems again with p nudged either side (central differences).
+
+import json
+
+import numpy as np
+from scipy.linalg import lu_factor, lu_solve
+
+from air_quality_code import (assemble_systems, flip_column, flow_patterns, parallel_patterns, prepare_street,
+                              weighting_concs)
+from air_quality_solver import systems
+
+
+# the 4 wind cases: existing conditions and new barrier A matrix, the
+# frequency weighting them and whether their boxes are flipped back (the
+# cases dimensioned from right to left)
+wind_cases = [
+    ("a1_orig", "a2_orig", "LR_freq", False),
+    ("a1_mir", "a2_mir", "RL_freq", True),
+    ("a1_par_1", "a2_par_1", "LR_par_freq", False),
+    ("a1_par_2", "a2_par_2", "RL_par_freq", True),
+]
+
+# default step for the central differences (m for heights and positions,
+# which the geometry rounds to 4 decimals)
+default_step = 1e-3
+
+
+def receptor_weights(state, receptor):
+    """Weights on the percentage change of each box of the 4 wind cases.
+
+    receptor is an index into the street output (per_change_no2 or
+    per_change_pm25: the cells of row 1, then rows 2 and 3) or an array of
+    weights over all of it. Returns a (15,) array per new barrier A matrix,
+    such that the receptor's (weighted) percentage change is the sum over the
+    wind cases of weights . percentage change, as solve_street combines them.
+    """
+
+    # which column of each dimensioning every output cell takes its value
+    # from, numbered from 1 (worked out by weighting column numbers exactly
+    # as solve_street weights the percentage changes)
+    l_cumu_flipped = flip_column(l=state["l_mirror"], l_cumu=state["l_cumu_mirror"].copy())
+    columns = np.arange(1, 6, dtype=float)
+    zeros = np.zeros(5)
+    col_LR = weighting_concs(l_cumu_LR=state["l_cumu_original"], l_cumu_RL=l_cumu_flipped, C_LR=columns,
+                             C_LR_par=zeros, C_RL=zeros, C_RL_par=zeros,
+                             LR_freq=1, LR_par_freq=0, RL_freq=0, RL_par_freq=0)[0]
+    col_RL = weighting_concs(l_cumu_LR=state["l_cumu_original"], l_cumu_RL=l_cumu_flipped, C_LR=zeros,
+                             C_LR_par=zeros, C_RL=columns, C_RL_par=zeros,
+                             LR_freq=0, LR_par_freq=0, RL_freq=1, RL_par_freq=0)[0]
+    n_cells = len(col_LR)
+
+    g = np.zeros(3*n_cells)
+    if np.ndim(receptor) == 0:
+        g[receptor] = 1
+    else:
+        g[:] = receptor
+    g = g.reshape(3, n_cells)
+
+    weights = {}
+    for _, new, freq, flipped in wind_cases:
+        cols = (col_RL if flipped else col_LR).astype(int)
+        w = np.zeros(15)
+        for row in range(3):
+            for cell in np.flatnonzero(cols):
+                j = cols[cell] - 1
+                # flip_conc reverses the columns of each row
+                box = 5*row + (4 - j if flipped else j)
+                w[box] += state[freq]*g[row,cell]
+        weights[new] = w
+    return weights
+
+
+# ___________ nudged systems ___________
+
+def obstruction_systems(state, obs_original):
+    # systems with the given obstruction values (mirror image as
+    # barrier_obstruction flips them)
+    obs_mirror = np.asarray(obs_original, dtype=float)[[2, 3, 0, 1]]
+    nudged = dict(state)
+    nudged.update(flow_patterns(nudged, obs=(np.asarray(obs_original, dtype=float), obs_mirror)))
+    nudged.update(parallel_patterns(nudged))
+    return assemble_systems(nudged)
+
+
+def layout_systems(content, gi_loc=None):
+    # systems (with the rest of the street state) of the scenario laid out again
+    state, message = prepare_street(content, gi_loc)
+    if message is not None:
+        raise ValueError("Nudged street layout fails the checks: %s" % message)
+    return state
+
+
+def barrier_height_content(content, change):
+    # the scenario with the new barrier's height changed
+    objects = json.loads(content["objects"])
+    barriers = [item["gi4raq_barrier"] for item in objects if item.get("gi4raq_barrier")]
+    if not barriers:
+        raise ValueError("The street has no new barrier")
+    barriers[0][0]["height"] = str(float(barriers[0][0]["height"]) + change)
+    return dict(content, objects=json.dumps(objects))
+
+
+def nudged_systems(content, state, step):
+    """(name, systems at p + step, systems at p - step, step) for each parameter."""
+
+    obs = np.asarray(state["obs_original"], dtype=float)
+    for k in range(len(obs)):
+        nudge = np.zeros(len(obs))
+        nudge[k] = step
+        yield ("obs_original", obstruction_systems(state, obs + nudge), obstruction_systems(state, obs - nudge), step)
+
+    yield ("barrier_height", layout_systems(barrier_height_content(content, step)),
+           layout_systems(barrier_height_content(content, -step)), step)
+    yield ("gi_loc", layout_systems(content, state["gi_loc"] + step),
+           layout_systems(content, state["gi_loc"] - step), step)
+
+    # all emissions scaled by 1 +/- step: the derivative is per unit relative
+    # change in emissions
+    emissions = ["ez_tot_no2_orig", "ez_tot_no2_mir", "ez_tot_pm25_orig", "ez_tot_pm25_mir"]
+    yield ("emissions", assemble_systems(dict(state, **{k: state[k]*(1 + step) for k in emissions})),
+           assemble_systems(dict(state, **{k: state[k]*(1 - step) for k in emissions})), step)
+
+    # both backgrounds changed by step ug/m3 (each only enters its own pollutant)
+    yield ("background", assemble_systems(dict(state, cB_no2=state["cB_no2"] + step, cB_pm25=state["cB_pm25"] + step)),
+           assemble_systems(dict(state, cB_no2=state["cB_no2"] - step, cB_pm25=state["cB_pm25"] - step)), step)
+
+
+def adjoint_sensitivities(content, receptor, step=default_step):
+    """Gradient of the percentage change at a receptor, by the adjoint method.
+
+    content is the decoded scenario (as for compute_street) and receptor an
+    index into, or weights over, the street output (see receptor_weights).
+    Returns {"no2": ..., "pm25": ...}, each a dictionary with the receptor's
+    percentage change ("value") and its derivatives with respect to
+    "obs_original" (the 4 obstruction values), "barrier_height" and "gi_loc"
+    (per m), "emissions" (per unit relative change in all emissions) and
+    "background" (per ug/m3).
+    """
+
+    state, message = prepare_street(content)
+    if message is not None:
+        raise ValueError(message)
+    weights = receptor_weights(state, receptor)
+
+    # each system factorised once, solved for both pollutants, and its
+    # adjoint found with one transposed solve
+    rhs_names = dict(systems)
+    concs = {}
+    adjoints = {}
+    value = np.zeros(2)
+    for existing, new, _, _ in wind_cases:
+        lus = {}
+        for a_name in (existing, new):
+            lus[a_name] = lu_factor(state[a_name])
+            concs[a_name] = lu_solve(lus[a_name], np.stack([state[d_name] for d_name, _ in rhs_names[a_name]], axis=-1))
+
+        c1 = concs[existing]
+        c2 = concs[new]
+        w = weights[new][:,None]
+        value += (w*100*(c2 - c1)/c1).sum(axis=0)
+        adjoints[new] = lu_solve(lus[new], 100*w/c1, trans=1)
+        adjoints[existing] = lu_solve(lus[existing], -100*w*c2/c1**2, trans=1)
+
+    gradients = {}
+    for name, plus, minus, h in nudged_systems(content, state, step):
+        total = np.zeros(2)
+        for a_name, names in systems:
+            da = (plus[a_name] - minus[a_name])/(2*h)
+            dd = np.stack([plus[d_name] - minus[d_name] for d_name, _ in names], axis=-1)/(2*h)
+            total += (adjoints[a_name]*(dd - da @ concs[a_name])).sum(axis=0)
+        gradients.setdefault(name, []).append(total)
+
+    sensitivities = {}
+    for k, pollutant in enumerate(("no2", "pm25")):
+        sensitivities[pollutant] = {"value": value[k]}
+        for name, totals in gradients.items():
+            sensitivities[pollutant][name] = np.array([t[k] for t in totals]) if len(totals) > 1 else totals[0][k]
+    return sensitivities
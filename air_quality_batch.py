@@ -0,0 +1,171 @@
+###############################################################################
+# BATCH RUNS OF THE AIR QUALITY CODE
+###############################################################################
+
+# Re-runs many stored scenarios in one go, e.g. after the met data or the
+# emission factors have been updated.
+#
+#   python air_quality_batch.py scenarios.jsonl --output results.jsonl
+#   python air_quality_batch.py stored_projects/ --workers 8
+#   python air_quality_batch.py scenarios.jsonl --met-store meteorology/met_store.bin
+#
+# The input is either a JSONL file (one scenario per line) or a directory of
+# scenario files (*.json, one scenario each, taken in name order). A scenario
+# may be the JSON the user interface builds or the base64 string it passes on
+# the command line.
+#
+# One JSON line is written per scenario, in input order:
+#   {"index": 0, "source": "scenarios.jsonl:1", "status": "ok", "result": {...}}
+#   {"index": 1, "source": "scenarios.jsonl:2", "status": "error",
+#    "error": {"stage": "Column dimensioning", "code": "2.1", "message": "..."}}
+# Calculations that raise are reported with stage "exception" and the
+# exception name as the code.
+
+import argparse
+import base64
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import air_quality_code
+
+
+# ___________ reading scenarios ___________
+
+def decode_scenario(text):
+    # JSON from the user interface, or the base64 string of it; a ValueError
+    # says which of them failed
+    text = text.strip()
+    try:
+        content = json.loads(text)
+    except json.JSONDecodeError as json_error:
+        try:
+            content = json.loads(base64.b64decode(text, validate=True).decode("utf8"))
+        except ValueError as base64_error:
+            raise ValueError("neither JSON (%s) nor base64 encoded JSON (%s)" % (json_error, base64_error))
+    if not isinstance(content, dict):
+        raise ValueError("a scenario is a JSON object, not %s" % type(content).__name__)
+    return content
+
+def read_scenarios(path):
+    """Yield (source, text) for every scenario in a JSONL file or directory."""
+    
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".json"):
+                with open(os.path.join(path, name), encoding="utf8") as f:
+                    yield name, f.read()
+    else:
+        with open(path, encoding="utf8") as f:
+            for n, line in enumerate(f, start=1):
+                if line.strip():
+                    yield "%s:%d" % (os.path.basename(path), n), line
+
+
+# ___________ running one scenario ___________
+
+# e.g. "Column dimensioning error 2.1: column 2 extends ..." or
+#      "Column dimensioning error: 7.1: total column widths ..."
+error_pattern = re.compile(r"^(?P<stage>.+?) error:? ?(?P<code>\d+(\.\d+)?)?: ?")
+
+def structured_error(message):
+    match = error_pattern.match(message)
+    if match is None:
+        return {"stage": None, "code": None, "message": message}
+    return {"stage": match.group("stage"), "code": match.group("code"), "message": message}
+
+def analyse_chunk(jobs):
+    """Records for a chunk of jobs, with all their systems solved in one stacked call."""
+    
+    records = [{"index": index, "source": source} for index, source, _ in jobs]
+    
+    contents = []
+    for record, (_, _, text) in zip(records, jobs):
+        try:
+            contents.append(decode_scenario(text))
+        except ValueError as e:
+            record["status"] = "error"
+            record["error"] = {"stage": "input", "code": None, "message": "Invalid scenario: %s" % e}
+    
+    decoded = [record for record in records if "status" not in record]
+    for record, street in zip(decoded, air_quality_code.run_scenarios(contents)):
+        if "exception" in street:
+            record["status"] = "error"
+            record["error"] = {"stage": "exception", "code": street["exception"],
+                               "message": street["error"]}
+        elif "error" in street:
+            record["status"] = "error"
+            record["error"] = structured_error(street["error"])
+        else:
+            record["status"] = "ok"
+            record["result"] = street
+    
+    return records
+
+def warm_worker(met_store=None):
+    if met_store is not None:
+        air_quality_code.use_met_store(met_store)
+    # met station locations are shared by every scenario, so read them up front
+    air_quality_code.load_sites()
+
+
+# ___________ running the batch ___________
+
+def run_batch(path, output, workers=None, chunksize=None, met_store=None):
+    """Run every scenario in path across a process pool, writing JSON lines to output.
+    
+    Returns (number of scenarios, number of errors, seconds taken).
+    """
+    
+    start = time.perf_counter()
+    jobs = [(index, source, text) for index, (source, text) in enumerate(read_scenarios(path))]
+    
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        # a few chunks per worker keeps them all busy without much hand-over overhead
+        chunksize = max(1, len(jobs)//(workers*4))
+    
+    # each chunk goes to a worker as a whole and is solved in one stacked call
+    chunks = [jobs[i:i + chunksize] for i in range(0, len(jobs), chunksize)]
+    
+    n_errors = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_worker,
+                             initargs=(met_store,)) as pool:
+        for records in pool.map(analyse_chunk, chunks):
+            for record in records:
+                if record["status"] == "error":
+                    n_errors += 1
+                output.write(json.dumps(record) + "\n")
+    
+    return len(jobs), n_errors, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a batch of GI4RAQ street scenarios.")
+    parser.add_argument("scenarios", help="JSONL file or directory of .json scenario files")
+    parser.add_argument("--output", "-o", default="-", help="results JSONL (default: stdout)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="scenarios handed to a worker at a time")
+    parser.add_argument("--met-store", default=None,
+                        help="local met store file (see air_quality_met.py) instead of downloading the met data")
+    args = parser.parse_args(argv)
+    
+    if args.output == "-":
+        n, n_errors, seconds = run_batch(args.scenarios, sys.stdout, args.workers, args.chunksize,
+                                         args.met_store)
+    else:
+        with open(args.output, "w", encoding="utf8") as output:
+            n, n_errors, seconds = run_batch(args.scenarios, output, args.workers, args.chunksize,
+                                             args.met_store)
+    
+    print("%d scenarios (%d errors) in %.2f s: %.1f scenarios/s"
+          % (n, n_errors, seconds, n/seconds if seconds > 0 else 0), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
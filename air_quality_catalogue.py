@@ -0,0 +1,282 @@
+###############################################################################
+# RANKING A CATALOGUE OF BARRIERS
+###############################################################################
+
+# Which of a list of candidate barriers (hedges, walls, hedges with trees, in
+# different places, heights and species) does most for a street? Every design
+# shares the street without the new barrier: the climatology, the emissions,
+# the existing barriers (eb_up/eb_down) and the existing conditions systems
+# (a1_*). These are worked out once and only the part that depends on the new
+# barrier is evaluated for each design.
+#
+#   python air_quality_catalogue.py base.json catalogue.jsonl --boxes boxes.csv
+#
+# The catalogue holds one design per line (or a JSON list): a new barrier as
+# the user interface writes it into gi4raq_barrier (type, height, obst,
+# seasonality, tcth, ...), with optionally the receptor zone it stands in
+# ("zone", default that of the base scenario's barrier) and a "name". Fields
+# not given are those of the base scenario's barrier, so a design can be as
+# short as {"obst": "90"}.
+#
+# The new barrier's height and position set the rows and columns of boxes, so
+# the baseline is only shared by designs with the same footprint: designs are
+# grouped by their layout and each group laid out once, its existing
+# conditions matrices factorised once. Within a group only the obstruction of
+# each design differs; its new barrier flows are worked out, its new barrier
+# systems assembled together with those of the rest of the group in one
+# stacked call, and solved as low-rank updates of the existing conditions
+# ones (see air_quality_solver.solve_barrier_designs).
+
+import argparse
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+
+import air_quality_code
+from air_quality_batch import decode_scenario
+from air_quality_code import (a_matrix, barrier_obstruction, d_vector, new_barrier_flows, new_barrier_parallel,
+                              prepare_street, ratios, run_solve_street, street_geometry, system_cases,
+                              system_emissions, system_geometry)
+from air_quality_optimise import receptor_weights, zone_extents
+from air_quality_solver import barrier_updates, solve_barrier_designs, solve_systems
+from air_quality_sweep import table_rows
+
+
+# geometry of the street the new barrier changes: rows, columns and zones
+footprint_keys = ["row_original", "zone_original", "bar_original", "check_original", "rec_original",
+                  "row_mirror", "zone_mirror", "bar_mirror", "check_mirror", "rec_mirror"]
+
+ranking_columns = ["rank", "design", "zone", "type", "height", "obst", "feasible", "error", "no2", "pm25",
+                   "objective"]
+
+
+# ___________ the designs ___________
+
+def load_catalogue(text):
+    """Designs from a JSON list or one JSON object per line."""
+
+    text = text.strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def design_content(base, design):
+    """The base scenario with its new barrier replaced by design."""
+
+    objects = json.loads(base["objects"])
+    by_name = {item["name"]: item for item in objects}
+    zone = next((item for item in objects if item.get("gi4raq_barrier")), None)
+
+    barrier = dict(zone["gi4raq_barrier"][0]) if zone is not None else {}
+    barrier.update({key: value for key, value in design.items() if key not in ("zone", "name")})
+    target = by_name.get(design["zone"]) if "zone" in design else zone
+    if target is None or target["type"] != "receptor_zone":
+        raise ValueError("Design %s has no receptor zone to stand in" % design.get("name"))
+
+    if zone is not None:
+        zone["gi4raq_barrier"] = []
+    target["gi4raq_barrier"] = [barrier]
+    # keep it within its zone
+    barrier["where_in_zone"] = str(float(min(float(barrier.get("where_in_zone", 0)), float(target["width"]))))
+    return dict(base, objects=json.dumps(objects)), target["name"], barrier
+
+
+def footprint(content):
+    # what the new barrier changes of the layout: designs with the same
+    # footprint share everything but their obstruction
+    geometry = street_geometry(json.loads(content["objects"]))
+    return tuple(tuple(np.asarray(geometry[key]).tolist()) for key in footprint_keys)
+
+
+# ___________ the new barrier part ___________
+
+def new_barrier_states(state, contents):
+    # the states of designs sharing the layout of state: only the new barrier
+    # (and so the obstruction, flows and systems depending on it) differs
+    designs = []
+    for content in contents:
+        design = dict(state)
+        design["gi"] = street_geometry(json.loads(content["objects"]))["gi"]
+        obs_original, obs_mirror = barrier_obstruction(design)
+        design.update(new_barrier_flows(design, obs_original, obs_mirror))
+        design.update(new_barrier_parallel(design, obs_original, obs_mirror))
+        designs.append(design)
+    return designs
+
+
+def new_barrier_systems(designs):
+    """Assemble the new barrier systems (a2_*) of many designs in one call.
+
+    Each design gets its a2_* matrices and d2_*/d4_* right-hand sides; the
+    existing conditions systems are left as they are.
+    """
+
+    new = [k for k, case in enumerate(system_cases) if case[0] in barrier_updates]
+    h, l, u, U, w, W = (np.concatenate(x) for x in zip(*[[g[new] for g in system_geometry(design)]
+                                                         for design in designs]))
+    ez_no2, ez_pm25 = (np.concatenate(x) for x in zip(*[[e[new] for e in system_emissions(design)]
+                                                        for design in designs]))
+    cB_no2 = np.repeat([design["cB_no2"] for design in designs], len(new))
+    cB_pm25 = np.repeat([design["cB_pm25"] for design in designs], len(new))
+
+    a = a_matrix(r=ratios(h=h, l=l), u=u, U=U, w=w, W=W)
+    d_no2 = d_vector(ez=ez_no2, l=l, w=w, W=W, cB=cB_no2)
+    d_pm25 = d_vector(ez=ez_pm25, l=l, w=w, W=W, cB=cB_pm25)
+
+    for i, design in enumerate(designs):
+        for j, k in enumerate(new):
+            a_name, no2_name, pm25_name = system_cases[k][:3]
+            design[a_name] = a[i*len(new) + j]
+            design[no2_name] = d_no2[i*len(new) + j]
+            design[pm25_name] = d_pm25[i*len(new) + j]
+    return designs
+
+
+def group_streets(state, contents):
+    # streets of the designs of one footprint group: the existing conditions
+    # concentrations solved once, those of each design as updates of them
+    designs = new_barrier_systems(new_barrier_states(state, contents))
+    existing = solve_systems(state)
+    streets = []
+    for design, concs in zip(designs, solve_barrier_designs(state, designs)):
+        streets.append(run_solve_street(design, dict(existing, **concs)))
+    return streets
+
+
+# ___________ ranking ___________
+
+def design_streets(base, designs):
+    """Street output of each design of the catalogue (see the top of this file).
+
+    Returns (streets, info): one street dictionary (or {"error": message})
+    and one (zone, barrier) per design, in order.
+    """
+
+    streets = [None]*len(designs)
+    info = [(None, {})]*len(designs)
+    groups = {}
+    for i, design in enumerate(designs):
+        try:
+            content, zone, barrier = design_content(base, design)
+            info[i] = (zone, barrier)
+            groups.setdefault(footprint(content), []).append((i, content))
+        except Exception as e:
+            streets[i] = {"error": "Design error: %s: %s" % (type(e).__name__, e)}
+
+    for members in groups.values():
+        indices = [i for i, _ in members]
+        contents = [content for _, content in members]
+        try:
+            state, message = prepare_street(contents[0])
+        except Exception as e:
+            message = "%s: %s" % (type(e).__name__, e)
+        if message is not None:
+            for i in indices:
+                streets[i] = {"error": message}
+            continue
+        try:
+            group = group_streets(state, contents)
+        except Exception:
+            # one bad design (e.g. singular system) spoils the batch, so go
+            # design by design
+            group = []
+            for content in contents:
+                try:
+                    group.extend(group_streets(state, [content]))
+                except Exception as e:
+                    group.append(air_quality_code.exception_error(e))
+        for i, street in zip(indices, group):
+            streets[i] = street
+
+    return streets, info
+
+
+def rank_designs(base, designs, no2_weight=1, pm25_weight=1, zones=None, rows=(1,)):
+    """Rank a catalogue of new barrier designs for one street.
+
+    base is the decoded scenario (as for compute_street) and designs a list
+    of barrier dictionaries (see the top of this file). The objective is
+    no2_weight*no2 + pm25_weight*pm25, the NO2 and PM2.5 percentage changes
+    averaged over the boxes of the receptor zones given (default: all of
+    them) in the rows given, as in air_quality_optimise.
+
+    Returns (ranking, boxes): one row per design, best first (see
+    ranking_columns; infeasible designs last), and the percentage change of
+    every box of every design, in the same order (columns as in
+    air_quality_sweep's table, the design's rank first).
+    """
+
+    extents = zone_extents(json.loads(base["objects"]))
+    if zones is None:
+        zones = [item["name"] for item in json.loads(base["objects"]) if item["type"] == "receptor_zone"]
+    receptors = [extents[name] for name in zones]
+
+    streets, info = design_streets(base, designs)
+
+    records = []
+    for i, (design, street, (zone, barrier)) in enumerate(zip(designs, streets, info)):
+        record = {"design": design.get("name", barrier.get("name", i)), "zone": zone, "type": barrier.get("type"),
+                  "height": barrier.get("height"), "obst": barrier.get("obst"), "feasible": "error" not in street,
+                  "error": street.get("error"), "no2": np.nan, "pm25": np.nan}
+        if record["feasible"]:
+            weights = receptor_weights(street, receptors, rows)
+            record["no2"] = weights @ np.asarray(street["per_change_no2"])
+            record["pm25"] = weights @ np.asarray(street["per_change_pm25"])
+        records.append(record)
+
+    ranking = pd.DataFrame(records)
+    ranking["objective"] = no2_weight*ranking["no2"] + pm25_weight*ranking["pm25"]
+    order = ranking.sort_values("objective", kind="stable", na_position="last").index
+    ranking = ranking.loc[order].reset_index(drop=True)
+    ranking["rank"] = np.arange(1, len(ranking) + 1)
+
+    names = ["design"]
+    box_rows = []
+    for rank, i in enumerate(order, 1):
+        box_rows.extend(table_rows(rank, {"design": ranking.at[rank - 1, "design"]}, names, streets[i]))
+    boxes = pd.DataFrame(box_rows, columns=["rank"] + names + ["status", "error", "row", "cell", "x_min", "x_max",
+                                                               "z_min", "z_max", "per_change_no2",
+                                                               "per_change_pm25"])
+    return ranking[ranking_columns], boxes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rank a catalogue of new barrier designs for a street.")
+    parser.add_argument("base", help="scenario file (JSON or base64)")
+    parser.add_argument("catalogue", help="designs: a JSON list or one JSON object per line")
+    parser.add_argument("--no2-weight", type=float, default=1, help="weight of the NO2 %% change")
+    parser.add_argument("--pm25-weight", type=float, default=1, help="weight of the PM2.5 %% change")
+    parser.add_argument("--zones", default=None,
+                        help="receptor zones to average over, comma separated (default: all)")
+    parser.add_argument("--rows", default="1", help="rows of boxes to average over, comma separated")
+    parser.add_argument("--output", "-o", default="-", help="ranking CSV (default: stdout)")
+    parser.add_argument("--boxes", default=None, help="CSV file for the change in every box of every design")
+    parser.add_argument("--met-store", default=None,
+                        help="local met store file (see air_quality_met.py) instead of downloading the met data")
+    args = parser.parse_args(argv)
+
+    if args.met_store is not None:
+        air_quality_code.use_met_store(args.met_store)
+    with open(args.base, encoding="utf8") as f:
+        base = decode_scenario(f.read())
+    with open(args.catalogue, encoding="utf8") as f:
+        designs = load_catalogue(f.read())
+
+    zones = args.zones.split(",") if args.zones else None
+    rows = tuple(int(r) for r in args.rows.split(","))
+    ranking, boxes = rank_designs(base, designs, args.no2_weight, args.pm25_weight, zones, rows)
+
+    if args.output == "-":
+        ranking.to_csv(sys.stdout, index=False)
+    else:
+        ranking.to_csv(args.output, index=False)
+    if args.boxes is not None:
+        boxes.to_csv(args.boxes, index=False)
+    print("%d designs ranked, %d feasible" % (len(ranking), ranking["feasible"].sum()), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
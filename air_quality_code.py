@@ -37,11 +37,12 @@
 
 # import necessary packages
 import numpy as np
+import argparse
 import base64
 import json
-from scipy.linalg import solve
 import math as math
 from statistics import mean
+from functools import lru_cache
 
 # note: there will be a warning symbol for 'import sys' if you are using a static
 # string below to obtain user info, but sys is needed for dynamic base64 
@@ -49,324 +50,138 @@ from statistics import mean
 import sys
 
 # for met data
-from shapely.geometry import Point, MultiPoint
-from shapely.ops import nearest_points
 import pandas as pd
-
-# set container for error flags - this will be checked before final calculations
-error = np.zeros((10,10))
+from air_quality_met import MetStore, StationIndex, sector_climatology
+from air_quality_solver import solve_stacked, solve_systems, solve_systems_many, systems as solver_systems
 
 ###############################################################################
-# DATA FROM USER INTERFACE CONTAINING INFORMATION ON STREET LAYOUT
+# METEOROLOGICAL DATA
 ###############################################################################
 
-# ___________ dynamic info from user interface ___________
-#if using a dynamic base64 string (fed from the user interface) use line below 
-content = json.loads(base64.b64decode(sys.argv[1]).decode('utf8'))
-
-# ___________ static info for testing purposes ___________
-# if using your own generated base64 string
-# 1) comment out line 65
-# 2) uncomment line 73 and assign a string to base64_test
-# 3) uncomment line 76 (decode the string and store as content)
-
-#base64_test = "eyJpZCI6MzcwLCJwcm9qZWN0c19pZCI6OTcsImF1dGhvcl9pZCI6NDIsImxhdCI6IjUyLjQ2NyIsImxuZyI6Ii0xLjkyOCIsIm5hbWUiOiJUZXN0IHdpdGggSGVsZW4gMDgwMTIwMjEiLCJ0YWciOiJhbmFseXNpcy0xLTEtMSIsIndpbmQiOiJOIiwib2JqZWN0cyI6Ilt7XCJ0eXBlXCI6XCJidWlsZGluZ1wiLFwibmFtZVwiOlwiQkwxXCIsXCJvcmRlclwiOjAsXCJsb2NrZWRcIjp0cnVlLFwiaGVpZ2h0XCI6XCI4LjBcIixcIndpZHRoXCI6MixcInNpZGVcIjpcImxlZnRcIixcIndoZXJlXCI6XCJzdHJlZXR0b2VuZFwifSx7XCJ0eXBlXCI6XCJyZWNlcHRvcl96b25lXCIsXCJuYW1lXCI6XCJSWkJMMVwiLFwib3JkZXJcIjoxLFwibG9ja2VkXCI6dHJ1ZSxcImF0dGFjaGVkVG9CdWlsZGluZ1wiOnRydWUsXCJ3aWR0aFwiOlwiMlwiLFwic2lkZVwiOlwibGVmdFwiLFwid2hlcmVcIjpcInN0cmVldHRvZW5kXCIsXCJleGlzdGluZ19iYXJyaWVyXCI6W119LHtcInR5cGVcIjpcIm1hcmtlclwiLFwibmFtZVwiOlwiU3RyZWV0IEJvdW5kYXJ5IDFcIixcInN1YnR5cGVcIjpcImVkZ2VcIixcIm9yZGVyXCI6MixcImxvY2tlZFwiOnRydWUsXCJzaWRlXCI6XCJsZWZ0XCJ9LHtcInR5cGVcIjpcInJlY2VwdG9yX3pvbmVcIixcIm5hbWVcIjpcIlJaMVwiLFwib3JkZXJcIjoxLFwibG9ja2VkXCI6ZmFsc2UsXCJ3aWR0aFwiOlwiM1wiLFwic2lkZVwiOlwibGVmdFwiLFwid2hlcmVcIjpcInN0cmVldHRva2VyYlwiLFwiZ2k0cmFxX2JhcnJpZXJcIjpbXX0se1widHlwZVwiOlwibWFya2VyXCIsXCJuYW1lXCI6XCJLZXJiIDFcIixcInN1YnR5cGVcIjpcImtlcmJcIixcIm9yZGVyXCI6MixcImxvY2tlZFwiOmZhbHNlLFwic2lkZVwiOlwibGVmdFwifSx7XCJ0eXBlXCI6XCJlbWlzc2lvbnNfem9uZVwiLFwibmFtZVwiOlwiRVoxXCIsXCJvcmRlclwiOjMsXCJsb2NrZWRcIjpmYWxzZSxcIndpZHRoXCI6XCIxNlwiLFwiY3VycmVudF9leHBvc3VyZV9ubzJcIjpudWxsLFwiY3VycmVudF9leHBvc3VyZV9QTTJfNVwiOm51bGwsXCJ0cmFmZmljXCI6XCI2MDBcIixcInNpZGVcIjpcInJpZ2h0XCIsXCJoYXNFbWlzc2lvbnNcIjpmYWxzZSxcIndoZXJlXCI6XCJrZXJidG9rZXJiXCIsXCJOTzJcIjpudWxsLFwiUE0yNVwiOm51bGwsXCJ2bW92ZW1lbnRcIjpcIjYwMFwiLFwiY3VycmVudF9lbWlzc2lvbnNfUE0yXzVcIjpudWxsLFwiY3VycmVudF9lbWlzc2lvbnNfbm8yXCI6bnVsbH0se1widHlwZVwiOlwibWFya2VyXCIsXCJuYW1lXCI6XCJLZXJiIDJcIixcInN1YnR5cGVcIjpcImtlcmJcIixcIm9yZGVyXCI6MixcImxvY2tlZFwiOmZhbHNlLFwic2lkZVwiOlwicmlnaHRcIn0se1widHlwZVwiOlwicmVjZXB0b3Jfem9uZVwiLFwibmFtZVwiOlwiUloyXCIsXCJvcmRlclwiOjEsXCJsb2NrZWRcIjpmYWxzZSxcIndpZHRoXCI6XCI1XCIsXCJzaWRlXCI6XCJyaWdodFwiLFwid2hlcmVcIjpcInN0cmVldHRva2VyYlwiLFwiZ2k0cmFxX2JhcnJpZXJcIjpbe1wibmFtZVwiOlwiSGVkZ2VcIixcInR5cGVcIjpcImdyZWVuLWJhcnJpZXJcIixcIndoZXJlX2luX3pvbmVcIjpcIjBcIixcImhlaWdodFwiOlwiMlwiLFwid2lkdGhcIjpcIjFcIixcIm9ic3RcIjpcIjc1XCIsXCJzZWFzXCI6bnVsbCxcInNlYXNvbmFsaXR5XCI6XCJldmVyZ2VlblwiLFwiYWFwXCI6bnVsbCxcImFhbVwiOm51bGwsXCJlbGlmZVwiOm51bGwsXCJ0YWFwXCI6bnVsbCxcInRjdGhcIjpudWxsLFwidGNiaFwiOm51bGwsXCJ0Y3dcIjpudWxsLFwidGFhbVwiOm51bGwsXCJ0Zm9ybVwiOm51bGwsXCJ0c2Vhc1wiOm51bGwsXCJ0c3BlY2llc1wiOm51bGwsXCJ0ZWxpZmVcIjpudWxsLFwidHNwXCI6bnVsbCxcInRvYnN0XCI6bnVsbCxcIm9yZGVyXCI6MH1dfSx7XCJ0eXBlXCI6XCJtYXJrZXJcIixcIm5hbWVcIjpcIlN0cmVldCBCb3VuZGFyeSAyXCIsXCJzdWJ0eXBlXCI6XCJlZGdlXCIsXCJvcmRlclwiOjQsXCJsb2NrZWRcIjp0cnVlLFwic2lkZVwiOlwicmlnaHRcIn0se1widHlwZVwiOlwicmVjZXB0b3Jfem9uZVwiLFwibmFtZVwiOlwiUlpCTDJcIixcIm9yZGVyXCI6NSxcImxvY2tlZFwiOnRydWUsXCJhdHRhY2hlZFRvQnVpbGRpbmdcIjp0cnVlLFwid2lkdGhcIjpcIjFcIixcInNpZGVcIjpcInJpZ2h0XCIsXCJ3aGVyZVwiOlwic3RyZWV0dG9lbmRcIixcImV4aXN0aW5nX2JhcnJpZXJcIjpbXX0se1widHlwZVwiOlwiYnVpbGRpbmdcIixcIm5hbWVcIjpcIkJMMlwiLFwib3JkZXJcIjo2LFwibG9ja2VkXCI6dHJ1ZSxcImhlaWdodFwiOlwiMTAuMFwiLFwid2lkdGhcIjoyLFwic2lkZVwiOlwicmlnaHRcIixcIndoZXJlXCI6XCJzdHJlZXR0b2VuZFwifV0iLCJsb2NrZWQiOm51bGwsIlBNMjUiOjExLCJOTzIiOjE1LCJjcmVhdGVkX2F0IjoiMjAyMS0wMS0wOCAxMzo1MDo1MiIsInVwZGF0ZWRfYXQiOiIyMDIxLTAxLTExIDExOjU5OjU4IiwiZGVsZXRlZF9hdCI6bnVsbCwibm8yX2JnX2NvbmNlbnRyYXRpb24iOjE1LCJwbTJwNV9iZ19jb25jZW50cmF0aW9uIjoxMSwicHJvamVjdCI6eyJpZCI6OTcsImF1dGhvcl9pZCI6NDIsIm5hbWUiOiJUb3duLCBSb2FkIChuciBKdW5jdGlvbikiLCJ0YWciOiJ0b3duLXJvYWQtbnItanVuY3Rpb24iLCJjcmVhdGVkX2F0IjoiMjAyMC0xMC0yNyAxMjoyMDozNyIsInVwZGF0ZWRfYXQiOiIyMDIwLTEwLTI3IDEyOjIwOjM3IiwiZGVsZXRlZF9hdCI6bnVsbH19=="
-
-# decode the base 64 string into JSON format
-#content = json.loads(base64.b64decode(base64_test))
-
-# ___________ same from now on ___________
-
-# display ALL the information from user interface (uncomment to see)
-#print(json.dumps(content, indent = 4))
-
-# extract the "objects" field 
-objects = content["objects"]
-
-# and convert to a list of dictionaries:
-objects = json.loads(objects)
-
-# for visual inspection (uncomment to see):
-#print(json.dumps(objects, indent = 4))
-
-
-
-# ___________ extract background pollution concentrations ___________
-
-cB_no2 = content["no2_bg_concentration"] # UNIT: ug/m3 
-
-cB_pm25 = content["pm2p5_bg_concentration"] # UNIT: ug/m3 
-
-
-# ___________ climatological wind characteristics ___________
+# read in the met station sites and wind data from the github repository
+# (to get the path go on the file, click 'raw', and copy the URL)
+sites_url = 'https://raw.githubusercontent.com/GI4RAQ/GI4RAQ-open/master/meteorology/locations.csv'
+station_root = "https://raw.githubusercontent.com/pearce-helen/GI4RAQ-open/master/meteorology/"
+
+# alternatively, a local met store built from the meteorology folder (see
+# air_quality_met.py) can be used so that nothing is downloaded at all
+met_store = None
+
+def use_met_store(path):
+    global met_store
+    met_store = MetStore(path)
+    load_sites.cache_clear()
+    read_station.cache_clear()
+    station_index.cache_clear()
+    station_climatology.cache_clear()
+
+# both files are only read once per process and then kept in memory, so a
+# long-running process does not download them again for every street
+
+@lru_cache(maxsize=None)
+def load_sites():
+    if met_store is not None:
+        return met_store.sites()
+    return pd.read_csv(sites_url)
+
+@lru_cache(maxsize=None)
+def read_station(station_id):
+    if met_store is not None:
+        return met_store.wind(station_id)
+    # combine the root and the station info into correct URL
+    url_station = station_root + "station" + str(station_id) + ".csv"
+    return pd.read_csv(url_station)
 
 # ___________ choose closest met station ______________
 
-# read in the met station sites from the github repository
-# (to get the path go on the file, click 'raw', and copy the URL)
+# spatial index of the met station locations, built once per process
+@lru_cache(maxsize=None)
+def station_index():
+    sites_df = load_sites()
+    return StationIndex(station = sites_df['station'], latitude = sites_df['latitude'], 
+                        longitude = sites_df['longitude'])
+
+def select_station(content):
+    # extract the location of the street, type float to ensure correct format
+    latitude = float(content["lat"])
+    longitude = float(content["lng"])
+    
+    # find the nearest met station to the street (great-circle distance)
+    station_id, distance_km = station_index().nearest(latitude, longitude)
+    # visual inspection
+    #print(latitude, longitude, station_id, distance_km)
+    
+    station_id = int(station_id)
+    
+    return station_id
 
-url = 'https://raw.githubusercontent.com/GI4RAQ/GI4RAQ-open/master/meteorology/locations.csv'
-sites_df = pd.read_csv(url)
-
-# visual inspection
-#print(sites_df)
-
-# combine all possible met station locations into 1 vector
-points = []
-for i in range(len(sites_df)):
-    points.append([float(sites_df['longitude'][i]), float(sites_df['latitude'][i])])
-
-# convert vector into Multipoint
-destinations = MultiPoint(points)
-#print(destinations)
-
-# set street location
-# extract the location of the street, type float to ensure correct format
-latitude = float(content["lat"])
-longitude = float(content["lng"])
-
-# combine into one point value
-orig = (longitude, latitude)
-orig = Point(orig)
-#print(orig)
-
-# find the nearest met station to the street
-# website for reference: https://automating-gis-processes.github.io/2017/lessons/L3/nearest-neighbour.html
-nearest_site = nearest_points(orig, destinations)
-# nearest_site[0] is the origin (street) while nearest_site[1] is the closest destination
-nearest_met = nearest_site[1] 
-# extract the x y (lon, lat) for the closest station
-nearest_met_lat = nearest_met.y
-nearest_met_lon = nearest_met.x
-# select the site ID from the sites_df
-station_id = sites_df.loc[(sites_df['latitude'] == nearest_met_lat) & (sites_df['longitude'] == nearest_met_lon), 'station'].item()
-# visual inspection
-#print(orig, station_id)
-
-station_id = int(station_id)
-# the station ID will be used to pull in the correct wind data file from github
 
 # _______________ calculate weighted L-R and R-L cross-canyon wind speed (u) _______________
 
 # convert street direction to degrees
-street_dir_chr = content["wind"]
-street_dir = 0
-
-if street_dir_chr == "N":
-    street_dir = 360
-elif street_dir_chr == "NNE":
-    street_dir = 22.5
-elif street_dir_chr == "NE":
-    street_dir = 45
-elif street_dir_chr == "ENE":
-    street_dir = 67.5
-elif street_dir_chr == "E":
-    street_dir = 90
-elif street_dir_chr == "ESE":
-    street_dir = 112.5
-elif street_dir_chr == "SE":
-    street_dir = 135
-elif street_dir_chr == "SSE":
-    street_dir = 157.5
-elif street_dir_chr == "S":
-    street_dir = 180
-elif street_dir_chr == "SSW":
-    street_dir = 202.5
-elif street_dir_chr == "SW":
-    street_dir = 225
-elif street_dir_chr == "WSW":
-    street_dir = 247.5
-elif street_dir_chr == "W":
-    street_dir = 270
-elif street_dir_chr == "WNW":
-    street_dir = 292.5
-elif street_dir_chr == "NW":
-    street_dir = 315
-elif street_dir_chr == "NNW":
-    street_dir = 337.5
-
-# visual inspection
-#print(street_dir)
-
-# select the station data based on the above:
-root = "https://raw.githubusercontent.com/pearce-helen/GI4RAQ-open/master/meteorology/"
-# combine the root and the station info into correct URL
-url_station = root + "station" + str(station_id) + ".csv"
-
-# visual inspection
-#print(url_station)
-
-# read in wind data from github
-wind = pd.read_csv(url_station)
-
-# visual inspection
-#print(wind)
-
-# wind stored in a pandas dataframe
-# developing with a pandas dataframe is different to in R, safest way to 
-# calculate things is to define a function first and then apply it using 
-# the lambda method. 
-# Also remember .copy() if making a new dataframe - ensures not just 'viewing'
-# a dataframe but actually making alterations
-
-#print(wind)
-# REPLACE slack wind speed with 0.5 m/s and assign the same direction as the street
-# so this is representative of total along-street component
-slack = wind['wind_speed'][0]
-wind['wind_speed'] = wind['wind_speed'].replace([slack],0.5)
-wind['wind_direction'] = wind['wind_direction'].replace([0],street_dir)
-#print(wind)
-
-# firstly, create a new column in the wind dataframe that contains modified angles as if 
-# the street was pointing northerly (i.e. at 0 degrees)
-# the was done to help calculate the wind sectors that are left-to-right and
-# right to left, as these angles will always been in the same relative locations
-# there is also a check to ensure the angle calculated is always between 0 and 360
-def rotate_street(wind_d):
-    angle =  wind_d - street_dir
-    if angle >= 360:
-        angle2 = angle-360
-        return angle2
-    elif angle <0:
-        angle2 = angle+360
-        return angle2
-    else:
-        return angle
-
-wind['street_dir_as_N'] = wind.apply(lambda wind: rotate_street(wind['wind_direction']), axis=1)
-#print(wind)
-
-# secondly, calculate theta: the difference between the perpendicular angle 
-# (relative to the street) and the relative wind directions for both the L-R and R-L cases
-# relative perpendicular wind at 270 degrees for L-R, and 90 degrees for R-L
-def dif_to_perp(perp,wind_d):
-    if perp == 360:
-        if wind_d < 180:
-            a = 0+wind_d
-        else:
-            a=360-wind_d
-        
-        return a
-        
-    else:
-        return abs(perp-wind_d)
-
-wind['LR_difference'] = wind.apply(lambda wind: dif_to_perp(270, wind['street_dir_as_N']), axis=1)
-#print(wind)
-wind['RL_difference'] = wind.apply(lambda wind: dif_to_perp(90, wind['street_dir_as_N']), axis=1)
-#print(wind)
-wind['par1_difference'] = wind.apply(lambda wind: dif_to_perp(360, wind['street_dir_as_N']), axis=1)
-#print(wind)
-wind['par2_difference'] = wind.apply(lambda wind: dif_to_perp(180, wind['street_dir_as_N']), axis=1)
-#print(wind)
-
-# create subsets that only include data that is relevant for each sector 
-# i.e. 45 +/- from the perpendicular
-LR_only = wind.loc[wind.LR_difference <= 45].copy()
-RL_only = wind.loc[wind.RL_difference <= 45].copy()
-par1_only = wind.loc[wind.par1_difference <= 45].copy()
-par2_only = wind.loc[wind.par2_difference <= 45].copy()
-
-#print(LR_only)
-#print(RL_only)
-
-# convert theta into radians as this is what math.cos assumes
-def calculate_radians(degrees):
-    return math.radians(degrees)
-
-LR_only["LR_dif_rad"] = LR_only.apply(lambda LR_only: calculate_radians(LR_only['LR_difference']), axis=1)
-RL_only["RL_dif_rad"] = RL_only.apply(lambda RL_only: calculate_radians(RL_only['RL_difference']), axis=1)
-par1_only["par_dif_rad"] = par1_only.apply(lambda par1_only: calculate_radians(par1_only['par1_difference']), axis=1)
-par2_only["par_dif_rad"] = par2_only.apply(lambda par2_only: calculate_radians(par2_only['par2_difference']), axis=1)
-
-# print(LR_only)
-# print(RL_only)
-# print(par1_only)
-# print(par2_only)
-
-# calculate the perpendicular component (across canyon) of each of the wind vectors
-
-# IMPORTANT: the angles calculated only need to be relative to the perpendicular
-# but need to still use the original wind speed values from the original wind directions
-# that they represent
-
-# cosine used as the hypotenuse of a right-angled triangle is the original wind speed
-# the acute angle has been calculated (theta - relative to the perpendicular)
-# and the adjacent side of the right-angled triangle represents the cross-street
-# component of the wind vector
-
-# for the along street speeds, cosine is still used because the adjacent component is now
-# orientated parallel to the street (i.e. the reference angle has changed through 90)
-def calculate_u(theta, wind_speed):
-    return math.cos(theta)*wind_speed
-
-LR_only["LR_u"] = LR_only.apply(lambda LR_only: calculate_u(LR_only['LR_dif_rad'],LR_only['wind_speed']), axis=1)
-RL_only["RL_u"] = RL_only.apply(lambda RL_only: calculate_u(RL_only['RL_dif_rad'],RL_only['wind_speed']), axis=1)
-par1_only["par_u"] = par1_only.apply(lambda par1_only: calculate_u(par1_only['par_dif_rad'],par1_only['wind_speed']), axis=1)
-par2_only["par_u"] = par2_only.apply(lambda par2_only: calculate_u(par2_only['par_dif_rad'],par2_only['wind_speed']), axis=1)
-
-# weighting of wind sectors needed to give greater 'weight' to the wind speeds
-# and directions that occur more frequently, and vice versa
-# firstly calculate how frequently the total sector of L-R and R-L occurs
-LR_freq = LR_only['fractional_occur'].sum()
-RL_freq = RL_only['fractional_occur'].sum()
-
-parallel = pd.concat([par1_only, par2_only])
-#print(parallel)
-par_freq = parallel['fractional_occur'].sum()
-#print(par_freq)
-
-def weighted_u(foccur,u,dir_freq):
-    return (foccur*u)/dir_freq
-
-LR_only["LR_u_weighted"] = LR_only.apply(lambda LR_only: weighted_u(LR_only['fractional_occur'], LR_only['LR_u'],LR_freq), axis=1)
-RL_only["RL_u_weighted"] = RL_only.apply(lambda RL_only: weighted_u(RL_only['fractional_occur'], RL_only['RL_u'],RL_freq), axis=1)
-parallel["par_u_weighted"] = parallel.apply(lambda parallel: weighted_u(parallel['fractional_occur'], parallel['par_u'],par_freq), axis=1)
-
-# finally sum the fractional wind speed components
-LR_u = LR_only['LR_u_weighted'].sum()
-RL_u = RL_only['RL_u_weighted'].sum()
-par_u = parallel['par_u_weighted'].sum()
-#print(LR_u, RL_u, par_u)
-
-
-# checking
-#print(LR_only['wind_direction'], LR_only['street_dir_as_N'])
-#print(LR_only['LR_difference'])
-#print(LR_only['LR_dif_rad'])
-#print(LR_only['wind_speed'])
-#print("WIND CONDITIONS")
-#print("Background wind (ubg) left to right:", LR_u)
-
-
-#print(RL_only['wind_direction'], RL_only['street_dir_as_N'])
-#print(RL_only['RL_difference'])
-#print(RL_only['RL_dif_rad'])
-#print(RL_only['wind_speed'])
-#print("Background wind (ubg) right to left:", RL_u)
-#print("Parallel wind (ubg_par)", par_u)
-
-# _______________ assign values for use further in code _______________
-
-# wind speed left to right (m/s) - climatological average
-ubg_orig = LR_u
-
-# wind speed right to left (m/s) - climatological average
-ubg_mir = RL_u
-
-ubg_parallel = par_u
-
-LR_par_freq = par_freq/2
-RL_par_freq = par_freq/2
-
-#print("L-->R Frequency:",LR_freq)
-#print("R-->L Frequency:", RL_freq)
-#print("Parallel Frequency:", par_freq)
-#print("Total time accounted for:", (LR_freq + RL_freq + par_freq))
-#print("")
-#sum([LR_freq, RL_freq, LR_par_freq, RL_par_freq])
-
-
+def street_direction(street_dir_chr):
+    street_dir = 0
+    
+    if street_dir_chr == "N":
+        street_dir = 360
+    elif street_dir_chr == "NNE":
+        street_dir = 22.5
+    elif street_dir_chr == "NE":
+        street_dir = 45
+    elif street_dir_chr == "ENE":
+        street_dir = 67.5
+    elif street_dir_chr == "E":
+        street_dir = 90
+    elif street_dir_chr == "ESE":
+        street_dir = 112.5
+    elif street_dir_chr == "SE":
+        street_dir = 135
+    elif street_dir_chr == "SSE":
+        street_dir = 157.5
+    elif street_dir_chr == "S":
+        street_dir = 180
+    elif street_dir_chr == "SSW":
+        street_dir = 202.5
+    elif street_dir_chr == "SW":
+        street_dir = 225
+    elif street_dir_chr == "WSW":
+        street_dir = 247.5
+    elif street_dir_chr == "W":
+        street_dir = 270
+    elif street_dir_chr == "WNW":
+        street_dir = 292.5
+    elif street_dir_chr == "NW":
+        street_dir = 315
+    elif street_dir_chr == "NNW":
+        street_dir = 337.5
+
+    return street_dir
+
+# the wind sectors are rotated as if the street was pointing northerly, so the
+# left-to-right (270) and right-to-left (90) perpendiculars and the two
+# along-street directions are always in the same relative place. Every sector
+# within 45 degrees of one of them contributes the component of its wind speed
+# in that direction (cosine of the angle), weighted by how often it occurs.
+# The calculation itself is in air_quality_met.py (sector_climatology), which
+# can do many street directions at once
+def wind_climatology(wind, street_dir):
+    climatology = sector_climatology(direction = wind["wind_direction"], 
+                                     frequency = wind["fractional_occur"], 
+                                     speed = wind["wind_speed"], street_dirs = street_dir)
+    
+    return {k: values[0] for k, values in climatology.items()}
+
+# the climatology only depends on the station and the street direction, so it
+# is worked out once per combination (or looked up in the met store, which
+# holds all of them)
+@lru_cache(maxsize=None)
+def station_climatology(station_id, street_dir):
+    climatology = None
+    if met_store is not None:
+        climatology = met_store.wind_climatology(station_id, street_dir)
+    if climatology is None:
+        climatology = wind_climatology(read_station(station_id), street_dir)
+    return climatology
 
 # ___________ extract GI intervention information ___________
 
@@ -381,418 +196,441 @@ RL_par_freq = par_freq/2
 # if objects[index][key] != []
 # means only where GI fields are complete is the information retained
 
-# extract the information on the GI by storing in another container
-gi = []           
-for index in range(len(objects)):
-    for key in objects[index]:
-        if key == "gi4raq_barrier":
-            if objects[index][key] != []:
-                gi = objects[index][key]
-
-#print(gi)
-
-# obtain the zone in which the GI is placed
-gi_zone = 0     # initialising value
-for index in range(len(objects)):
-    for key in objects[index]:
-        if key == "gi4raq_barrier":
-            if objects[index][key] != []:
-                gi_zone = objects[index]["name"]
-#print(gi_zone)
-gi_zone_w = next((item.get('width') for item in objects if item["name"]==gi_zone), 0)
-
-# determine exactly where the GI barrier is (m from left to middle of barrier)
-gi_loc = 0  # initialising value
-a = 0     # just a counter
-
-# Determine distance from left edge of STREET to the zone in which the
-# GI is located 
-for item in objects:
-    if item["name"] == gi_zone:
-        break
-    if item["type"] != "marker":
-        if item["type"] != "building":
-            a = float(item.get("width"))
-            gi_loc = gi_loc + a
-            gi_loc = round(gi_loc, 4)
-
-#print(gi_loc)
-
-
-# RFI: Barrier positioning quick fix
-# extract distance from lhs of ZONE to middle of barrier
-gi_loc2 = float(next((item.get('where_in_zone') for item in gi), 0))
-#print(gi_loc2)
-gi_zone_w = float(gi_zone_w)
-
-if gi_loc2 == 0:
-    gi_loc2 = gi_loc2 + 0.01
-elif gi_loc2 == gi_zone_w:
-    gi_loc2 = gi_loc2 - 0.01
-
-# combine location of zone and location of object within the zone to get
-# the location of the barrier in meters from left edge of street
-gi_loc = round(float(gi_loc) + float(gi_loc2), 4)
-
-#print(gi_loc)
+def gi_information(objects):
+    # extract the information on the GI by storing in another container
+    gi = []           
+    for index in range(len(objects)):
+        for key in objects[index]:
+            if key == "gi4raq_barrier":
+                if objects[index][key] != []:
+                    gi = objects[index][key]
+
+    #print(gi)
+
+    # obtain the zone in which the GI is placed
+    gi_zone = 0     # initialising value
+    for index in range(len(objects)):
+        for key in objects[index]:
+            if key == "gi4raq_barrier":
+                if objects[index][key] != []:
+                    gi_zone = objects[index]["name"]
+    #print(gi_zone)
+    gi_zone_w = next((item.get('width') for item in objects if item["name"]==gi_zone), 0)
+
+    # determine exactly where the GI barrier is (m from left to middle of barrier)
+    gi_loc = 0  # initialising value
+    a = 0     # just a counter
+
+    # Determine distance from left edge of STREET to the zone in which the
+    # GI is located 
+    for item in objects:
+        if item["name"] == gi_zone:
+            break
+        if item["type"] != "marker":
+            if item["type"] != "building":
+                a = float(item.get("width"))
+                gi_loc = gi_loc + a
+                gi_loc = round(gi_loc, 4)
+
+    #print(gi_loc)
+
+
+    # RFI: Barrier positioning quick fix
+    # extract distance from lhs of ZONE to middle of barrier
+    gi_loc2 = float(next((item.get('where_in_zone') for item in gi), 0))
+    #print(gi_loc2)
+    gi_zone_w = float(gi_zone_w)
+
+    if gi_loc2 == 0:
+        gi_loc2 = gi_loc2 + 0.01
+    elif gi_loc2 == gi_zone_w:
+        gi_loc2 = gi_loc2 - 0.01
+
+    # combine location of zone and location of object within the zone to get
+    # the location of the barrier in meters from left edge of street
+    gi_loc = round(float(gi_loc) + float(gi_loc2), 4)
+
+    #print(gi_loc)
+    
+    return gi, gi_loc
 
 ###############################################################################
 # GEOMETRY: WIND ACROSS STREET LEFT --> RIGHT (original)
 ###############################################################################
 
-# ___________ total street width ___________
-a = 0 # just a counter
-roadw= 0  # initialising value
+def geometry_original(objects, gi, gi_loc):
+    # ___________ total street width ___________
+    a = 0 # just a counter
+    roadw= 0  # initialising value
 
-# calculate total street width by adding zone widths together
-# (excluding marker & building widths)        
-for item in objects:
-    if item["type"] != "marker":
-        if item["type"] != "building":
-            a = float(item.get("width"))
-            roadw = roadw + a
-            roadw = round(roadw, 4)
+    # calculate total street width by adding zone widths together
+    # (excluding marker & building widths)        
+    for item in objects:
+        if item["type"] != "marker":
+            if item["type"] != "building":
+                a = float(item.get("width"))
+                roadw = roadw + a
+                roadw = round(roadw, 4)
 
-#print(roadw)            
+    #print(roadw)            
 
-# ___________ set horizontal (row_original) defining values ___________
+    # ___________ set horizontal (row_original) defining values ___________
 
-# row_original = storage container initialised with zeros
-row_original = np.array([0,0,0,0,0,0,0,0,0,0], dtype = float)
+    # row_original = storage container initialised with zeros
+    row_original = np.array([0,0,0,0,0,0,0,0,0,0], dtype = float)
 
-# left hand side building height
-row_original[0]=next((item.get('height') for item in objects if item["name"]=="BL1"), 0)
+    # left hand side building height
+    row_original[0]=next((item.get('height') for item in objects if item["name"]=="BL1"), 0)
 
-# right hand side building height
-row_original[1]=next((item.get('height') for item in objects if item["name"]=="BL2"), 0)
+    # right hand side building height
+    row_original[1]=next((item.get('height') for item in objects if item["name"]=="BL2"), 0)
 
-# hedge height
-row_original[2] = 0
-for item in gi:
-    if item["type"] != "green-barrier":
-        row_original[2] = 0
-    else:
-        row_original[2] = item.get("height")
+    # hedge height
+    row_original[2] = 0
+    for item in gi:
+        if item["type"] != "green-barrier":
+            row_original[2] = 0
+        else:
+            row_original[2] = item.get("height")
 
-# proposed grey infra height
-row_original[3] = 0
-for item in gi:
-    if item["type"] != "grey-barrier":
-        row_original[3] = 0
-    else:
-        row_original[3] = item.get("height")
+    # proposed grey infra height
+    row_original[3] = 0
+    for item in gi:
+        if item["type"] != "grey-barrier":
+            row_original[3] = 0
+        else:
+            row_original[3] = item.get("height")
         
-# tree base height at maturity
-row_original[4] = 0
-for item in gi:
-    if item["type"] == "green-barrier-trees":
-        row_original[4] = item.get("tcbh")
-    elif item["type"] == "grey-barrier-trees":
-        row_original[4] = item.get("tcbh")
+    # tree base height at maturity
+    row_original[4] = 0
+    for item in gi:
+        if item["type"] == "green-barrier-trees":
+            row_original[4] = item.get("tcbh")
+        elif item["type"] == "grey-barrier-trees":
+            row_original[4] = item.get("tcbh")
+        else:
+            row_original[4] = 0
+
+    # tree top height at maturity
+    row_original[5] = 0
+    for item in gi:
+        if item["type"] == "green-barrier-trees":
+            row_original[5] = item.get("tcth")
+        elif item["type"] == "grey-barrier-trees":
+            row_original[5] = item.get("tcth")
+        else:
+            row_original[5] = 0
+
+    # existing barrier upwind height
+    # extract all information on upwind existing barrier and store in eb_up
+    eb_up = []
+    for item in objects:
+        if item["name"] == "RZBL1":
+            eb_up = item.get("existing_barrier")           
+
+    # if eb_up contains information, proceed to extract existing barrier height
+    if eb_up != []:
+        row_original[8] = next((item.get('height') for item in eb_up), False)
     else:
-        row_original[4] = 0
-
-# tree top height at maturity
-row_original[5] = 0
-for item in gi:
-    if item["type"] == "green-barrier-trees":
-        row_original[5] = item.get("tcth")
-    elif item["type"] == "grey-barrier-trees":
-        row_original[5] = item.get("tcth")
+        row_original[8] = 0
+    
+
+    # existing barrier downwind height
+    # extract all information on downwind existing barrier and store in eb_down
+    eb_down = []
+    for item in objects:
+        if item["name"] == "RZBL2":
+            eb_down = item.get("existing_barrier")           
+
+    # if eb_down contains information, proceed to extract existing barrier height
+    if eb_down != []:
+        row_original[9] = next((item.get('height') for item in eb_down), False)
     else:
-        row_original[5] = 0
-
-# existing barrier upwind height
-# extract all information on upwind existing barrier and store in eb_up
-eb_up = []
-for item in objects:
-    if item["name"] == "RZBL1":
-        eb_up = item.get("existing_barrier")           
-
-# if eb_up contains information, proceed to extract existing barrier height
-if eb_up != []:
-    row_original[8] = next((item.get('height') for item in eb_up), False)
-else:
-    row_original[8] = 0
-    
-
-# existing barrier downwind height
-# extract all information on downwind existing barrier and store in eb_down
-eb_down = []
-for item in objects:
-    if item["name"] == "RZBL2":
-        eb_down = item.get("existing_barrier")           
-
-# if eb_down contains information, proceed to extract existing barrier height
-if eb_down != []:
-    row_original[9] = next((item.get('height') for item in eb_down), False)
-else:
-    row_original[9] = 0
-
-#print(row_original)
-
-# ___________ set vertical defining values ___________
-
-# zone_original = storage container
-zone_original = np.array([0,0,0,0,0], dtype = float)
-
-# for each, add up the widths of objects until you hit the marker
-# upwind street boundary
-a = 0  
-zone_original[0] = 0
-for item in objects:
-    if item["type"] != "marker":
-        if item["type"] != "building":
-            a = float(item.get("width"))
-            zone_original[0] = zone_original[0] + a
-            zone_original[0] = round(zone_original[0], 4)
-            if zone_original[0] == 0:
-                zone_original[0] = 0.01
-    elif item["name"] == "Street Boundary 1":
-        break
-
-# determine where emission zones start and end
-# first, initialise values
-ez1_start = 0
-ez1_finish = 0
-ez2_start = 0
-ez2_finish = 0
-
-# ez1 finish
-a = 0    
-for item in objects:
-    if item["type"] != "marker":
-        if item["type"] != "building":
-            a = float(item.get("width"))
-            ez1_finish = ez1_finish + a
-            ez1_finish = round(ez1_finish, 4)
-    if item["name"] == "EZ1":
-        break
-
-# ez1 start
-ez1_w = 0
-for item in objects:
-    if item["name"] == "EZ1":
-        ez1_w = float(item.get("width"))
+        row_original[9] = 0
+
+    #print(row_original)
+
+    # ___________ set vertical defining values ___________
+
+    # zone_original = storage container
+    zone_original = np.array([0,0,0,0,0], dtype = float)
+
+    # for each, add up the widths of objects until you hit the marker
+    # upwind street boundary
+    a = 0  
+    zone_original[0] = 0
+    for item in objects:
+        if item["type"] != "marker":
+            if item["type"] != "building":
+                a = float(item.get("width"))
+                zone_original[0] = zone_original[0] + a
+                zone_original[0] = round(zone_original[0], 4)
+                if zone_original[0] == 0:
+                    zone_original[0] = 0.01
+        elif item["name"] == "Street Boundary 1":
+            break
+
+    # determine where emission zones start and end
+    # first, initialise values
+    ez1_start = 0
+    ez1_finish = 0
+    ez2_start = 0
+    ez2_finish = 0
+
+    # ez1 finish
+    a = 0    
+    for item in objects:
+        if item["type"] != "marker":
+            if item["type"] != "building":
+                a = float(item.get("width"))
+                ez1_finish = ez1_finish + a
+                ez1_finish = round(ez1_finish, 4)
+        if item["name"] == "EZ1":
+            break
+
+    # ez1 start
+    ez1_w = 0
+    for item in objects:
+        if item["name"] == "EZ1":
+            ez1_w = float(item.get("width"))
         
-ez1_start = ez1_finish - ez1_w
-
-# ez2 finish
-a = 0    
-for item in objects:
-    if item["type"] != "marker":
-        if item["type"] != "building":
-            a = float(item.get("width"))
-            ez2_finish = ez2_finish + a
-            ez2_finish = round(ez2_finish, 4)
-    if item["name"] == "EZ2":
-        break
+    ez1_start = ez1_finish - ez1_w
+
+    # ez2 finish
+    a = 0    
+    for item in objects:
+        if item["type"] != "marker":
+            if item["type"] != "building":
+                a = float(item.get("width"))
+                ez2_finish = ez2_finish + a
+                ez2_finish = round(ez2_finish, 4)
+        if item["name"] == "EZ2":
+            break
  
-# ez2 start   
-ez2_w = 0
-for item in objects:
-    if item["name"] == "EZ2":
-        ez2_w = float(item.get("width"))
+    # ez2 start   
+    ez2_w = 0
+    for item in objects:
+        if item["name"] == "EZ2":
+            ez2_w = float(item.get("width"))
      
-ez2_start = ez2_finish - ez2_w  
-
-# determine number of emission zones
-nez = 0
-if ez2_start == ez2_finish:
-    nez = 1
-else:
-    nez = 2    
-    
-#print(nez)
-    
-# determine upwind near edge and downwind far edge of emission zones 
-zone_original[1] = 0   
-zone_original[2] = 0
-
-# if there's only 1 emission zone, use ez1 start and finish
-# but if there are 2 emission zones, use ez1 start and ez2 finish
-if nez == 1:
-    zone_original[1] = ez1_start
-    zone_original[2] = ez1_finish
-elif nez == 2:
-    zone_original[1] = ez1_start
-    zone_original[2] = ez2_finish
-
-# downwind street boundary
-a = 0    
-zone_original[3] = 0
-for item in objects:
-    if item["type"] != "marker":
-        if item["type"] != "building":
-            a = float(item.get("width"))
-            zone_original[3] = zone_original[3] + a
-            zone_original[3] = round(zone_original[3], 4)
-            if zone_original[3] == roadw:
-                zone_original[3] = roadw - 0.01
-    if item["name"] == "Street Boundary 2":
-        break
-
-# downwind building
-zone_original[4] = roadw 
-
-#print(zone_original)
-
-# barrier locations (m from left of street)
-# bar_original = a strage container
-bar_original = np.array([0,0,0,0], dtype = float)
-
-# existing barrier upwind
-if eb_up == []:
-    bar_original[0] = 0
-else:
-    # if there is an existing barrier upwind it is defaulted to SB:
-    bar_original[0] = zone_original[0]
-    
-    # alternative methodology to not default to SB:
-    #bar_original[0] = next((item.get('metersinzone_original') for item in eb_up), 0)
-
-
-# existing barrier downwind
-if eb_down == []:
-    bar_original[2] = 0
-else:
-    # make the position default to only being on the street boundary:
-    bar_original[2] = zone_original[3]
-    
-    # alternative methodology to not default to SB:
-    #bar_original[2] = zone_original[3] + next((item.get('metersinzone_original') for item in eb_down), 0)
-    
-    
-# new barriers upwind and downwind done together
-if gi_loc <= zone_original[1]:
-    bar_original[1] = gi_loc
-    bar_original[3] = 0
-elif gi_loc >= zone_original[2]:
-    bar_original[1] = 0
-    bar_original[3] = gi_loc
-
-#print(bar_original)
-
-# check presence of barriers in locations (1 = true, 0 = false)
-check_original = np.array([0,0,0,0], dtype = float)
-
-# existing barrier upwind
-if bar_original[0] > 0:
-    check_original[0] = 1
-else:
-    check_original[0] = 0
-
-# new barrier upwind
-if bar_original[1] > 0:
-    check_original[1] = 1
-else:
-    check_original[1] = 0
-
-# existing barrier downwind 
-if bar_original[2] > 0:
-    check_original[2] = 1
-else:
-    check_original[2] = 0
-
-# new barrier downwind 
-if bar_original[3] > 0:
-    check_original[3] = 1
-else:
-    check_original[3] = 0
-
-#print(check_original)    
-
-# recirculation locations of barriers (m from left of street)
-# rec_original = a storage container
-rec_original = np.array([0,0,0,0,0], dtype = float)
-recirc = 0
-
-
-# RFI: default 0.1 recirc zone if 3H-3=0
-# upwind building recirc
-# if there is building upwind the recirculation is calculated by 3H-3
-# however if this is less than or equal to 0, 0.01 is assigned
-# if there is no building upwind the recirc = 0 
-# (done this way to avoid adding 0.01 as a recirc if there's no building)
-if row_original[0] > 0:
-    recirc = (row_original[0]*3)-3
-    if recirc <= 0:
-        recirc = 0.01    
-    rec_original[0] = recirc
-else:
-    rec_original[0] = 0
-
-# upwind existing barrier recirc
-# reassign recirc to not carry over anything calculated previously
-recirc = 0
-# if there is an existing barrier upwind
-if check_original[0] == 1:
-    # the recirculation = 3H-3
-    recirc = (row_original[8]*3)-3
-    # if the above calculation results <= 0 a default of 0.01 is applied
-    if recirc <= 0:
-        recirc = 0.01
-    # finally, vertical reference of recirculation touch-down is: 
-    # the width of recirculation + the location of the barrier
-    rec_original[1] = recirc+bar_original[0]
-else:
-    rec_original[1] = 0
-    
-
-# upwind new barrier recirc 
-# reassign recirc to not carry over anything calculated previously
-recirc = 0
-# if there is a new barrier upwind
-if check_original[1] == 1:
-    # the recirculation = 3H-3
-    recirc = (max(row_original[2:6])*3)-3
-    # if the above calculation results <= 0 default of 0.01 is applied
-    if recirc <= 0:
-        recirc = 0.01
-    # finally, vertical reference of recirculation touch-down is: 
-    # the width of recirculation + the location of the barrier
-    rec_original[2] = recirc+bar_original[1]
-else:
-    rec_original[2] = 0
-
-# downwind existing barrier recirc
-# reassign recirc to not carry over anything calculated previously
-recirc = 0
-# if there is an existing barrier downwind
-if check_original[2] == 1:
-    # the recirculation = 3H-3
-    recirc = (row_original[9]*3)-3
-    # if the above calculation results <= 0 default of 0.01 is applied
-    if recirc <= 0:
-        recirc = 0.01
-    # finally, vertical reference of recirculation touch-down is: 
-    # the width of recirculation + the location of the barrier
-    rec_original[3] = recirc+bar_original[2]
-else:
-    rec_original[3] = 0
-
-# downwind new barrier recirc 
-# reassign recirc to not carry over anything calculated previously
-recirc = 0
-# if there is a new barrier downwind
-if check_original[3] == 1:
-    # the recirculation = 3H-3
-    recirc = (max(row_original[2:6])*3)-3
-    # if the above calculation resuls <= 0 default of 0.01 is applied
-    if recirc <= 0:
-        recirc = 0.01
-    # finally, vertical reference of recirculation touch-down is: 
-    # the width of recirculation + the location of the barrier
-    rec_original[4] = recirc+bar_original[3]
-else:
-    rec_original[4] = 0
-
-
-#print("Row: left to right dimensioning:", row_original)
-#print("Zone: left to right dimensioning:", zone_original)
-#print("Bar: left to right dimensioning:", bar_original)
-#print("Check: left to right dimensioning:", check_original)
-#print("Rec: left to right dimensioning:", rec_original)
+    ez2_start = ez2_finish - ez2_w  
+
+    # determine number of emission zones
+    nez = 0
+    if ez2_start == ez2_finish:
+        nez = 1
+    else:
+        nez = 2    
+    
+    #print(nez)
+    
+    # determine upwind near edge and downwind far edge of emission zones 
+    zone_original[1] = 0   
+    zone_original[2] = 0
+
+    # if there's only 1 emission zone, use ez1 start and finish
+    # but if there are 2 emission zones, use ez1 start and ez2 finish
+    if nez == 1:
+        zone_original[1] = ez1_start
+        zone_original[2] = ez1_finish
+    elif nez == 2:
+        zone_original[1] = ez1_start
+        zone_original[2] = ez2_finish
+
+    # downwind street boundary
+    a = 0    
+    zone_original[3] = 0
+    for item in objects:
+        if item["type"] != "marker":
+            if item["type"] != "building":
+                a = float(item.get("width"))
+                zone_original[3] = zone_original[3] + a
+                zone_original[3] = round(zone_original[3], 4)
+                if zone_original[3] == roadw:
+                    zone_original[3] = roadw - 0.01
+        if item["name"] == "Street Boundary 2":
+            break
+
+    # downwind building
+    zone_original[4] = roadw 
+
+    #print(zone_original)
+
+    # barrier locations (m from left of street)
+    # bar_original = a strage container
+    bar_original = np.array([0,0,0,0], dtype = float)
+
+    # existing barrier upwind
+    if eb_up == []:
+        bar_original[0] = 0
+    else:
+        # if there is an existing barrier upwind it is defaulted to SB:
+        bar_original[0] = zone_original[0]
+    
+        # alternative methodology to not default to SB:
+        #bar_original[0] = next((item.get('metersinzone_original') for item in eb_up), 0)
+
+
+    # existing barrier downwind
+    if eb_down == []:
+        bar_original[2] = 0
+    else:
+        # make the position default to only being on the street boundary:
+        bar_original[2] = zone_original[3]
+    
+        # alternative methodology to not default to SB:
+        #bar_original[2] = zone_original[3] + next((item.get('metersinzone_original') for item in eb_down), 0)
+    
+    
+    # new barriers upwind and downwind done together
+    if gi_loc <= zone_original[1]:
+        bar_original[1] = gi_loc
+        bar_original[3] = 0
+    elif gi_loc >= zone_original[2]:
+        bar_original[1] = 0
+        bar_original[3] = gi_loc
+
+    #print(bar_original)
+
+    # check presence of barriers in locations (1 = true, 0 = false)
+    check_original = np.array([0,0,0,0], dtype = float)
+
+    # existing barrier upwind
+    if bar_original[0] > 0:
+        check_original[0] = 1
+    else:
+        check_original[0] = 0
+
+    # new barrier upwind
+    if bar_original[1] > 0:
+        check_original[1] = 1
+    else:
+        check_original[1] = 0
+
+    # existing barrier downwind 
+    if bar_original[2] > 0:
+        check_original[2] = 1
+    else:
+        check_original[2] = 0
+
+    # new barrier downwind 
+    if bar_original[3] > 0:
+        check_original[3] = 1
+    else:
+        check_original[3] = 0
+
+    #print(check_original)    
+
+    # recirculation locations of barriers (m from left of street)
+    # rec_original = a storage container
+    rec_original = np.array([0,0,0,0,0], dtype = float)
+    recirc = 0
+
+
+    # RFI: default 0.1 recirc zone if 3H-3=0
+    # upwind building recirc
+    # if there is building upwind the recirculation is calculated by 3H-3
+    # however if this is less than or equal to 0, 0.01 is assigned
+    # if there is no building upwind the recirc = 0 
+    # (done this way to avoid adding 0.01 as a recirc if there's no building)
+    if row_original[0] > 0:
+        recirc = (row_original[0]*3)-3
+        if recirc <= 0:
+            recirc = 0.01    
+        rec_original[0] = recirc
+    else:
+        rec_original[0] = 0
+
+    # upwind existing barrier recirc
+    # reassign recirc to not carry over anything calculated previously
+    recirc = 0
+    # if there is an existing barrier upwind
+    if check_original[0] == 1:
+        # the recirculation = 3H-3
+        recirc = (row_original[8]*3)-3
+        # if the above calculation results <= 0 a default of 0.01 is applied
+        if recirc <= 0:
+            recirc = 0.01
+        # finally, vertical reference of recirculation touch-down is: 
+        # the width of recirculation + the location of the barrier
+        rec_original[1] = recirc+bar_original[0]
+    else:
+        rec_original[1] = 0
+    
+
+    # upwind new barrier recirc 
+    # reassign recirc to not carry over anything calculated previously
+    recirc = 0
+    # if there is a new barrier upwind
+    if check_original[1] == 1:
+        # the recirculation = 3H-3
+        recirc = (max(row_original[2:6])*3)-3
+        # if the above calculation results <= 0 default of 0.01 is applied
+        if recirc <= 0:
+            recirc = 0.01
+        # finally, vertical reference of recirculation touch-down is: 
+        # the width of recirculation + the location of the barrier
+        rec_original[2] = recirc+bar_original[1]
+    else:
+        rec_original[2] = 0
+
+    # downwind existing barrier recirc
+    # reassign recirc to not carry over anything calculated previously
+    recirc = 0
+    # if there is an existing barrier downwind
+    if check_original[2] == 1:
+        # the recirculation = 3H-3
+        recirc = (row_original[9]*3)-3
+        # if the above calculation results <= 0 default of 0.01 is applied
+        if recirc <= 0:
+            recirc = 0.01
+        # finally, vertical reference of recirculation touch-down is: 
+        # the width of recirculation + the location of the barrier
+        rec_original[3] = recirc+bar_original[2]
+    else:
+        rec_original[3] = 0
+
+    # downwind new barrier recirc 
+    # reassign recirc to not carry over anything calculated previously
+    recirc = 0
+    # if there is a new barrier downwind
+    if check_original[3] == 1:
+        # the recirculation = 3H-3
+        recirc = (max(row_original[2:6])*3)-3
+        # if the above calculation resuls <= 0 default of 0.01 is applied
+        if recirc <= 0:
+            recirc = 0.01
+        # finally, vertical reference of recirculation touch-down is: 
+        # the width of recirculation + the location of the barrier
+        rec_original[4] = recirc+bar_original[3]
+    else:
+        rec_original[4] = 0
+
+
+    #print("Row: left to right dimensioning:", row_original)
+    #print("Zone: left to right dimensioning:", zone_original)
+    #print("Bar: left to right dimensioning:", bar_original)
+    #print("Check: left to right dimensioning:", check_original)
+    #print("Rec: left to right dimensioning:", rec_original)
+
+    geometry = {}
+    geometry["roadw"] = roadw
+    geometry["row_original"] = row_original
+    geometry["zone_original"] = zone_original
+    geometry["bar_original"] = bar_original
+    geometry["check_original"] = check_original
+    geometry["rec_original"] = rec_original
+    geometry["ez1_start"] = ez1_start
+    geometry["ez1_finish"] = ez1_finish
+    geometry["ez2_start"] = ez2_start
+    geometry["ez2_finish"] = ez2_finish
+    geometry["ez1_w"] = ez1_w
+    geometry["ez2_w"] = ez2_w
+    geometry["nez"] = nez
+    geometry["eb_up"] = eb_up
+    geometry["eb_down"] = eb_down
+    
+    return geometry
 
 ###############################################################################
 # GEOMETRY: WIND ACROSS STREET RIGHT --> LEFT (mirror)
@@ -803,167 +641,183 @@ else:
 # We now need to create a mirror image of these values to represent the wind
     # flowing right to left across the street
 
-# initialise new empty containers
-row_mirror = np.array([0,0,0,0,0,0,0,0,0,0], dtype = float)
-zone_mirror = np.array([0,0,0,0,0], dtype = float)
-bar_mirror = np.array([0,0,0,0], dtype = float)
-check_mirror = np.array([0,0,0,0], dtype = float)
-rec_mirror = np.array([0,0,0,0,0], dtype = float)
-
-# ___________ reverse 'row' ___________
-# row[0] = upwind building height, row[1] = downwind building height
-# flip the upwind and downwind building heights
-row_mirror[0] = row_original[1]
-row_mirror[1] = row_original[0]
-
-# all gi heights will remain the same
-row_mirror[2] = row_original[2]
-row_mirror[3] = row_original[3]
-row_mirror[4] = row_original[4]
-row_mirror[5] = row_original[5]
-
-# existing barriers upwind/downwind flip over
-row_mirror[8] = row_original[9]
-row_mirror[9] = row_original[8]
-
-# ___________ reverse 'zone' ___________
-# upwind street boundary
-zone_mirror[0] = roadw - zone_original[3]
-# upwind edge of emission zone
-zone_mirror[1] = roadw - zone_original[2]
-# downwind edge of emission zone
-zone_mirror[2] = roadw - zone_original[1]
-# downwind street boundary
-zone_mirror[3] = roadw - zone_original[0]
-# downwind building
-zone_mirror[4] = roadw
-
-# ___________ reverse 'check' ___________
-# existing barrier upwind
-check_mirror[0] = check_original[2]
-# new barrier upwind
-check_mirror[1] = check_original[3]
-#existing barrier downwind
-check_mirror[2] = check_original[0]
-# new barrier downwind
-check_mirror[3] = check_original[1]
-
-
-# ___________ reverse 'bar' ___________
-
-if check_mirror[0] == 1:
-    # existing barrier upwind position (not height)
-    bar_mirror[0] = roadw - bar_original[2]
-else:
-    bar_mirror[0] = 0
-    
-if check_mirror[1] == 1:
-    # new barrier upwind position (not height)
-    bar_mirror[1] = roadw - bar_original[3]
-else:
-    bar_mirror[1] = 0
-    
-if check_mirror[2] == 1:
-    # existing barrier downwind position (not height)
-    bar_mirror[2] = roadw - bar_original[0]
-else:
-    bar_mirror[2] = 0
-
-if check_mirror[3] == 1:
-    # new barrier downwind position (not height)
-    bar_mirror[3] = roadw - bar_original[1]
-else:
-    bar_mirror[3] = 0
-
-
-# ___________ reverse 'rec' ___________
-
-recirc = 0
-
-# upwind building recirc
-# if there is building upwind the recirculation is calculated by 3H-3
-# however if this is less than or equal to 0, 0.01 is assigned
-# if there is no building upwind the recirc = 0 
-# (done this way to avoid adding 0.01 as a recirc if there's no building)
-if row_mirror[0] > 0:
-    recirc = (row_mirror[0]*3)-3
-    if recirc <= 0:
-        recirc = 0.01    
-    rec_mirror[0] = recirc
-else:
-    rec_mirror[0] = 0
-
-# upwind existing barrier recirc
-# reassign recirc to not carry over anything calculated previously
-recirc = 0
-# if there is an existing barrier upwind
-if check_mirror[0] == 1:
-    # the recirculation = 3H-3
-    recirc = (row_mirror[8]*3)-3
-    # if the above calculation results <= 0 a default of 0.01 is applied
-    if recirc <= 0:
-        recirc = 0.01
-    # finally, vertical reference of recirculation touch-down is: 
-    # the width of recirculation + the location of the barrier
-    rec_mirror[1] = recirc+bar_mirror[0]
-else:
-    rec_mirror[1] = 0
-    
-
-# upwind new barrier recirc 
-# reassign recirc to not carry over anything calculated previously
-recirc = 0
-# if there is a new barrier upwind
-if check_mirror[1] == 1:
-    # the recirculation = 3H-3
-    recirc = (max(row_mirror[2:6])*3)-3
-    # if the above calculation results <= 0 default of 0.01 is applied
-    if recirc <= 0:
-        recirc = 0.01
-    # finally, vertical reference of recirculation touch-down is: 
-    # the width of recirculation + the location of the barrier
-    rec_mirror[2] = recirc+bar_mirror[1]
-else:
-    rec_mirror[2] = 0
-
-# downwind existing barrier recirc
-# reassign recirc to not carry over anything calculated previously
-recirc = 0
-# if there is an existing barrier downwind
-if check_mirror[2] == 1:
-    # the recirculation = 3H-3
-    recirc = (row_mirror[9]*3)-3
-    # if the above calculation results <= 0 default of 0.01 is applied
-    if recirc <= 0:
-        recirc = 0.01
-    # finally, vertical reference of recirculation touch-down is: 
-    # the width of recirculation + the location of the barrier
-    rec_mirror[3] = recirc+bar_mirror[2]
-else:
-    rec_mirror[3] = 0
-
-# downwind new barrier recirc 
-# reassign recirc to not carry over anything calculated previously
-recirc = 0
-# if there is a new barrier downwind
-if check_mirror[3] == 1:
-    # the recirculation = 3H-3
-    recirc = (max(row_mirror[2:6])*3)-3
-    # if the above calculation resuls <= 0 default of 0.01 is applied
-    if recirc <= 0:
-        recirc = 0.01
-    # finally, vertical reference of recirculation touch-down is: 
-    # the width of recirculation + the location of the barrier
-    rec_mirror[4] = recirc+bar_mirror[3]
-else:
-    rec_mirror[4] = 0
-
-#print("Row: right to left dimensioning:", row_mirror)
-#print("Zone: right to left dimensioning:", zone_mirror)
-#print("Bar: right to left dimensioning:", bar_mirror)
-#print("Check: right to left dimensioning:", check_mirror)
-#print("Rec: right to left dimensioning:", rec_mirror)
+def geometry_mirror(geometry):
+    roadw = geometry["roadw"]
+    row_original = geometry["row_original"]
+    zone_original = geometry["zone_original"]
+    bar_original = geometry["bar_original"]
+    check_original = geometry["check_original"]
+
+    # initialise new empty containers
+    row_mirror = np.array([0,0,0,0,0,0,0,0,0,0], dtype = float)
+    zone_mirror = np.array([0,0,0,0,0], dtype = float)
+    bar_mirror = np.array([0,0,0,0], dtype = float)
+    check_mirror = np.array([0,0,0,0], dtype = float)
+    rec_mirror = np.array([0,0,0,0,0], dtype = float)
+
+    # ___________ reverse 'row' ___________
+    # row[0] = upwind building height, row[1] = downwind building height
+    # flip the upwind and downwind building heights
+    row_mirror[0] = row_original[1]
+    row_mirror[1] = row_original[0]
+
+    # all gi heights will remain the same
+    row_mirror[2] = row_original[2]
+    row_mirror[3] = row_original[3]
+    row_mirror[4] = row_original[4]
+    row_mirror[5] = row_original[5]
+
+    # existing barriers upwind/downwind flip over
+    row_mirror[8] = row_original[9]
+    row_mirror[9] = row_original[8]
+
+    # ___________ reverse 'zone' ___________
+    # upwind street boundary
+    zone_mirror[0] = roadw - zone_original[3]
+    # upwind edge of emission zone
+    zone_mirror[1] = roadw - zone_original[2]
+    # downwind edge of emission zone
+    zone_mirror[2] = roadw - zone_original[1]
+    # downwind street boundary
+    zone_mirror[3] = roadw - zone_original[0]
+    # downwind building
+    zone_mirror[4] = roadw
+
+    # ___________ reverse 'check' ___________
+    # existing barrier upwind
+    check_mirror[0] = check_original[2]
+    # new barrier upwind
+    check_mirror[1] = check_original[3]
+    #existing barrier downwind
+    check_mirror[2] = check_original[0]
+    # new barrier downwind
+    check_mirror[3] = check_original[1]
+
+
+    # ___________ reverse 'bar' ___________
+
+    if check_mirror[0] == 1:
+        # existing barrier upwind position (not height)
+        bar_mirror[0] = roadw - bar_original[2]
+    else:
+        bar_mirror[0] = 0
+    
+    if check_mirror[1] == 1:
+        # new barrier upwind position (not height)
+        bar_mirror[1] = roadw - bar_original[3]
+    else:
+        bar_mirror[1] = 0
+    
+    if check_mirror[2] == 1:
+        # existing barrier downwind position (not height)
+        bar_mirror[2] = roadw - bar_original[0]
+    else:
+        bar_mirror[2] = 0
+
+    if check_mirror[3] == 1:
+        # new barrier downwind position (not height)
+        bar_mirror[3] = roadw - bar_original[1]
+    else:
+        bar_mirror[3] = 0
+
+
+    # ___________ reverse 'rec' ___________
+
+    recirc = 0
+
+    # upwind building recirc
+    # if there is building upwind the recirculation is calculated by 3H-3
+    # however if this is less than or equal to 0, 0.01 is assigned
+    # if there is no building upwind the recirc = 0 
+    # (done this way to avoid adding 0.01 as a recirc if there's no building)
+    if row_mirror[0] > 0:
+        recirc = (row_mirror[0]*3)-3
+        if recirc <= 0:
+            recirc = 0.01    
+        rec_mirror[0] = recirc
+    else:
+        rec_mirror[0] = 0
+
+    # upwind existing barrier recirc
+    # reassign recirc to not carry over anything calculated previously
+    recirc = 0
+    # if there is an existing barrier upwind
+    if check_mirror[0] == 1:
+        # the recirculation = 3H-3
+        recirc = (row_mirror[8]*3)-3
+        # if the above calculation results <= 0 a default of 0.01 is applied
+        if recirc <= 0:
+            recirc = 0.01
+        # finally, vertical reference of recirculation touch-down is: 
+        # the width of recirculation + the location of the barrier
+        rec_mirror[1] = recirc+bar_mirror[0]
+    else:
+        rec_mirror[1] = 0
+    
+
+    # upwind new barrier recirc 
+    # reassign recirc to not carry over anything calculated previously
+    recirc = 0
+    # if there is a new barrier upwind
+    if check_mirror[1] == 1:
+        # the recirculation = 3H-3
+        recirc = (max(row_mirror[2:6])*3)-3
+        # if the above calculation results <= 0 default of 0.01 is applied
+        if recirc <= 0:
+            recirc = 0.01
+        # finally, vertical reference of recirculation touch-down is: 
+        # the width of recirculation + the location of the barrier
+        rec_mirror[2] = recirc+bar_mirror[1]
+    else:
+        rec_mirror[2] = 0
+
+    # downwind existing barrier recirc
+    # reassign recirc to not carry over anything calculated previously
+    recirc = 0
+    # if there is an existing barrier downwind
+    if check_mirror[2] == 1:
+        # the recirculation = 3H-3
+        recirc = (row_mirror[9]*3)-3
+        # if the above calculation results <= 0 default of 0.01 is applied
+        if recirc <= 0:
+            recirc = 0.01
+        # finally, vertical reference of recirculation touch-down is: 
+        # the width of recirculation + the location of the barrier
+        rec_mirror[3] = recirc+bar_mirror[2]
+    else:
+        rec_mirror[3] = 0
+
+    # downwind new barrier recirc 
+    # reassign recirc to not carry over anything calculated previously
+    recirc = 0
+    # if there is a new barrier downwind
+    if check_mirror[3] == 1:
+        # the recirculation = 3H-3
+        recirc = (max(row_mirror[2:6])*3)-3
+        # if the above calculation resuls <= 0 default of 0.01 is applied
+        if recirc <= 0:
+            recirc = 0.01
+        # finally, vertical reference of recirculation touch-down is: 
+        # the width of recirculation + the location of the barrier
+        rec_mirror[4] = recirc+bar_mirror[3]
+    else:
+        rec_mirror[4] = 0
+
+    #print("Row: right to left dimensioning:", row_mirror)
+    #print("Zone: right to left dimensioning:", zone_mirror)
+    #print("Bar: right to left dimensioning:", bar_mirror)
+    #print("Check: right to left dimensioning:", check_mirror)
+    #print("Rec: right to left dimensioning:", rec_mirror)
     
+    mirror = {}
+    mirror["row_mirror"] = row_mirror
+    mirror["zone_mirror"] = zone_mirror
+    mirror["bar_mirror"] = bar_mirror
+    mirror["check_mirror"] = check_mirror
+    mirror["rec_mirror"] = rec_mirror
+    
+    return mirror
+
 ###############################################################################
 # Make sure all values are rounded before progressing
     # otherwise when checking i x == x can erraneously report False
@@ -979,9 +833,6 @@ def rounding_row(row_input):
     row_input[9] = round(row_input[9], 4)
     return row_input
 
-row_original = rounding_row(row_input=row_original)
-row_mirror = rounding_row(row_input=row_mirror)
-
 def rounding_5(data):
     data[0] = round(data[0], 4)
     data[1] = round(data[1], 4)
@@ -990,11 +841,6 @@ def rounding_5(data):
     data[4] = round(data[4], 4)
     return data
 
-zone_original = rounding_5(data=zone_original)
-zone_mirror = rounding_5(data=zone_mirror)
-rec_original = rounding_5(data=rec_original)
-rec_mirror = rounding_5(data=rec_mirror)
-
 def rounding_4(data):
     data[0] = round(data[0], 4)
     data[1] = round(data[1], 4)
@@ -1002,12 +848,34 @@ def rounding_4(data):
     data[3] = round(data[3], 4)
     return data
 
-bar_original = rounding_4(data=bar_original)
-bar_mirror = rounding_4(data=bar_mirror)
-
-#print(bar_original, bar_mirror)
+# gi_loc optionally places the new barrier somewhere else (m from the left 
+# edge of the street) than the objects do
+def street_geometry(objects, gi_loc=None):
+    gi, gi_loc_objects = gi_information(objects)
+    if gi_loc is None:
+        gi_loc = gi_loc_objects
+    
+    geometry = geometry_original(objects=objects, gi=gi, gi_loc=gi_loc)
+    geometry.update(geometry_mirror(geometry=geometry))
+    geometry["gi"] = gi
+    geometry["gi_loc"] = gi_loc
+    
+    geometry["row_original"] = rounding_row(row_input=geometry["row_original"])
+    geometry["row_mirror"] = rounding_row(row_input=geometry["row_mirror"])
     
+    geometry["zone_original"] = rounding_5(data=geometry["zone_original"])
+    geometry["zone_mirror"] = rounding_5(data=geometry["zone_mirror"])
+    geometry["rec_original"] = rounding_5(data=geometry["rec_original"])
+    geometry["rec_mirror"] = rounding_5(data=geometry["rec_mirror"])
     
+    geometry["bar_original"] = rounding_4(data=geometry["bar_original"])
+    geometry["bar_mirror"] = rounding_4(data=geometry["bar_mirror"])
+    
+    #print(geometry["bar_original"], geometry["bar_mirror"])
+    
+    return geometry
+    
+
 ###############################################################################
 # ROW DIMENSIONING
 ###############################################################################
@@ -1016,7 +884,7 @@ bar_mirror = rounding_4(data=bar_mirror)
 # RFI: only currently allow GI to be smaller than both buildings, and there
 # must be buildings on each side
 
-def row_dimensioning(row):
+def row_dimensioning(row, error):
     # h = a storage container
     h = np.array([0,0,0,0], dtype = float)
     
@@ -1099,18 +967,12 @@ def row_dimensioning(row):
     
     return h
 
-h_original = row_dimensioning(row = row_original)
-h_mirror = row_dimensioning(row = row_mirror)
-
-#print(h_original)
-#print(h_mirror)
-
 ###############################################################################
 # COLUMN DIMENSIONING
 ###############################################################################
 # NOTE: ignore 0 index to avoid confusion with row 1, row 2, row 3
 
-def column_dimensioning(rec, zone, check, bar, row):
+def column_dimensioning(rec, zone, check, bar, row, error):
         
     # l = a storage container
     l = np.array([0,0,0,0,0,0], dtype = float)
@@ -1623,266 +1485,289 @@ def column_dimensioning(rec, zone, check, bar, row):
         
     return l
 
-l_original = column_dimensioning(rec=rec_original, zone=zone_original, 
-                                 check=check_original, bar=bar_original, 
-                                 row=row_original)
-l_mirror = column_dimensioning(rec=rec_mirror, zone=zone_mirror, 
-                               check=check_mirror, bar=bar_mirror, 
-                               row = row_mirror)
-    
-#print(l_original)
-#print(l_mirror)
-
-# check that all the columns add up to total road width
-if round(sum(l_original),4) != roadw:
-    error[7,1] = 1
-
-if round(sum(l_mirror),4) != roadw:
-    error[7,2] = 1
-
-# ___________ format column and row output ___________
-
-# convert to l and h to lists, otherwise you get the error: 
-# Object of type 'ndarray' is not JSON serializable
-
-# these provide a list of widths/heights of individual columns/rows
-l_original_list = l_original.tolist()
-h_original_list = h_original.tolist()
-
-l_mirror_list = l_mirror.tolist()
-h_mirror_list = h_mirror.tolist()
+def street_dimensioning(state, error):
+    roadw = state["roadw"]
+    row_original = state["row_original"]
+    row_mirror = state["row_mirror"]
+    rec_original = state["rec_original"]
+    zone_original = state["zone_original"]
+    check_original = state["check_original"]
+    bar_original = state["bar_original"]
+    rec_mirror = state["rec_mirror"]
+    zone_mirror = state["zone_mirror"]
+    check_mirror = state["check_mirror"]
+    bar_mirror = state["bar_mirror"]
+
+    h_original = row_dimensioning(row = row_original, error = error)
+    h_mirror = row_dimensioning(row = row_mirror, error = error)
+    
+    l_original = column_dimensioning(rec=rec_original, zone=zone_original, 
+                                     check=check_original, bar=bar_original, 
+                                     row=row_original, error=error)
+    l_mirror = column_dimensioning(rec=rec_mirror, zone=zone_mirror, 
+                                   check=check_mirror, bar=bar_mirror, 
+                                   row = row_mirror, error=error)
+
+    # check that all the columns add up to total road width
+    if round(sum(l_original),4) != roadw:
+        error[7,1] = 1
+
+    if round(sum(l_mirror),4) != roadw:
+        error[7,2] = 1
+
+    # ___________ format column and row output ___________
+
+    # calculate cumulative distance in m from left / bottom:
+    l_cumu_original = np.array([0,0,0,0,0,0], dtype = float)
+    l_cumu_original[1] = round(l_original[1], 4)
+    l_cumu_original[2] = round(l_original[1]+l_original[2], 4)
+    l_cumu_original[3] = round(l_original[1]+l_original[2]+l_original[3], 4)
+    l_cumu_original[4] = round(l_original[1]+l_original[2]+l_original[3]+l_original[4], 4)
+    l_cumu_original[5] = round(l_original[1]+l_original[2]+l_original[3]+l_original[4]+l_original[5], 4)
+
+    h_cumu_original = np.array([0,0,0,0], dtype = float)
+    h_cumu_original[1] = round(h_original[1],4)
+    h_cumu_original[2] = round(h_original[1]+h_original[2],4)
+    h_cumu_original[3] = round(h_original[1]+h_original[2]+h_original[3],4)
+    # as a list for the output, an ndarray is not JSON serializable
+    h_cumu_original_list = h_cumu_original.tolist()
+
+    # calculate cumulative distance in m from left / bottom:
+    l_cumu_mirror = np.array([0,0,0,0,0,0], dtype = float)
+    l_cumu_mirror[1] = round(l_mirror[1], 4)
+    l_cumu_mirror[2] = round(l_mirror[1]+l_mirror[2], 4)
+    l_cumu_mirror[3] = round(l_mirror[1]+l_mirror[2]+l_mirror[3], 4)
+    l_cumu_mirror[4] = round(l_mirror[1]+l_mirror[2]+l_mirror[3]+l_mirror[4], 4)
+    l_cumu_mirror[5] = round(l_mirror[1]+l_mirror[2]+l_mirror[3]+l_mirror[4]+l_mirror[5], 4)
+
+    h_cumu_mirror = np.array([0,0,0,0], dtype = float)
+    h_cumu_mirror[1] = round(h_mirror[1],4)
+    h_cumu_mirror[2] = round(h_mirror[1]+h_mirror[2],4)
+    h_cumu_mirror[3] = round(h_mirror[1]+h_mirror[2]+h_mirror[3],4)
+
+    dims = {}
+    dims["h_original"] = h_original
+    dims["h_mirror"] = h_mirror
+    dims["l_original"] = l_original
+    dims["l_mirror"] = l_mirror
+    dims["l_cumu_original"] = l_cumu_original
+    dims["h_cumu_original"] = h_cumu_original
+    dims["l_cumu_mirror"] = l_cumu_mirror
+    dims["h_cumu_mirror"] = h_cumu_mirror
+    dims["h_cumu_original_list"] = h_cumu_original_list
+    
+    return dims
 
 
-# calculate cumulative distance in m from left / bottom:
-l_cumu_original = np.array([0,0,0,0,0,0], dtype = float)
-l_cumu_original[1] = round(l_original[1], 4)
-l_cumu_original[2] = round(l_original[1]+l_original[2], 4)
-l_cumu_original[3] = round(l_original[1]+l_original[2]+l_original[3], 4)
-l_cumu_original[4] = round(l_original[1]+l_original[2]+l_original[3]+l_original[4], 4)
-l_cumu_original[5] = round(l_original[1]+l_original[2]+l_original[3]+l_original[4]+l_original[5], 4)
-l_cumu_original_list = l_cumu_original.tolist()
-
-h_cumu_original = np.array([0,0,0,0], dtype = float)
-h_cumu_original[1] = round(h_original[1],4)
-h_cumu_original[2] = round(h_original[1]+h_original[2],4)
-h_cumu_original[3] = round(h_original[1]+h_original[2]+h_original[3],4)
-h_cumu_original_list = h_cumu_original.tolist()
-
-
-# calculate cumulative distance in m from left / bottom:
-l_cumu_mirror = np.array([0,0,0,0,0,0], dtype = float)
-l_cumu_mirror[1] = round(l_mirror[1], 4)
-l_cumu_mirror[2] = round(l_mirror[1]+l_mirror[2], 4)
-l_cumu_mirror[3] = round(l_mirror[1]+l_mirror[2]+l_mirror[3], 4)
-l_cumu_mirror[4] = round(l_mirror[1]+l_mirror[2]+l_mirror[3]+l_mirror[4], 4)
-l_cumu_mirror[5] = round(l_mirror[1]+l_mirror[2]+l_mirror[3]+l_mirror[4]+l_mirror[5], 4)
-l_cumu_mirror_list = l_cumu_mirror.tolist()
-
-h_cumu_mirror = np.array([0,0,0,0], dtype = float)
-h_cumu_mirror[1] = round(h_mirror[1],4)
-h_cumu_mirror[2] = round(h_mirror[1]+h_mirror[2],4)
-h_cumu_mirror[3] = round(h_mirror[1]+h_mirror[2]+h_mirror[3],4)
-h_cumu_mirror_list = h_cumu_mirror.tolist()
-
-#print(l_cumu_original_list)
-#print(h_cumu_original_list)
-#print(l_cumu_mirror_list)
-#print(h_cumu_mirror_list)
-
 ###############################################################################
 # ADVECTION & DISPERSION PATTERNS
 ###############################################################################
 
 # ___________ obstruction values for barriers ___________
 
-# obstruction array
-obs_original = np.array([0,0,0,0], dtype = float)
-
-# defined in terms of HOW MUCH THE AIR IS STOPPED 
-# e.g. 80% obstruction = only 20% of air can get through barrier
+# constants of the obstruction of plants: the share of it a deciduous hedge or
+# tree crown keeps (halved), and a factor on tfact, the share of the street
+# the tree crowns cover. (deciduous_ratio, tfact_scale)
+obstruction_constants = (0.5, 1.0)
+
+def barrier_obstruction(state, constants=obstruction_constants):
+    deciduous_ratio, tfact_scale = constants
+    eb_up = state["eb_up"]
+    eb_down = state["eb_down"]
+    gi = state["gi"]
+    gi_loc = state["gi_loc"]
+    zone_original = state["zone_original"]
+    row_original = state["row_original"]
+    h_original = state["h_original"]
+
+    # obstruction array
+    obs_original = np.array([0,0,0,0], dtype = float)
+
+    # defined in terms of HOW MUCH THE AIR IS STOPPED 
+    # e.g. 80% obstruction = only 20% of air can get through barrier
  
-# upwind existing
-obs_original[0] = next((item.get('obst') for item in eb_up), 0)
-obs_original[0] = obs_original[0]/100
-
-# downwind existing
-obs_original[2] = next((item.get('obst') for item in eb_down), 0)
-obs_original[2] = obs_original[2]/100
-
-# upwind new and downwind new done together as there can only be 1
-
-# account for a decrease in blocking ability by a barrier
-# if there's a gap between the barrier and tree line
-
-for item in gi:
-    # if it's a hedge + trees:
-    if item["type"] == "green-barrier-trees":
-        # obstruction of barrier value
-        obar = float(item.get("obst"))
-        obar = obar/100
-        # adjust obar for seasonality of green barrier: simply halve if deciduous
-        if item["seasonality"] == "deciduous":
-            obar = obar/2
-        # obstruction of tree value (not accounting for spaces between trees along street)
-        otree = float(item.get("tobst"))
-        otree = otree/100
-        # adjust otree for seasonality of tree crowns: simply halve if deciduous
-        if item["tseas"] == "deciduous":
-            otree = otree/2
-        # obstruction of gap
-        ogap = 0
+    # upwind existing
+    obs_original[0] = next((item.get('obst') for item in eb_up), 0)
+    obs_original[0] = obs_original[0]/100
+
+    # downwind existing
+    obs_original[2] = next((item.get('obst') for item in eb_down), 0)
+    obs_original[2] = obs_original[2]/100
+
+    # upwind new and downwind new done together as there can only be 1
+
+    # account for a decrease in blocking ability by a barrier
+    # if there's a gap between the barrier and tree line
+
+    for item in gi:
+        # if it's a hedge + trees:
+        if item["type"] == "green-barrier-trees":
+            # obstruction of barrier value
+            obar = float(item.get("obst"))
+            obar = obar/100
+            # adjust obar for seasonality of green barrier: simply halve if deciduous
+            if item["seasonality"] == "deciduous":
+                obar = obar*deciduous_ratio
+            # obstruction of tree value (not accounting for spaces between trees along street)
+            otree = float(item.get("tobst"))
+            otree = otree/100
+            # adjust otree for seasonality of tree crowns: simply halve if deciduous
+            if item["tseas"] == "deciduous":
+                otree = otree*deciduous_ratio
+            # obstruction of gap
+            ogap = 0
         
-        # heights
-        # total barrier height
-        htotal = float(item.get("tcth"))
-        # just tree crown
-        htree = float(item.get("tcth"))-float(item.get("tcbh"))
-        # calculate gap between hedge and tree
-        hgap = float(item.get("tcbh"))-float(item.get("height"))
-        # just hedge height
-        hbar = float(item.get("height"))
-
-        # having got heights, modify otree to reflect spaces between trees along street
-        # first get tree crown width, twidth, and tree spacing at planting, tspace
-        twidth = float(item.get("tcw"))
-        tspace = float(item.get("tsp"))
-        # calculate modification factor, tfact (assuming tree crowns are oval and tspace ≥ twidth/2)
-        tfact = ((math.pi * twidth)/(4 * tspace))
-        # multiply otree by tfact and ensure 0 ≤ otree ≤ 0.99
-        otree = otree*tfact
-        if otree < 0:
-            otree = 0
-        elif otree > 0.99:
-            otree = 0.99
+            # heights
+            # total barrier height
+            htotal = float(item.get("tcth"))
+            # just tree crown
+            htree = float(item.get("tcth"))-float(item.get("tcbh"))
+            # calculate gap between hedge and tree
+            hgap = float(item.get("tcbh"))-float(item.get("height"))
+            # just hedge height
+            hbar = float(item.get("height"))
+
+            # having got heights, modify otree to reflect spaces between trees along street
+            # first get tree crown width, twidth, and tree spacing at planting, tspace
+            twidth = float(item.get("tcw"))
+            tspace = float(item.get("tsp"))
+            # calculate modification factor, tfact (assuming tree crowns are oval and tspace ≥ twidth/2)
+            tfact = ((math.pi * twidth)/(4 * tspace))*tfact_scale
+            # multiply otree by tfact and ensure 0 ≤ otree ≤ 0.99
+            otree = otree*tfact
+            if otree < 0:
+                otree = 0
+            elif otree > 0.99:
+                otree = 0.99
         
-        # work out gi obstruction based on obar, ogap and otree
-        ototal = ((obar*hbar)+(ogap*hgap)+(otree*htree))/htotal
-        gi_obs = round(ototal, 2)
-    
-    # if it's a fence/wall + trees use same methodology as above: 
-    elif item["type"] == "grey-barrier-trees":
-        # obstruction of barrier value
-        obar = float(item.get("obst"))
-        obar = obar/100
-        # obstruction of tree value (not accounting for spaces between trees along street)
-        otree = float(item.get("tobst"))
-        otree = otree/100
-        # adjust otree for seasonality of tree crowns: simply halve if deciduous
-        if item["tseas"] == "deciduous":
-            otree = otree/2
-        # obstruction of gap
-        ogap = 0
+            # work out gi obstruction based on obar, ogap and otree
+            ototal = ((obar*hbar)+(ogap*hgap)+(otree*htree))/htotal
+            gi_obs = round(ototal, 2)
+    
+        # if it's a fence/wall + trees use same methodology as above: 
+        elif item["type"] == "grey-barrier-trees":
+            # obstruction of barrier value
+            obar = float(item.get("obst"))
+            obar = obar/100
+            # obstruction of tree value (not accounting for spaces between trees along street)
+            otree = float(item.get("tobst"))
+            otree = otree/100
+            # adjust otree for seasonality of tree crowns: simply halve if deciduous
+            if item["tseas"] == "deciduous":
+                otree = otree*deciduous_ratio
+            # obstruction of gap
+            ogap = 0
         
-        # heights
-        # total barrier height
-        htotal = float(item.get("tcth"))
-        # just tree crown
-        htree = float(item.get("tcth"))-float(item.get("tcbh"))
-        # calculate gap between hedge and tree
-        hgap = float(item.get("tcbh"))-float(item.get("height"))
-        # just fence/wall height
-        hbar = float(item.get("height"))
-
-        # having got heights, modify otree to reflect spaces between trees along street
-        # first get tree crown width, twidth, and tree spacing at planting, tspace
-        twidth = float(item.get("tcw"))
-        tspace = float(item.get("tsp"))
-        # calculate modification factor, tfact (assuming tree crowns are oval and tspace ≥ twidth/2)
-        tfact = ((math.pi * twidth)/(4 * tspace))
-        # multiply otree by tfact and ensure 0 ≤ otree ≤ 0.99
-        otree = otree*tfact
-        if otree < 0:
-            otree = 0
-        elif otree > 0.99:
-            otree = 0.99
+            # heights
+            # total barrier height
+            htotal = float(item.get("tcth"))
+            # just tree crown
+            htree = float(item.get("tcth"))-float(item.get("tcbh"))
+            # calculate gap between hedge and tree
+            hgap = float(item.get("tcbh"))-float(item.get("height"))
+            # just fence/wall height
+            hbar = float(item.get("height"))
+
+            # having got heights, modify otree to reflect spaces between trees along street
+            # first get tree crown width, twidth, and tree spacing at planting, tspace
+            twidth = float(item.get("tcw"))
+            tspace = float(item.get("tsp"))
+            # calculate modification factor, tfact (assuming tree crowns are oval and tspace ≥ twidth/2)
+            tfact = ((math.pi * twidth)/(4 * tspace))*tfact_scale
+            # multiply otree by tfact and ensure 0 ≤ otree ≤ 0.99
+            otree = otree*tfact
+            if otree < 0:
+                otree = 0
+            elif otree > 0.99:
+                otree = 0.99
         
-        # work out gi obstruction based on obar, ogap and otree
-        ototal = ((obar*hbar)+(ogap*hgap)+(otree*htree))/htotal
-        gi_obs = round(ototal, 2)
-    
-    # if it's just a hedge (with no trees)
-    elif item["type"] == "green-barrier":
-        # obstruction of barrier value
-        obar = float(item.get("obst"))
-        obar = obar/100
-        # adjust obar for seasonality of green barrier: simply halve if deciduous
-        if item["seasonality"] == "deciduous":
-            obar = obar/2        
-        gi_obs = round(obar, 2)
-    
-    # if it's just a fence/wall (with no trees)
-    elif item["type"] == "grey-barrier":    
-        # obstruction of barrier value
-        obar = float(item.get("obst"))
-        obar = obar/100
-        gi_obs = round(obar, 2)
+            # work out gi obstruction based on obar, ogap and otree
+            ototal = ((obar*hbar)+(ogap*hgap)+(otree*htree))/htotal
+            gi_obs = round(ototal, 2)
+    
+        # if it's just a hedge (with no trees)
+        elif item["type"] == "green-barrier":
+            # obstruction of barrier value
+            obar = float(item.get("obst"))
+            obar = obar/100
+            # adjust obar for seasonality of green barrier: simply halve if deciduous
+            if item["seasonality"] == "deciduous":
+                obar = obar*deciduous_ratio        
+            gi_obs = round(obar, 2)
+    
+        # if it's just a fence/wall (with no trees)
+        elif item["type"] == "grey-barrier":    
+            # obstruction of barrier value
+            obar = float(item.get("obst"))
+            obar = obar/100
+            gi_obs = round(obar, 2)
 
 
         
-# assign to the correct location (upwind or downwind)
-if gi_loc <= zone_original[1]:
-    obs_original[1] = gi_obs
-    obs_original[3] = 0
-elif gi_loc >= zone_original[2]:
-    obs_original[1] = 0
-    obs_original[3] = gi_obs
+    # assign to the correct location (upwind or downwind)
+    if gi_loc <= zone_original[1]:
+        obs_original[1] = gi_obs
+        obs_original[3] = 0
+    elif gi_loc >= zone_original[2]:
+        obs_original[1] = 0
+        obs_original[3] = gi_obs
 
-#print(obs_original)
+    #print(obs_original)
 
-# ___________ SCALE obstruction values for barriers to row heights ___________
+    # ___________ SCALE obstruction values for barriers to row heights ___________
         
-# this will need looking at again should we change the rules around heights
-        # of barriers (e.g. GI has to be less than the building heights);
-        # currently assumed any barrier is WITHIN FIRST ROW - existing & new
+    # this will need looking at again should we change the rules around heights
+            # of barriers (e.g. GI has to be less than the building heights);
+            # currently assumed any barrier is WITHIN FIRST ROW - existing & new
         
-# upwind existing
-obs_original[0] = obs_original[0]*(row_original[8]/h_original[1])
+    # upwind existing
+    obs_original[0] = obs_original[0]*(row_original[8]/h_original[1])
 
-# downwind existing
-obs_original[2] = obs_original[2]*(row_original[9]/h_original[1])
+    # downwind existing
+    obs_original[2] = obs_original[2]*(row_original[9]/h_original[1])
 
-# upwind new
-obs_original[1] = obs_original[1]*(max(row_original[2:6])/h_original[1])
+    # upwind new
+    obs_original[1] = obs_original[1]*(max(row_original[2:6])/h_original[1])
 
-# downwind new
-obs_original[3] = obs_original[3]*(max(row_original[2:6])/h_original[1])
+    # downwind new
+    obs_original[3] = obs_original[3]*(max(row_original[2:6])/h_original[1])
 
-# ___________ flip for mirror image ___________
+    # ___________ flip for mirror image ___________
 
-obs_mirror = np.array([0,0,0,0], dtype = float)
-#existing upwind
-obs_mirror[0] = obs_original[2]
-#new upwind
-obs_mirror[1] = obs_original[3]
-#existing downwind
-obs_mirror[2] = obs_original[0]
-#new downwind
-obs_mirror[3] = obs_original[1]
+    obs_mirror = np.array([0,0,0,0], dtype = float)
+    #existing upwind
+    obs_mirror[0] = obs_original[2]
+    #new upwind
+    obs_mirror[1] = obs_original[3]
+    #existing downwind
+    obs_mirror[2] = obs_original[0]
+    #new downwind
+    obs_mirror[3] = obs_original[1]
 
 
-# if any barriers have 100% coverage, change obstruction to 0.99 otherwise solver 
-# issues occur because of knock-on effect on advection and dispersion patterns;
-# now dispersion is calculated from advection values (adv*0.1)
-# but if obs=1, advection will = 0 in some places and throw out the calculations
+    # if any barriers have 100% coverage, change obstruction to 0.99 otherwise solver 
+    # issues occur because of knock-on effect on advection and dispersion patterns;
+    # now dispersion is calculated from advection values (adv*0.1)
+    # but if obs=1, advection will = 0 in some places and throw out the calculations
 
-for i in range(len(obs_original)):
-    if obs_original[i]==1:
-        obs_original[i]=0.99
-    else:
-        obs_original[i]=obs_original[i]
+    for i in range(len(obs_original)):
+        if obs_original[i]==1:
+            obs_original[i]=0.99
+        else:
+            obs_original[i]=obs_original[i]
         
-for i in range(len(obs_mirror)):
-    if obs_mirror[i]==1:
-        obs_mirror[i]=0.99
-    else:
-        obs_mirror[i]=obs_mirror[i]
+    for i in range(len(obs_mirror)):
+        if obs_mirror[i]==1:
+            obs_mirror[i]=0.99
+        else:
+            obs_mirror[i]=obs_mirror[i]
         
-#print(obs_original)
-#print(obs_mirror)
+    #print(obs_original)
+    #print(obs_mirror)
 
-# ___________ determine how many columns are FULLY spanned by a recirc  ___________
+    return obs_original, obs_mirror
 
-full_rec = 0
+# ___________ determine how many columns are FULLY spanned by a recirc  ___________
 
 def recirc_col(recirc, l_cumu):
     if recirc < l_cumu[1]:
@@ -1918,43 +1803,11 @@ def recirc_col(recirc, l_cumu):
     elif recirc > l_cumu[5]:
         full_rec = 5
         return full_rec
+    # only left for a recirculation length that is not a number
+    raise ValueError("Recirculation length is not a number")
   
-rec_ncol_orig = 0
-rec_nrow_orig = 0
-rec_ncol_mir = 0
-rec_nrow_mir = 0
-
-# if the upwind building is aligned with row 2:
-if row_original[0] == h_cumu_original[2]:
-    rec_nrow_orig = 2
-    rec_ncol_orig = recirc_col(recirc = rec_original[0], l_cumu = l_cumu_original)
-# if the upwind building is aligned with row 3:
-elif row_original[0] == h_cumu_original[3]:
-    # ft is reduced; flow within canyon is slower than background wind speed
-    rec_nrow_orig = 3
-    rec_ncol_orig = recirc_col(recirc = rec_original[0], l_cumu = l_cumu_original)
-    
-# if the upwind building is aligned with row 2:
-if row_mirror[0] == h_cumu_mirror[2]:
-    rec_nrow_mir = 2
-    rec_ncol_mir = recirc_col(recirc = rec_mirror[0], l_cumu = l_cumu_mirror)
-# if the upwind building is aligned with row 3:
-elif row_mirror[0] == h_cumu_mirror[3]:
-    # ft is reduced; flow within canyon is slower than background wind speed
-    rec_nrow_mir = 3
-    rec_ncol_mir = recirc_col(recirc = rec_mirror[0], l_cumu = l_cumu_mirror)
-
-#print(rec_nrow_orig, rec_ncol_orig)
-#print(rec_nrow_mir, rec_ncol_mir)
-
 # ___________ dynamic assignment of wind speeds within canyon ___________
 
-# H = upwind building height
-H_orig = row_original[0]
-H_mir = row_mirror[0]
-# w = street width
-w = roadw
-
 # function to determine wind speed (u) at any height (z)
 def ws_point(ubg,z,H,w):
     
@@ -1984,8 +1837,9 @@ def ws_point(ubg,z,H,w):
     return u
 
 
-# function to determine average wind speed (u) across a row
-def ws_average(row_min, row_max, ubg, H):
+# function to determine average wind speed (u) across a row, as the mean of 
+# 10 points from row_min to row_max (the original method)
+def ws_average_10_point(row_min, row_max, ubg, H, w):
     dif = row_max - row_min
     dif9 = dif/9
     
@@ -2004,43 +1858,62 @@ def ws_average(row_min, row_max, ubg, H):
     avg_u = mean(data)
     
     return avg_u
-        
-
-U3_orig = ws_average(row_min = h_cumu_original[2], row_max = h_cumu_original[3], ubg = ubg_orig, H = H_orig)
-U2_orig = ws_average(row_min = h_cumu_original[1], row_max = h_cumu_original[2], ubg = ubg_orig, H = H_orig)
-U1_orig = ws_average(row_min = 0, row_max = h_cumu_original[1], ubg = ubg_orig, H = H_orig)
-Uh_orig = ws_point(ubg = ubg_orig, z = H_orig, H = H_orig, w = w)
-Ur_orig = (0.1*Uh_orig)*(H_orig/(2*h_original[rec_nrow_orig]))
-Ut_orig = ws_point(ubg = ubg_orig,z=max(row_original[0],row_original[1]),H = H_orig, w = w)
-
-U3_mir = ws_average(row_min = h_cumu_mirror[2], row_max = h_cumu_mirror[3], ubg = ubg_mir, H = H_mir)
-U2_mir = ws_average(row_min = h_cumu_mirror[1], row_max = h_cumu_mirror[2], ubg = ubg_mir, H = H_mir)
-U1_mir = ws_average(row_min = 0, row_max = h_cumu_mirror[1], ubg = ubg_mir, H = H_mir)
-Uh_mir = ws_point(ubg = ubg_mir, z = H_mir, H = H_mir, w = w)
-Ur_mir = (0.1*Uh_mir)*(H_mir/(2*h_mirror[rec_nrow_mir]))
-Ut_mir = ws_point(ubg = ubg_mir,z=max(row_mirror[0],row_mirror[1]),H = H_mir, w = w)
 
-#print(Ut_orig, Uh_orig, Ur_orig, U3_orig, U2_orig, U1_orig)
-#print(Ut_mir, Uh_mir, Ur_mir, U3_mir, U2_mir, U1_mir)
 
+# the row averages are worked out by integrating the wind profile over the 
+# row, unless switched back to the 10 point mean (use_10_point_ws_average) to
+# reproduce results of the original code exactly
+ten_point_ws_average = False
 
-# ___________ prepare empty containers ___________
+def use_10_point_ws_average(flag = True):
+    global ten_point_ws_average
+    ten_point_ws_average = flag
+    layout_responses.cache_clear()
 
-# base patterns: left to right wind
-ua1_orig = np.zeros((5,6)) 	# horizontal advection velocities
-wa1_orig = np.zeros((5,6))   # vertical advection velocities
-ue1_orig = np.zeros((5,6))   # horizontal dispersion velocities
-we1_orig = np.zeros((5,6))   # vertical dispersion velocities
-
-ua1_mir = np.zeros((5,6)) 	# horizontal advection velocities
-wa1_mir = np.zeros((5,6))   # vertical advection velocities
-ue1_mir = np.zeros((5,6))   # horizontal dispersion velocities
-we1_mir = np.zeros((5,6))   # vertical dispersion velocities
+log_5000_500 = math.log(5000)/math.log(500)
 
+# function to determine average wind speed (u) across a row: the profile of 
+# ws_point integrated from row_min to row_max and divided by the row height.
+# Takes arrays of rows (and streets) as well as single values
+def ws_average(row_min, row_max, ubg, H, w):
+    if ten_point_ws_average:
+        return np.vectorize(ws_average_10_point)(row_min, row_max, ubg, H, w)
+    
+    row_min, row_max, ubg, H, w = np.broadcast_arrays(*(np.asarray(x, dtype = float) for x in (row_min, row_max, ubg, H, w)))
+    
+    # d based on street dimensions, as in ws_point
+    d = np.where(w <= 1.5*H, 0.7*H, np.where(w <= 5*H, H - 0.2*w, 0))
+    
+    # log profile u = c*log(5z-5d), floored at 0.1*uh: the floor applies below
+    # z_floor, where the profile comes down to it
+    c = ubg*log_5000_500/np.log(500 - 5*d)
+    min_u = 0.1*c*np.log(5*H - 5*d)
+    z_floor = d + np.exp(0.1*np.log(5*H - 5*d))/5
+    
+    def integral(z):
+        # of the log profile, from z_floor up to z
+        z = np.maximum(z, z_floor)
+        return c*((z - d)*(np.log(5*z - 5*d) - 1))
+    
+    total = min_u*(np.minimum(row_max, z_floor) - np.minimum(row_min, z_floor)) + integral(row_max) - integral(row_min)
+    
+    # rows of no height: the wind speed at that point
+    point = np.where(row_min < z_floor, min_u, c*np.log(5*np.maximum(row_min, z_floor) - 5*d))
+    
+    dif = row_max - row_min
+    return np.where(dif > 0, total/np.where(dif > 0, dif, 1), point)
+        
 
 # ___________ Advection & Dispersion Assignment: NO BARRIERS ___________
 
-def no_barriers_pattern(row, h_cumu, rec_ncol, wa1, we1, ua1, ue1, U1, U2, U3, Ut, Uh, Ur, l, h,):
+# the base patterns take their dispersion as a fraction of the advection (or
+# wind speed) driving it: ue_ratio across the street, we_ratio up and down,
+# and the recirculation speed as recirc_ratio of the wind speed at roof level
+# (see flow_patterns). These are the constants of the model, (ue_ratio,
+# we_ratio, recirc_ratio), that can be varied to see how much they matter
+pattern_constants = (0.1, 0.1, 0.1)
+
+def no_barriers_pattern(row, h_cumu, rec_ncol, wa1, we1, ua1, ue1, U1, U2, U3, Ut, Uh, Ur, l, h, ue_ratio=0.1, we_ratio=0.1):
     # assign air flow outside of recirc
     # upwind building covers 2 rows
     if row[0] == h_cumu[2]:
@@ -2057,9 +1930,9 @@ def no_barriers_pattern(row, h_cumu, rec_ncol, wa1, we1, ua1, ue1, U1, U2, U3, U
             wa1[3,rec_ncol+1] = -(((U2*h[2])/l[rec_ncol+1])+abs(wa1[2,rec_ncol+1]))
             
             # dispersion for vertical down
-            we1[4,1] = abs(wa1[4,1])*0.1
-            we1[3,rec_ncol+1] = abs(wa1[3,rec_ncol+1])*0.1
-            we1[2,rec_ncol+1] = abs(wa1[2,rec_ncol+1])*0.1
+            we1[4,1] = abs(wa1[4,1])*we_ratio
+            we1[3,rec_ncol+1] = abs(wa1[3,rec_ncol+1])*we_ratio
+            we1[2,rec_ncol+1] = abs(wa1[2,rec_ncol+1])*we_ratio
             
             #assign mirror upwards wind in column 5
             wa1[2,5] = ((U1*h[1])/l[5])
@@ -2067,20 +1940,20 @@ def no_barriers_pattern(row, h_cumu, rec_ncol, wa1, we1, ua1, ue1, U1, U2, U3, U
             wa1[4,5] = ((U3*h[3])/l[5]) + wa1[3,5]
             
             # dispersion for vertical up
-            we1[4,5] = abs(wa1[4,5])*0.1
-            we1[3,5] = abs(wa1[3,5])*0.1
-            we1[2,5] = abs(wa1[2,5])*0.1
+            we1[4,5] = abs(wa1[4,5])*we_ratio
+            we1[3,5] = abs(wa1[3,5])*we_ratio
+            we1[2,5] = abs(wa1[2,5])*we_ratio
             
             # vertical dispersion in columns between up and down flows
             if rec_ncol < 3:
-                we1[3,(rec_ncol+2):5] = (abs(wa1[3,rec_ncol+1])+abs(wa1[3,5]))/2*0.1
-                we1[2,(rec_ncol+2):5] = (abs(wa1[2,rec_ncol+1])+abs(wa1[2,5]))/2*0.1
+                we1[3,(rec_ncol+2):5] = (abs(wa1[3,rec_ncol+1])+abs(wa1[3,5]))/2*we_ratio
+                we1[2,(rec_ncol+2):5] = (abs(wa1[2,rec_ncol+1])+abs(wa1[2,5]))/2*we_ratio
                 
             # vertical dispersion at top (above recirc - only 2 rows covered)
             # driven by exchanges with air above canyon
-            we1[4,2:5] = 0.1*Ut
+            we1[4,2:5] = we_ratio*Ut
             # apart from the box with the addition input for U1 and U2
-            we1[4,rec_ncol+1] = abs(wa1[4,rec_ncol+1])*0.1
+            we1[4,rec_ncol+1] = abs(wa1[4,rec_ncol+1])*we_ratio
             
             # horizontal
             # assign horizontal advection for f1,f2 and f3
@@ -2089,9 +1962,9 @@ def no_barriers_pattern(row, h_cumu, rec_ncol, wa1, we1, ua1, ue1, U1, U2, U3, U
             ua1[1,(rec_ncol+2):] = U1
             
             # horizontal dispersion
-            ue1[1,(rec_ncol+2):] = abs(ua1[1,(rec_ncol+2):])*0.1
-            ue1[2,(rec_ncol+2):] = abs(ua1[2,(rec_ncol+2):])*0.1
-            ue1[3,:] = abs(ua1[3,:])*0.1
+            ue1[1,(rec_ncol+2):] = np.abs(ua1[1,(rec_ncol+2):])*ue_ratio
+            ue1[2,(rec_ncol+2):] = np.abs(ua1[2,(rec_ncol+2):])*ue_ratio
+            ue1[3,:] = np.abs(ua1[3,:])*ue_ratio
             
         elif rec_ncol >= 4:
             # cases 5 & 6
@@ -2100,17 +1973,17 @@ def no_barriers_pattern(row, h_cumu, rec_ncol, wa1, we1, ua1, ue1, U1, U2, U3, U
             wa1[4,5] = ((U3*h[3])/l[5])
             
             # dispersion at the top of boxes
-            we1[4,:] = 0.1*Ut
-            we1[4,1] = abs(wa1[4,1])*0.1
-            we1[4,5] = abs(wa1[4,5])*0.1
+            we1[4,:] = we_ratio*Ut
+            we1[4,1] = abs(wa1[4,1])*we_ratio
+            we1[4,5] = abs(wa1[4,5])*we_ratio
             
             # horizontal dispersion
-            ue1[3,2:] = abs(ua1[3,2:])*0.1
+            ue1[3,2:] = np.abs(ua1[3,2:])*ue_ratio
             
             if rec_ncol == 4:
                 # vertical dispersion for slack regions
-                we1[2,5] = abs(wa1[4,5])*0.1
-                we1[3,5] = abs(wa1[4,5])*0.1
+                we1[2,5] = abs(wa1[4,5])*we_ratio
+                we1[3,5] = abs(wa1[4,5])*we_ratio
                 
                 
             
@@ -2123,9 +1996,9 @@ def no_barriers_pattern(row, h_cumu, rec_ncol, wa1, we1, ua1, ue1, U1, U2, U3, U
             wa1[4,rec_ncol+1] = -(((U3*h[3])/l[rec_ncol+1])+abs(wa1[3,rec_ncol+1]))
             
             # dispersion for vertical down
-            we1[4,rec_ncol+1] = abs(wa1[4,rec_ncol+1])*0.1
-            we1[3,rec_ncol+1] = abs(wa1[3,rec_ncol+1])*0.1
-            we1[2,rec_ncol+1] = abs(wa1[2,rec_ncol+1])*0.1
+            we1[4,rec_ncol+1] = abs(wa1[4,rec_ncol+1])*we_ratio
+            we1[3,rec_ncol+1] = abs(wa1[3,rec_ncol+1])*we_ratio
+            we1[2,rec_ncol+1] = abs(wa1[2,rec_ncol+1])*we_ratio
             
             # upwards: flow out of canyon
             wa1[2,5] = ((U1*h[1])/l[5])
@@ -2133,13 +2006,13 @@ def no_barriers_pattern(row, h_cumu, rec_ncol, wa1, we1, ua1, ue1, U1, U2, U3, U
             wa1[4,5] = ((U3*h[3])/l[5]) + wa1[3,5]
             
             # dispersion for vertical up
-            we1[2,5] = wa1[2,5]*0.1
-            we1[3,5] = wa1[3,5]*0.1
-            we1[4,5] = wa1[4,5]*0.1
+            we1[2,5] = wa1[2,5]*we_ratio
+            we1[3,5] = wa1[3,5]*we_ratio
+            we1[4,5] = wa1[4,5]*we_ratio
             
             # vertical dispersion in between advection flows up and down
             if rec_ncol < 3:
-                we1[4,(rec_ncol+2):5] = 0.1*Uh
+                we1[4,(rec_ncol+2):5] = we_ratio*Uh
                 we1[3,(rec_ncol+2):5] = (we1[3,rec_ncol+1]+we1[3,5])/2
                 we1[2,(rec_ncol+2):5] = (we1[2,rec_ncol+1]+we1[2,5])/2
             
@@ -2149,17 +2022,17 @@ def no_barriers_pattern(row, h_cumu, rec_ncol, wa1, we1, ua1, ue1, U1, U2, U3, U
             ua1[1,(rec_ncol+2):] = U1
             
             # horizontal dispersion
-            ue1[3,(rec_ncol+2):] = abs(ua1[3,(rec_ncol+2):])*0.1
-            ue1[2,(rec_ncol+2):] = abs(ua1[2,(rec_ncol+2):])*0.1
-            ue1[1,(rec_ncol+2):] = abs(ua1[1,(rec_ncol+2):])*0.1
+            ue1[3,(rec_ncol+2):] = np.abs(ua1[3,(rec_ncol+2):])*ue_ratio
+            ue1[2,(rec_ncol+2):] = np.abs(ua1[2,(rec_ncol+2):])*ue_ratio
+            ue1[1,(rec_ncol+2):] = np.abs(ua1[1,(rec_ncol+2):])*ue_ratio
             
         # else - for cases 5 & 6 there are no flows outside the recirc zone
         elif rec_ncol == 4:
             # no horizontal dispersion but vertical dispersion based on ACH
             # no advection flows outside of recirc
-            we1[2,5] = 0.1*Uh
-            we1[3,5] = 0.1*Uh
-            we1[4,5] = 0.1*Uh
+            we1[2,5] = we_ratio*Uh
+            we1[3,5] = we_ratio*Uh
+            we1[4,5] = we_ratio*Uh
     
     # flows within recirc region
     if row[0] == h_cumu[2]:
@@ -2177,18 +2050,18 @@ def no_barriers_pattern(row, h_cumu, rec_ncol, wa1, we1, ua1, ue1, U1, U2, U3, U
             wa1[2,1] = (abs(ua1[1,2])*h[1])/l[1]
             
             # horizontal dispersion
-            ue1[2,2:(rec_ncol+1)] = abs(ua1[2,2:(rec_ncol+1)])*0.1
-            ue1[1,2:(rec_ncol+1)] = abs(ua1[1,2:(rec_ncol+1)])*0.1
+            ue1[2,2:(rec_ncol+1)] = np.abs(ua1[2,2:(rec_ncol+1)])*ue_ratio
+            ue1[1,2:(rec_ncol+1)] = np.abs(ua1[1,2:(rec_ncol+1)])*ue_ratio
             
             # vertical dispersion = 10% of average up and down velocities
             # vertical dispersion within recirc
-            we1[2,1] = abs(wa1[2,1])*0.1
-            we1[2,rec_ncol] = abs(wa1[2,rec_ncol])*0.1
+            we1[2,1] = abs(wa1[2,1])*we_ratio
+            we1[2,rec_ncol] = abs(wa1[2,rec_ncol])*we_ratio
             we1[2,2:rec_ncol] =  (we1[2,1]+we1[2,rec_ncol])/2
             #we1[2,1:(rec_ncol+1)] = ((abs(wa1[2,1])+abs(wa1[2,rec_ncol]))/2)*0.1
             
         elif rec_ncol == 1:
-            we1[2,1] = 0.1*Ur
+            we1[2,1] = we_ratio*Ur
             
     elif row[0] == h_cumu[3]:
         if rec_ncol >= 2:
@@ -2208,8 +2081,8 @@ def no_barriers_pattern(row, h_cumu, rec_ncol, wa1, we1, ua1, ue1, U1, U2, U3, U
             
             
             # horizontal dispersion
-            ue1[3,2:(rec_ncol+1)] = abs(ua1[3,2:(rec_ncol+1)])*0.1
-            ue1[1,2:(rec_ncol+1)] = abs(ua1[1,2:(rec_ncol+1)])*0.1
+            ue1[3,2:(rec_ncol+1)] = np.abs(ua1[3,2:(rec_ncol+1)])*ue_ratio
+            ue1[1,2:(rec_ncol+1)] = np.abs(ua1[1,2:(rec_ncol+1)])*ue_ratio
             
             # horizontal dispersion through slack middle = average of top and bottom
             ue1[2,2:(rec_ncol+1)] = (ue1[3,2:(rec_ncol+1)]+ue1[1,2:(rec_ncol+1)])/2
@@ -2217,19 +2090,19 @@ def no_barriers_pattern(row, h_cumu, rec_ncol, wa1, we1, ua1, ue1, U1, U2, U3, U
             
             # vertical dispersion
             # default each row to average of up/down velocities *0.1
-            we1[2,1:(rec_ncol+1)] = ((abs(wa1[2,rec_ncol])+abs(wa1[2,1]))/2)*0.1
-            we1[3,1:(rec_ncol+1)] = ((abs(wa1[3,rec_ncol])+abs(wa1[3,1]))/2)*0.1
+            we1[2,1:(rec_ncol+1)] = ((abs(wa1[2,rec_ncol])+abs(wa1[2,1]))/2)*we_ratio
+            we1[3,1:(rec_ncol+1)] = ((abs(wa1[3,rec_ncol])+abs(wa1[3,1]))/2)*we_ratio
             
             # then specify each edge driven by local advection
-            we1[2,rec_ncol] = abs(wa1[2,rec_ncol])*0.1
-            we1[3,rec_ncol] = abs(wa1[3,rec_ncol])*0.1
+            we1[2,rec_ncol] = abs(wa1[2,rec_ncol])*we_ratio
+            we1[3,rec_ncol] = abs(wa1[3,rec_ncol])*we_ratio
             
-            we1[2,1] = abs(wa1[2,1])*0.1
-            we1[3,1] = abs(wa1[3,1])*0.1
+            we1[2,1] = abs(wa1[2,1])*we_ratio
+            we1[3,1] = abs(wa1[3,1])*we_ratio
         
         elif rec_ncol == 1:
-            we1[2,1] = 0.1*Ur
-            we1[3,1] = 0.1*Ur
+            we1[2,1] = we_ratio*Ur
+            we1[3,1] = we_ratio*Ur
         
     
     
@@ -2265,45 +2138,6 @@ def no_barriers_pattern(row, h_cumu, rec_ncol, wa1, we1, ua1, ue1, U1, U2, U3, U
         
     return ue1, ua1, we1, wa1        
 
-no_barriers_orig = no_barriers_pattern(row=row_original, h_cumu=h_cumu_original, 
-                                rec_ncol=rec_ncol_orig, wa1=wa1_orig, we1=we1_orig, 
-                                ua1=ua1_orig, ue1=ue1_orig, U1=U1_orig, U2=U2_orig, 
-                                U3=U3_orig, Ut=Ut_orig, Uh=Uh_orig, Ur=Ur_orig, 
-                                l=l_original, h=h_original)
-ue1_orig = no_barriers_orig[0]
-ua1_orig = no_barriers_orig[1]
-we1_orig = no_barriers_orig[2]
-wa1_orig = no_barriers_orig[3]
-
-# print("ue1_orig")
-# print(ue1_orig)
-# print("ua1_orig")
-# print(ua1_orig)
-# print("we1_orig")
-# print(we1_orig)
-# print("wa1_orig")
-# print(wa1_orig)
-
-no_barriers_mir = no_barriers_pattern(row=row_mirror, h_cumu=h_cumu_mirror, 
-                                rec_ncol=rec_ncol_mir, wa1=wa1_mir, we1=we1_mir, 
-                                ua1=ua1_mir, ue1=ue1_mir, U1=U1_mir, U2=U2_mir, 
-                                U3=U3_mir, Ut=Ut_mir, Uh=Uh_mir, Ur=Ur_mir, 
-                                l=l_mirror, h=h_mirror)
-ue1_mir = no_barriers_mir[0]
-ua1_mir = no_barriers_mir[1]
-we1_mir = no_barriers_mir[2]
-wa1_mir = no_barriers_mir[3]
-
-# print("ue1_mir")
-# print(ue1_mir)
-# print("ua1_mir")
-# print(ua1_mir)
-# print("we1_mir")
-# print(we1_mir)
-# print("wa1_mir")
-# print(wa1_mir)
-
-
 # ___________ Advection & Dispersion Assignment: FUNCTIONS for barriers ___________
 
 # 1) ----- define functions -----
@@ -2337,12 +2171,12 @@ def bar_outside(obs, bar_col, bar_recirc, ue, ua, we, wa, h, l, l_cumu):
         # remember convention within python to be right exclusive when using :
         ua[2,(bar_col+1):(rec_ncol_bar+2)] = ua[2,(bar_col+1):(rec_ncol_bar+2)]+delta_u2
         # respective dispersion:
-        ue[2,(bar_col+1):(rec_ncol_bar+2)] = abs(ua[2,(bar_col+1):(rec_ncol_bar+2)])*0.1
+        ue[2,(bar_col+1):(rec_ncol_bar+2)] = np.abs(ua[2,(bar_col+1):(rec_ncol_bar+2)])*0.1
         
         # carry on delta u1 until the rejoin
         ua[1,(bar_col+1):(rec_ncol_bar+2)] = ua[1,(bar_col+1):(rec_ncol_bar+2)]-delta_u1
         # respective dispersion:
-        ue[1,(bar_col+1):(rec_ncol_bar+2)] = abs(ua[1,(bar_col+1):(rec_ncol_bar+2)])*0.1
+        ue[1,(bar_col+1):(rec_ncol_bar+2)] = np.abs(ua[1,(bar_col+1):(rec_ncol_bar+2)])*0.1
     
         # bring delta U2 back down to ground
         delta_u2_down = ((delta_u2*h[2])/l[rec_ncol_bar+1])
@@ -2357,12 +2191,12 @@ def bar_outside(obs, bar_col, bar_recirc, ue, ua, we, wa, h, l, l_cumu):
         # carry on delta U2 across 2nd row
         ua[2,(bar_col+1):] = ua[2,(bar_col+1):]+delta_u2
         # respective dispersion:
-        ue[2,(bar_col+1):] = abs(ua[2,(bar_col+1):])*0.1
+        ue[2,(bar_col+1):] = np.abs(ua[2,(bar_col+1):])*0.1
     
         # carry delta u1 across 1st row
         ua[1,(bar_col+1):] = ua[1,(bar_col+1):]-delta_u1
         # respective dispersion:
-        ue[1,(bar_col+1):] = abs(ua[1,(bar_col+1):])*0.1
+        ue[1,(bar_col+1):] = np.abs(ua[1,(bar_col+1):])*0.1
 
     
         # adjust vertical values in column 5
@@ -2421,8 +2255,8 @@ def bar_inside(obs, bar_col, ue, ua, we, wa, h, l, rec_ncol, rec_nrow):
         wa[2,1] = wa[2,1]-delta_ur_111
     
         # horizontal dispersion
-        ue[2,2:(rec_ncol+1)] = abs(ua[2,2:(rec_ncol+1)])*0.1
-        ue[1,2:(rec_ncol+1)] = abs(ua[1,2:(rec_ncol+1)])*0.1
+        ue[2,2:(rec_ncol+1)] = np.abs(ua[2,2:(rec_ncol+1)])*0.1
+        ue[1,2:(rec_ncol+1)] = np.abs(ua[1,2:(rec_ncol+1)])*0.1
     
         # vertical dispersion = 10% of average up and down velocities
         # vertical dispersion within recirc
@@ -2451,8 +2285,8 @@ def bar_inside(obs, bar_col, ue, ua, we, wa, h, l, rec_ncol, rec_nrow):
         wa[3,1] = wa[3,1]-delta_ur_111
     
         # horizontal dispersion
-        ue[3,2:(rec_ncol+1)] = abs(ua[3,2:(rec_ncol+1)])*0.1
-        ue[1,2:(rec_ncol+1)] = abs(ua[1,2:(rec_ncol+1)])*0.1
+        ue[3,2:(rec_ncol+1)] = np.abs(ua[3,2:(rec_ncol+1)])*0.1
+        ue[1,2:(rec_ncol+1)] = np.abs(ua[1,2:(rec_ncol+1)])*0.1
     
         # horizontal dispersion through slack middle = average of top and bottom
         ue[2,2:(rec_ncol+1)] = (ue[3,2:(rec_ncol+1)]+ue[1,2:(rec_ncol+1)])/2
@@ -2517,17 +2351,6 @@ def bar_inside_disp(bar, ue, obs, l_cumu):
 
 # ___________ Advection & Dispersion Assignment: EXISTING BARRIERS ___________
 
-# copy existing patterns into new storage containers
-ue2_orig = ue1_orig.copy()
-ua2_orig = ua1_orig.copy()
-we2_orig = we1_orig.copy()
-wa2_orig = wa1_orig.copy()
-
-ue2_mir = ue1_mir.copy()
-ua2_mir = ua1_mir.copy()
-we2_mir = we1_mir.copy()
-wa2_mir = wa1_mir.copy()
-
 def existing_barrier_pattern(check, l_cumu, rec_ncol, rec_nrow, bar, obs, rec, ue2, ua2, we2, wa2, h, l, row):
         # 1. OUTSIDE RECIRC
     # barriers considered in order of impact on advection patterns
@@ -2603,59 +2426,8 @@ def existing_barrier_pattern(check, l_cumu, rec_ncol, rec_nrow, bar, obs, rec, u
     
     return ue2, ua2, we2, wa2 
 
-existing_barriers_orig = existing_barrier_pattern(check=check_original, l_cumu=l_cumu_original, 
-                                                  rec_ncol=rec_ncol_orig, rec_nrow=rec_nrow_orig, 
-                                                  bar=bar_original, obs=obs_original, rec=rec_original, 
-                                                  ue2=ue2_orig, ua2=ua2_orig, we2=we2_orig, wa2=wa2_orig, 
-                                                  h=h_original, l=l_original, row=row_original)
-
-ue2_orig = existing_barriers_orig[0]
-ua2_orig = existing_barriers_orig[1]
-we2_orig = existing_barriers_orig[2]
-wa2_orig = existing_barriers_orig[3]
-
-# print("ue2_orig")
-# print(ue2_orig)
-# print("ua2_orig")
-# print(ua2_orig)
-# print("we2_orig")
-# print(we2_orig)
-# print("wa2_orig")
-# print(wa2_orig)
-
-existing_barriers_mir = existing_barrier_pattern(check=check_mirror, l_cumu=l_cumu_mirror, 
-                                                  rec_ncol=rec_ncol_mir, rec_nrow=rec_nrow_mir, 
-                                                  bar=bar_mirror, obs=obs_mirror, rec=rec_mirror, 
-                                                  ue2=ue2_mir, ua2=ua2_mir, we2=we2_mir, wa2=wa2_mir, 
-                                                  h=h_mirror, l=l_mirror, row=row_mirror)
-
-ue2_mir = existing_barriers_mir[0]
-ua2_mir = existing_barriers_mir[1]
-we2_mir = existing_barriers_mir[2]
-wa2_mir = existing_barriers_mir[3]
-
-# print("ue2_mir")
-# print(ue2_mir)
-# print("ua2_mir")
-# print(ua2_mir)
-# print("we2_mir")
-# print(we2_mir)
-# print("wa2_mir")
-# print(wa2_mir)
-
 # ___________ Advection & Dispersion Assignment: NEW GI BARRIER ___________
 
-# make a fresh copy of base advection patterns
-ue3_orig = ue1_orig.copy()
-ua3_orig = ua1_orig.copy()
-we3_orig = we1_orig.copy()
-wa3_orig = wa1_orig.copy()
-
-ue3_mir = ue1_mir.copy()
-ua3_mir = ua1_mir.copy()
-we3_mir = we1_mir.copy()
-wa3_mir = wa1_mir.copy()
-
 def new_barrier_pattern(check, l_cumu, bar, obs, rec, ue3, ua3, we3, wa3, h, l, rec_ncol, zone, row, rec_nrow):
         # 1. OUTSIDE RECIRC
     
@@ -2695,7 +2467,7 @@ def new_barrier_pattern(check, l_cumu, bar, obs, rec, ue3, ua3, we3, wa3, h, l,
     # therefore including: upwind existing, upwind/downwind new, downwind existing
     if l_cumu[rec_ncol] > zone[3]:
         # if all barriers are the same height
-        if max(row[2:6]) == row[8] and row[8] == row[9]:
+        if row[2:6].max() == row[8] and row[8] == row[9]:
             # apply advection changes (disp included) based on GI
             # if the barrier is upwind
             if check[1] == 1:
@@ -2716,7 +2488,7 @@ def new_barrier_pattern(check, l_cumu, bar, obs, rec, ue3, ua3, we3, wa3, h, l,
                 bar_inside_disp(bar=bar[2], ue=ue3, obs=obs[2], l_cumu=l_cumu)
                 
         # if the GI is equal to the tallest existing barrier 
-        elif max(row[2:6]) == max(row[8:]):
+        elif row[2:6].max() == row[8:].max():
             # apply advection changes based on GI
             # if the barrier is upwind
             if check[1] == 1:
@@ -2737,7 +2509,7 @@ def new_barrier_pattern(check, l_cumu, bar, obs, rec, ue3, ua3, we3, wa3, h, l,
                 bar_inside_disp(bar=bar[2], ue=ue3, obs=obs[2], l_cumu=l_cumu)
                 
         # if the existing barriers are equal heights, and they are both greater than the GI
-        elif row[8] == row[9] and row[8] > max(row[2:6]):
+        elif row[8] == row[9] and row[8] > row[2:6].max():
             # advection changes on downwind barrier
             bar_inside_check(bar=bar[2], obs=obs[2], ue=ue3, ua=ua3, we=we3, wa=wa3, l_cumu=l_cumu, h=h, l=l, rec_ncol=rec_ncol, rec_nrow=rec_nrow)
                 
@@ -2747,7 +2519,7 @@ def new_barrier_pattern(check, l_cumu, bar, obs, rec, ue3, ua3, we3, wa3, h, l,
             bar_inside_disp(bar=bar[3], ue=ue3, obs=obs[3], l_cumu=l_cumu)
         
         # if upwind existing is exclusively the tallest
-        elif row[8] == max(row[2:]):
+        elif row[8] == row[2:].max():
             # apply advection using upwind existing barrier info
             bar_inside_check(bar=bar[0], obs=obs[0], ue=ue3, ua=ua3, we=we3, wa=wa3, l_cumu=l_cumu, h=h, l=l, rec_ncol=rec_ncol, rec_nrow=rec_nrow)
             
@@ -2757,7 +2529,7 @@ def new_barrier_pattern(check, l_cumu, bar, obs, rec, ue3, ua3, we3, wa3, h, l,
             bar_inside_disp(bar=bar[3], ue=ue3, obs=obs[3], l_cumu=l_cumu)
             
         # if the downwind existing is exclusively the tallest    
-        elif row[9] == max(row[2:]):
+        elif row[9] == row[2:].max():
             # apply advection using downwind existing barrier info
             bar_inside_check(bar=bar[2], obs=obs[2], ue=ue3, ua=ua3, we=we3, wa=wa3, l_cumu=l_cumu, h=h, l=l, rec_ncol=rec_ncol, rec_nrow=rec_nrow)
             
@@ -2767,7 +2539,7 @@ def new_barrier_pattern(check, l_cumu, bar, obs, rec, ue3, ua3, we3, wa3, h, l,
             bar_inside_disp(bar=bar[3], ue=ue3, obs=obs[3], l_cumu=l_cumu)
         
         # else if the GI is exclusively the tallest    
-        elif max(row[2:6]) == max(row[2:]):
+        elif row[2:6].max() == row[2:].max():
             # if the barrier is upwind
             if check[1] == 1:
                 # apply advection changes based on new barrier upwind
@@ -2794,21 +2566,21 @@ def new_barrier_pattern(check, l_cumu, bar, obs, rec, ue3, ua3, we3, wa3, h, l,
         # check if there is a barrier downwind (bar[3] would be 0 if there is no barrier downwind)
         if check[3] == 1:
             # if they are both the same height
-            if row[8] == max(row[2:6]):
+            if row[8] == row[2:6].max():
                 # apply advection using new barrier
                 bar_inside_check(bar=bar[3], obs=obs[3], ue=ue3, ua=ua3, we=we3, wa=wa3, l_cumu=l_cumu, h=h, l=l, rec_ncol=rec_ncol, rec_nrow=rec_nrow)
                 # apply dispersion using upwind existing
                 bar_inside_disp(bar=bar[0], ue=ue3, obs=obs[0], l_cumu=l_cumu)
             
             # if upwind existing is the tallest
-            elif row[8] > max(row[2:6]):
+            elif row[8] > row[2:6].max():
                 # apply advection using upwind existing barrier info
                 bar_inside_check(bar=bar[0], obs=obs[0], ue=ue3, ua=ua3, we=we3, wa=wa3, l_cumu=l_cumu, h=h, l=l, rec_ncol=rec_ncol, rec_nrow=rec_nrow)
                 # apply dispersion changes using new barrier info
                 bar_inside_disp(bar=bar[3], ue=ue3, obs=obs[3], l_cumu=l_cumu)
                 
             # else if the new barrier is the tallest
-            elif max(row[2:6]) > row[8]:
+            elif row[2:6].max() > row[8]:
                 # apply advection using new barrier
                 bar_inside_check(bar=bar[3], obs=obs[3], ue=ue3, ua=ua3, we=we3, wa=wa3, l_cumu=l_cumu, h=h, l=l, rec_ncol=rec_ncol, rec_nrow=rec_nrow)
                 # apply dispersion using upwind existing
@@ -2820,21 +2592,21 @@ def new_barrier_pattern(check, l_cumu, bar, obs, rec, ue3, ua3, we3, wa3, h, l,
     if l_cumu[rec_ncol] > bar[1] and l_cumu[rec_ncol] <= zone[3]:
         if check[1] == 1:
             # if they are both the same height
-            if row[8] == max(row[2:6]):
+            if row[8] == row[2:6].max():
                 # apply advection using new barrier
                 bar_inside_check(bar=bar[1], obs=obs[1], ue=ue3, ua=ua3, we=we3, wa=wa3, l_cumu=l_cumu, h=h, l=l, rec_ncol=rec_ncol, rec_nrow=rec_nrow)
                 # apply dispersion using upwind existing
                 bar_inside_disp(bar=bar[0], ue=ue3, obs=obs[0], l_cumu=l_cumu)
             
             # if upwind existing is the tallest
-            elif row[8] > max(row[2:6]):
+            elif row[8] > row[2:6].max():
                 # apply advection using upwind existing barrier info
                 bar_inside_check(bar=bar[0], obs=obs[0], ue=ue3, ua=ua3, we=we3, wa=wa3, l_cumu=l_cumu, h=h, l=l, rec_ncol=rec_ncol, rec_nrow=rec_nrow)
                 # apply dispersion changes using new barrier info
                 bar_inside_disp(bar=bar[1], ue=ue3, obs=obs[1], l_cumu=l_cumu)
                 
             # else if the new barrier is the tallest
-            elif max(row[2:6]) > row[8]:
+            elif row[2:6].max() > row[8]:
                 # apply advection using new barrier
                 bar_inside_check(bar=bar[1], obs=obs[1], ue=ue3, ua=ua3, we=we3, wa=wa3, l_cumu=l_cumu, h=h, l=l, rec_ncol=rec_ncol, rec_nrow=rec_nrow)
                 # apply dispersion using upwind existing
@@ -2873,47 +2645,328 @@ def new_barrier_pattern(check, l_cumu, bar, obs, rec, ue3, ua3, we3, wa3, h, l,
 
 
 
-new_barrier_orig = new_barrier_pattern(check=check_original, l_cumu=l_cumu_original, 
-                                       bar=bar_original, obs=obs_original, rec=rec_original, 
-                                       ue3=ue3_orig, ua3=ua3_orig, we3=we3_orig, wa3=wa3_orig, 
-                                       h=h_original, l=l_original, rec_ncol=rec_ncol_orig, 
-                                       zone=zone_original, row=row_original, rec_nrow=rec_nrow_orig)
-
-ue3_orig = new_barrier_orig[0]
-ua3_orig = new_barrier_orig[1]
-we3_orig = new_barrier_orig[2]
-wa3_orig = new_barrier_orig[3]
-
-# print("ue3_orig")
-# print(ue3_orig)
-# print("ua3_orig")
-# print(ua3_orig)
-# print("we3_orig")
-# print(we3_orig)
-# print("wa3_orig")
-# print(wa3_orig)
-
-
-new_barrier_mir = new_barrier_pattern(check=check_mirror, l_cumu=l_cumu_mirror, 
-                                       bar=bar_mirror, obs=obs_mirror, rec=rec_mirror, 
-                                       ue3=ue3_mir, ua3=ua3_mir, we3=we3_mir, wa3=wa3_mir, 
-                                       h=h_mirror, l=l_mirror, rec_ncol=rec_ncol_mir, 
-                                       zone=zone_mirror, row=row_mirror, rec_nrow=rec_nrow_mir)
-
-ue3_mir = new_barrier_mir[0]
-ua3_mir = new_barrier_mir[1]
-we3_mir = new_barrier_mir[2]
-wa3_mir = new_barrier_mir[3]
-
-# print("ue3_mir")
-# print(ue3_mir)
-# print("ua3_mir")
-# print(ua3_mir)
-# print("we3_mir")
-# print(we3_mir)
-# print("wa3_mir")
-# print(wa3_mir)
-
+# ___________ Advection & Dispersion Assignment: NEW GI BARRIER ONLY ___________
+
+# the new barrier patterns on their own, from the base patterns and recirc
+# extents flow_patterns stores in the state, so that barriers with the same
+# footprint (and so the same layout) can be tried without working out the
+# base and existing barrier patterns again
+def new_barrier_flows(state, obs_original, obs_mirror):
+    row_original = state["row_original"]
+    row_mirror = state["row_mirror"]
+    bar_original = state["bar_original"]
+    bar_mirror = state["bar_mirror"]
+    check_original = state["check_original"]
+    check_mirror = state["check_mirror"]
+    zone_original = state["zone_original"]
+    zone_mirror = state["zone_mirror"]
+    h_original = state["h_original"]
+    h_mirror = state["h_mirror"]
+    l_original = state["l_original"]
+    l_mirror = state["l_mirror"]
+    l_cumu_original = state["l_cumu_original"]
+    l_cumu_mirror = state["l_cumu_mirror"]
+    rec_original = state["rec_original"]
+    rec_mirror = state["rec_mirror"]
+    rec_ncol_orig = state["rec_ncol_orig"]
+    rec_nrow_orig = state["rec_nrow_orig"]
+    rec_ncol_mir = state["rec_ncol_mir"]
+    rec_nrow_mir = state["rec_nrow_mir"]
+    ue1_orig = state["ue1_orig"]
+    ua1_orig = state["ua1_orig"]
+    we1_orig = state["we1_orig"]
+    wa1_orig = state["wa1_orig"]
+    ue1_mir = state["ue1_mir"]
+    ua1_mir = state["ua1_mir"]
+    we1_mir = state["we1_mir"]
+    wa1_mir = state["wa1_mir"]
+
+    # make a fresh copy of base advection patterns
+    ue3_orig = ue1_orig.copy()
+    ua3_orig = ua1_orig.copy()
+    we3_orig = we1_orig.copy()
+    wa3_orig = wa1_orig.copy()
+
+    ue3_mir = ue1_mir.copy()
+    ua3_mir = ua1_mir.copy()
+    we3_mir = we1_mir.copy()
+    wa3_mir = wa1_mir.copy()
+
+    new_barrier_orig = new_barrier_pattern(check=check_original, l_cumu=l_cumu_original, 
+                                           bar=bar_original, obs=obs_original, rec=rec_original, 
+                                           ue3=ue3_orig, ua3=ua3_orig, we3=we3_orig, wa3=wa3_orig, 
+                                           h=h_original, l=l_original, rec_ncol=rec_ncol_orig, 
+                                           zone=zone_original, row=row_original, rec_nrow=rec_nrow_orig)
+
+    ue3_orig = new_barrier_orig[0]
+    ua3_orig = new_barrier_orig[1]
+    we3_orig = new_barrier_orig[2]
+    wa3_orig = new_barrier_orig[3]
+
+    # print("ue3_orig")
+    # print(ue3_orig)
+    # print("ua3_orig")
+    # print(ua3_orig)
+    # print("we3_orig")
+    # print(we3_orig)
+    # print("wa3_orig")
+    # print(wa3_orig)
+
+
+    new_barrier_mir = new_barrier_pattern(check=check_mirror, l_cumu=l_cumu_mirror, 
+                                           bar=bar_mirror, obs=obs_mirror, rec=rec_mirror, 
+                                           ue3=ue3_mir, ua3=ua3_mir, we3=we3_mir, wa3=wa3_mir, 
+                                           h=h_mirror, l=l_mirror, rec_ncol=rec_ncol_mir, 
+                                           zone=zone_mirror, row=row_mirror, rec_nrow=rec_nrow_mir)
+
+    ue3_mir = new_barrier_mir[0]
+    ua3_mir = new_barrier_mir[1]
+    we3_mir = new_barrier_mir[2]
+    wa3_mir = new_barrier_mir[3]
+
+    # print("ue3_mir")
+    # print(ue3_mir)
+    # print("ua3_mir")
+    # print(ua3_mir)
+    # print("we3_mir")
+    # print(we3_mir)
+    # print("wa3_mir")
+    # print(wa3_mir)
+
+    flows = {}
+    flows["obs_original"] = obs_original
+    flows["obs_mirror"] = obs_mirror
+    flows["ue3_orig"] = ue3_orig
+    flows["ua3_orig"] = ua3_orig
+    flows["we3_orig"] = we3_orig
+    flows["wa3_orig"] = wa3_orig
+    flows["ue3_mir"] = ue3_mir
+    flows["ua3_mir"] = ua3_mir
+    flows["we3_mir"] = we3_mir
+    flows["wa3_mir"] = wa3_mir
+    
+    return flows
+
+
+# ___________ Advection & Dispersion Assignment: ALL PATTERNS ___________
+
+# obs optionally gives (obs_original, obs_mirror) to use instead of those
+# worked out from the barriers, e.g. to see how sensitive the flows are to
+# them, and constants (ue_ratio, we_ratio, recirc_ratio) other values of
+# pattern_constants
+def flow_patterns(state, obs=None, constants=pattern_constants):
+    roadw = state["roadw"]
+    row_original = state["row_original"]
+    row_mirror = state["row_mirror"]
+    rec_original = state["rec_original"]
+    rec_mirror = state["rec_mirror"]
+    bar_original = state["bar_original"]
+    bar_mirror = state["bar_mirror"]
+    check_original = state["check_original"]
+    check_mirror = state["check_mirror"]
+    h_original = state["h_original"]
+    h_mirror = state["h_mirror"]
+    l_original = state["l_original"]
+    l_mirror = state["l_mirror"]
+    h_cumu_original = state["h_cumu_original"]
+    h_cumu_mirror = state["h_cumu_mirror"]
+    l_cumu_original = state["l_cumu_original"]
+    l_cumu_mirror = state["l_cumu_mirror"]
+    ubg_orig = state["ubg_orig"]
+    ubg_mir = state["ubg_mir"]
+
+    if obs is None:
+        obs_original, obs_mirror = barrier_obstruction(state)
+    else:
+        obs_original, obs_mirror = obs
+    ue_ratio, we_ratio, recirc_ratio = constants
+
+    rec_ncol_orig = 0
+    rec_nrow_orig = 0
+    rec_ncol_mir = 0
+    rec_nrow_mir = 0
+
+    # if the upwind building is aligned with row 2:
+    if row_original[0] == h_cumu_original[2]:
+        rec_nrow_orig = 2
+        rec_ncol_orig = recirc_col(recirc = rec_original[0], l_cumu = l_cumu_original)
+    # if the upwind building is aligned with row 3:
+    elif row_original[0] == h_cumu_original[3]:
+        # ft is reduced; flow within canyon is slower than background wind speed
+        rec_nrow_orig = 3
+        rec_ncol_orig = recirc_col(recirc = rec_original[0], l_cumu = l_cumu_original)
+    
+    # if the upwind building is aligned with row 2:
+    if row_mirror[0] == h_cumu_mirror[2]:
+        rec_nrow_mir = 2
+        rec_ncol_mir = recirc_col(recirc = rec_mirror[0], l_cumu = l_cumu_mirror)
+    # if the upwind building is aligned with row 3:
+    elif row_mirror[0] == h_cumu_mirror[3]:
+        # ft is reduced; flow within canyon is slower than background wind speed
+        rec_nrow_mir = 3
+        rec_ncol_mir = recirc_col(recirc = rec_mirror[0], l_cumu = l_cumu_mirror)
+
+    #print(rec_nrow_orig, rec_ncol_orig)
+    #print(rec_nrow_mir, rec_ncol_mir)
+
+    # ___________ dynamic assignment of wind speeds within canyon ___________
+
+    # H = upwind building height
+    H_orig = row_original[0]
+    H_mir = row_mirror[0]
+    # w = street width
+    w = roadw
+
+    # all 3 rows at once
+    U1_orig, U2_orig, U3_orig = ws_average(row_min = h_cumu_original[0:3], row_max = h_cumu_original[1:4], ubg = ubg_orig, H = H_orig, w = w)
+    Uh_orig = ws_point(ubg = ubg_orig, z = H_orig, H = H_orig, w = w)
+    Ur_orig = (recirc_ratio*Uh_orig)*(H_orig/(2*h_original[rec_nrow_orig]))
+    Ut_orig = ws_point(ubg = ubg_orig,z=max(row_original[0],row_original[1]),H = H_orig, w = w)
+
+    U1_mir, U2_mir, U3_mir = ws_average(row_min = h_cumu_mirror[0:3], row_max = h_cumu_mirror[1:4], ubg = ubg_mir, H = H_mir, w = w)
+    Uh_mir = ws_point(ubg = ubg_mir, z = H_mir, H = H_mir, w = w)
+    Ur_mir = (recirc_ratio*Uh_mir)*(H_mir/(2*h_mirror[rec_nrow_mir]))
+    Ut_mir = ws_point(ubg = ubg_mir,z=max(row_mirror[0],row_mirror[1]),H = H_mir, w = w)
+
+    #print(Ut_orig, Uh_orig, Ur_orig, U3_orig, U2_orig, U1_orig)
+    #print(Ut_mir, Uh_mir, Ur_mir, U3_mir, U2_mir, U1_mir)
+
+
+    # ___________ prepare empty containers ___________
+
+    # base patterns: left to right wind
+    ua1_orig = np.zeros((5,6)) 	# horizontal advection velocities
+    wa1_orig = np.zeros((5,6))   # vertical advection velocities
+    ue1_orig = np.zeros((5,6))   # horizontal dispersion velocities
+    we1_orig = np.zeros((5,6))   # vertical dispersion velocities
+
+    ua1_mir = np.zeros((5,6)) 	# horizontal advection velocities
+    wa1_mir = np.zeros((5,6))   # vertical advection velocities
+    ue1_mir = np.zeros((5,6))   # horizontal dispersion velocities
+    we1_mir = np.zeros((5,6))   # vertical dispersion velocities
+
+
+    no_barriers_orig = no_barriers_pattern(row=row_original, h_cumu=h_cumu_original, 
+                                    rec_ncol=rec_ncol_orig, wa1=wa1_orig, we1=we1_orig, 
+                                    ua1=ua1_orig, ue1=ue1_orig, U1=U1_orig, U2=U2_orig, 
+                                    U3=U3_orig, Ut=Ut_orig, Uh=Uh_orig, Ur=Ur_orig, 
+                                    l=l_original, h=h_original, ue_ratio=ue_ratio, we_ratio=we_ratio)
+    ue1_orig = no_barriers_orig[0]
+    ua1_orig = no_barriers_orig[1]
+    we1_orig = no_barriers_orig[2]
+    wa1_orig = no_barriers_orig[3]
+
+    # print("ue1_orig")
+    # print(ue1_orig)
+    # print("ua1_orig")
+    # print(ua1_orig)
+    # print("we1_orig")
+    # print(we1_orig)
+    # print("wa1_orig")
+    # print(wa1_orig)
+
+    no_barriers_mir = no_barriers_pattern(row=row_mirror, h_cumu=h_cumu_mirror, 
+                                    rec_ncol=rec_ncol_mir, wa1=wa1_mir, we1=we1_mir, 
+                                    ua1=ua1_mir, ue1=ue1_mir, U1=U1_mir, U2=U2_mir, 
+                                    U3=U3_mir, Ut=Ut_mir, Uh=Uh_mir, Ur=Ur_mir, 
+                                    l=l_mirror, h=h_mirror, ue_ratio=ue_ratio, we_ratio=we_ratio)
+    ue1_mir = no_barriers_mir[0]
+    ua1_mir = no_barriers_mir[1]
+    we1_mir = no_barriers_mir[2]
+    wa1_mir = no_barriers_mir[3]
+
+    # print("ue1_mir")
+    # print(ue1_mir)
+    # print("ua1_mir")
+    # print(ua1_mir)
+    # print("we1_mir")
+    # print(we1_mir)
+    # print("wa1_mir")
+    # print(wa1_mir)
+
+
+    # ___________ Advection & Dispersion Assignment: EXISTING BARRIERS ___________
+
+    # copy existing patterns into new storage containers
+    ue2_orig = ue1_orig.copy()
+    ua2_orig = ua1_orig.copy()
+    we2_orig = we1_orig.copy()
+    wa2_orig = wa1_orig.copy()
+
+    ue2_mir = ue1_mir.copy()
+    ua2_mir = ua1_mir.copy()
+    we2_mir = we1_mir.copy()
+    wa2_mir = wa1_mir.copy()
+
+    existing_barriers_orig = existing_barrier_pattern(check=check_original, l_cumu=l_cumu_original, 
+                                                      rec_ncol=rec_ncol_orig, rec_nrow=rec_nrow_orig, 
+                                                      bar=bar_original, obs=obs_original, rec=rec_original, 
+                                                      ue2=ue2_orig, ua2=ua2_orig, we2=we2_orig, wa2=wa2_orig, 
+                                                      h=h_original, l=l_original, row=row_original)
+
+    ue2_orig = existing_barriers_orig[0]
+    ua2_orig = existing_barriers_orig[1]
+    we2_orig = existing_barriers_orig[2]
+    wa2_orig = existing_barriers_orig[3]
+
+    # print("ue2_orig")
+    # print(ue2_orig)
+    # print("ua2_orig")
+    # print(ua2_orig)
+    # print("we2_orig")
+    # print(we2_orig)
+    # print("wa2_orig")
+    # print(wa2_orig)
+
+    existing_barriers_mir = existing_barrier_pattern(check=check_mirror, l_cumu=l_cumu_mirror, 
+                                                      rec_ncol=rec_ncol_mir, rec_nrow=rec_nrow_mir, 
+                                                      bar=bar_mirror, obs=obs_mirror, rec=rec_mirror, 
+                                                      ue2=ue2_mir, ua2=ua2_mir, we2=we2_mir, wa2=wa2_mir, 
+                                                      h=h_mirror, l=l_mirror, row=row_mirror)
+
+    ue2_mir = existing_barriers_mir[0]
+    ua2_mir = existing_barriers_mir[1]
+    we2_mir = existing_barriers_mir[2]
+    wa2_mir = existing_barriers_mir[3]
+
+    # print("ue2_mir")
+    # print(ue2_mir)
+    # print("ua2_mir")
+    # print(ua2_mir)
+    # print("we2_mir")
+    # print(we2_mir)
+    # print("wa2_mir")
+    # print(wa2_mir)
+
+    flows = {}
+    flows["obs_original"] = obs_original
+    flows["obs_mirror"] = obs_mirror
+    flows["rec_ncol_orig"] = rec_ncol_orig
+    flows["rec_nrow_orig"] = rec_nrow_orig
+    flows["rec_ncol_mir"] = rec_ncol_mir
+    flows["rec_nrow_mir"] = rec_nrow_mir
+    # base patterns (no barriers), which the new barrier patterns start from
+    flows["ue1_orig"] = ue1_orig
+    flows["ua1_orig"] = ua1_orig
+    flows["we1_orig"] = we1_orig
+    flows["wa1_orig"] = wa1_orig
+    flows["ue1_mir"] = ue1_mir
+    flows["ua1_mir"] = ua1_mir
+    flows["we1_mir"] = we1_mir
+    flows["wa1_mir"] = wa1_mir
+    flows["ue2_orig"] = ue2_orig
+    flows["ua2_orig"] = ua2_orig
+    flows["we2_orig"] = we2_orig
+    flows["wa2_orig"] = wa2_orig
+    flows["ue2_mir"] = ue2_mir
+    flows["ua2_mir"] = ua2_mir
+    flows["we2_mir"] = we2_mir
+    flows["wa2_mir"] = wa2_mir
+
+    # the new barrier patterns start from the base ones
+    flows.update(new_barrier_flows(dict(state, **flows), obs_original, obs_mirror))
+    
+    return flows
 
 # ___________ Parallel wind: dispersion only ___________
 
@@ -2939,8 +2992,9 @@ def ws_point_parallel(ubg,z,H):
 
 
 
-# function to determine average wind speed (u) across a row
-def ws_average_parallel(row_min, row_max, ubg, H):
+# function to determine average wind speed (u) across a row, as the mean of 
+# 10 points from row_min to row_max (the original method)
+def ws_average_parallel_10_point(row_min, row_max, ubg, H):
     dif = row_max - row_min
     dif9 = dif/9
     
@@ -2961,233 +3015,294 @@ def ws_average_parallel(row_min, row_max, ubg, H):
     return avg_u
 
 
-#test = ws_point_parallel(ubg = ubg_parallel, z=50,H=min(row_original[0],row_original[1]))
-#print(test)
-
-#Uh_parallel = ws_point_parallel(ubg = ubg_parallel, z = min(row_original[0],row_original[1]), H = min(row_original[0],row_original[1]))
-# assumes that the rows don't change between original and mirror dimensioning
-ue_row1 = ws_average_parallel(row_min = 0, row_max = h_cumu_original[1], ubg = ubg_parallel, H = min(row_original[0],row_original[1]))
-ue_row2 = ws_average_parallel(row_min = h_cumu_original[1], row_max = h_cumu_original[2], ubg = ubg_parallel, H = min(row_original[0],row_original[1]))
-ue_row3 = ws_average_parallel(row_min = h_cumu_original[2], row_max = h_cumu_original[3], ubg = ubg_parallel, H = min(row_original[0],row_original[1]))
-
-we_row12 = ws_point_parallel(ubg = ubg_parallel, z=h_cumu_original[1], H=min(row_original[0],row_original[1]))
-we_row23 = ws_point_parallel(ubg = ubg_parallel, z=h_cumu_original[2], H=min(row_original[0],row_original[1]))
-we_row3b = ws_point_parallel(ubg = ubg_parallel, z=h_cumu_original[3], H=min(row_original[0],row_original[1]))
-
-#print(ue_row1, ue_row2, ue_row3)
-#print(we_row12, we_row23, we_row3b)
-
-# create empty containers
-# existing barriers, dimensioning based on wind left to right
-ue1_par = np.zeros((5,6)) 	
-ua1_par = np.zeros((5,6))   # advection - will remain 0
-we1_par = np.zeros((5,6))  
-wa1_par = np.zeros((5,6))   # advection - will remain 0
-
-# existing barriers only, dimensioning based on wind right to left
-ue2_par = np.zeros((5,6)) 	
-ua2_par = np.zeros((5,6))   # advection - will remain 0
-we2_par = np.zeros((5,6))  
-wa2_par = np.zeros((5,6))   # advection - will remain 0
-
-# apply linear reductions of ACH from roof top for both horizontal and vertical
-ue1_par[1,1] = 0 #c11 to wall
-ue1_par[1,2] = ue_row1*0.1 #c11 and c12
-ue1_par[1,3] = ue_row1*0.1 #c12 and c13
-ue1_par[1,4] = ue_row1*0.1 #c13 and c14
-ue1_par[1,5] = ue_row1*0.1 #c14 and c15
-ue1_par[2,1] = 0 #c21 to wall
-ue1_par[2,2] = ue_row2*0.1 #c21 and c22
-ue1_par[2,3] = ue_row2*0.1 #c22 and c23
-ue1_par[2,4] = ue_row2*0.1 #c23 and c24
-ue1_par[2,5] = ue_row2*0.1 #c24 and c25
-ue1_par[3,1] = 0 #c31 to wall
-ue1_par[3,2] = ue_row3*0.1 #c31 and c32
-ue1_par[3,3] = ue_row3*0.1 #c32 and c33
-ue1_par[3,4] = ue_row3*0.1 #c33 and c34
-ue1_par[3,5] = ue_row3*0.1 #c34 and c35
-
-#vertical dispersion co-efficients
-#we[1,1] = 0 #ground to c11
-#we[1,2] = 0 #ground to c12
-#we[1,3] = 0 #ground to c13
-#we[1,4] = 0 #ground to c14
-#we[1,5] = 0 #ground to c15
-we1_par[2,1] = we_row12*0.1 #c11 to c21
-we1_par[2,2] = we_row12*0.1 #c12 and c22
-we1_par[2,3] = we_row12*0.1 #c13 and c23
-we1_par[2,4] = we_row12*0.1 #c13 and c24
-we1_par[2,5] = we_row12*0.1 #c15 and c25
-we1_par[3,1] = we_row23*0.1 #c21 and c31
-we1_par[3,2] = we_row23*0.1 #c22 and c32
-we1_par[3,3] = we_row23*0.1 #c23 and c33
-we1_par[3,4] = we_row23*0.1 #c24 and c34
-we1_par[3,5] = we_row23*0.1 #c25 and c35
-we1_par[4,1] = we_row3b*0.1 #c31 and cb
-we1_par[4,2] = we_row3b*0.1 #c32 and cb
-we1_par[4,3] = we_row3b*0.1 #c33 and cb
-we1_par[4,4] = we_row3b*0.1 #c24 and cb
-we1_par[4,5] = we_row3b*0.1 #c35 and cb
-
-# apply linear reductions of ACH from roof top for both horizontal and vertical
-ue2_par[1,1] = 0 #c11 to wall
-ue2_par[1,2] = ue_row1*0.1 #c11 and c12
-ue2_par[1,3] = ue_row1*0.1 #c12 and c13
-ue2_par[1,4] = ue_row1*0.1 #c13 and c14
-ue2_par[1,5] = ue_row1*0.1 #c14 and c15
-ue2_par[2,1] = 0 #c21 to wall
-ue2_par[2,2] = ue_row2*0.1 #c21 and c22
-ue2_par[2,3] = ue_row2*0.1 #c22 and c23
-ue2_par[2,4] = ue_row2*0.1 #c23 and c24
-ue2_par[2,5] = ue_row2*0.1 #c24 and c25
-ue2_par[3,1] = 0 #c31 to wall
-ue2_par[3,2] = ue_row3*0.1 #c31 and c32
-ue2_par[3,3] = ue_row3*0.1 #c32 and c33
-ue2_par[3,4] = ue_row3*0.1 #c33 and c34
-ue2_par[3,5] = ue_row3*0.1 #c34 and c35
-
-#vertical dispersion co-efficients
-#we[1,1] = 0 #ground to c11
-#we[1,2] = 0 #ground to c12
-#we[1,3] = 0 #ground to c13
-#we[1,4] = 0 #ground to c14
-#we[1,5] = 0 #ground to c15
-we2_par[2,1] = we_row12*0.1 #c11 to c21
-we2_par[2,2] = we_row12*0.1 #c12 and c22
-we2_par[2,3] = we_row12*0.1 #c13 and c23
-we2_par[2,4] = we_row12*0.1 #c13 and c24
-we2_par[2,5] = we_row12*0.1 #c15 and c25
-we2_par[3,1] = we_row23*0.1 #c21 and c31
-we2_par[3,2] = we_row23*0.1 #c22 and c32
-we2_par[3,3] = we_row23*0.1 #c23 and c33
-we2_par[3,4] = we_row23*0.1 #c24 and c34
-we2_par[3,5] = we_row23*0.1 #c25 and c35
-we2_par[4,1] = we_row3b*0.1 #c31 and cb
-we2_par[4,2] = we_row3b*0.1 #c32 and cb
-we2_par[4,3] = we_row3b*0.1 #c33 and cb
-we2_par[4,4] = we_row3b*0.1 #c24 and cb
-we2_par[4,5] = we_row3b*0.1 #c35 and cb
-
-
-# print("ue1_par")
-# print(ue1_par)
-# print("ua1_par")
-# print(ua1_par)
-# print("we1_par")
-# print(we1_par)
-# print("wa1_par")
-# print(wa1_par)
-
-# print("ue2_par")
-# print(ue2_par)
-# print("ua2_par")
-# print(ua2_par)
-# print("we2_par")
-# print(we2_par)
-# print("wa2_par")
-# print(wa2_par)
-
-# -----------------------------------------------------------------------------
-
-# create function to determine dispersion reduction based on obs at box boundary
-# where a barrier lies
-# use the bar_inside_disp function to assess at each box boundary
-
-# apply function to existing barriers
-# upwind
-if check_original[0] == 1:
-    bar_inside_disp(bar=bar_original[0], ue=ue1_par, obs=obs_original[0], l_cumu=l_cumu_original)
-# downwind    
-if check_original[2] == 1:
-    bar_inside_disp(bar=bar_original[2], ue=ue1_par, obs=obs_original[2], l_cumu=l_cumu_original)
-#upwind
-if check_mirror[0] == 1:
-    bar_inside_disp(bar=bar_mirror[0], ue=ue2_par, obs=obs_mirror[0], l_cumu=l_cumu_mirror)
-#downwind    
-if check_mirror[2] == 1:
-    bar_inside_disp(bar=bar_mirror[2], ue=ue2_par, obs=obs_mirror[2], l_cumu=l_cumu_mirror)
-
-# print("ue1_par")
-# print(ue1_par)
-# print("ua1_par")
-# print(ua1_par)
-# print("we1_par")
-# print(we1_par)
-# print("wa1_par")
-# print(wa1_par)
-
-# print("ue2_par")
-# print(ue2_par)
-# print("ua2_par")
-# print(ua2_par)
-# print("we2_par")
-# print(we2_par)
-# print("wa2_par")
-# print(wa2_par)
-    
-# make copies of existing dispersion patterns
-ue3_par = ue1_par.copy()
-ua3_par = ua1_par.copy()
-we3_par = we1_par.copy()
-wa3_par = wa1_par.copy()
-
-ue4_par = ue2_par.copy()
-ua4_par = ua2_par.copy()
-we4_par = we2_par.copy()
-wa4_par = wa2_par.copy()
-
-# apply function to new barriers
-if check_original[1] == 1:
-    bar_inside_disp(bar=bar_original[1], ue=ue3_par, obs=obs_original[1], l_cumu=l_cumu_original)
-
-if check_original[3] == 1:
-    bar_inside_disp(bar=bar_original[3], ue=ue3_par, obs=obs_original[3], l_cumu=l_cumu_original)
-
-if check_mirror[1] == 1:
-    bar_inside_disp(bar=bar_mirror[1], ue=ue4_par, obs=obs_mirror[1], l_cumu=l_cumu_mirror)
-    
-if check_mirror[3] == 1:
-    bar_inside_disp(bar=bar_mirror[3], ue=ue4_par, obs=obs_mirror[3], l_cumu=l_cumu_mirror)
-
-# print("ue3_par")
-# print(ue3_par)
-# print("ua3_par")
-# print(ua3_par)
-# print("we3_par")
-# print(we3_par)
-# print("wa3_par")
-# print(wa3_par)
-
-# print("ue4_par")
-# print(ue4_par)
-# print("ua4_par")
-# print(ua4_par)
-# print("we4_par")
-# print(we4_par)
-# print("wa4_par")
-# print(wa4_par)
+# function to determine average wind speed (u) across a row: the profile of
+# ws_point_parallel integrated over the row (see ws_average)
+def ws_average_parallel(row_min, row_max, ubg, H):
+    if ten_point_ws_average:
+        return np.vectorize(ws_average_parallel_10_point)(row_min, row_max, ubg, H)
+    
+    row_min, row_max, ubg, H = np.broadcast_arrays(*(np.asarray(x, dtype = float) for x in (row_min, row_max, ubg, H)))
+    
+    # linear up to H, log profile u = c*log(5z) above
+    c = ubg*log_5000_500/math.log(500)
+    uh = c*np.log(5*H)
+    
+    def integral(z):
+        # of the linear part from 0, and of the log profile from H, up to z
+        below = np.minimum(z, H)
+        above = np.maximum(z, H)
+        return uh*below**2/(2*H) + c*(above*(np.log(5*above) - 1) - H*(np.log(5*H) - 1))
+    
+    total = integral(row_max) - integral(row_min)
+    
+    # rows of no height: the wind speed at that point
+    point = np.where(row_min <= H, uh*(row_min/H), c*np.log(5*np.maximum(row_min, H)))
     
+    dif = row_max - row_min
+    return np.where(dif > 0, total/np.where(dif > 0, dif, 1), point)
+
+
+# the parallel wind patterns with the new barrier, from those without it in 
+# the state (as parallel_patterns stores them)
+def new_barrier_parallel(state, obs_original, obs_mirror):
+    l_cumu_original = state["l_cumu_original"]
+    l_cumu_mirror = state["l_cumu_mirror"]
+    bar_original = state["bar_original"]
+    bar_mirror = state["bar_mirror"]
+    check_original = state["check_original"]
+    check_mirror = state["check_mirror"]
+    ue1_par = state["ue1_par"]
+    ua1_par = state["ua1_par"]
+    we1_par = state["we1_par"]
+    wa1_par = state["wa1_par"]
+    ue2_par = state["ue2_par"]
+    ua2_par = state["ua2_par"]
+    we2_par = state["we2_par"]
+    wa2_par = state["wa2_par"]
+    
+    # make copies of existing dispersion patterns
+    ue3_par = ue1_par.copy()
+    ua3_par = ua1_par.copy()
+    we3_par = we1_par.copy()
+    wa3_par = wa1_par.copy()
+
+    ue4_par = ue2_par.copy()
+    ua4_par = ua2_par.copy()
+    we4_par = we2_par.copy()
+    wa4_par = wa2_par.copy()
+
+    # apply function to new barriers
+    if check_original[1] == 1:
+        bar_inside_disp(bar=bar_original[1], ue=ue3_par, obs=obs_original[1], l_cumu=l_cumu_original)
+
+    if check_original[3] == 1:
+        bar_inside_disp(bar=bar_original[3], ue=ue3_par, obs=obs_original[3], l_cumu=l_cumu_original)
+
+    if check_mirror[1] == 1:
+        bar_inside_disp(bar=bar_mirror[1], ue=ue4_par, obs=obs_mirror[1], l_cumu=l_cumu_mirror)
+    
+    if check_mirror[3] == 1:
+        bar_inside_disp(bar=bar_mirror[3], ue=ue4_par, obs=obs_mirror[3], l_cumu=l_cumu_mirror)
+
+    parallel = {}
+    parallel["ue3_par"] = ue3_par
+    parallel["ua3_par"] = ua3_par
+    parallel["we3_par"] = we3_par
+    parallel["wa3_par"] = wa3_par
+    parallel["ue4_par"] = ue4_par
+    parallel["ua4_par"] = ua4_par
+    parallel["we4_par"] = we4_par
+    parallel["wa4_par"] = wa4_par
+    
+    return parallel
+
+# the dispersion along the street is the same fraction of the wind speed as
+# in the base patterns: constants as for flow_patterns (recirc_ratio unused)
+def parallel_patterns(state, constants=pattern_constants):
+    row_original = state["row_original"]
+    h_cumu_original = state["h_cumu_original"]
+    l_cumu_original = state["l_cumu_original"]
+    l_cumu_mirror = state["l_cumu_mirror"]
+    bar_original = state["bar_original"]
+    bar_mirror = state["bar_mirror"]
+    check_original = state["check_original"]
+    check_mirror = state["check_mirror"]
+    obs_original = state["obs_original"]
+    obs_mirror = state["obs_mirror"]
+    ubg_parallel = state["ubg_parallel"]
+    ue_ratio, we_ratio, _ = constants
+
+    #test = ws_point_parallel(ubg = ubg_parallel, z=50,H=min(row_original[0],row_original[1]))
+    #print(test)
+
+    #Uh_parallel = ws_point_parallel(ubg = ubg_parallel, z = min(row_original[0],row_original[1]), H = min(row_original[0],row_original[1]))
+    # assumes that the rows don't change between original and mirror dimensioning
+    ue_row1, ue_row2, ue_row3 = ws_average_parallel(row_min = h_cumu_original[0:3], row_max = h_cumu_original[1:4], ubg = ubg_parallel, H = min(row_original[0],row_original[1]))
+
+    we_row12 = ws_point_parallel(ubg = ubg_parallel, z=h_cumu_original[1], H=min(row_original[0],row_original[1]))
+    we_row23 = ws_point_parallel(ubg = ubg_parallel, z=h_cumu_original[2], H=min(row_original[0],row_original[1]))
+    we_row3b = ws_point_parallel(ubg = ubg_parallel, z=h_cumu_original[3], H=min(row_original[0],row_original[1]))
+
+    #print(ue_row1, ue_row2, ue_row3)
+    #print(we_row12, we_row23, we_row3b)
+
+    # create empty containers
+    # existing barriers, dimensioning based on wind left to right
+    ue1_par = np.zeros((5,6)) 	
+    ua1_par = np.zeros((5,6))   # advection - will remain 0
+    we1_par = np.zeros((5,6))  
+    wa1_par = np.zeros((5,6))   # advection - will remain 0
+
+    # existing barriers only, dimensioning based on wind right to left
+    ue2_par = np.zeros((5,6)) 	
+    ua2_par = np.zeros((5,6))   # advection - will remain 0
+    we2_par = np.zeros((5,6))  
+    wa2_par = np.zeros((5,6))   # advection - will remain 0
+
+    # apply linear reductions of ACH from roof top for both horizontal and vertical
+    ue1_par[1,1] = 0 #c11 to wall
+    ue1_par[1,2] = ue_row1*ue_ratio #c11 and c12
+    ue1_par[1,3] = ue_row1*ue_ratio #c12 and c13
+    ue1_par[1,4] = ue_row1*ue_ratio #c13 and c14
+    ue1_par[1,5] = ue_row1*ue_ratio #c14 and c15
+    ue1_par[2,1] = 0 #c21 to wall
+    ue1_par[2,2] = ue_row2*ue_ratio #c21 and c22
+    ue1_par[2,3] = ue_row2*ue_ratio #c22 and c23
+    ue1_par[2,4] = ue_row2*ue_ratio #c23 and c24
+    ue1_par[2,5] = ue_row2*ue_ratio #c24 and c25
+    ue1_par[3,1] = 0 #c31 to wall
+    ue1_par[3,2] = ue_row3*ue_ratio #c31 and c32
+    ue1_par[3,3] = ue_row3*ue_ratio #c32 and c33
+    ue1_par[3,4] = ue_row3*ue_ratio #c33 and c34
+    ue1_par[3,5] = ue_row3*ue_ratio #c34 and c35
+
+    #vertical dispersion co-efficients
+    #we[1,1] = 0 #ground to c11
+    #we[1,2] = 0 #ground to c12
+    #we[1,3] = 0 #ground to c13
+    #we[1,4] = 0 #ground to c14
+    #we[1,5] = 0 #ground to c15
+    we1_par[2,1] = we_row12*we_ratio #c11 to c21
+    we1_par[2,2] = we_row12*we_ratio #c12 and c22
+    we1_par[2,3] = we_row12*we_ratio #c13 and c23
+    we1_par[2,4] = we_row12*we_ratio #c13 and c24
+    we1_par[2,5] = we_row12*we_ratio #c15 and c25
+    we1_par[3,1] = we_row23*we_ratio #c21 and c31
+    we1_par[3,2] = we_row23*we_ratio #c22 and c32
+    we1_par[3,3] = we_row23*we_ratio #c23 and c33
+    we1_par[3,4] = we_row23*we_ratio #c24 and c34
+    we1_par[3,5] = we_row23*we_ratio #c25 and c35
+    we1_par[4,1] = we_row3b*we_ratio #c31 and cb
+    we1_par[4,2] = we_row3b*we_ratio #c32 and cb
+    we1_par[4,3] = we_row3b*we_ratio #c33 and cb
+    we1_par[4,4] = we_row3b*we_ratio #c24 and cb
+    we1_par[4,5] = we_row3b*we_ratio #c35 and cb
+
+    # apply linear reductions of ACH from roof top for both horizontal and vertical
+    ue2_par[1,1] = 0 #c11 to wall
+    ue2_par[1,2] = ue_row1*ue_ratio #c11 and c12
+    ue2_par[1,3] = ue_row1*ue_ratio #c12 and c13
+    ue2_par[1,4] = ue_row1*ue_ratio #c13 and c14
+    ue2_par[1,5] = ue_row1*ue_ratio #c14 and c15
+    ue2_par[2,1] = 0 #c21 to wall
+    ue2_par[2,2] = ue_row2*ue_ratio #c21 and c22
+    ue2_par[2,3] = ue_row2*ue_ratio #c22 and c23
+    ue2_par[2,4] = ue_row2*ue_ratio #c23 and c24
+    ue2_par[2,5] = ue_row2*ue_ratio #c24 and c25
+    ue2_par[3,1] = 0 #c31 to wall
+    ue2_par[3,2] = ue_row3*ue_ratio #c31 and c32
+    ue2_par[3,3] = ue_row3*ue_ratio #c32 and c33
+    ue2_par[3,4] = ue_row3*ue_ratio #c33 and c34
+    ue2_par[3,5] = ue_row3*ue_ratio #c34 and c35
+
+    #vertical dispersion co-efficients
+    #we[1,1] = 0 #ground to c11
+    #we[1,2] = 0 #ground to c12
+    #we[1,3] = 0 #ground to c13
+    #we[1,4] = 0 #ground to c14
+    #we[1,5] = 0 #ground to c15
+    we2_par[2,1] = we_row12*we_ratio #c11 to c21
+    we2_par[2,2] = we_row12*we_ratio #c12 and c22
+    we2_par[2,3] = we_row12*we_ratio #c13 and c23
+    we2_par[2,4] = we_row12*we_ratio #c13 and c24
+    we2_par[2,5] = we_row12*we_ratio #c15 and c25
+    we2_par[3,1] = we_row23*we_ratio #c21 and c31
+    we2_par[3,2] = we_row23*we_ratio #c22 and c32
+    we2_par[3,3] = we_row23*we_ratio #c23 and c33
+    we2_par[3,4] = we_row23*we_ratio #c24 and c34
+    we2_par[3,5] = we_row23*we_ratio #c25 and c35
+    we2_par[4,1] = we_row3b*we_ratio #c31 and cb
+    we2_par[4,2] = we_row3b*we_ratio #c32 and cb
+    we2_par[4,3] = we_row3b*we_ratio #c33 and cb
+    we2_par[4,4] = we_row3b*we_ratio #c24 and cb
+    we2_par[4,5] = we_row3b*we_ratio #c35 and cb
+
+
+    # print("ue1_par")
+    # print(ue1_par)
+    # print("ua1_par")
+    # print(ua1_par)
+    # print("we1_par")
+    # print(we1_par)
+    # print("wa1_par")
+    # print(wa1_par)
+
+    # print("ue2_par")
+    # print(ue2_par)
+    # print("ua2_par")
+    # print(ua2_par)
+    # print("we2_par")
+    # print(we2_par)
+    # print("wa2_par")
+    # print(wa2_par)
+
+    # -----------------------------------------------------------------------------
+
+    # create function to determine dispersion reduction based on obs at box boundary
+    # where a barrier lies
+    # use the bar_inside_disp function to assess at each box boundary
+
+    # apply function to existing barriers
+    # upwind
+    if check_original[0] == 1:
+        bar_inside_disp(bar=bar_original[0], ue=ue1_par, obs=obs_original[0], l_cumu=l_cumu_original)
+    # downwind    
+    if check_original[2] == 1:
+        bar_inside_disp(bar=bar_original[2], ue=ue1_par, obs=obs_original[2], l_cumu=l_cumu_original)
+    #upwind
+    if check_mirror[0] == 1:
+        bar_inside_disp(bar=bar_mirror[0], ue=ue2_par, obs=obs_mirror[0], l_cumu=l_cumu_mirror)
+    #downwind    
+    if check_mirror[2] == 1:
+        bar_inside_disp(bar=bar_mirror[2], ue=ue2_par, obs=obs_mirror[2], l_cumu=l_cumu_mirror)
+
+    # print("ue1_par")
+    # print(ue1_par)
+    # print("ua1_par")
+    # print(ua1_par)
+    # print("we1_par")
+    # print(we1_par)
+    # print("wa1_par")
+    # print(wa1_par)
+
+    # print("ue2_par")
+    # print(ue2_par)
+    # print("ua2_par")
+    # print(ua2_par)
+    # print("we2_par")
+    # print(we2_par)
+    # print("wa2_par")
+    # print(wa2_par)
+    
+    
+    parallel = {}
+    parallel["ue1_par"] = ue1_par
+    parallel["ua1_par"] = ua1_par
+    parallel["we1_par"] = we1_par
+    parallel["wa1_par"] = wa1_par
+    parallel["ue2_par"] = ue2_par
+    parallel["ua2_par"] = ua2_par
+    parallel["we2_par"] = we2_par
+    parallel["wa2_par"] = wa2_par
+    
+    # the new barrier only reduces the dispersion at the barrier
+    parallel.update(new_barrier_parallel(dict(state, **parallel), obs_original, obs_mirror))
+    
+    return parallel
+
+
 ###############################################################################
 # EMISSIONS
 ###############################################################################
 
-def emis_calc(veh_per_hour):
-    # RFI: generic emissions estimate - could look at specifying fleets
-    # e.g. London, urban outside London, rural (same as in NAEI)
-    # Generate an emissions value from AADT provided by user
-    # units: vehicles per day
-    aadt = np.array([0,0,0,0,0], dtype = float)
-    # cars and taxis (81%)
-    aadt[0] = veh_per_hour*0.81
-    # LGVs (15%)
-    aadt[1] = veh_per_hour*0.15
-    # HGVs (1.5%)
-    aadt[2] = veh_per_hour*0.015
-    # Buses and coaches (1.5% - remainder from above)
-    aadt[3] = veh_per_hour*0.015
-    # Motorcycles (1%)
-    aadt[4] = veh_per_hour*0.01
-    
+# RFI: generic emissions estimate - could look at specifying fleets
+# e.g. London, urban outside London, rural (same as in NAEI)
+# share of the traffic of each vehicle class: cars and taxis (81%), LGVs
+# (15%), HGVs (1.5%), buses and coaches (1.5% - remainder from above),
+# motorcycles (1%)
+fleet_shares = np.array([0.81, 0.15, 0.015, 0.015, 0.01])
+
+def emission_factors():
     # emission factors
     # datasets used: Fleet Weighted Road Transport Emission Factor 2017
               # Primary NO2 Emission factors for road transport (2019 version)
@@ -3226,6 +3341,19 @@ def emis_calc(veh_per_hour):
     # pm2.5 from exhausts + tyre wear + brake wear + road abrasion
     pm25_ef[4] = 0.008+0.002+0.002+0.002
     
+    return no2_ef, pm25_ef
+
+# ef optionally gives (no2_ef, pm25_ef), g/km per vehicle of each class,
+# instead of those of emission_factors
+def emis_calc(veh_per_hour, ef=None):
+    # Generate an emissions value from AADT provided by user
+    # units: vehicles per day
+    aadt = veh_per_hour*fleet_shares
+    
+    if ef is None:
+        ef = emission_factors()
+    no2_ef, pm25_ef = ef
+    
     # emission (g/km/hr) = ef (g/km/veh) * activity (veh/hr)
     no2_gkmhr = np.array([0,0,0,0,0], dtype = float) 
     no2_gkmhr[0] = no2_ef[0]*(aadt[0])
@@ -3266,64 +3394,6 @@ def emis_calc(veh_per_hour):
 
     return e1d_no2, e1d_pm25
 
-ez1_veh = 0
-ez2_veh = 0
-ez1_emis_no2 = 0
-ez2_emis_no2 = 0
-ez1_emis_pm25 = 0
-ez2_emis_pm25 = 0
-
-# for each emission zone, if emissions are provided by user in 
-# "current_exposure_no2"then use these figures, 
-# if not then use the vehicle movement
-
-for item in objects:
-    if item["name"] == "EZ1":
-        ez1_emis_no2 = item.get("current_emissions_no2")
-        if ez1_emis_no2 == None:
-            ez1_veh = float(item.get("vmovement"))
-            ez1_emis_no2 = float(emis_calc(ez1_veh)[0])
-
-for item in objects:
-    if item["name"] == "EZ2":
-        ez2_emis_no2 = item.get("current_emissions_no2")
-        if ez2_emis_no2 == None:
-            ez2_veh = float(item.get("vmovement"))
-            ez2_emis_no2 = float(emis_calc(ez2_veh)[0])
-            
-for item in objects:
-    if item["name"] == "EZ1":
-        ez1_emis_pm25 = item.get("current_emissions_PM2_5")
-        if ez1_emis_pm25 == None:
-            ez1_veh = float(item.get("vmovement"))
-            ez1_emis_pm25 = float(emis_calc(ez1_veh)[1])
-
-
-for item in objects:
-    if item["name"] == "EZ2":
-        ez2_emis_pm25 = item.get("current_emissions_PM2_5")
-        if ez2_emis_pm25 == None:
-            ez2_veh = float(item.get("vmovement"))
-            ez2_emis_pm25 = float(emis_calc(ez2_veh)[1])
-
-#print(ez1_emis_no2)
-#print(ez1_emis_pm25)
-
-#print(ez2_emis_no2)
-#print(ez2_emis_pm25)
-
-# partition emissions into respective boxes
-# value represents % of emissions in box - should all sum to 1
-emis_par_orig = np.array([0,0,0,0,0], dtype = float) 
-emis_par_mir = np.array([0,0,0,0,0], dtype = float) 
-
-ez1_par_orig = np.array([0,0,0,0,0,0], dtype = float)
-ez2_par_orig = np.array([0,0,0,0,0,0], dtype = float)
-
-ez1_par_mir = np.array([0,0,0,0,0,0], dtype = float)
-ez2_par_mir = np.array([0,0,0,0,0,0], dtype = float)
-
-
 def emission_partition(l_cumu, l, ez1_start, ez1_finish, ez2_start, ez2_finish, ez1_par, ez2_par, ez1_w, ez2_w):
         
     # go through each column and see if it crosses into the emissions zone
@@ -3522,409 +3592,297 @@ def emission_partition(l_cumu, l, ez1_start, ez1_finish, ez2_start, ez2_finish,
         
     return ez1_par, ez2_par
 
-emis_par_fun_orig = emission_partition(l_cumu=l_cumu_original, l=l_original, 
-                                       ez1_start=ez1_start, ez1_finish=ez1_finish, ez2_start=ez2_start, ez2_finish=ez2_finish, 
-                                       ez1_par=ez1_par_orig, ez2_par=ez2_par_orig, 
-                                       ez1_w=ez1_w, ez2_w=ez2_w)
-
-ez1_par_orig = emis_par_fun_orig[0]
-ez2_par_orig = emis_par_fun_orig[1]
-
-#print(ez1_par_orig)
-#print(ez2_par_orig)
-
-# had to flip things around because function to partition emissions relies on
-# EZ1 being first. Therefore in mirror version, EZ1 becomes EZ2 and vice versa
-# is this hardwired into the platform? So if there's only 1 emissions zone it's EZ1,
-# and if there are 2, EZ1 is upwind of EZ2?
-ez2_finish_mir= round(roadw-ez1_start,4)
-ez2_start_mir= round(roadw-ez1_finish,4)
-ez1_finish_mir= round(roadw-ez2_start,4)
-ez1_start_mir= round(roadw-ez2_finish,4)
-
-#print(ez1_start_mir, ez1_finish_mir, ez2_start_mir, ez2_finish_mir)
-
-emis_par_fun_mir = emission_partition(l_cumu=l_cumu_mirror, l=l_mirror, 
-                                       ez1_start=ez1_start_mir, ez1_finish=ez1_finish_mir, ez2_start=ez2_start_mir, ez2_finish=ez2_finish_mir, 
-                                       ez1_par=ez1_par_mir, ez2_par=ez2_par_mir, 
-                                       ez1_w=ez2_w, ez2_w=ez1_w)
-
-ez1_par_mir = emis_par_fun_mir[0]
-ez2_par_mir = emis_par_fun_mir[1]
-
-#print(ez1_par_mir)
-#print(ez2_par_mir)
-
-ez_tot_no2_orig = np.array([0,0,0,0,0,0], dtype = float)
-ez_tot_no2_orig[1] = (ez1_par_orig[1]*float(ez1_emis_no2)) + (ez2_par_orig[1]*float(ez2_emis_no2))
-ez_tot_no2_orig[2] = (ez1_par_orig[2]*float(ez1_emis_no2)) + (ez2_par_orig[2]*float(ez2_emis_no2))
-ez_tot_no2_orig[3] = (ez1_par_orig[3]*float(ez1_emis_no2)) + (ez2_par_orig[3]*float(ez2_emis_no2))
-ez_tot_no2_orig[4] = (ez1_par_orig[4]*float(ez1_emis_no2)) + (ez2_par_orig[4]*float(ez2_emis_no2))
-ez_tot_no2_orig[5] = (ez1_par_orig[5]*float(ez1_emis_no2)) + (ez2_par_orig[5]*float(ez2_emis_no2))
-
-ez_tot_pm25_orig = np.array([0,0,0,0,0,0], dtype = float)
-ez_tot_pm25_orig[1] = (ez1_par_orig[1]*float(ez1_emis_pm25)) + (ez2_par_orig[1]*float(ez2_emis_pm25))
-ez_tot_pm25_orig[2] = (ez1_par_orig[2]*float(ez1_emis_pm25)) + (ez2_par_orig[2]*float(ez2_emis_pm25))
-ez_tot_pm25_orig[3] = (ez1_par_orig[3]*float(ez1_emis_pm25)) + (ez2_par_orig[3]*float(ez2_emis_pm25))
-ez_tot_pm25_orig[4] = (ez1_par_orig[4]*float(ez1_emis_pm25)) + (ez2_par_orig[4]*float(ez2_emis_pm25))
-ez_tot_pm25_orig[5] = (ez1_par_orig[5]*float(ez1_emis_pm25)) + (ez2_par_orig[5]*float(ez2_emis_pm25))
-
-ez_tot_no2_mir = np.array([0,0,0,0,0,0], dtype = float)
-ez_tot_no2_mir[1] = (ez1_par_mir[1]*float(ez2_emis_no2)) + (ez2_par_mir[1]*float(ez1_emis_no2))
-ez_tot_no2_mir[2] = (ez1_par_mir[2]*float(ez2_emis_no2)) + (ez2_par_mir[2]*float(ez1_emis_no2))
-ez_tot_no2_mir[3] = (ez1_par_mir[3]*float(ez2_emis_no2)) + (ez2_par_mir[3]*float(ez1_emis_no2))
-ez_tot_no2_mir[4] = (ez1_par_mir[4]*float(ez2_emis_no2)) + (ez2_par_mir[4]*float(ez1_emis_no2))
-ez_tot_no2_mir[5] = (ez1_par_mir[5]*float(ez2_emis_no2)) + (ez2_par_mir[5]*float(ez1_emis_no2))
-
-ez_tot_pm25_mir = np.array([0,0,0,0,0,0], dtype = float)
-ez_tot_pm25_mir[1] = (ez1_par_mir[1]*float(ez2_emis_pm25)) + (ez2_par_mir[1]*float(ez1_emis_pm25))
-ez_tot_pm25_mir[2] = (ez1_par_mir[2]*float(ez2_emis_pm25)) + (ez2_par_mir[2]*float(ez1_emis_pm25))
-ez_tot_pm25_mir[3] = (ez1_par_mir[3]*float(ez2_emis_pm25)) + (ez2_par_mir[3]*float(ez1_emis_pm25))
-ez_tot_pm25_mir[4] = (ez1_par_mir[4]*float(ez2_emis_pm25)) + (ez2_par_mir[4]*float(ez1_emis_pm25))
-ez_tot_pm25_mir[5] = (ez1_par_mir[5]*float(ez2_emis_pm25)) + (ez2_par_mir[5]*float(ez1_emis_pm25))
-
-# check the sum of partitioned emissions equal the orginal
-if round(sum(ez_tot_no2_orig),0) != round((float(ez1_emis_no2) + float(ez2_emis_no2))):
-    error[8,1] = 1
-    
-if round(sum(ez_tot_no2_mir),0) != round((float(ez1_emis_no2) + float(ez2_emis_no2))):
-    error[8,1] = 1
-    
-if round(sum(ez_tot_pm25_orig),0) != round((float(ez1_emis_pm25) + float(ez2_emis_pm25))):
-    error[8,1] = 1
-    
-if round(sum(ez_tot_pm25_mir),0) != round((float(ez1_emis_pm25) + float(ez2_emis_pm25))):
-    error[8,1] = 1
-
-#print(error[8,1])
-#print(ez_tot_no2_orig)
-#print(ez_tot_pm25_orig)
-#print(ez_tot_no2_mir)
-#print(ez_tot_pm25_mir)
-
+def street_emissions(objects, state, error):
+    roadw = state["roadw"]
+    l_cumu_original = state["l_cumu_original"]
+    l_original = state["l_original"]
+    l_cumu_mirror = state["l_cumu_mirror"]
+    l_mirror = state["l_mirror"]
+    ez1_start = state["ez1_start"]
+    ez1_finish = state["ez1_finish"]
+    ez2_start = state["ez2_start"]
+    ez2_finish = state["ez2_finish"]
+    ez1_w = state["ez1_w"]
+    ez2_w = state["ez2_w"]
+
+    ez1_veh = 0
+    ez2_veh = 0
+    ez1_emis_no2 = 0
+    ez2_emis_no2 = 0
+    ez1_emis_pm25 = 0
+    ez2_emis_pm25 = 0
+
+    # for each emission zone, if emissions are provided by user in 
+    # "current_exposure_no2"then use these figures, 
+    # if not then use the vehicle movement
+
+    for item in objects:
+        if item["name"] == "EZ1":
+            ez1_emis_no2 = item.get("current_emissions_no2")
+            if ez1_emis_no2 == None:
+                ez1_veh = float(item.get("vmovement"))
+                ez1_emis_no2 = float(emis_calc(ez1_veh)[0])
+
+    for item in objects:
+        if item["name"] == "EZ2":
+            ez2_emis_no2 = item.get("current_emissions_no2")
+            if ez2_emis_no2 == None:
+                ez2_veh = float(item.get("vmovement"))
+                ez2_emis_no2 = float(emis_calc(ez2_veh)[0])
+            
+    for item in objects:
+        if item["name"] == "EZ1":
+            ez1_emis_pm25 = item.get("current_emissions_PM2_5")
+            if ez1_emis_pm25 == None:
+                ez1_veh = float(item.get("vmovement"))
+                ez1_emis_pm25 = float(emis_calc(ez1_veh)[1])
+
+
+    for item in objects:
+        if item["name"] == "EZ2":
+            ez2_emis_pm25 = item.get("current_emissions_PM2_5")
+            if ez2_emis_pm25 == None:
+                ez2_veh = float(item.get("vmovement"))
+                ez2_emis_pm25 = float(emis_calc(ez2_veh)[1])
+
+    # partition emissions into respective boxes
+    # value represents % of emissions in box - should all sum to 1
+    ez1_par_orig = np.array([0,0,0,0,0,0], dtype = float)
+    ez2_par_orig = np.array([0,0,0,0,0,0], dtype = float)
+
+    ez1_par_mir = np.array([0,0,0,0,0,0], dtype = float)
+    ez2_par_mir = np.array([0,0,0,0,0,0], dtype = float)
+
+
+    emis_par_fun_orig = emission_partition(l_cumu=l_cumu_original, l=l_original, 
+                                           ez1_start=ez1_start, ez1_finish=ez1_finish, ez2_start=ez2_start, ez2_finish=ez2_finish, 
+                                           ez1_par=ez1_par_orig, ez2_par=ez2_par_orig, 
+                                           ez1_w=ez1_w, ez2_w=ez2_w)
+
+    ez1_par_orig = emis_par_fun_orig[0]
+    ez2_par_orig = emis_par_fun_orig[1]
+
+    # had to flip things around because function to partition emissions relies on
+    # EZ1 being first. Therefore in mirror version, EZ1 becomes EZ2 and vice versa
+    # is this hardwired into the platform? So if there's only 1 emissions zone it's EZ1,
+    # and if there are 2, EZ1 is upwind of EZ2?
+    ez2_finish_mir= round(roadw-ez1_start,4)
+    ez2_start_mir= round(roadw-ez1_finish,4)
+    ez1_finish_mir= round(roadw-ez2_start,4)
+    ez1_start_mir= round(roadw-ez2_finish,4)
+
+    emis_par_fun_mir = emission_partition(l_cumu=l_cumu_mirror, l=l_mirror, 
+                                           ez1_start=ez1_start_mir, ez1_finish=ez1_finish_mir, ez2_start=ez2_start_mir, ez2_finish=ez2_finish_mir, 
+                                           ez1_par=ez1_par_mir, ez2_par=ez2_par_mir, 
+                                           ez1_w=ez2_w, ez2_w=ez1_w)
+
+    ez1_par_mir = emis_par_fun_mir[0]
+    ez2_par_mir = emis_par_fun_mir[1]
+
+    ez_tot_no2_orig = np.array([0,0,0,0,0,0], dtype = float)
+    ez_tot_no2_orig[1] = (ez1_par_orig[1]*float(ez1_emis_no2)) + (ez2_par_orig[1]*float(ez2_emis_no2))
+    ez_tot_no2_orig[2] = (ez1_par_orig[2]*float(ez1_emis_no2)) + (ez2_par_orig[2]*float(ez2_emis_no2))
+    ez_tot_no2_orig[3] = (ez1_par_orig[3]*float(ez1_emis_no2)) + (ez2_par_orig[3]*float(ez2_emis_no2))
+    ez_tot_no2_orig[4] = (ez1_par_orig[4]*float(ez1_emis_no2)) + (ez2_par_orig[4]*float(ez2_emis_no2))
+    ez_tot_no2_orig[5] = (ez1_par_orig[5]*float(ez1_emis_no2)) + (ez2_par_orig[5]*float(ez2_emis_no2))
+
+    ez_tot_pm25_orig = np.array([0,0,0,0,0,0], dtype = float)
+    ez_tot_pm25_orig[1] = (ez1_par_orig[1]*float(ez1_emis_pm25)) + (ez2_par_orig[1]*float(ez2_emis_pm25))
+    ez_tot_pm25_orig[2] = (ez1_par_orig[2]*float(ez1_emis_pm25)) + (ez2_par_orig[2]*float(ez2_emis_pm25))
+    ez_tot_pm25_orig[3] = (ez1_par_orig[3]*float(ez1_emis_pm25)) + (ez2_par_orig[3]*float(ez2_emis_pm25))
+    ez_tot_pm25_orig[4] = (ez1_par_orig[4]*float(ez1_emis_pm25)) + (ez2_par_orig[4]*float(ez2_emis_pm25))
+    ez_tot_pm25_orig[5] = (ez1_par_orig[5]*float(ez1_emis_pm25)) + (ez2_par_orig[5]*float(ez2_emis_pm25))
+
+    ez_tot_no2_mir = np.array([0,0,0,0,0,0], dtype = float)
+    ez_tot_no2_mir[1] = (ez1_par_mir[1]*float(ez2_emis_no2)) + (ez2_par_mir[1]*float(ez1_emis_no2))
+    ez_tot_no2_mir[2] = (ez1_par_mir[2]*float(ez2_emis_no2)) + (ez2_par_mir[2]*float(ez1_emis_no2))
+    ez_tot_no2_mir[3] = (ez1_par_mir[3]*float(ez2_emis_no2)) + (ez2_par_mir[3]*float(ez1_emis_no2))
+    ez_tot_no2_mir[4] = (ez1_par_mir[4]*float(ez2_emis_no2)) + (ez2_par_mir[4]*float(ez1_emis_no2))
+    ez_tot_no2_mir[5] = (ez1_par_mir[5]*float(ez2_emis_no2)) + (ez2_par_mir[5]*float(ez1_emis_no2))
+
+    ez_tot_pm25_mir = np.array([0,0,0,0,0,0], dtype = float)
+    ez_tot_pm25_mir[1] = (ez1_par_mir[1]*float(ez2_emis_pm25)) + (ez2_par_mir[1]*float(ez1_emis_pm25))
+    ez_tot_pm25_mir[2] = (ez1_par_mir[2]*float(ez2_emis_pm25)) + (ez2_par_mir[2]*float(ez1_emis_pm25))
+    ez_tot_pm25_mir[3] = (ez1_par_mir[3]*float(ez2_emis_pm25)) + (ez2_par_mir[3]*float(ez1_emis_pm25))
+    ez_tot_pm25_mir[4] = (ez1_par_mir[4]*float(ez2_emis_pm25)) + (ez2_par_mir[4]*float(ez1_emis_pm25))
+    ez_tot_pm25_mir[5] = (ez1_par_mir[5]*float(ez2_emis_pm25)) + (ez2_par_mir[5]*float(ez1_emis_pm25))
+
+    # check the sum of partitioned emissions equal the orginal
+    if round(sum(ez_tot_no2_orig),0) != round((float(ez1_emis_no2) + float(ez2_emis_no2))):
+        error[8,1] = 1
+    
+    if round(sum(ez_tot_no2_mir),0) != round((float(ez1_emis_no2) + float(ez2_emis_no2))):
+        error[8,1] = 1
+    
+    if round(sum(ez_tot_pm25_orig),0) != round((float(ez1_emis_pm25) + float(ez2_emis_pm25))):
+        error[8,1] = 1
+    
+    if round(sum(ez_tot_pm25_mir),0) != round((float(ez1_emis_pm25) + float(ez2_emis_pm25))):
+        error[8,1] = 1
+
+    emissions = {}
+    emissions["ez_tot_no2_orig"] = ez_tot_no2_orig
+    emissions["ez_tot_pm25_orig"] = ez_tot_pm25_orig
+    emissions["ez_tot_no2_mir"] = ez_tot_no2_mir
+    emissions["ez_tot_pm25_mir"] = ez_tot_pm25_mir
+    
+    return emissions
 
 ###############################################################################
 # A MATRIX 
 ###############################################################################
 
-# ___________ Functions for positive/negative conventions ___________
+# ___________ Box numbering ___________
+
+# the boxes (concentrations C11..C35 for the 3x5 street) are numbered row by
+# row from the bottom: box = n_cols*(row-1) + (column-1), rows 1..n_rows and
+# columns 1..n_cols
+@lru_cache(maxsize = None)
+def box_grid(n_rows, n_cols):
+    row = np.repeat(np.arange(1, n_rows+1), n_cols)
+    col = np.tile(np.arange(1, n_cols+1), n_rows)
+    return row, col
+
 
-# postive flows: left to right, and upwards (bottom to top)
-# negative flows: right to left, and downwards (top to bottom)
-def alpha(x):
-    if x > 0:
-        return 1
-    elif x < 0:
-        return 0
-    elif x == 0:
-        return 0
-    
-def beta(x):
-    if x > 0:
-        return 0
-    elif x < 0:
-        return 1
-    elif x == 0:
-        return 0
-    
-        
 # ___________ Ratios ___________
-# ratios worked out to make equations more readable in a matrix
-r1 = np.zeros((4,6))
-r1[1,1] = h_original[1]/l_original[1] 
-r1[1,2] = h_original[1]/l_original[2] 
-r1[1,3] = h_original[1]/l_original[3]
-r1[1,4] = h_original[1]/l_original[4] 
-r1[1,5] = h_original[1]/l_original[5] 
-r1[2,1] = h_original[2]/l_original[1] 
-r1[2,2] = h_original[2]/l_original[2]
-r1[2,3] = h_original[2]/l_original[3] 
-r1[2,4] = h_original[2]/l_original[4]
-r1[2,5] = h_original[2]/l_original[5]
-r1[3,1] = h_original[3]/l_original[1]
-r1[3,2] = h_original[3]/l_original[2] 
-r1[3,3] = h_original[3]/l_original[3] 
-r1[3,4] = h_original[3]/l_original[4]
-r1[3,5] = h_original[3]/l_original[5] 
-
-r2 = np.zeros((4,6))
-r2[1,1] = h_mirror[1]/l_mirror[1] 
-r2[1,2] = h_mirror[1]/l_mirror[2] 
-r2[1,3] = h_mirror[1]/l_mirror[3]
-r2[1,4] = h_mirror[1]/l_mirror[4] 
-r2[1,5] = h_mirror[1]/l_mirror[5] 
-r2[2,1] = h_mirror[2]/l_mirror[1] 
-r2[2,2] = h_mirror[2]/l_mirror[2]
-r2[2,3] = h_mirror[2]/l_mirror[3] 
-r2[2,4] = h_mirror[2]/l_mirror[4]
-r2[2,5] = h_mirror[2]/l_mirror[5]
-r2[3,1] = h_mirror[3]/l_mirror[1]
-r2[3,2] = h_mirror[3]/l_mirror[2] 
-r2[3,3] = h_mirror[3]/l_mirror[3] 
-r2[3,4] = h_mirror[3]/l_mirror[4]
-r2[3,5] = h_mirror[3]/l_mirror[5] 
+# ratios worked out to make equations more readable in a matrix:
+# r[row, column] = h[row]/l[column]
+def ratios(h, l):
+    h = np.asarray(h, dtype = float)
+    l = np.asarray(l, dtype = float)
+    r = np.zeros(h.shape + l.shape[-1:])
+    r[...,1:,1:] = h[...,1:,None]/l[...,None,1:]
+    
+    return r
 
 
 # ___________ Large 5x3 A-Matrix function ___________
 
+# u/U: horizontal dispersion/advection through the left face of column j,
+# w/W: vertical dispersion/advection through the bottom face of row i
+# postive flows: left to right, and upwards (bottom to top)
+# negative flows: right to left, and downwards (top to bottom)
+# so np.maximum(U, 0) is what is advected out of the box upwind of a face and 
+# np.minimum(U, 0) what comes back against the positive direction
+
+# nonzero entries of the A matrix as (rows, columns, values), values having
+# the leading dimensions of the inputs; the grid size comes from r (rows and
+# columns + 1, index 0 unused) and the flows have one more row for the roof
+def a_coefficients(r, u, U, w, W):
+    r, u, U, w, W = (np.asarray(x, dtype = float) for x in (r, u, U, w, W))
+    n_rows = r.shape[-2] - 1
+    n_cols = r.shape[-1] - 1
+    i, j = box_grid(n_rows, n_cols)
+    boxes = np.arange(n_rows*n_cols)
+    
+    # faces a box exchanges through (the others are buildings, ground or, for
+    # the top of the last row, the background above roof level)
+    has_left = j > 1
+    has_right = j < n_cols
+    has_below = i > 1
+    has_above = i < n_rows
+    
+    rb = r[...,i,j]
+    
+    # exchanges through the left/right faces (faces outside the street are masked)
+    uL = u[...,i,j]
+    UL = U[...,i,j]
+    uR = u[...,i,np.where(has_right, j+1, j)]
+    UR = U[...,i,np.where(has_right, j+1, j)]
+    
+    # exchanges through the bottom/top faces (the last row tops onto the background)
+    wB = w[...,i,j]
+    WB = W[...,i,j]
+    wT = w[...,i+1,j]
+    WT = W[...,i+1,j]
+    
+    # leaving the box
+    out_left = np.where(has_left, uL - np.minimum(UL, 0), 0)
+    out_right = np.where(has_right, uR + np.maximum(UR, 0), 0)
+    out_below = np.where(has_below, wB - np.minimum(WB, 0), 0)
+    out_above = wT + np.maximum(WT, 0)
+    
+    # coming in from the neighbouring boxes
+    below = (-np.maximum(WB, 0) - wB)[...,has_below]
+    
+    # C33 from C23: the original hand-written 3x5 matrix uses the vertical 
+    # advection of column 2 here (W[3,2] rather than W[3,3]); kept as it was
+    if (n_rows, n_cols) == (3, 5):
+        below[...,7] = -np.maximum(W[...,3,2], 0) - w[...,3,3]
+    
+    rows = np.concatenate((boxes, boxes[has_left], boxes[has_right], boxes[has_below], boxes[has_above]))
+    cols = np.concatenate((boxes, boxes[has_left]-1, boxes[has_right]+1,
+                           boxes[has_below]-n_cols, boxes[has_above]+n_cols))
+    values = np.concatenate((rb*(out_right + out_left) + out_above + out_below,
+                             (rb*(-np.maximum(UL, 0) - uL))[...,has_left],
+                             (rb*(np.minimum(UR, 0) - uR))[...,has_right],
+                             below,
+                             (np.minimum(WT, 0) - wT)[...,has_above]), axis = -1)
+    
+    return rows, cols, values
+
+
+# works on a single street (r: 4x6, flows: 5x6) or on stacks of them (the
+# leading dimensions are kept), giving 15x15 matrices (or n x n, n being the
+# number of boxes, for other grids)
 def a_matrix(r, u, U, w, W):
-    a = np.zeros((15,15), dtype = float) # a matrix
-    # C11
-    a[0,0] = r[1,1]*(u[1,2] + alpha(U[1,2])*U[1,2]) + w[2,1] + alpha(W[2,1])*W[2,1]
-    a[0,1] = r[1,1]*(beta(U[1,2])*U[1,2] - u[1,2])
-    a[0,2] = 0
-    a[0,3] = 0
-    a[0,4] = 0
-    a[0,5] = beta(W[2,1])*W[2,1] - w[2,1]
-    a[0,6] = 0
-    a[0,7] = 0
-    a[0,8] = 0
-    a[0,9] = 0
-    a[0,10] = 0
-    a[0,11] = 0
-    a[0,12] = 0
-    a[0,13] = 0
-    a[0,14] = 0
-    
-    # C12
-    a[1,0] = r[1,2]*(-alpha(U[1,2])*U[1,2] - u[1,2])
-    a[1,1] = r[1,2]*(alpha(U[1,3])*U[1,3] + u[1,3] - beta(U[1,2])*U[1,2] + u[1,2]) + w[2,2] + alpha(W[2,2])*W[2,2]
-    a[1,2] = r[1,2]*(beta(U[1,3])*U[1,3] - u[1,3])
-    a[1,3] = 0
-    a[1,4] = 0
-    a[1,5] = 0
-    a[1,6] = beta(W[2,2])*W[2,2] - w[2,2]
-    a[1,7] = 0
-    a[1,8] = 0
-    a[1,9] = 0
-    a[1,10] = 0
-    a[1,11] = 0
-    a[1,12] = 0
-    a[1,13] = 0
-    a[1,14] = 0
-    
-    # C13
-    a[2,0] = 0
-    a[2,1] = r[1,3]*(-alpha(U[1,3])*U[1,3] - u[1,3])
-    a[2,2] = r[1,3]*(alpha(U[1,4])*U[1,4] + u[1,4] - beta(U[1,3])*U[1,3] + u[1,3]) + alpha(W[2,3])*W[2,3] + w[2,3]
-    a[2,3] = r[1,3]*(beta(U[1,4])*U[1,4] - u[1,4])
-    a[2,4] = 0
-    a[2,5] = 0
-    a[2,6] = 0
-    a[2,7] = beta(W[2,3])*W[2,3] - w[2,3]
-    a[2,8] = 0
-    a[2,9] = 0
-    a[2,10] = 0
-    a[2,11] = 0
-    a[2,12] = 0
-    a[2,13] = 0
-    a[2,14] = 0
-    
-    # C14
-    a[3,0] = 0
-    a[3,1] = 0
-    a[3,2] = r[1,4]*(-alpha(U[1,4])*U[1,4] - u[1,4])
-    a[3,3] = r[1,4]*(alpha(U[1,5])*U[1,5] + u[1,5] - beta(U[1,4])*U[1,4] + u[1,4]) + alpha(W[2,4])*W[2,4] + w[2,4]
-    a[3,4] = r[1,4]*(beta(U[1,5])*U[1,5] - u[1,5])
-    a[3,5] = 0
-    a[3,6] = 0
-    a[3,7] = 0
-    a[3,8] = beta(W[2,4])*W[2,4] - w[2,4]
-    a[3,9] = 0
-    a[3,10] = 0
-    a[3,11] = 0
-    a[3,12] = 0
-    a[3,13] = 0
-    a[3,14] = 0
-    
-    # C15
-    a[4,0] = 0
-    a[4,1] = 0
-    a[4,2] = 0
-    a[4,3] = r[1,5]*(-alpha(U[1,5])*U[1,5] - u[1,5])
-    a[4,4] = r[1,5]*(u[1,5] - beta(U[1,5])*U[1,5]) + alpha(W[2,5])*W[2,5] + w[2,5]
-    a[4,5] = 0
-    a[4,6] = 0
-    a[4,7] = 0
-    a[4,8] = 0
-    a[4,9] = beta(W[2,5])*W[2,5] - w[2,5]
-    a[4,10] = 0
-    a[4,11] = 0
-    a[4,12] = 0
-    a[4,13] = 0
-    a[4,14] = 0
-    
-    # C21
-    a[5,0] = -alpha(W[2,1])*W[2,1] - w[2,1]
-    a[5,1] = 0
-    a[5,2] = 0
-    a[5,3] = 0
-    a[5,4] = 0
-    a[5,5] = r[2,1]*(alpha(U[2,2])*U[2,2] + u[2,2]) + w[2,1] - beta(W[2,1])*W[2,1] + w[3,1] + alpha(W[3,1])*W[3,1]
-    a[5,6] = r[2,1]*(beta(U[2,2])*U[2,2] - u[2,2])
-    a[5,7] = 0
-    a[5,8] = 0
-    a[5,9] = 0
-    a[5,10] = beta(W[3,1])*W[3,1] - w[3,1]
-    a[5,11] = 0
-    a[5,12] = 0
-    a[5,13] = 0
-    a[5,14] = 0
-    
-    # C22
-    a[6,0] = 0
-    a[6,1] = -alpha(W[2,2])*W[2,2] - w[2,2]
-    a[6,2] = 0
-    a[6,3] = 0
-    a[6,4] = 0
-    a[6,5] = r[2,2]*(-alpha(U[2,2])*U[2,2] - u[2,2])
-    a[6,6] = r[2,2]*(alpha(U[2,3])*U[2,3] + u[2,3] - beta(U[2,2])*U[2,2] + u[2,2]) + w[2,2] - beta(W[2,2])*W[2,2] + w[3,2] + alpha(W[3,2])*W[3,2]
-    a[6,7] = r[2,2]*(beta(U[2,3])*U[2,3] - u[2,3])
-    a[6,8] = 0
-    a[6,9] = 0
-    a[6,10] = 0
-    a[6,11] = beta(W[3,2])*W[3,2] - w[3,2]
-    a[6,12] = 0
-    a[6,13] = 0
-    a[6,14] = 0
-    
-    # C23  
-    a[7,0] = 0
-    a[7,1] = 0
-    a[7,2] = -alpha(W[2,3])*W[2,3] - w[2,3]
-    a[7,3] = 0
-    a[7,4] = 0
-    a[7,5] = 0
-    a[7,6] = r[2,3]*(-alpha(U[2,3])*U[2,3] - u[2,3])
-    a[7,7] = r[2,3]*(alpha(U[2,4])*U[2,4] + u[2,4] - beta(U[2,3])*U[2,3] + u[2,3]) + w[2,3] - beta(W[2,3])*W[2,3] + w[3,3] + alpha(W[3,3])*W[3,3]
-    a[7,8] = r[2,3]*(beta(U[2,4])*U[2,4] - u[2,4])
-    a[7,9] = 0
-    a[7,10] = 0
-    a[7,11] = 0
-    a[7,12] = beta(W[3,3])*W[3,3] - w[3,3]
-    a[7,13] = 0
-    a[7,14] = 0
-    
-    # C24
-    a[8,0] = 0
-    a[8,1] = 0
-    a[8,2] = 0
-    a[8,3] = -alpha(W[2,4])*W[2,4] - w[2,4]
-    a[8,4] = 0
-    a[8,5] = 0
-    a[8,6] = 0
-    a[8,7] = r[2,4]*(-alpha(U[2,4])*U[2,4] - u[2,4])
-    a[8,8] = r[2,4]*(alpha(U[2,5])*U[2,5] + u[2,5] - beta(U[2,4])*U[2,4] + u[2,4]) + w[2,4] - beta(W[2,4])*W[2,4] + w[3,4] + alpha(W[3,4])*W[3,4]
-    a[8,9] = r[2,4]*(beta(U[2,5])*U[2,5] - u[2,5])
-    a[8,10] = 0
-    a[8,11] = 0
-    a[8,12] = 0
-    a[8,13] = beta(W[3,4])*W[3,4] - w[3,4]
-    a[8,14] = 0
-    
-    # C25
-    a[9,0] = 0
-    a[9,1] = 0
-    a[9,2] = 0
-    a[9,3] = 0
-    a[9,4] = -alpha(W[2,5])*W[2,5] - w[2,5]
-    a[9,5] = 0
-    a[9,6] = 0
-    a[9,7] = 0
-    a[9,8] = r[2,5]*(-alpha(U[2,5])*U[2,5] - u[2,5])
-    a[9,9] = r[2,5]*(u[2,5] - beta(U[2,5])*U[2,5]) + w[2,5] - beta(W[2,5])*W[2,5] + w[3,5] + alpha(W[3,5])*W[3,5]
-    a[9,10] = 0
-    a[9,11] = 0
-    a[9,12] = 0
-    a[9,13] = 0
-    a[9,14] = beta(W[3,5])*W[3,5] - w[3,5]
-    
-    # C31
-    a[10,0] = 0
-    a[10,1] = 0
-    a[10,2] = 0
-    a[10,3] = 0
-    a[10,4] = 0
-    a[10,5] = -alpha(W[3,1])*W[3,1] - w[3,1]
-    a[10,6] = 0
-    a[10,7] = 0
-    a[10,8] = 0
-    a[10,9] = 0
-    a[10,10] = r[3,1]*(u[3,2] + alpha(U[3,2])*U[3,2]) + w[3,1] - beta(W[3,1])*W[3,1] + w[4,1] + alpha(W[4,1])*W[4,1]
-    a[10,11] = r[3,1]*(beta(U[3,2])*U[3,2] - u[3,2])
-    a[10,12] = 0
-    a[10,13] = 0
-    a[10,14] = 0
-    
-    # C32
-    a[11,0] = 0
-    a[11,1] = 0
-    a[11,2] = 0
-    a[11,3] = 0
-    a[11,4] = 0
-    a[11,5] = 0
-    a[11,6] = -alpha(W[3,2])*W[3,2] - w[3,2]
-    a[11,7] = 0
-    a[11,8] = 0
-    a[11,9] = 0
-    a[11,10] = r[3,2]*(-alpha(U[3,2])*U[3,2] - u[3,2])
-    a[11,11] = r[3,2]*(u[3,2] - beta(U[3,2])*U[3,2] + u[3,3] + alpha(U[3,3])*U[3,3]) + w[3,2] - beta(W[3,2])*W[3,2] + w[4,2] + alpha(W[4,2])*W[4,2]
-    a[11,12] = r[3,2]*(beta(U[3,3])*U[3,3] - u[3,3])
-    a[11,13] = 0
-    a[11,14] = 0
-    
-    # C33
-    a[12,0] = 0
-    a[12,1] = 0
-    a[12,2] = 0
-    a[12,3] = 0
-    a[12,4] = 0
-    a[12,5] = 0
-    a[12,6] = 0
-    a[12,7] = -alpha(W[3,2])*W[3,2] - w[3,3]
-    a[12,8] = 0
-    a[12,9] = 0
-    a[12,10] = 0
-    a[12,11] = r[3,3]*(-alpha(U[3,3])*U[3,3] - u[3,3])
-    a[12,12] = r[3,3]*(u[3,3] - beta(U[3,3])*U[3,3] + u[3,4] + alpha(U[3,4])*U[3,4]) + w[3,3] - beta(W[3,3])*W[3,3] + w[4,3] + alpha(W[4,3])*W[4,3]
-    a[12,13] = r[3,3]*(beta(U[3,4])*U[3,4] -u[3,4])
-    a[12,14] = 0
-    
-    # C34
-    a[13,0] = 0
-    a[13,1] = 0
-    a[13,2] = 0
-    a[13,3] = 0
-    a[13,4] = 0
-    a[13,5] = 0
-    a[13,6] = 0
-    a[13,7] = 0
-    a[13,8] = -alpha(W[3,4])*W[3,4] - w[3,4]
-    a[13,9] = 0
-    a[13,10] = 0
-    a[13,11] = 0
-    a[13,12] = r[3,4]*(-alpha(U[3,4])*U[3,4] - u[3,4])
-    a[13,13] = r[3,4]*(u[3,4] - beta(U[3,4])*U[3,4] + u[3,5] + alpha(U[3,5])*U[3,5]) + w[3,4] - beta(W[3,4])*W[3,4] + w[4,4] + alpha(W[4,4])*W[4,4]
-    a[13,14] = r[3,4]*(beta(U[3,5])*U[3,5] -u[3,5])
-    
-    # C35
-    a[14,0] = 0
-    a[14,1] = 0
-    a[14,2] = 0
-    a[14,3] = 0
-    a[14,4] = 0
-    a[14,5] = 0
-    a[14,6] = 0
-    a[14,7] = 0
-    a[14,8] = 0
-    a[14,9] = -alpha(W[3,5])*W[3,5] - w[3,5]
-    a[14,10] = 0
-    a[14,11] = 0
-    a[14,12] = 0
-    a[14,13] = r[3,5]*(-alpha(U[3,5])*U[3,5] - u[3,5])
-    a[14,14] = r[3,5]*(u[3,5] - beta(U[3,5])*U[3,5]) + w[3,5] - beta(W[3,5])*W[3,5] + w[4,5] + alpha(W[4,5])*W[4,5]
-    
-    return np.array(a)
+    rows, cols, values = a_coefficients(r, u, U, w, W)
+    n = (np.shape(r)[-2] - 1)*(np.shape(r)[-1] - 1)
+    
+    a = np.zeros(values.shape[:-1] + (n,n))
+    a[...,rows,cols] = values
+    
+    return a
+
+# the same nonzero entries written straight into diagonal ordered form, as
+# scipy.linalg.solve_banded takes it (see air_quality_solver.band_storage): 
+# a[i,j] goes to ab[n_cols+i-j, j], the boxes only exchanging with those up 
+# to one row (n_cols boxes) away. No n x n matrix is built
+def a_bands(r, u, U, w, W):
+    rows, cols, values = a_coefficients(r, u, U, w, W)
+    n_cols = np.shape(r)[-1] - 1
+    n = (np.shape(r)[-2] - 1)*n_cols
+    
+    ab = np.zeros(values.shape[:-1] + (2*n_cols+1, n))
+    ab[...,n_cols+rows-cols,cols] = values
+    
+    return ab
+
+
+# ___________ Right-hand side vectors ___________
+
+# emissions into the bottom boxes, averaging the line emission source over 
+# the area of 'ground' (ug/m2/s); no inputs into the middle boxes from either
+# emissions or background; background inputs into the top boxes. Minimum for 
+# W because if negative, the flow is downwards into the street, yet as it is 
+# treated here as an input it should be positive, hence signs cancel out
+def d_vector(ez, l, w, W, cB):
+    ez, l, w, W = (np.asarray(x, dtype = float) for x in (ez, l, w, W))
+    cB = np.asarray(cB, dtype = float)[...,None]
+    n_rows = w.shape[-2] - 2
+    n_cols = l.shape[-1] - 1
+    
+    d = np.zeros(ez.shape[:-1] + (n_rows*n_cols,))
+    d[...,:n_cols] = ez[...,1:]/l[...,1:]
+    d[...,-n_cols:] = (w[...,n_rows+1,1:] - np.minimum(W[...,n_rows+1,1:], 0))*cB
+    
+    return d
+
+
+# the same right-hand side as a matrix, d = s @ [ez[1..5], cB]: one column 
+# per unit emission into each bottom box and one for a unit background
+def source_matrix(l, w, W):
+    l, w, W = (np.asarray(x, dtype = float) for x in (l, w, W))
+    n_rows = w.shape[-2] - 2
+    n_cols = l.shape[-1] - 1
+    cols = np.arange(n_cols)
+    
+    s = np.zeros(l.shape[:-1] + (n_rows*n_cols, n_cols+1))
+    s[...,cols,cols] = 1/l[...,1:]
+    s[...,(n_rows-1)*n_cols + cols,n_cols] = w[...,n_rows+1,1:] - np.minimum(W[...,n_rows+1,1:], 0)
+    
+    return s
+
 
 # ___________ Define for different scenarios (before/after) ___________
 
@@ -3938,328 +3896,160 @@ def a_matrix(r, u, U, w, W):
     # and dispersion values were set to 0 ue2/we2/ua2/wa2 arrays
     # changed obstruction value to 0.99 in those cases
 
-# use A-matrix with different dispersion and advection values
-# wind left to right, before new barrier
-a1_orig = a_matrix(r = r1, u = ue2_orig, w = we2_orig, U = ua2_orig, W = wa2_orig)
-
-# wind left to right, after new barrier
-a2_orig = a_matrix(r = r1, u = ue3_orig, w = we3_orig, U = ua3_orig, W = wa3_orig)
-
-# wind right to left, before new barrier
-a1_mir = a_matrix(r = r2, u = ue2_mir, w = we2_mir, U = ua2_mir, W = wa2_mir)
-# wind right to left, after new barrier
-a2_mir = a_matrix(r = r2, u = ue3_mir, w = we3_mir, U = ua3_mir, W = wa3_mir)
-
-# wind parallel, before new barrier, dimensioning from wind left to right
-a1_par_1 = a_matrix(r = r1, u = ue1_par, U = ua1_par, w = we1_par, W = wa1_par)
-# wind parallel, before new barrier, dimensioning from wind right to left
-a1_par_2 = a_matrix(r = r2, u = ue2_par, U = ua2_par, w = we2_par, W = wa2_par)
-# wind parallel, after new barrier, dimensioning from wind left to right
-a2_par_1 = a_matrix(r = r1, u = ue3_par, U = ua3_par, w = we3_par, W = wa3_par)
-# wind parallel, after new barrier, dimensioning from wind right to left
-a2_par_2 = a_matrix(r = r2, u = ue4_par, U = ua4_par, w = we4_par, W = wa4_par)
-
-
-# d1_orig = inputs for existing conditions, NO2
-d1_orig = np.array([0,0,0,0,0,0,0,0,0,0,0,0,0,0,0], dtype = float)
-d1_orig[0] = ez_tot_no2_orig[1]/l_original[1] # averaging line emission source over area of 'ground' = (ug/m2/s)
-d1_orig[1] = ez_tot_no2_orig[2]/l_original[2]
-d1_orig[2] = ez_tot_no2_orig[3]/l_original[3]
-d1_orig[3] = ez_tot_no2_orig[4]/l_original[4]
-d1_orig[4] = ez_tot_no2_orig[5]/l_original[5]
-d1_orig[5] = 0      # no inputs into middle boxes from either emissions or background
-d1_orig[6] = 0
-d1_orig[7] = 0
-d1_orig[8] = 0
-d1_orig[9] = 0
-d1_orig[10] = (we2_orig[4,1] - beta(wa2_orig[4,1])*wa2_orig[4,1])*cB_no2  # background inputs into top boxes
-d1_orig[11] = (we2_orig[4,2] - beta(wa2_orig[4,2])*wa2_orig[4,2])*cB_no2  # negative for beta because if true, the sign of W[4,x] would be negative
-d1_orig[12] = (we2_orig[4,3] - beta(wa2_orig[4,3])*wa2_orig[4,3])*cB_no2  # yet as here being treated as an input, it should be positive, hence signs cancel out
-d1_orig[13] = (we2_orig[4,4] - beta(wa2_orig[4,4])*wa2_orig[4,4])*cB_no2
-d1_orig[14] = (we2_orig[4,5] - beta(wa2_orig[4,5])*wa2_orig[4,5])*cB_no2
-
-
-# d2_orig = inputs for new conditions, NO2
-d2_orig = np.array([0,0,0,0,0,0,0,0,0,0,0,0,0,0,0], dtype = float)
-d2_orig[0] = ez_tot_no2_orig[1]/l_original[1] # averaging line emission source over area of 'ground' = (ug/m2/s)
-d2_orig[1] = ez_tot_no2_orig[2]/l_original[2]
-d2_orig[2] = ez_tot_no2_orig[3]/l_original[3]
-d2_orig[3] = ez_tot_no2_orig[4]/l_original[4]
-d2_orig[4] = ez_tot_no2_orig[5]/l_original[5]
-d2_orig[5] = 0      # no inputs into middle boxes from either emissions or background
-d2_orig[6] = 0
-d2_orig[7] = 0
-d2_orig[8] = 0
-d2_orig[9] = 0
-d2_orig[10] = (we3_orig[4,1] - beta(wa3_orig[4,1])*wa3_orig[4,1])*cB_no2  # background inputs into top boxes
-d2_orig[11] = (we3_orig[4,2] - beta(wa3_orig[4,2])*wa3_orig[4,2])*cB_no2  # negative for beta because if true, the sign of W[4,x] would be negative
-d2_orig[12] = (we3_orig[4,3] - beta(wa3_orig[4,3])*wa3_orig[4,3])*cB_no2  # yet as here being treated as an input, it should be positive, hence signs cancel out
-d2_orig[13] = (we3_orig[4,4] - beta(wa3_orig[4,4])*wa3_orig[4,4])*cB_no2
-d2_orig[14] = (we3_orig[4,5] - beta(wa3_orig[4,5])*wa3_orig[4,5])*cB_no2
-
-
-# d3_orig = inputs for existing conditions, PM2.5
-d3_orig = np.array([0,0,0,0,0,0,0,0,0,0,0,0,0,0,0], dtype = float)
-d3_orig[0] = ez_tot_pm25_orig[1]/l_original[1] # averaging line emission source over area of 'ground' = (ug/m2/s)
-d3_orig[1] = ez_tot_pm25_orig[2]/l_original[2]
-d3_orig[2] = ez_tot_pm25_orig[3]/l_original[3]
-d3_orig[3] = ez_tot_pm25_orig[4]/l_original[4]
-d3_orig[4] = ez_tot_pm25_orig[5]/l_original[5]
-d3_orig[5] = 0      # no inputs into middle boxes from either emissions or background
-d3_orig[6] = 0
-d3_orig[7] = 0
-d3_orig[8] = 0
-d3_orig[9] = 0
-d3_orig[10] = (we2_orig[4,1] - beta(wa2_orig[4,1])*wa2_orig[4,1])*cB_pm25  # background inputs into top boxes
-d3_orig[11] = (we2_orig[4,2] - beta(wa2_orig[4,2])*wa2_orig[4,2])*cB_pm25  # negative for beta because if true, the sign of W[4,x] would be negative
-d3_orig[12] = (we2_orig[4,3] - beta(wa2_orig[4,3])*wa2_orig[4,3])*cB_pm25  # yet as here being treated as an input, it should be positive, hence signs cancel out
-d3_orig[13] = (we2_orig[4,4] - beta(wa2_orig[4,4])*wa2_orig[4,4])*cB_pm25
-d3_orig[14] = (we2_orig[4,5] - beta(wa2_orig[4,5])*wa2_orig[4,5])*cB_pm25
-
-
-# d4_orig = inputs for new conditions, PM2.5
-d4_orig = np.array([0,0,0,0,0,0,0,0,0,0,0,0,0,0,0], dtype = float)
-d4_orig[0] = ez_tot_pm25_orig[1]/l_original[1] # averaging line emission source over area of 'ground' = (ug/m2/s)
-d4_orig[1] = ez_tot_pm25_orig[2]/l_original[2]
-d4_orig[2] = ez_tot_pm25_orig[3]/l_original[3]
-d4_orig[3] = ez_tot_pm25_orig[4]/l_original[4]
-d4_orig[4] = ez_tot_pm25_orig[5]/l_original[5]
-d4_orig[5] = 0      # no inputs into middle boxes from either emissions or background
-d4_orig[6] = 0
-d4_orig[7] = 0
-d4_orig[8] = 0
-d4_orig[9] = 0
-d4_orig[10] = (we3_orig[4,1] - beta(wa3_orig[4,1])*wa3_orig[4,1])*cB_pm25  # background inputs into top boxes
-d4_orig[11] = (we3_orig[4,2] - beta(wa3_orig[4,2])*wa3_orig[4,2])*cB_pm25  # negative for beta because if true, the sign of W[4,x] would be negative
-d4_orig[12] = (we3_orig[4,3] - beta(wa3_orig[4,3])*wa3_orig[4,3])*cB_pm25  # yet as here being treated as an input, it should be positive, hence signs cancel out
-d4_orig[13] = (we3_orig[4,4] - beta(wa3_orig[4,4])*wa3_orig[4,4])*cB_pm25
-d4_orig[14] = (we3_orig[4,5] - beta(wa3_orig[4,5])*wa3_orig[4,5])*cB_pm25
-
-# d1_mir = inputs for existing conditions, NO2
-d1_mir = np.array([0,0,0,0,0,0,0,0,0,0,0,0,0,0,0], dtype = float)
-d1_mir[0] = ez_tot_no2_mir[1]/l_mirror[1] # averaging line emission source over area of 'ground' = (ug/m2/s)
-d1_mir[1] = ez_tot_no2_mir[2]/l_mirror[2]
-d1_mir[2] = ez_tot_no2_mir[3]/l_mirror[3]
-d1_mir[3] = ez_tot_no2_mir[4]/l_mirror[4]
-d1_mir[4] = ez_tot_no2_mir[5]/l_mirror[5]
-d1_mir[5] = 0      # no inputs into middle boxes from either emissions or background
-d1_mir[6] = 0
-d1_mir[7] = 0
-d1_mir[8] = 0
-d1_mir[9] = 0
-d1_mir[10] = (we2_mir[4,1] - beta(wa2_mir[4,1])*wa2_mir[4,1])*cB_no2  # background inputs into top boxes
-d1_mir[11] = (we2_mir[4,2] - beta(wa2_mir[4,2])*wa2_mir[4,2])*cB_no2  # negative for beta because if true, the sign of W[4,x] would be negative
-d1_mir[12] = (we2_mir[4,3] - beta(wa2_mir[4,3])*wa2_mir[4,3])*cB_no2  # yet as here being treated as an input, it should be positive, hence signs cancel out
-d1_mir[13] = (we2_mir[4,4] - beta(wa2_mir[4,4])*wa2_mir[4,4])*cB_no2
-d1_mir[14] = (we2_mir[4,5] - beta(wa2_mir[4,5])*wa2_mir[4,5])*cB_no2
-
-
-# d2_mir = inputs for new conditions, NO2
-d2_mir = np.array([0,0,0,0,0,0,0,0,0,0,0,0,0,0,0], dtype = float)
-d2_mir[0] = ez_tot_no2_mir[1]/l_mirror[1] # averaging line emission source over area of 'ground' = (ug/m2/s)
-d2_mir[1] = ez_tot_no2_mir[2]/l_mirror[2]
-d2_mir[2] = ez_tot_no2_mir[3]/l_mirror[3]
-d2_mir[3] = ez_tot_no2_mir[4]/l_mirror[4]
-d2_mir[4] = ez_tot_no2_mir[5]/l_mirror[5]
-d2_mir[5] = 0      # no inputs into middle boxes from either emissions or background
-d2_mir[6] = 0
-d2_mir[7] = 0
-d2_mir[8] = 0
-d2_mir[9] = 0
-d2_mir[10] = (we3_mir[4,1] - beta(wa3_mir[4,1])*wa3_mir[4,1])*cB_no2  # background inputs into top boxes
-d2_mir[11] = (we3_mir[4,2] - beta(wa3_mir[4,2])*wa3_mir[4,2])*cB_no2  # negative for beta because if true, the sign of W[4,x] would be negative
-d2_mir[12] = (we3_mir[4,3] - beta(wa3_mir[4,3])*wa3_mir[4,3])*cB_no2  # yet as here being treated as an input, it should be positive, hence signs cancel out
-d2_mir[13] = (we3_mir[4,4] - beta(wa3_mir[4,4])*wa3_mir[4,4])*cB_no2
-d2_mir[14] = (we3_mir[4,5] - beta(wa3_mir[4,5])*wa3_mir[4,5])*cB_no2
-
-
-# d3_mir = inputs for existing conditions, PM2.5
-d3_mir = np.array([0,0,0,0,0,0,0,0,0,0,0,0,0,0,0], dtype = float)
-d3_mir[0] = ez_tot_pm25_mir[1]/l_mirror[1] # averaging line emission source over area of 'ground' = (ug/m2/s)
-d3_mir[1] = ez_tot_pm25_mir[2]/l_mirror[2]
-d3_mir[2] = ez_tot_pm25_mir[3]/l_mirror[3]
-d3_mir[3] = ez_tot_pm25_mir[4]/l_mirror[4]
-d3_mir[4] = ez_tot_pm25_mir[5]/l_mirror[5]
-d3_mir[5] = 0      # no inputs into middle boxes from either emissions or background
-d3_mir[6] = 0
-d3_mir[7] = 0
-d3_mir[8] = 0
-d3_mir[9] = 0
-d3_mir[10] = (we2_mir[4,1] - beta(wa2_mir[4,1])*wa2_mir[4,1])*cB_pm25  # background inputs into top boxes
-d3_mir[11] = (we2_mir[4,2] - beta(wa2_mir[4,2])*wa2_mir[4,2])*cB_pm25  # negative for beta because if true, the sign of W[4,x] would be negative
-d3_mir[12] = (we2_mir[4,3] - beta(wa2_mir[4,3])*wa2_mir[4,3])*cB_pm25  # yet as here being treated as an input, it should be positive, hence signs cancel out
-d3_mir[13] = (we2_mir[4,4] - beta(wa2_mir[4,4])*wa2_mir[4,4])*cB_pm25
-d3_mir[14] = (we2_mir[4,5] - beta(wa2_mir[4,5])*wa2_mir[4,5])*cB_pm25
-
-
-# d4_mir = inputs for new conditions, PM2.5
-d4_mir = np.array([0,0,0,0,0,0,0,0,0,0,0,0,0,0,0], dtype = float)
-d4_mir[0] = ez_tot_pm25_mir[1]/l_mirror[1] # averaging line emission source over area of 'ground' = (ug/m2/s)
-d4_mir[1] = ez_tot_pm25_mir[2]/l_mirror[2]
-d4_mir[2] = ez_tot_pm25_mir[3]/l_mirror[3]
-d4_mir[3] = ez_tot_pm25_mir[4]/l_mirror[4]
-d4_mir[4] = ez_tot_pm25_mir[5]/l_mirror[5]
-d4_mir[5] = 0      # no inputs into middle boxes from either emissions or background
-d4_mir[6] = 0
-d4_mir[7] = 0
-d4_mir[8] = 0
-d4_mir[9] = 0
-d4_mir[10] = (we3_mir[4,1] - beta(wa3_mir[4,1])*wa3_mir[4,1])*cB_pm25  # background inputs into top boxes
-d4_mir[11] = (we3_mir[4,2] - beta(wa3_mir[4,2])*wa3_mir[4,2])*cB_pm25  # negative for beta because if true, the sign of W[4,x] would be negative
-d4_mir[12] = (we3_mir[4,3] - beta(wa3_mir[4,3])*wa3_mir[4,3])*cB_pm25  # yet as here being treated as an input, it should be positive, hence signs cancel out
-d4_mir[13] = (we3_mir[4,4] - beta(wa3_mir[4,4])*wa3_mir[4,4])*cB_pm25
-d4_mir[14] = (we3_mir[4,5] - beta(wa3_mir[4,5])*wa3_mir[4,5])*cB_pm25
-
-###############################################################################
-# d1_orig_par = inputs for existing conditions, NO2
-d1_orig_par = np.array([0,0,0,0,0,0,0,0,0,0,0,0,0,0,0], dtype = float)
-d1_orig_par[0] = ez_tot_no2_orig[1]/l_original[1] # averaging line emission source over area of 'ground' = (ug/m2/s)
-d1_orig_par[1] = ez_tot_no2_orig[2]/l_original[2]
-d1_orig_par[2] = ez_tot_no2_orig[3]/l_original[3]
-d1_orig_par[3] = ez_tot_no2_orig[4]/l_original[4]
-d1_orig_par[4] = ez_tot_no2_orig[5]/l_original[5]
-d1_orig_par[5] = 0      # no inputs into middle boxes from either emissions or background
-d1_orig_par[6] = 0
-d1_orig_par[7] = 0
-d1_orig_par[8] = 0
-d1_orig_par[9] = 0
-d1_orig_par[10] = (we1_par[4,1] - beta(wa1_par[4,1])*wa1_par[4,1])*cB_no2  # background inputs into top boxes
-d1_orig_par[11] = (we1_par[4,2] - beta(wa1_par[4,2])*wa1_par[4,2])*cB_no2  # negative for beta because if true, the sign of W[4,x] would be negative
-d1_orig_par[12] = (we1_par[4,3] - beta(wa1_par[4,3])*wa1_par[4,3])*cB_no2  # yet as here being treated as an input, it should be positive, hence signs cancel out
-d1_orig_par[13] = (we1_par[4,4] - beta(wa1_par[4,4])*wa1_par[4,4])*cB_no2
-d1_orig_par[14] = (we1_par[4,5] - beta(wa1_par[4,5])*wa1_par[4,5])*cB_no2
-
-
-# d2_orig_par = inputs for new conditions, NO2
-d2_orig_par = np.array([0,0,0,0,0,0,0,0,0,0,0,0,0,0,0], dtype = float)
-d2_orig_par[0] = ez_tot_no2_orig[1]/l_original[1] # averaging line emission source over area of 'ground' = (ug/m2/s)
-d2_orig_par[1] = ez_tot_no2_orig[2]/l_original[2]
-d2_orig_par[2] = ez_tot_no2_orig[3]/l_original[3]
-d2_orig_par[3] = ez_tot_no2_orig[4]/l_original[4]
-d2_orig_par[4] = ez_tot_no2_orig[5]/l_original[5]
-d2_orig_par[5] = 0      # no inputs into middle boxes from either emissions or background
-d2_orig_par[6] = 0
-d2_orig_par[7] = 0
-d2_orig_par[8] = 0
-d2_orig_par[9] = 0
-d2_orig_par[10] = (we3_par[4,1] - beta(wa3_par[4,1])*wa3_par[4,1])*cB_no2  # background inputs into top boxes
-d2_orig_par[11] = (we3_par[4,2] - beta(wa3_par[4,2])*wa3_par[4,2])*cB_no2  # negative for beta because if true, the sign of W[4,x] would be negative
-d2_orig_par[12] = (we3_par[4,3] - beta(wa3_par[4,3])*wa3_par[4,3])*cB_no2  # yet as here being treated as an input, it should be positive, hence signs cancel out
-d2_orig_par[13] = (we3_par[4,4] - beta(wa3_par[4,4])*wa3_par[4,4])*cB_no2
-d2_orig_par[14] = (we3_par[4,5] - beta(wa3_par[4,5])*wa3_par[4,5])*cB_no2
-
-
-# d3_orig_par = inputs for existing conditions, PM2.5
-d3_orig_par = np.array([0,0,0,0,0,0,0,0,0,0,0,0,0,0,0], dtype = float)
-d3_orig_par[0] = ez_tot_pm25_orig[1]/l_original[1] # averaging line emission source over area of 'ground' = (ug/m2/s)
-d3_orig_par[1] = ez_tot_pm25_orig[2]/l_original[2]
-d3_orig_par[2] = ez_tot_pm25_orig[3]/l_original[3]
-d3_orig_par[3] = ez_tot_pm25_orig[4]/l_original[4]
-d3_orig_par[4] = ez_tot_pm25_orig[5]/l_original[5]
-d3_orig_par[5] = 0      # no inputs into middle boxes from either emissions or background
-d3_orig_par[6] = 0
-d3_orig_par[7] = 0
-d3_orig_par[8] = 0
-d3_orig_par[9] = 0
-d3_orig_par[10] = (we1_par[4,1] - beta(wa1_par[4,1])*wa1_par[4,1])*cB_pm25  # background inputs into top boxes
-d3_orig_par[11] = (we1_par[4,2] - beta(wa1_par[4,2])*wa1_par[4,2])*cB_pm25  # negative for beta because if true, the sign of W[4,x] would be negative
-d3_orig_par[12] = (we1_par[4,3] - beta(wa1_par[4,3])*wa1_par[4,3])*cB_pm25  # yet as here being treated as an input, it should be positive, hence signs cancel out
-d3_orig_par[13] = (we1_par[4,4] - beta(wa1_par[4,4])*wa1_par[4,4])*cB_pm25
-d3_orig_par[14] = (we1_par[4,5] - beta(wa1_par[4,5])*wa1_par[4,5])*cB_pm25
-
-
-# d4_orig_par = inputs for new conditions, PM2.5
-d4_orig_par = np.array([0,0,0,0,0,0,0,0,0,0,0,0,0,0,0], dtype = float)
-d4_orig_par[0] = ez_tot_pm25_orig[1]/l_original[1] # averaging line emission source over area of 'ground' = (ug/m2/s)
-d4_orig_par[1] = ez_tot_pm25_orig[2]/l_original[2]
-d4_orig_par[2] = ez_tot_pm25_orig[3]/l_original[3]
-d4_orig_par[3] = ez_tot_pm25_orig[4]/l_original[4]
-d4_orig_par[4] = ez_tot_pm25_orig[5]/l_original[5]
-d4_orig_par[5] = 0      # no inputs into middle boxes from either emissions or background
-d4_orig_par[6] = 0
-d4_orig_par[7] = 0
-d4_orig_par[8] = 0
-d4_orig_par[9] = 0
-d4_orig_par[10] = (we3_par[4,1] - beta(wa3_par[4,1])*wa3_par[4,1])*cB_pm25  # background inputs into top boxes
-d4_orig_par[11] = (we3_par[4,2] - beta(wa3_par[4,2])*wa3_par[4,2])*cB_pm25  # negative for beta because if true, the sign of W[4,x] would be negative
-d4_orig_par[12] = (we3_par[4,3] - beta(wa3_par[4,3])*wa3_par[4,3])*cB_pm25  # yet as here being treated as an input, it should be positive, hence signs cancel out
-d4_orig_par[13] = (we3_par[4,4] - beta(wa3_par[4,4])*wa3_par[4,4])*cB_pm25
-d4_orig_par[14] = (we3_par[4,5] - beta(wa3_par[4,5])*wa3_par[4,5])*cB_pm25
-
-# d1_mir_par = inputs for existing conditions, NO2
-d1_mir_par = np.array([0,0,0,0,0,0,0,0,0,0,0,0,0,0,0], dtype = float)
-d1_mir_par[0] = ez_tot_no2_mir[1]/l_mirror[1] # averaging line emission source over area of 'ground' = (ug/m2/s)
-d1_mir_par[1] = ez_tot_no2_mir[2]/l_mirror[2]
-d1_mir_par[2] = ez_tot_no2_mir[3]/l_mirror[3]
-d1_mir_par[3] = ez_tot_no2_mir[4]/l_mirror[4]
-d1_mir_par[4] = ez_tot_no2_mir[5]/l_mirror[5]
-d1_mir_par[5] = 0      # no inputs into middle boxes from either emissions or background
-d1_mir_par[6] = 0
-d1_mir_par[7] = 0
-d1_mir_par[8] = 0
-d1_mir_par[9] = 0
-d1_mir_par[10] = (we2_par[4,1] - beta(wa2_par[4,1])*wa2_par[4,1])*cB_no2  # background inputs into top boxes
-d1_mir_par[11] = (we2_par[4,2] - beta(wa2_par[4,2])*wa2_par[4,2])*cB_no2  # negative for beta because if true, the sign of W[4,x] would be negative
-d1_mir_par[12] = (we2_par[4,3] - beta(wa2_par[4,3])*wa2_par[4,3])*cB_no2  # yet as here being treated as an input, it should be positive, hence signs cancel out
-d1_mir_par[13] = (we2_par[4,4] - beta(wa2_par[4,4])*wa2_par[4,4])*cB_no2
-d1_mir_par[14] = (we2_par[4,5] - beta(wa2_par[4,5])*wa2_par[4,5])*cB_no2
-
-
-# d2_mir_par = inputs for new conditions, NO2
-d2_mir_par = np.array([0,0,0,0,0,0,0,0,0,0,0,0,0,0,0], dtype = float)
-d2_mir_par[0] = ez_tot_no2_mir[1]/l_mirror[1] # averaging line emission source over area of 'ground' = (ug/m2/s)
-d2_mir_par[1] = ez_tot_no2_mir[2]/l_mirror[2]
-d2_mir_par[2] = ez_tot_no2_mir[3]/l_mirror[3]
-d2_mir_par[3] = ez_tot_no2_mir[4]/l_mirror[4]
-d2_mir_par[4] = ez_tot_no2_mir[5]/l_mirror[5]
-d2_mir_par[5] = 0      # no inputs into middle boxes from either emissions or background
-d2_mir_par[6] = 0
-d2_mir_par[7] = 0
-d2_mir_par[8] = 0
-d2_mir_par[9] = 0
-d2_mir_par[10] = (we4_par[4,1] - beta(wa4_par[4,1])*wa4_par[4,1])*cB_no2  # background inputs into top boxes
-d2_mir_par[11] = (we4_par[4,2] - beta(wa4_par[4,2])*wa4_par[4,2])*cB_no2  # negative for beta because if true, the sign of W[4,x] would be negative
-d2_mir_par[12] = (we4_par[4,3] - beta(wa4_par[4,3])*wa4_par[4,3])*cB_no2  # yet as here being treated as an input, it should be positive, hence signs cancel out
-d2_mir_par[13] = (we4_par[4,4] - beta(wa4_par[4,4])*wa4_par[4,4])*cB_no2
-d2_mir_par[14] = (we4_par[4,5] - beta(wa4_par[4,5])*wa4_par[4,5])*cB_no2
-
-
-# d3_mir_par = inputs for existing conditions, PM2.5
-d3_mir_par = np.array([0,0,0,0,0,0,0,0,0,0,0,0,0,0,0], dtype = float)
-d3_mir_par[0] = ez_tot_pm25_mir[1]/l_mirror[1] # averaging line emission source over area of 'ground' = (ug/m2/s)
-d3_mir_par[1] = ez_tot_pm25_mir[2]/l_mirror[2]
-d3_mir_par[2] = ez_tot_pm25_mir[3]/l_mirror[3]
-d3_mir_par[3] = ez_tot_pm25_mir[4]/l_mirror[4]
-d3_mir_par[4] = ez_tot_pm25_mir[5]/l_mirror[5]
-d3_mir_par[5] = 0      # no inputs into middle boxes from either emissions or background
-d3_mir_par[6] = 0
-d3_mir_par[7] = 0
-d3_mir_par[8] = 0
-d3_mir_par[9] = 0
-d3_mir_par[10] = (we2_par[4,1] - beta(wa2_par[4,1])*wa2_par[4,1])*cB_pm25  # background inputs into top boxes
-d3_mir_par[11] = (we2_par[4,2] - beta(wa2_par[4,2])*wa2_par[4,2])*cB_pm25  # negative for beta because if true, the sign of W[4,x] would be negative
-d3_mir_par[12] = (we2_par[4,3] - beta(wa2_par[4,3])*wa2_par[4,3])*cB_pm25  # yet as here being treated as an input, it should be positive, hence signs cancel out
-d3_mir_par[13] = (we2_par[4,4] - beta(wa2_par[4,4])*wa2_par[4,4])*cB_pm25
-d3_mir_par[14] = (we2_par[4,5] - beta(wa2_par[4,5])*wa2_par[4,5])*cB_pm25
-
-
-# d4_mir_par = inputs for new conditions, PM2.5
-d4_mir_par = np.array([0,0,0,0,0,0,0,0,0,0,0,0,0,0,0], dtype = float)
-d4_mir_par[0] = ez_tot_pm25_mir[1]/l_mirror[1] # averaging line emission source over area of 'ground' = (ug/m2/s)
-d4_mir_par[1] = ez_tot_pm25_mir[2]/l_mirror[2]
-d4_mir_par[2] = ez_tot_pm25_mir[3]/l_mirror[3]
-d4_mir_par[3] = ez_tot_pm25_mir[4]/l_mirror[4]
-d4_mir_par[4] = ez_tot_pm25_mir[5]/l_mirror[5]
-d4_mir_par[5] = 0      # no inputs into middle boxes from either emissions or background
-d4_mir_par[6] = 0
-d4_mir_par[7] = 0
-d4_mir_par[8] = 0
-d4_mir_par[9] = 0
-d4_mir_par[10] = (we4_par[4,1] - beta(wa4_par[4,1])*wa4_par[4,1])*cB_pm25  # background inputs into top boxes
-d4_mir_par[11] = (we4_par[4,2] - beta(wa4_par[4,2])*wa4_par[4,2])*cB_pm25  # negative for beta because if true, the sign of W[4,x] would be negative
-d4_mir_par[12] = (we4_par[4,3] - beta(wa4_par[4,3])*wa4_par[4,3])*cB_pm25  # yet as here being treated as an input, it should be positive, hence signs cancel out
-d4_mir_par[13] = (we4_par[4,4] - beta(wa4_par[4,4])*wa4_par[4,4])*cB_pm25
-d4_mir_par[14] = (we4_par[4,5] - beta(wa4_par[4,5])*wa4_par[4,5])*cB_pm25
+# each system: A matrix, NO2 and PM2.5 right-hand sides, the dimensioning it
+# uses (wind left to right "orig" or right to left "mir") and its flow pattern
+# (horizontal dispersion/advection, vertical dispersion/advection)
+system_cases = [
+    # wind left to right, before/after new barrier
+    ("a1_orig", "d1_orig", "d3_orig", "orig", ("ue2_orig", "ua2_orig", "we2_orig", "wa2_orig")),
+    ("a2_orig", "d2_orig", "d4_orig", "orig", ("ue3_orig", "ua3_orig", "we3_orig", "wa3_orig")),
+    # wind right to left, before/after new barrier
+    ("a1_mir", "d1_mir", "d3_mir", "mir", ("ue2_mir", "ua2_mir", "we2_mir", "wa2_mir")),
+    ("a2_mir", "d2_mir", "d4_mir", "mir", ("ue3_mir", "ua3_mir", "we3_mir", "wa3_mir")),
+    # parallel wind, dimensioning left to right, before/after new barrier
+    ("a1_par_1", "d1_orig_par", "d3_orig_par", "orig", ("ue1_par", "ua1_par", "we1_par", "wa1_par")),
+    ("a2_par_1", "d2_orig_par", "d4_orig_par", "orig", ("ue3_par", "ua3_par", "we3_par", "wa3_par")),
+    # parallel wind, dimensioning right to left, before/after new barrier
+    ("a1_par_2", "d1_mir_par", "d3_mir_par", "mir", ("ue2_par", "ua2_par", "we2_par", "wa2_par")),
+    ("a2_par_2", "d2_mir_par", "d4_mir_par", "mir", ("ue4_par", "ua4_par", "we4_par", "wa4_par")),
+]
+
+# dimensions and flows of all 8 systems of a street stacked in system_cases
+# order: h, l, then u, U, w, W
+def system_geometry(state):
+    dims = {"orig": (state["h_original"], state["l_original"]),
+            "mir": (state["h_mirror"], state["l_mirror"])}
+    
+    h, l = (np.stack(x) for x in zip(*[dims[case[3]] for case in system_cases]))
+    u, U, w, W = (np.stack([state[name] for name in x]) for x in zip(*[case[4] for case in system_cases]))
+    
+    return h, l, u, U, w, W
+
+# NO2 and PM2.5 emissions of all 8 systems, stacked the same way
+def system_emissions(state):
+    emissions = {"orig": (state["ez_tot_no2_orig"], state["ez_tot_pm25_orig"]),
+                 "mir": (state["ez_tot_no2_mir"], state["ez_tot_pm25_mir"])}
+    
+    ez_no2, ez_pm25 = (np.stack(x) for x in zip(*[emissions[case[3]] for case in system_cases]))
+    
+    return ez_no2, ez_pm25
+
+def assemble_systems(state, banded=False):
+    # stack all 8 systems and build them together (the A matrices in diagonal
+    # ordered form if banded, see a_bands)
+    h, l, u, U, w, W = system_geometry(state)
+    ez_no2, ez_pm25 = system_emissions(state)
+    
+    assemble = a_bands if banded else a_matrix
+    a = assemble(r = ratios(h = h, l = l), u = u, U = U, w = w, W = W)
+    d_no2 = d_vector(ez = ez_no2, l = l, w = w, W = W, cB = state["cB_no2"])
+    d_pm25 = d_vector(ez = ez_pm25, l = l, w = w, W = W, cB = state["cB_pm25"])
+    
+    systems = {}
+    for k, (a_name, no2_name, pm25_name, _, _) in enumerate(system_cases):
+        systems[a_name] = a[k]
+        systems[no2_name] = d_no2[k]
+        systems[pm25_name] = d_pm25[k]
+    
+    return systems
+
+
+# ___________ Source-receptor responses ___________
+
+# for a fixed street geometry and flow field the concentrations are linear in 
+# the emissions and the background, so each system can be solved once for 
+# unit inputs: concentrations = response @ [ez[1..5], cB], the response being
+# 15x6 (A^-1 times its source_matrix). Any traffic, fleet or background is 
+# then just a matrix-vector product
+def response_matrices(state):
+    h, l, u, U, w, W = system_geometry(state)
+    a = a_matrix(r = ratios(h = h, l = l), u = u, U = U, w = w, W = W)
+    
+    responses = solve_stacked(a, source_matrix(l = l, w = w, W = W))
+    
+    return {case[0]: responses[k] for k, case in enumerate(system_cases)}
+
+# concentrations of all 8 systems (as solve_systems gives them) from the 
+# response matrices, for the emissions and backgrounds in state; pass a copy
+# of the state with other ez_tot_* or cB_* values to try other assumptions
+def response_concs(state, responses):
+    ez_no2, ez_pm25 = system_emissions(state)
+    names = dict(solver_systems)
+    
+    concs = {}
+    for k, (a_name, _, _, _, _) in enumerate(system_cases):
+        (_, no2_name), (_, pm25_name) = names[a_name]
+        concs[no2_name] = responses[a_name] @ np.append(ez_no2[k,1:], state["cB_no2"])
+        concs[pm25_name] = responses[a_name] @ np.append(ez_pm25[k,1:], state["cB_pm25"])
+    
+    return concs
+
+
+# ___________ Unit wind speed responses ___________
+
+# every velocity in the flow patterns (ws_point, ws_average, Ur/Ut/Uh, the 0.1
+# dispersion ratios, the parallel profiles) is proportional to the background
+# wind speed, so each A matrix is ubg times the one at 1 m/s, and so is the 
+# background input through the roof. The emission part of the concentrations 
+# therefore goes as 1/ubg and the background part does not change with it:
+# the responses at unit speed, worked out once per street layout, give the
+# concentrations for any ubg_orig/ubg_mir/ubg_parallel
+
+# street layout entries the flow patterns are worked out from (besides ubg):
+# arrays, then the barrier descriptions and other plain values
+layout_arrays = ["row_original", "row_mirror", "h_original", "h_mirror", "h_cumu_original", "h_cumu_mirror",
+                 "l_original", "l_mirror", "l_cumu_original", "l_cumu_mirror", "rec_original", "rec_mirror",
+                 "zone_original", "zone_mirror", "bar_original", "bar_mirror", "check_original", "check_mirror"]
+layout_values = ["roadw", "gi", "gi_loc", "eb_up", "eb_down"]
+
+# background wind speed each system's flows are worked out for
+system_speeds = {"a1_orig": "ubg_orig", "a2_orig": "ubg_orig", "a1_mir": "ubg_mir", "a2_mir": "ubg_mir",
+                 "a1_par_1": "ubg_parallel", "a2_par_1": "ubg_parallel",
+                 "a1_par_2": "ubg_parallel", "a2_par_2": "ubg_parallel"}
+
+@lru_cache(maxsize = 256)
+def layout_responses(layout):
+    # response matrices at 1 m/s for a street layout given as JSON (so it can
+    # be cached): the layout_arrays as lists, then the layout_values
+    arrays, values = json.loads(layout)
+    state = {k: np.array(v) for k, v in zip(layout_arrays, arrays)}
+    state.update(zip(layout_values, values))
+    state.update(ubg_orig = 1.0, ubg_mir = 1.0, ubg_parallel = 1.0)
+    state.update(flow_patterns(state))
+    state.update(parallel_patterns(state))
+    
+    return response_matrices(state)
+
+# response matrices of a street (from prepare_street) at 1 m/s, cached per
+# street layout, so the same street at other met stations or wind speeds 
+# does not need solving again
+def unit_speed_responses(state):
+    layout = json.dumps([[state[k].tolist() for k in layout_arrays], [state[k] for k in layout_values]])
+    
+    return layout_responses(layout)
+
+# unit speed responses rescaled for the wind speeds in state: emission columns
+# divided by ubg, background column as it is
+def scale_responses(responses, state):
+    scaled = {}
+    for a_name, response in responses.items():
+        ubg = state[system_speeds[a_name]]
+        scaled[a_name] = np.column_stack((response[:,:-1]/ubg, response[:,-1]))
+    
+    return scaled
+
+# concentrations of all 8 systems (as solve_systems gives them) from the 
+# cached unit speed responses
+def unit_speed_concs(state):
+    return response_concs(state, scale_responses(unit_speed_responses(state), state))
+
+# consistency check: largest difference between the rescaled and the directly
+# solved concentrations, relative to the largest concentration of each system
+def unit_speed_check(state):
+    direct = solve_systems(state)
+    scaled = unit_speed_concs(state)
+    
+    return max(np.max(np.abs(scaled[k] - direct[k]))/np.max(np.abs(direct[k])) for k in direct)
 
 ###############################################################################
 # CALCULATE & SEND DATA BACK
@@ -4270,7 +4060,7 @@ d4_mir_par[14] = (we4_par[4,5] - beta(wa4_par[4,5])*wa4_par[4,5])*cB_pm25
 # otherwise, calculate the percentage change
 
 empty_array = np.empty((3,5))
-empty_array[:] = np.NaN
+empty_array[:] = np.nan
 empty_array = empty_array.tolist()
 
 #______________ define function to reverse mirror _____________________________
@@ -4404,77 +4194,81 @@ def weighting_concs(l_cumu_LR, l_cumu_RL, C_LR, C_LR_par, C_RL, C_RL_par, LR_fre
 #______________________________________________________________________________
 
 
-if error[0,0] == 1:
-    print("Row dimensioning error: generic")
-    print(empty_array)
-elif error[0,1] == 1:
-    print("Row dimensioning error 1: no buildings present")
-    print(empty_array)
-elif error[0,2] == 1:
-    print("Row dimensioning error 2: only 1 building present")
-    print(empty_array)
-elif error[0,3] == 1:
-    print("Row dimensioning error 3: green infrastructure proposed is the same height or taller than at least one building")
-    print(empty_array)
-elif error[0,4] == 1:
-    print("Row dimensioning error 4: existing barrier is the same height or taller than at least one building")
-    print(empty_array)
-elif error[1,1] == 1:
-    print("Column dimensioning error 1.1: column 2 further than far edge of emission zone")
-    print(empty_array)
-elif error[1,2] == 1:
-    print("Column dimensioning error 1.2: column 4 extends further than downwind building")
-    print(empty_array)
-elif error[2,1] == 1:
-    print("Column dimensioning error 2.1: column 2 extends beyond far edge of emission zone")
-    print(empty_array)
-elif error[2,2] == 1:
-    print("Column dimensioning error 2.2: column 4 extends beyond downwind building")
-    print(empty_array)
-elif error[3,1] == 1:
-    print("Column dimensioning error 3.1: upwind existing barrier recirculation extends beyond far limit of emission zone")
-    print(empty_array)
-elif error[3,2] == 1:
-    print("Column dimensioning error 3.2: upwind new barrier recirculation extends beyond far limit of emission zone")
-    print(empty_array)
-elif error[3,3] == 1:
-    print("Column dimensioning error 3.3: upwind new barrier recirculation extends beyond far limit of emission zone")
-    print(empty_array)
-elif error[3,4] == 1:
-    print("Column dimensioning error 3.4: column 4 extends beyond downwind building")
-    print(empty_array)
-elif error[4,1] == 1:
-    print("Column dimensioning error 4.1: existing barrier upwind is taller than upwind building")
-    print(empty_array)
-elif error[4,2] == 1:
-    print("Column dimensioning error 4.2: new barrier upwind taller than upwind building")
-    print(empty_array)
-elif error[5,1] == 1:
-    print("Column dimensioning error 5.1: existing barrier upwind taller than upwind building")
-    print(empty_array)
-elif error[5,2] == 1:
-    print("Column dimensioning error 5.2: new barrier upwind is taller than upwind building")
-    print(empty_array)
-elif error[7,1] == 1:
-    print("Column dimensioning error: 7.1: total column widths do not equal road width (wind left to right)")
-    print(empty_array)
-elif error[7,2] == 1:
-    print("Column dimensioning error: 7.2: total column widths do not equal road width  (wind right to left)")
-    print(empty_array)
-elif error[8,1] == 1:
-    print("Emissions error 1: partitioned emissions do not equal total emissions")
-    print(empty_array)
-else:
+def error_message(error):
+    message = None
+    
+    if error[0,0] == 1:
+        message = "Row dimensioning error: generic"
+    elif error[0,1] == 1:
+        message = "Row dimensioning error 1: no buildings present"
+    elif error[0,2] == 1:
+        message = "Row dimensioning error 2: only 1 building present"
+    elif error[0,3] == 1:
+        message = "Row dimensioning error 3: green infrastructure proposed is the same height or taller than at least one building"
+    elif error[0,4] == 1:
+        message = "Row dimensioning error 4: existing barrier is the same height or taller than at least one building"
+    elif error[1,1] == 1:
+        message = "Column dimensioning error 1.1: column 2 further than far edge of emission zone"
+    elif error[1,2] == 1:
+        message = "Column dimensioning error 1.2: column 4 extends further than downwind building"
+    elif error[2,1] == 1:
+        message = "Column dimensioning error 2.1: column 2 extends beyond far edge of emission zone"
+    elif error[2,2] == 1:
+        message = "Column dimensioning error 2.2: column 4 extends beyond downwind building"
+    elif error[3,1] == 1:
+        message = "Column dimensioning error 3.1: upwind existing barrier recirculation extends beyond far limit of emission zone"
+    elif error[3,2] == 1:
+        message = "Column dimensioning error 3.2: upwind new barrier recirculation extends beyond far limit of emission zone"
+    elif error[3,3] == 1:
+        message = "Column dimensioning error 3.3: upwind new barrier recirculation extends beyond far limit of emission zone"
+    elif error[3,4] == 1:
+        message = "Column dimensioning error 3.4: column 4 extends beyond downwind building"
+    elif error[4,1] == 1:
+        message = "Column dimensioning error 4.1: existing barrier upwind is taller than upwind building"
+    elif error[4,2] == 1:
+        message = "Column dimensioning error 4.2: new barrier upwind taller than upwind building"
+    elif error[5,1] == 1:
+        message = "Column dimensioning error 5.1: existing barrier upwind taller than upwind building"
+    elif error[5,2] == 1:
+        message = "Column dimensioning error 5.2: new barrier upwind is taller than upwind building"
+    elif error[7,1] == 1:
+        message = "Column dimensioning error: 7.1: total column widths do not equal road width (wind left to right)"
+    elif error[7,2] == 1:
+        message = "Column dimensioning error: 7.2: total column widths do not equal road width  (wind right to left)"
+    elif error[8,1] == 1:
+        message = "Emissions error 1: partitioned emissions do not equal total emissions"
+    
+    return message
+
+def solve_street(state, extra_rhs=None, concs=None, solver="dense"):
+    l_cumu_original = state["l_cumu_original"]
+    l_mirror = state["l_mirror"]
+    l_cumu_mirror = state["l_cumu_mirror"]
+    h_cumu_original_list = state["h_cumu_original_list"]
+    LR_freq = state["LR_freq"]
+    RL_freq = state["RL_freq"]
+    LR_par_freq = state["LR_par_freq"]
+    RL_par_freq = state["RL_par_freq"]
+
     # if there are no errors, solve for existing and new conditions
+    # (all 8 systems in one stacked call, NO2 and PM2.5 together) - unless
+    # they have already been solved together with those of other streets
+    if concs is None and solver == "unit_speed":
+        if extra_rhs is not None:
+            raise ValueError("extra_rhs cannot be solved with the unit_speed solver")
+        concs = unit_speed_concs(state)
+    elif concs is None:
+        concs = solve_systems(state, extra_rhs = extra_rhs, solver = solver)
+    
     # _________________________________________________________________________
     # WIND: LEFT TO RIGHT
     # NO2
-    C1_orig = solve(a1_orig, d1_orig)
-    C2_orig = solve(a2_orig, d2_orig)
+    C1_orig = concs["C1_orig"]
+    C2_orig = concs["C2_orig"]
     
     # PM2.5
-    C3_orig = solve(a1_orig, d3_orig)
-    C4_orig = solve(a2_orig, d4_orig)
+    C3_orig = concs["C3_orig"]
+    C4_orig = concs["C4_orig"]
     
     # calculate the percentage changes in concentrations before and after
     # NO2
@@ -4488,12 +4282,12 @@ else:
     # _________________________________________________________________________
     # WIND: RIGHT TO LEFT
     # NO2
-    C1_mir = solve(a1_mir, d1_mir)
-    C2_mir = solve(a2_mir, d2_mir)
+    C1_mir = concs["C1_mir"]
+    C2_mir = concs["C2_mir"]
     
     # PM2.5
-    C3_mir = solve(a1_mir, d3_mir)
-    C4_mir = solve(a2_mir, d4_mir)
+    C3_mir = concs["C3_mir"]
+    C4_mir = concs["C4_mir"]
     
     # calculate the percentage changes in concentrations before and after
     # NO2
@@ -4505,7 +4299,8 @@ else:
     # flip back so each box corresponds to the same space in the street
     per_change_no2_mir_flipped = flip_conc(C=per_change_no2_mir)
     per_change_pm25_mir_flipped = flip_conc(C=per_change_pm25_mir)
-    l_cumu_flipped = flip_column(l=l_mirror, l_cumu=l_cumu_mirror)
+    # (on a copy: flip_column works in place, and the street state is reused)
+    l_cumu_flipped = flip_column(l=l_mirror, l_cumu=l_cumu_mirror.copy())
     
     #print("NO2 % Change (wind R->L)", per_change_no2_mir_flipped, sep = "\n")
     #print("PM 2.5 % Change (wind R->L)",per_change_pm25_mir_flipped, sep = '\n')
@@ -4514,12 +4309,12 @@ else:
     # WIND: PARALLEL
     # NO2
     # dimensioning from left to right
-    C1_par_1 = solve(a1_par_1, d1_orig_par)
-    C2_par_1 = solve(a2_par_1, d2_orig_par)
+    C1_par_1 = concs["C1_par_1"]
+    C2_par_1 = concs["C2_par_1"]
     
     # dimensioning from right to left
-    C1_par_2 = solve(a1_par_2, d1_mir_par)
-    C2_par_2 = solve(a2_par_2, d2_mir_par)
+    C1_par_2 = concs["C1_par_2"]
+    C2_par_2 = concs["C2_par_2"]
     
     # % change of NO2 based on dispersion only (parallel wind) with dimensioning from wind left-to-right
     per_change_no2_par_1 = ((C2_par_1 - C1_par_1)/C1_par_1)*100
@@ -4528,12 +4323,12 @@ else:
     
     # PM2.5
     # dimensioning from left to right
-    C3_par_1 = solve(a1_par_1, d3_orig_par)
-    C4_par_1 = solve(a2_par_1, d4_orig_par)
+    C3_par_1 = concs["C3_par_1"]
+    C4_par_1 = concs["C4_par_1"]
     
     # dimensioning from right to left
-    C3_par_2 = solve(a1_par_2, d3_mir_par)
-    C4_par_2 = solve(a2_par_2, d4_mir_par)
+    C3_par_2 = concs["C3_par_2"]
+    C4_par_2 = concs["C4_par_2"]
     
     # % change of PM2.5 based on dispersion only (parallel wind) with dimensioning from wind left-to-right
     per_change_pm25_par_1 = ((C4_par_1 - C3_par_1)/C3_par_1)*100
@@ -4611,10 +4406,232 @@ else:
     street["per_change_no2"] = per_change_no2.tolist()
     street["per_change_pm25"] = per_change_pm25.tolist()
     
-    # send data back
-    json_data = json.dumps(street)
-    print(json_data, sep = '\n')
+    # solutions for any extra right-hand sides passed in
+    if "extra" in concs:
+        street["extra"] = {k: v.tolist() for k, v in concs["extra"].items()}
+    
+    return street
+
+
+###############################################################################
+# STREET CALCULATION
+###############################################################################
+
+def prepare_street(content, gi_loc=None, banded=False):
+    """Everything up to (not including) solving the systems of equations.
+    
+    Returns (state, message): the street state holding the A matrices and
+    right-hand sides, and the error message if the street layout fails one
+    of the checks (None otherwise, state is then incomplete). gi_loc
+    optionally moves the new barrier (see street_geometry). If banded, the
+    A matrices are assembled straight into diagonal ordered form (see
+    a_bands); such a state can only be solved with the banded solver.
+    """
+    
+    # set container for error flags - this will be checked before final calculations
+    error = np.zeros((10,10))
+    
+    # extract the "objects" field and convert to a list of dictionaries
+    objects = json.loads(content["objects"])
+    
+    state = {}
     
+    # background pollution concentrations
+    state["cB_no2"] = content["no2_bg_concentration"] # UNIT: ug/m3 
+    state["cB_pm25"] = content["pm2p5_bg_concentration"] # UNIT: ug/m3 
+    
+    # climatological wind characteristics at the closest met station
+    station_id = select_station(content)
+    street_dir = street_direction(content["wind"])
+    state.update(station_climatology(station_id, street_dir))
+    
+    # street layout, dimensions and emissions
+    state.update(street_geometry(objects, gi_loc))
+    state.update(street_dimensioning(state, error))
+    state.update(street_emissions(objects, state, error))
+    
+    # validation: all the error flags are set by now, so stop before the flow
+    # patterns and the systems of equations are worked out for a bad layout
+    message = error_message(error)
+    if message is not None:
+        return state, message
+    
+    # flow patterns and the systems of equations
+    state.update(flow_patterns(state))
+    state.update(parallel_patterns(state))
+    state.update(assemble_systems(state, banded = banded))
+    
+    return state, None
+
+def compute_street(content, extra_rhs=None, solver="dense"):
+    """Run the full street calculation for one scenario.
+
+    content is the decoded scenario from the user interface (lat, lng, wind,
+    objects, no2_bg_concentration, pm2p5_bg_concentration). Returns the
+    street dictionary ("columns", "rows", "per_change_no2", "per_change_pm25")
+    or {"error": message} when the street layout fails one of the checks.
+
+    extra_rhs optionally maps A matrix names (a1_orig, a2_orig, ... see
+    air_quality_solver.systems) to further right-hand sides to solve with the
+    same matrices; their solutions are added to the street as "extra".
+
+    solver is "dense" (the reference), "banded" or "update" (see
+    air_quality_solver), or "unit_speed" (the cached unit wind speed responses
+    rescaled, see unit_speed_concs; not with extra_rhs).
+    """
+    
+    state, message = prepare_street(content, banded = solver == "banded")
+    if message is not None:
+        return {"error": message}
+    
+    return solve_street(state, extra_rhs = extra_rhs, solver = solver)
+
+
+
+###############################################################################
+# RUN FROM THE COMMAND LINE
+###############################################################################
+
+def exception_error(e):
+    # an exception raised by the calculation, reported like a layout error
+    # (plus the name of the exception)
+    return {"error": "%s: %s" % (type(e).__name__, e), "exception": type(e).__name__}
+
+def run_scenario(content):
+    """compute_street, with any exception reported as {"error": message} too.
+    
+    Used by the long-running entry points (worker, server, batch) so that one
+    bad scenario does not take the whole process down.
+    """
+    
+    try:
+        return compute_street(content)
+    except Exception as e:
+        return exception_error(e)
+
+def run_solve_street(state, concs=None):
+    # solve_street with exceptions reported as in run_scenario
+    try:
+        return solve_street(state, concs = concs)
+    except Exception as e:
+        return exception_error(e)
+
+def run_scenarios(contents):
+    """run_scenario for many scenarios, solving all their systems in one stacked call.
+    
+    Returns one street dictionary (or {"error": message}) per scenario, in
+    order.
+    """
+    
+    streets = [None]*len(contents)
+    prepared = []
+    for i, content in enumerate(contents):
+        try:
+            state, message = prepare_street(content)
+        except Exception as e:
+            streets[i] = exception_error(e)
+            continue
+        if message is not None:
+            streets[i] = {"error": message}
+        else:
+            prepared.append((i, state))
+    
+    if not prepared:
+        return streets
+    
+    try:
+        all_concs = solve_systems_many([state for _, state in prepared])
+    except ValueError:
+        # a singular matrix (LinAlgError) or one with infs or NaNs fails the
+        # whole stack, so solve street by street
+        all_concs = [None]*len(prepared)
+    
+    for (i, state), concs in zip(prepared, all_concs):
+        streets[i] = run_solve_street(state, concs)
+    
+    return streets
+
+def run_worker(stdin, stdout):
+    """Long-running worker: one scenario JSON per line in, one result per line out.
+    
+    The process (imports, cached met data) stays warm between scenarios. Each
+    input line gets exactly one output line, in the same order: the street
+    dictionary, or {"error": message} if the layout fails a check or the
+    calculation raises.
+    """
+    
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        
+        try:
+            content = json.loads(line)
+        except ValueError as e:
+            street = {"error": "Invalid scenario JSON: %s" % e}
+        else:
+            street = run_scenario(content)
+        
+        stdout.write(json.dumps(street) + "\n")
+        stdout.flush()
+
+def main(argv):
+    
+    parser = argparse.ArgumentParser(description="GI4RAQ air quality code for one street.")
+    parser.add_argument("scenario", nargs="?", help="base64 encoded scenario from the user interface")
+    parser.add_argument("--worker", action="store_true",
+                        help="keep running, reading one scenario JSON per line on stdin")
+    parser.add_argument("--met-store", default=None,
+                        help="local met store file (see air_quality_met.py) instead of downloading the met data")
+    parser.add_argument("--10-point-ws-average", dest="ten_point", action="store_true",
+                        help="average the wind speed over each row from 10 points, as the original code")
+    args = parser.parse_args(argv[1:])
+    
+    if args.met_store is not None:
+        use_met_store(args.met_store)
+    if args.ten_point:
+        use_10_point_ws_average()
+    
+    # ___________ persistent worker fed line by line on stdin ___________
+    if args.worker:
+        run_worker(sys.stdin, sys.stdout)
+        return
+    
+    if args.scenario is None:
+        parser.error("a scenario is needed unless running with --worker")
+    
+    # ___________ dynamic info from user interface ___________
+    #if using a dynamic base64 string (fed from the user interface) use line below 
+    content = json.loads(base64.b64decode(args.scenario).decode('utf8'))
+    
+    # ___________ static info for testing purposes ___________
+    # if using your own generated base64 string
+    # 1) comment out the line above
+    # 2) uncomment the base64_test line below and assign a string to it
+    # 3) uncomment the line after it (decode the string and store as content)
+    
+    #base64_test = "eyJpZCI6MzcwLCJwcm9qZWN0c19pZCI6OTcsImF1dGhvcl9pZCI6NDIsImxhdCI6IjUyLjQ2NyIsImxuZyI6Ii0xLjkyOCIsIm5hbWUiOiJUZXN0IHdpdGggSGVsZW4gMDgwMTIwMjEiLCJ0YWciOiJhbmFseXNpcy0xLTEtMSIsIndpbmQiOiJOIiwib2JqZWN0cyI6Ilt7XCJ0eXBlXCI6XCJidWlsZGluZ1wiLFwibmFtZVwiOlwiQkwxXCIsXCJvcmRlclwiOjAsXCJsb2NrZWRcIjp0cnVlLFwiaGVpZ2h0XCI6XCI4LjBcIixcIndpZHRoXCI6MixcInNpZGVcIjpcImxlZnRcIixcIndoZXJlXCI6XCJzdHJlZXR0b2VuZFwifSx7XCJ0eXBlXCI6XCJyZWNlcHRvcl96b25lXCIsXCJuYW1lXCI6XCJSWkJMMVwiLFwib3JkZXJcIjoxLFwibG9ja2VkXCI6dHJ1ZSxcImF0dGFjaGVkVG9CdWlsZGluZ1wiOnRydWUsXCJ3aWR0aFwiOlwiMlwiLFwic2lkZVwiOlwibGVmdFwiLFwid2hlcmVcIjpcInN0cmVldHRvZW5kXCIsXCJleGlzdGluZ19iYXJyaWVyXCI6W119LHtcInR5cGVcIjpcIm1hcmtlclwiLFwibmFtZVwiOlwiU3RyZWV0IEJvdW5kYXJ5IDFcIixcInN1YnR5cGVcIjpcImVkZ2VcIixcIm9yZGVyXCI6MixcImxvY2tlZFwiOnRydWUsXCJzaWRlXCI6XCJsZWZ0XCJ9LHtcInR5cGVcIjpcInJlY2VwdG9yX3pvbmVcIixcIm5hbWVcIjpcIlJaMVwiLFwib3JkZXJcIjoxLFwibG9ja2VkXCI6ZmFsc2UsXCJ3aWR0aFwiOlwiM1wiLFwic2lkZVwiOlwibGVmdFwiLFwid2hlcmVcIjpcInN0cmVldHRva2VyYlwiLFwiZ2k0cmFxX2JhcnJpZXJcIjpbXX0se1widHlwZVwiOlwibWFya2VyXCIsXCJuYW1lXCI6XCJLZXJiIDFcIixcInN1YnR5cGVcIjpcImtlcmJcIixcIm9yZGVyXCI6MixcImxvY2tlZFwiOmZhbHNlLFwic2lkZVwiOlwibGVmdFwifSx7XCJ0eXBlXCI6XCJlbWlzc2lvbnNfem9uZVwiLFwibmFtZVwiOlwiRVoxXCIsXCJvcmRlclwiOjMsXCJsb2NrZWRcIjpmYWxzZSxcIndpZHRoXCI6XCIxNlwiLFwiY3VycmVudF9leHBvc3VyZV9ubzJcIjpudWxsLFwiY3VycmVudF9leHBvc3VyZV9QTTJfNVwiOm51bGwsXCJ0cmFmZmljXCI6XCI2MDBcIixcInNpZGVcIjpcInJpZ2h0XCIsXCJoYXNFbWlzc2lvbnNcIjpmYWxzZSxcIndoZXJlXCI6XCJrZXJidG9rZXJiXCIsXCJOTzJcIjpudWxsLFwiUE0yNVwiOm51bGwsXCJ2bW92ZW1lbnRcIjpcIjYwMFwiLFwiY3VycmVudF9lbWlzc2lvbnNfUE0yXzVcIjpudWxsLFwiY3VycmVudF9lbWlzc2lvbnNfbm8yXCI6bnVsbH0se1widHlwZVwiOlwibWFya2VyXCIsXCJuYW1lXCI6XCJLZXJiIDJcIixcInN1YnR5cGVcIjpcImtlcmJcIixcIm9yZGVyXCI6MixcImxvY2tlZFwiOmZhbHNlLFwic2lkZVwiOlwicmlnaHRcIn0se1widHlwZVwiOlwicmVjZXB0b3Jfem9uZVwiLFwibmFtZVwiOlwiUloyXCIsXCJvcmRlclwiOjEsXCJsb2NrZWRcIjpmYWxzZSxcIndpZHRoXCI6XCI1XCIsXCJzaWRlXCI6XCJyaWdodFwiLFwid2hlcmVcIjpcInN0cmVldHRva2VyYlwiLFwiZ2k0cmFxX2JhcnJpZXJcIjpbe1wibmFtZVwiOlwiSGVkZ2VcIixcInR5cGVcIjpcImdyZWVuLWJhcnJpZXJcIixcIndoZXJlX2luX3pvbmVcIjpcIjBcIixcImhlaWdodFwiOlwiMlwiLFwid2lkdGhcIjpcIjFcIixcIm9ic3RcIjpcIjc1XCIsXCJzZWFzXCI6bnVsbCxcInNlYXNvbmFsaXR5XCI6XCJldmVyZ2VlblwiLFwiYWFwXCI6bnVsbCxcImFhbVwiOm51bGwsXCJlbGlmZVwiOm51bGwsXCJ0YWFwXCI6bnVsbCxcInRjdGhcIjpudWxsLFwidGNiaFwiOm51bGwsXCJ0Y3dcIjpudWxsLFwidGFhbVwiOm51bGwsXCJ0Zm9ybVwiOm51bGwsXCJ0c2Vhc1wiOm51bGwsXCJ0c3BlY2llc1wiOm51bGwsXCJ0ZWxpZmVcIjpudWxsLFwidHNwXCI6bnVsbCxcInRvYnN0XCI6bnVsbCxcIm9yZGVyXCI6MH1dfSx7XCJ0eXBlXCI6XCJtYXJrZXJcIixcIm5hbWVcIjpcIlN0cmVldCBCb3VuZGFyeSAyXCIsXCJzdWJ0eXBlXCI6XCJlZGdlXCIsXCJvcmRlclwiOjQsXCJsb2NrZWRcIjp0cnVlLFwic2lkZVwiOlwicmlnaHRcIn0se1widHlwZVwiOlwicmVjZXB0b3Jfem9uZVwiLFwibmFtZVwiOlwiUlpCTDJcIixcIm9yZGVyXCI6NSxcImxvY2tlZFwiOnRydWUsXCJhdHRhY2hlZFRvQnVpbGRpbmdcIjp0cnVlLFwid2lkdGhcIjpcIjFcIixcInNpZGVcIjpcInJpZ2h0XCIsXCJ3aGVyZVwiOlwic3RyZWV0dG9lbmRcIixcImV4aXN0aW5nX2JhcnJpZXJcIjpbXX0se1widHlwZVwiOlwiYnVpbGRpbmdcIixcIm5hbWVcIjpcIkJMMlwiLFwib3JkZXJcIjo2LFwibG9ja2VkXCI6dHJ1ZSxcImhlaWdodFwiOlwiMTAuMFwiLFwid2lkdGhcIjoyLFwic2lkZVwiOlwicmlnaHRcIixcIndoZXJlXCI6XCJzdHJlZXR0b2VuZFwifV0iLCJsb2NrZWQiOm51bGwsIlBNMjUiOjExLCJOTzIiOjE1LCJjcmVhdGVkX2F0IjoiMjAyMS0wMS0wOCAxMzo1MDo1MiIsInVwZGF0ZWRfYXQiOiIyMDIxLTAxLTExIDExOjU5OjU4IiwiZGVsZXRlZF9hdCI6bnVsbCwibm8yX2JnX2NvbmNlbnRyYXRpb24iOjE1LCJwbTJwNV9iZ19jb25jZW50cmF0aW9uIjoxMSwicHJvamVjdCI6eyJpZCI6OTcsImF1dGhvcl9pZCI6NDIsIm5hbWUiOiJUb3duLCBSb2FkIChuciBKdW5jdGlvbikiLCJ0YWciOiJ0b3duLXJvYWQtbnItanVuY3Rpb24iLCJjcmVhdGVkX2F0IjoiMjAyMC0xMC0yNyAxMjoyMDozNyIsInVwZGF0ZWRfYXQiOiIyMDIwLTEwLTI3IDEyOjIwOjM3IiwiZGVsZXRlZF9hdCI6bnVsbH19=="
+    
+    # decode the base 64 string into JSON format
+    #content = json.loads(base64.b64decode(base64_test))
+    
+    # display ALL the information from user interface (uncomment to see)
+    #print(json.dumps(content, indent = 4))
+    
+    street = compute_street(content)
+    
+    if "error" in street:
+        print(street["error"])
+        print(empty_array)
+    else:
+        # send data back
+        json_data = json.dumps(street)
+        print(json_data, sep = '\n')
+
+
+if __name__ == "__main__":
+    main(sys.argv)
+
 
 
 ###############################################################################
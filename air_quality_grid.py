@@ -0,0 +1,219 @@
+###############################################################################
+# FINER BOX GRIDS
+###############################################################################
+
+# The street model splits the canyon cross-section into 3 rows x 5 columns of
+# boxes. This engine subdivides those rows and columns (evenly, by any number
+# of parts each, so resolution can be added only where it is needed, e.g. the
+# footway at breathing height) and builds and solves the N x M box model on
+# that finer grid, with the A matrices held in sparse form.
+#
+# The faces between the sub-boxes of one original box take their exchanges
+# from the faces of that box: linearly interpolated across it between its two
+# faces in the same direction (in the boxes next to a wall, the ground or the
+# end of the street, constant at the value of the box's other face), while
+# the sub-boxes along a face share its values. Road
+# emissions are spread over the sub-columns of their column, and the
+# background comes in through the roof as before.
+#
+# With no subdivision (the default) the grid, A matrices and right-hand sides
+# are the 3x5 model's, bit for bit; solved sparse they agree with the dense
+# solve to rounding.
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import splu
+
+from air_quality_code import a_coefficients, d_vector, ratios, system_cases, system_emissions, system_geometry
+from air_quality_solver import systems
+
+
+def subdivisions(parts, n):
+    """Number of parts for each of n rows or columns.
+
+    parts is one number for all of them or a sequence with one per row/column
+    (bottom to top, left to right).
+    """
+
+    parts = np.broadcast_to(np.asarray(parts, dtype=int), (n,))
+    if (parts < 1).any():
+        raise ValueError("Every row and column needs at least 1 part: %s" % list(parts))
+    return parts
+
+
+def split(parts):
+    # for each fine row/column: its original row/column (from 1), the fraction
+    # of that one below/left of it and the number of parts it was split into
+    parent = np.repeat(np.arange(1, len(parts) + 1), parts)
+    count = np.repeat(parts, parts)
+    first = np.repeat(np.cumsum(parts) - parts, parts)
+    return parent, (np.arange(len(parent)) - first)/count, count
+
+
+def refine_lengths(x, parts):
+    """Row heights h or column widths l (index 0 unused) of the finer grid."""
+
+    x = np.asarray(x, dtype=float)
+    parent, _, count = split(subdivisions(parts, x.shape[-1] - 1))
+    fine = np.zeros(x.shape[:-1] + (len(parent) + 1,))
+    fine[...,1:] = x[...,parent]/count
+    return fine
+
+
+def face_distances(x):
+    # distance between the centres of the boxes either side of each face, from
+    # row heights or column widths x (index 0 unused): faces 1..n are below/left
+    # of each box and n + 1 beyond the last one (the roof); where there is a box
+    # on one side only (a wall, the ground, the roof) from its centre
+    x = np.asarray(x, dtype=float)
+    d = np.zeros(x.shape[:-1] + (x.shape[-1] + 1,))
+    d[...,1] = x[...,1]/2
+    d[...,2:-1] = (x[...,1:-1] + x[...,2:])/2
+    d[...,-1] = x[...,-1]/2
+    return d
+
+
+def refine_horizontal(x, rows, columns, l=None):
+    # u/U on the finer grid: each sub-row takes its row's values, and the faces
+    # inside a column are interpolated between its left and right faces (next
+    # to a wall or the end of the street, the box's other face all the way
+    # across). For a dispersion (u, given the column widths l) the exchange
+    # goes as 1/distance between the box centres, so it is x times that
+    # distance that is interpolated and each fine face gets it over its own
+    n_rows = x.shape[-2] - 2
+    n_cols = x.shape[-1] - 1
+    row, _, _ = split(subdivisions(rows, n_rows))
+    col, f, _ = split(subdivisions(columns, n_cols))
+
+    left = x[...,row[:,None],col]
+    right = x[...,row[:,None],np.minimum(col + 1, n_cols)]
+    if l is not None:
+        d = face_distances(l)[...,None,:]
+        d_fine = face_distances(refine_lengths(l, columns))[...,None,1:-1]
+        left = left*(d[...,col]/d_fine)
+        right = right*(d[...,np.minimum(col + 1, n_cols)]/d_fine)
+    inside = (1 - f)*np.where(col > 1, left, right) + f*np.where(col < n_cols, right, left)
+
+    fine = np.zeros(x.shape[:-2] + (len(row) + 2, len(col) + 1))
+    fine[...,1:-1,1:] = np.where(f == 0, left, inside)
+    fine[...,-1,1:] = x[...,n_rows + 1,col]
+    return fine
+
+
+def refine_vertical(x, rows, columns, h=None):
+    # w/W on the finer grid: each sub-column takes its column's values, and the
+    # faces inside a row are interpolated between its bottom and top faces
+    # (next to the ground, the top face all the way up). A dispersion (w,
+    # given the row heights h) is interpolated as for refine_horizontal, and
+    # the exchange through the roof goes as 1/half the height of the top row
+    n_rows = x.shape[-2] - 2
+    n_cols = x.shape[-1] - 1
+    row, g, _ = split(subdivisions(rows, n_rows))
+    col, _, _ = split(subdivisions(columns, n_cols))
+    g = g[:,None]
+
+    bottom = x[...,row[:,None],col]
+    top = x[...,row[:,None] + 1,col]
+    roof = x[...,n_rows + 1,col]
+    if h is not None:
+        d = face_distances(h)[...,:,None]
+        d_fine = face_distances(refine_lengths(h, rows))[...,1:,None]
+        bottom = bottom*(d[...,row,:]/d_fine[...,:-1,:])
+        top = top*(d[...,row + 1,:]/d_fine[...,:-1,:])
+        roof = roof*(d[...,n_rows + 1,:]/d_fine[...,-1,:])
+    inside = (1 - g)*np.where(row[:,None] > 1, bottom, top) + g*top
+
+    fine = np.zeros(x.shape[:-2] + (len(row) + 2, len(col) + 1))
+    fine[...,1:-1,1:] = np.where(g == 0, bottom, inside)
+    fine[...,-1,1:] = roof
+    return fine
+
+
+def refine_street(state, rows=1, columns=1):
+    """Inputs of the 8 systems of a street on the finer grid.
+
+    Returns h, l, NO2 and PM2.5 emissions, u, U, w, W stacked in system_cases
+    order, as air_quality_code.system_geometry and system_emissions give them
+    for the 3x5 grid.
+    """
+
+    h, l, u, U, w, W = system_geometry(state)
+    ez_no2, ez_pm25 = system_emissions(state)
+
+    # emissions per column: each sub-column gets its share of the column's
+    n_cols = l.shape[-1] - 1
+    col, _, count = split(subdivisions(columns, n_cols))
+    ez_no2_fine = np.zeros(ez_no2.shape[:-1] + (len(col) + 1,))
+    ez_no2_fine[...,1:] = ez_no2[...,col]/count
+    ez_pm25_fine = np.zeros(ez_pm25.shape[:-1] + (len(col) + 1,))
+    ez_pm25_fine[...,1:] = ez_pm25[...,col]/count
+
+    return (refine_lengths(h, rows), refine_lengths(l, columns), ez_no2_fine, ez_pm25_fine,
+            refine_horizontal(u, rows, columns, l), refine_horizontal(U, rows, columns),
+            refine_vertical(w, rows, columns, h), refine_vertical(W, rows, columns))
+
+
+def sparse_matrix(r, u, U, w, W):
+    """A matrices of a stack of systems as one sparse block-diagonal matrix.
+
+    Takes the same (stacked) inputs as air_quality_code.a_matrix; system k
+    occupies rows and columns k*n to (k+1)*n - 1, n being the number of boxes.
+    """
+
+    rows, cols, values = a_coefficients(r, u, U, w, W)
+    values = np.atleast_2d(values)
+    n = (np.shape(r)[-2] - 1)*(np.shape(r)[-1] - 1)
+    offset = n*np.arange(len(values))[:,None]
+    return csr_matrix((values.ravel(), ((rows + offset).ravel(), (cols + offset).ravel())),
+                      shape=(n*len(values), n*len(values)))
+
+
+def grid_systems(state, rows=1, columns=1):
+    """The 8 systems of a street on the finer grid.
+
+    Returns the sparse block-diagonal A matrix of all 8 (see sparse_matrix)
+    and the NO2 and PM2.5 right-hand sides as its two columns.
+    """
+
+    h, l, ez_no2, ez_pm25, u, U, w, W = refine_street(state, rows, columns)
+
+    a = sparse_matrix(ratios(h = h, l = l), u, U, w, W)
+    rhs = np.stack((d_vector(ez = ez_no2, l = l, w = w, W = W, cB = state["cB_no2"]),
+                    d_vector(ez = ez_pm25, l = l, w = w, W = W, cB = state["cB_pm25"])), axis=-1)
+    return a, rhs.reshape(-1, 2)
+
+
+def solve_grid(state, rows=1, columns=1):
+    """Concentrations for all 8 systems of a street on the finer grid.
+
+    rows and columns give the number of parts for each of the 3 rows and 5
+    columns (see subdivisions). Returns a dictionary of concentration vectors
+    keyed C1_orig, C3_orig, ... as air_quality_solver.solve_systems does, each
+    with one value per fine box, numbered row by row from the bottom.
+    """
+
+    a, rhs = grid_systems(state, rows, columns)
+    solution = splu(a.tocsc()).solve(rhs).reshape(len(system_cases), -1, 2)
+
+    order = [case[0] for case in system_cases]
+    concs = {}
+    for a_name, rhs_names in systems:
+        for k, (_, c_name) in enumerate(rhs_names):
+            concs[c_name] = solution[order.index(a_name),:,k]
+    return concs
+
+
+def coarsen(c, rows=1, columns=1, n_rows=3, n_cols=5):
+    """Average fine-grid concentrations back onto the original boxes.
+
+    The sub-boxes of a box are all the same size, so this is their plain mean;
+    gives vectors with one value per original box, as from the 3x5 model.
+    """
+
+    row_parts = subdivisions(rows, n_rows)
+    col_parts = subdivisions(columns, n_cols)
+    c = np.asarray(c).reshape(np.shape(c)[:-1] + (row_parts.sum(), col_parts.sum()))
+
+    c = np.add.reduceat(c, np.cumsum(row_parts) - row_parts, axis=-2)/row_parts[:,None]
+    c = np.add.reduceat(c, np.cumsum(col_parts) - col_parts, axis=-1)/col_parts
+    return c.reshape(c.shape[:-2] + (n_rows*n_cols,))
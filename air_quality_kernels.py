@@ -0,0 +1,317 @@
+###############################################################################
+# COMPILED KERNELS
+###############################################################################
+
+# The flow patterns and the emission partition of a street are worked out by
+# branch-heavy scalar code over small arrays (recirc_col, no_barriers_pattern,
+# bar_outside, bar_inside, existing_barrier_pattern, new_barrier_pattern and
+# emission_partition in air_quality_code). Over many streets they dominate the
+# run time, so this module runs them over a whole batch of streets at once,
+# compiled with Numba (nopython mode, CPU) when it is installed. Without Numba
+# the very same functions run interpreted, so the results do not depend on
+# which backend is used.
+#
+# There is only one copy of the code: each function of air_quality_code is
+# compiled as it is, with the functions it calls bound to their compiled
+# versions.
+#
+#   python air_quality_kernels.py check scenarios.jsonl
+#   python air_quality_kernels.py benchmark scenarios.jsonl --repeat 100
+#
+# check compares the batched kernels (compiled if Numba is installed) with the
+# interpreted functions and with the flow patterns of air_quality_code; the
+# benchmark times both backends on the same batch.
+
+import argparse
+import sys
+import time
+import types
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+import air_quality_code
+from air_quality_batch import decode_scenario, read_scenarios
+from air_quality_code import (bar_inside, bar_inside_check, bar_inside_disp, bar_outside, bar_outside_check,
+                              barrier_obstruction, emission_partition, existing_barrier_pattern,
+                              new_barrier_pattern, no_barriers_pattern, pattern_constants, prepare_street,
+                              recirc_col, ws_average, ws_point)
+
+
+# ___________ batched kernels ___________
+
+def batch_patterns(row, h_cumu, l_cumu, h, l, check, bar, obs, rec, zone, speeds, constants, extent, patterns):
+    # flow patterns of a batch of streets, filled into patterns (N, 3, 4, 5, 6):
+    # no barriers, existing barriers and new barrier, each ue, ua, we, wa, as
+    # air_quality_code.flow_patterns works them out for one dimensioning,
+    # with the constants (N, 3) of each (ue_ratio, we_ratio, recirc_ratio);
+    # extent (N, 2) gets rec_ncol, rec_nrow
+    for i in range(row.shape[0]):
+        rec_ncol = 0
+        rec_nrow = 0
+        if row[i,0] == h_cumu[i,2]:
+            rec_nrow = 2
+            rec_ncol = recirc_col(recirc = rec[i,0], l_cumu = l_cumu[i])
+        elif row[i,0] == h_cumu[i,3]:
+            rec_nrow = 3
+            rec_ncol = recirc_col(recirc = rec[i,0], l_cumu = l_cumu[i])
+
+        # speeds: U1, U2, U3, Ut, Uh
+        Uh = speeds[i,4]
+        Ur = (constants[i,2]*Uh)*(row[i,0]/(2*h[i,rec_nrow]))
+
+        no_barriers_pattern(row=row[i], h_cumu=h_cumu[i], rec_ncol=rec_ncol,
+                            wa1=patterns[i,0,3], we1=patterns[i,0,2], ua1=patterns[i,0,1], ue1=patterns[i,0,0],
+                            U1=speeds[i,0], U2=speeds[i,1], U3=speeds[i,2], Ut=speeds[i,3], Uh=Uh, Ur=Ur,
+                            l=l[i], h=h[i], ue_ratio=constants[i,0], we_ratio=constants[i,1])
+        patterns[i,1] = patterns[i,0]
+        patterns[i,2] = patterns[i,0]
+
+        existing_barrier_pattern(check=check[i], l_cumu=l_cumu[i], rec_ncol=rec_ncol, rec_nrow=rec_nrow,
+                                 bar=bar[i], obs=obs[i], rec=rec[i],
+                                 ue2=patterns[i,1,0], ua2=patterns[i,1,1], we2=patterns[i,1,2], wa2=patterns[i,1,3],
+                                 h=h[i], l=l[i], row=row[i])
+        new_barrier_pattern(check=check[i], l_cumu=l_cumu[i], bar=bar[i], obs=obs[i], rec=rec[i],
+                            ue3=patterns[i,2,0], ua3=patterns[i,2,1], we3=patterns[i,2,2], wa3=patterns[i,2,3],
+                            h=h[i], l=l[i], rec_ncol=rec_ncol, zone=zone[i], row=row[i], rec_nrow=rec_nrow)
+
+        extent[i,0] = rec_ncol
+        extent[i,1] = rec_nrow
+
+
+def batch_partitions(l_cumu, l, ez, ez_w, partitions):
+    # emission partition of a batch of streets, filled into partitions
+    # (N, 2, 6): the share of EZ1 and of EZ2 in each column; ez (N, 4) holds
+    # the start and finish of EZ1 and EZ2, ez_w (N, 2) their widths
+    for i in range(l_cumu.shape[0]):
+        emission_partition(l_cumu=l_cumu[i], l=l[i],
+                           ez1_start=ez[i,0], ez1_finish=ez[i,1], ez2_start=ez[i,2], ez2_finish=ez[i,3],
+                           ez1_par=partitions[i,0], ez2_par=partitions[i,1], ez1_w=ez_w[i,0], ez2_w=ez_w[i,1])
+
+
+# ___________ backends ___________
+
+# in the order they call each other
+kernel_functions = [recirc_col, bar_outside, bar_inside, bar_outside_check, bar_inside_check, bar_inside_disp,
+                    no_barriers_pattern, existing_barrier_pattern, new_barrier_pattern, emission_partition,
+                    batch_patterns, batch_partitions]
+
+def compile_kernels(functions):
+    # each function compiled in nopython mode, with the globals it refers to
+    # bound to the compiled versions of the ones before it; numpy's error
+    # model so that dividing by zero gives inf as in the interpreted code.
+    # Compiling takes a minute or so, so the functions of air_quality_code are
+    # cached on disk (Numba recompiles them when that file changes); the
+    # batch functions, which take in the code of the others, are not, so they
+    # never hold on to an old version of it
+    namespace = {"__name__": __name__, "np": np}
+    for function in functions:
+        rebound = types.FunctionType(function.__code__, namespace, function.__name__, function.__defaults__)
+        cache = function.__module__ == air_quality_code.__name__
+        namespace[function.__name__] = numba.njit(error_model="numpy", cache=cache)(rebound)
+    return namespace
+
+interpreted = {function.__name__: function for function in kernel_functions}
+
+# compiled on first use, then kept
+compiled = {}
+
+def kernels(backend=None):
+    """The batched kernels: "compiled", "interpreted", or the best available."""
+
+    if backend is None:
+        backend = "compiled" if numba is not None else "interpreted"
+    if backend == "interpreted":
+        return interpreted
+    if backend != "compiled":
+        raise ValueError("Unknown backend: %s" % backend)
+    if numba is None:
+        raise ValueError("The compiled backend needs numba")
+    if not compiled:
+        compiled.update(compile_kernels(kernel_functions))
+    return compiled
+
+
+# ___________ stacking streets ___________
+
+def stack_streets(states):
+    """Inputs of the batched kernels for many streets, both dimensionings.
+
+    states are street states from prepare_street (the layout, at least).
+    Returns a dictionary of stacked arrays, the original dimensioning of
+    every street first and then their mirror image, so street k has rows k
+    and N + k. The constants are the model's own (pattern_constants); change
+    them to work the patterns out for others.
+    """
+
+    inputs = {k: [] for k in ("row", "h_cumu", "l_cumu", "h", "l", "check", "bar", "obs", "rec", "zone",
+                              "speeds", "constants", "ez", "ez_w")}
+    obstruction = [barrier_obstruction(state) for state in states]
+    for k, side in enumerate(("original", "mirror")):
+        for state, obs in zip(states, obstruction):
+            row = state["row_" + side]
+            h_cumu = state["h_cumu_" + side]
+            ubg = state["ubg_orig" if side == "original" else "ubg_mir"]
+            w = state["roadw"]
+
+            # canyon wind speeds, as air_quality_code.flow_patterns has them
+            U1, U2, U3 = ws_average(row_min = h_cumu[0:3], row_max = h_cumu[1:4], ubg = ubg, H = row[0], w = w)
+            Ut = ws_point(ubg = ubg, z = max(row[0], row[1]), H = row[0], w = w)
+            Uh = ws_point(ubg = ubg, z = row[0], H = row[0], w = w)
+
+            # the emission zones swap over in the mirror image, as in
+            # air_quality_code.street_emissions
+            if side == "original":
+                ez = [state["ez1_start"], state["ez1_finish"], state["ez2_start"], state["ez2_finish"]]
+                ez_w = [state["ez1_w"], state["ez2_w"]]
+            else:
+                ez = [round(w - state["ez2_finish"], 4), round(w - state["ez2_start"], 4),
+                      round(w - state["ez1_finish"], 4), round(w - state["ez1_start"], 4)]
+                ez_w = [state["ez2_w"], state["ez1_w"]]
+
+            for name, value in (("row", row), ("h_cumu", h_cumu), ("l_cumu", state["l_cumu_" + side]),
+                                ("h", state["h_" + side]), ("l", state["l_" + side]),
+                                ("check", state["check_" + side]), ("bar", state["bar_" + side]),
+                                ("obs", obs[k]), ("rec", state["rec_" + side]), ("zone", state["zone_" + side]),
+                                ("speeds", [U1, U2, U3, Ut, Uh]), ("constants", pattern_constants), ("ez", ez),
+                                ("ez_w", ez_w)):
+                inputs[name].append(value)
+
+    return {name: np.array(values, dtype=float) for name, values in inputs.items()}
+
+
+def street_patterns(inputs, backend=None):
+    """Flow patterns of stacked streets (see stack_streets).
+
+    Returns (extent, patterns): rec_ncol and rec_nrow per row of the stack
+    (N, 2) and the patterns (N, 3, 4, 5, 6) of no barriers, existing barriers
+    and the new barrier, each ue, ua, we, wa.
+    """
+
+    n = len(inputs["row"])
+    extent = np.zeros((n, 2), dtype=np.int64)
+    patterns = np.zeros((n, 3, 4, 5, 6))
+    kernels(backend)["batch_patterns"](inputs["row"], inputs["h_cumu"], inputs["l_cumu"], inputs["h"], inputs["l"],
+                                       inputs["check"], inputs["bar"], inputs["obs"], inputs["rec"], inputs["zone"],
+                                       inputs["speeds"], inputs["constants"], extent, patterns)
+    return extent, patterns
+
+
+def street_partitions(inputs, backend=None):
+    """Emission partition of stacked streets (see stack_streets), (N, 2, 6)."""
+
+    partitions = np.zeros((len(inputs["row"]), 2, 6))
+    kernels(backend)["batch_partitions"](inputs["l_cumu"], inputs["l"], inputs["ez"], inputs["ez_w"], partitions)
+    return partitions
+
+
+# ___________ parity and timing ___________
+
+flow_names = ["ue", "ua", "we", "wa"]
+
+def parity_check(states, backend=None):
+    """Largest differences between the kernels and the interpreted code.
+
+    Runs the batched kernels of the given backend on the streets and compares
+    them with the interpreted kernels ("patterns", "partitions") and with the
+    flows air_quality_code.flow_patterns stored in the states ("flows",
+    "extent"). All are 0 when the backends agree bit for bit.
+    """
+
+    inputs = stack_streets(states)
+    extent, patterns = street_patterns(inputs, backend)
+    partitions = street_partitions(inputs, backend)
+    extent_ref, patterns_ref = street_patterns(inputs, "interpreted")
+
+    flows = np.zeros_like(patterns[:,1:])
+    extent_state = np.zeros_like(extent)
+    n = len(states)
+    for k, side in enumerate(("orig", "mir")):
+        for i, state in enumerate(states):
+            for p, pattern in enumerate(("2", "3")):
+                for f, name in enumerate(flow_names):
+                    flows[k*n + i,p,f] = state[name + pattern + "_" + side]
+            extent_state[k*n + i] = state["rec_ncol_" + side], state["rec_nrow_" + side]
+
+    return {"patterns": np.abs(patterns - patterns_ref).max(initial=0),
+            "partitions": np.abs(partitions - street_partitions(inputs, "interpreted")).max(initial=0),
+            "flows": np.abs(patterns[:,1:] - flows).max(initial=0),
+            "extent": max(np.abs(extent - extent_ref).max(initial=0), np.abs(extent - extent_state).max(initial=0))}
+
+
+def benchmark(states, repeat=1, backends=("interpreted", "compiled")):
+    """Seconds per street for the flow patterns and emission partition of each backend.
+
+    The streets are repeated repeat times to make a bigger batch; the
+    compiled kernels are run once beforehand so compiling is not timed.
+    """
+
+    inputs = {name: np.concatenate([value]*repeat) for name, value in stack_streets(states).items()}
+    n = len(inputs["row"])//2
+
+    timings = {}
+    for backend in backends:
+        if backend == "compiled" and numba is None:
+            continue
+        if backend == "compiled":
+            street_patterns({name: value[:1] for name, value in inputs.items()}, backend)
+            street_partitions({name: value[:1] for name, value in inputs.items()}, backend)
+        start = time.perf_counter()
+        street_patterns(inputs, backend)
+        street_partitions(inputs, backend)
+        timings[backend] = (time.perf_counter() - start)/n
+    return timings
+
+
+def load_states(path):
+    # prepared states of the scenarios that pass the layout checks (those the
+    # model cannot run are left out, as run_scenarios reports them)
+    states = []
+    for _, text in read_scenarios(path):
+        try:
+            state, message = prepare_street(decode_scenario(text))
+        except Exception:
+            continue
+        if message is None:
+            states.append(state)
+    return states
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check and time the compiled GI4RAQ kernels.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    check = subparsers.add_parser("check", help="compare the kernels with the interpreted code")
+    check.add_argument("scenarios", help="JSONL file or directory of .json scenario files")
+    check.add_argument("--backend", choices=["compiled", "interpreted"], default=None,
+                       help="kernels to check (default: compiled if numba is installed)")
+    bench = subparsers.add_parser("benchmark", help="time the compiled and interpreted kernels")
+    bench.add_argument("scenarios", help="JSONL file or directory of .json scenario files")
+    bench.add_argument("--repeat", type=int, default=10, help="times to repeat the scenarios in the batch")
+    for sub in (check, bench):
+        sub.add_argument("--met-store", default=None,
+                         help="local met store file (see air_quality_met.py) instead of downloading the met data")
+    args = parser.parse_args(argv)
+
+    if args.met_store is not None:
+        air_quality_code.use_met_store(args.met_store)
+    states = load_states(args.scenarios)
+
+    if args.command == "check":
+        differences = parity_check(states, args.backend)
+        for name, value in differences.items():
+            print("%-10s %.3g" % (name, value))
+        if max(differences.values()) != 0:
+            sys.exit(1)
+    elif args.command == "benchmark":
+        if numba is None:
+            print("numba is not installed: timing the interpreted kernels only")
+        for backend, seconds in benchmark(states, args.repeat).items():
+            print("%-11s %8.2f us per street" % (backend, seconds*1e6))
+
+
+if __name__ == "__main__":
+    main()
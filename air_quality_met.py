@@ -0,0 +1,243 @@
+###############################################################################
+# LOCAL METEOROLOGY STORE
+###############################################################################
+
+# The met data in the meteorology/ folder (locations.csv and one
+# station{id}.csv per station) compiled into a single binary file, so the air
+# quality code can run without downloading anything. The file is opened with
+# mmap and the arrays are read straight out of it without copying.
+#
+# The store also holds the wind climatology of every station for each of the
+# 16 street bearings the user interface offers (15 x 16 = 240 combinations),
+# worked out once at build time with the same code the model uses, so the
+# model only has to look it up.
+#
+#   python air_quality_met.py build meteorology/ meteorology/met_store.bin
+#   python air_quality_code.py --met-store meteorology/met_store.bin <base64>
+#
+# File layout (little endian, every block 8-byte aligned):
+#   header      magic, version, number of stations, number of sectors,
+#               number of bearings
+#   station     int64   (stations,)            station ID
+#   latitude    float64 (stations,)
+#   longitude   float64 (stations,)
+#   direction   int64   (stations, sectors)    wind_direction
+#   frequency   float64 (stations, sectors)    fractional_occur
+#   speed       float64 (stations, sectors)    wind_speed
+#   bearing     float64 (bearings,)            street direction in degrees
+#   climatology float64 (stations, bearings, climatology_keys)
+# Stations are kept in the order of locations.csv, sectors in the order of the
+# station files (row 0 is the slack/calm row), bearings in the order of
+# compass_points.
+
+import argparse
+import mmap
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+
+magic = b"GI4RAQMS"
+version = 2
+header = struct.Struct("<8sIIII")
+
+# street directions offered by the user interface
+compass_points = ["N", "NNE", "NE", "ENE", "E", "ESE", "SE", "SSE",
+                  "S", "SSW", "SW", "WSW", "W", "WNW", "NW", "NNW"]
+
+# values returned by air_quality_code.wind_climatology, in table order
+climatology_keys = ["ubg_orig", "ubg_mir", "ubg_parallel", "LR_freq", "RL_freq",
+                    "par_freq", "LR_par_freq", "RL_par_freq"]
+
+
+# ___________ wind climatology for a street ___________
+
+def sector_climatology(direction, frequency, speed, street_dirs):
+    """Wind climatology of a met station for a batch of street bearings.
+
+    direction, frequency and speed are the wind_direction, fractional_occur
+    and wind_speed columns of a station file (row 0 being the slack/calm row),
+    street_dirs the street directions in degrees. Any of them may have
+    leading dimensions, e.g. many street bearings or many samples of the
+    wind speeds (n, sectors), which are broadcast together. Returns a
+    dictionary of arrays, one value per street direction (or sample), keyed
+    by climatology_keys. Gives the same values, up to rounding, as the
+    sector by sector pandas version did.
+    """
+
+    direction = np.asarray(direction)
+    frequency = np.asarray(frequency, dtype=float)
+    speed = np.asarray(speed, dtype=float)
+    street_dirs = np.atleast_1d(np.asarray(street_dirs, dtype=float))[...,None]
+
+    # REPLACE slack wind speed with 0.5 m/s and assign the same direction as the street
+    # so this is representative of total along-street component
+    speed = np.where(speed == speed[...,:1], 0.5, speed)
+    wind_d = np.where(direction == 0, street_dirs, direction)
+
+    # wind direction relative to the street, as if the street ran north
+    angle = wind_d - street_dirs
+    angle = np.where(angle >= 360, angle - 360, np.where(angle < 0, angle + 360, angle))
+
+    # difference to the perpendicular (L-R: 270, R-L: 90) and to the nearer
+    # along-street direction (360 or 180; a sector is only ever within 45
+    # degrees of one of them)
+    differences = {"LR": np.abs(270 - angle), "RL": np.abs(90 - angle),
+                   "par": np.minimum(np.where(angle < 180, angle, 360 - angle), np.abs(180 - angle))}
+
+    # only the sectors within 45 degrees count, each contributing the
+    # component of its wind speed in that direction
+    climatology = {}
+    for k, name in (("LR", "ubg_orig"), ("RL", "ubg_mir"), ("par", "ubg_parallel")):
+        weights = np.where(differences[k] <= 45, frequency, 0)
+        total = weights.sum(axis=-1)
+        flow = (weights*np.cos(np.radians(differences[k]))*speed).sum(axis=-1)
+        climatology[name] = np.divide(flow, total, out=np.zeros_like(flow), where=total > 0)
+        climatology[k + "_freq"] = total
+
+    return {"ubg_orig": climatology["ubg_orig"], "ubg_mir": climatology["ubg_mir"],
+            "ubg_parallel": climatology["ubg_parallel"], "LR_freq": climatology["LR_freq"],
+            "RL_freq": climatology["RL_freq"], "par_freq": climatology["par_freq"],
+            "LR_par_freq": climatology["par_freq"]/2, "RL_par_freq": climatology["par_freq"]/2}
+
+
+# ___________ nearest met station ___________
+
+# mean radius of the Earth
+earth_radius_km = 6371.0088
+
+def unit_vectors(latitude, longitude):
+    # points on the unit sphere, so that the straight-line (chord) distance
+    # between two of them orders them the same as the great-circle distance
+    lat = np.radians(np.asarray(latitude, dtype=float))
+    lon = np.radians(np.asarray(longitude, dtype=float))
+    return np.stack((np.cos(lat)*np.cos(lon), np.cos(lat)*np.sin(lon), np.sin(lat)), axis=-1)
+
+class StationIndex:
+    """KD-tree of met station locations for nearest-station lookups.
+
+    Built once from the station IDs and coordinates (degrees); nearest() then
+    takes any number of street coordinates at once and returns the closest
+    station by great-circle distance.
+    """
+
+    def __init__(self, station, latitude, longitude):
+        self.station = np.asarray(station)
+        self.tree = cKDTree(unit_vectors(latitude, longitude))
+
+    def nearest(self, latitude, longitude):
+        """Return (station IDs, great-circle distances in km) of the closest stations."""
+
+        chord, i = self.tree.query(unit_vectors(latitude, longitude))
+        distance_km = 2*earth_radius_km*np.arcsin(np.minimum(chord/2, 1))
+        return self.station[i], distance_km
+
+
+# ___________ building the store ___________
+
+def build_met_store(met_dir, path):
+    """Compile locations.csv and the station files in met_dir into one binary file."""
+
+    # imported here as the air quality code itself imports this module
+    from air_quality_code import street_direction
+
+    # read with pandas, exactly as the air quality code does, so the stored
+    # values are bit for bit the ones the CSVs give
+    sites_df = pd.read_csv(os.path.join(met_dir, "locations.csv"))
+    station = sites_df["station"].to_numpy(dtype="<i8")
+    latitude = sites_df["latitude"].to_numpy(dtype="<f8")
+    longitude = sites_df["longitude"].to_numpy(dtype="<f8")
+
+    winds = [pd.read_csv(os.path.join(met_dir, "station" + str(s) + ".csv")) for s in station]
+    n_sectors = len(winds[0])
+    for s, wind in zip(station, winds):
+        if len(wind) != n_sectors:
+            raise ValueError("station%d.csv has %d sectors, expected %d" % (s, len(wind), n_sectors))
+
+    direction = np.array([wind["wind_direction"] for wind in winds], dtype="<i8")
+    frequency = np.array([wind["fractional_occur"] for wind in winds], dtype="<f8")
+    speed = np.array([wind["wind_speed"] for wind in winds], dtype="<f8")
+
+    bearing = np.array([street_direction(c) for c in compass_points], dtype="<f8")
+    climatology = np.zeros((len(station), len(compass_points), len(climatology_keys)), dtype="<f8")
+    for i in range(len(station)):
+        values = sector_climatology(direction[i], frequency[i], speed[i], bearing)
+        climatology[i] = np.stack([values[k] for k in climatology_keys], axis=-1)
+
+    with open(path, "wb") as f:
+        f.write(header.pack(magic, version, len(station), n_sectors, len(compass_points)))
+        for block in (station, latitude, longitude, direction, frequency, speed, bearing, climatology):
+            f.write(np.ascontiguousarray(block).tobytes())
+
+
+# ___________ reading the store ___________
+
+class MetStore:
+    """Read-only view of a met store file, memory-mapped.
+
+    The arrays (station, latitude, longitude, direction, frequency, speed,
+    bearing, climatology) point into the mapped file rather than holding a
+    copy of the data.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        file_magic, file_version, n_stations, n_sectors, n_bearings = header.unpack_from(self.buffer, 0)
+        if file_magic != magic or file_version != version:
+            raise ValueError("%s is not a version %d met store" % (path, version))
+
+        offset = header.size
+        blocks = []
+        for dtype, shape in (("<i8", (n_stations,)), ("<f8", (n_stations,)), ("<f8", (n_stations,)),
+                             ("<i8", (n_stations, n_sectors)), ("<f8", (n_stations, n_sectors)),
+                             ("<f8", (n_stations, n_sectors)), ("<f8", (n_bearings,)),
+                             ("<f8", (n_stations, n_bearings, len(climatology_keys)))):
+            count = int(np.prod(shape))
+            blocks.append(np.frombuffer(self.buffer, dtype=dtype, count=count, offset=offset).reshape(shape))
+            offset += count*8
+
+        (self.station, self.latitude, self.longitude, self.direction, self.frequency, self.speed,
+         self.bearing, self.climatology) = blocks
+        self.index = {int(s): i for i, s in enumerate(self.station)}
+        self.bearing_index = {float(b): j for j, b in enumerate(self.bearing)}
+
+    def sites(self):
+        # same columns as locations.csv
+        return pd.DataFrame({"station": self.station, "latitude": self.latitude,
+                             "longitude": self.longitude})
+
+    def wind(self, station_id):
+        # same columns as station{id}.csv
+        i = self.index[int(station_id)]
+        return pd.DataFrame({"wind_direction": self.direction[i], "fractional_occur": self.frequency[i],
+                             "wind_speed": self.speed[i]})
+
+    def wind_climatology(self, station_id, street_dir):
+        # precomputed air_quality_code.wind_climatology, or None if the street
+        # direction is not one of the compass points in the table
+        j = self.bearing_index.get(float(street_dir))
+        if j is None:
+            return None
+        values = self.climatology[self.index[int(station_id)], j]
+        return {k: values[n] for n, k in enumerate(climatology_keys)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the local GI4RAQ met store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="compile the meteorology folder into a met store")
+    build.add_argument("met_dir", help="folder with locations.csv and the station files")
+    build.add_argument("path", help="met store file to write")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        build_met_store(args.met_dir, args.path)
+
+
+if __name__ == "__main__":
+    main()
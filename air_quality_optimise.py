@@ -0,0 +1,280 @@
+###############################################################################
+# BARRIER PLACEMENT OPTIMISER
+###############################################################################
+
+# Instead of moving the new barrier about in the user interface by hand, this
+# searches its position, height and obstruction for a fixed street. The
+# objective is the weighted NO2 and PM2.5 percentage change in the boxes of
+# the receptor zones (by default the ground row of all of them, each box
+# counting by how much of its width lies in a zone), to be made as negative
+# as possible.
+#
+#   python air_quality_optimise.py base.json --rounds 8 --batch-size 256 \
+#       --surface surface.csv
+#
+# The search is a cross-entropy method over the unit cube of the 3 design
+# variables: a scrambled Sobol batch over the whole space first, then each
+# round samples around the best tenth of all feasible designs so far, its
+# spread shrinking as they agree. Every round is one batch: the designs are
+# laid out and checked (a design that fails the dimensioning checks, e.g. a
+# barrier as tall as a building, is dropped before its flows are worked out)
+# and the rest are solved together in one stacked call.
+#
+# The position runs along the receptor zones the barrier may stand in (RZ1
+# and RZ2 by default) end to end, the height from a lower bound to the
+# shorter building (row_dimensioning only allows a barrier shorter than both
+# buildings) and the obstruction over 0-100 %. The height and obstruction
+# are the barrier's "height" and "obst"; trees keep their crowns as in the
+# base scenario.
+
+import argparse
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+from scipy.stats import qmc
+
+import air_quality_code
+from air_quality_batch import decode_scenario
+from air_quality_code import prepare_street, run_solve_street, solve_systems_many
+
+
+design_variables = ["gi_loc", "height", "obstruction"]
+
+# receptor zones the new barrier may stand in
+barrier_zone_names = ["RZ1", "RZ2"]
+
+# lowest barrier height searched by default (m)
+min_barrier_height = 0.5
+
+# distance kept from the edges of a zone, as gi_information does (m)
+zone_margin = 0.01
+
+
+# ___________ the street ___________
+
+def zone_extents(objects):
+    """(start, end) of every zone in m from the left edge of the street."""
+
+    extents = {}
+    x = 0
+    for item in objects:
+        if item["type"] != "marker" and item["type"] != "building":
+            width = float(item.get("width"))
+            extents[item["name"]] = (round(x, 4), round(x + width, 4))
+            x += width
+    return extents
+
+
+def receptor_weights(street, extents, rows=(1,)):
+    # weight of each box of the street output (row 1 first): the width of the
+    # box inside the zones given by extents, in the rows given, normalised
+    x = np.asarray(street["columns"])
+    n_rows = len(street["rows"]) - 1
+    inside = np.zeros(len(x) - 1)
+    for start, end in extents:
+        inside += np.clip(np.minimum(x[1:], end) - np.maximum(x[:-1], start), 0, None)
+    weights = np.zeros((n_rows, len(x) - 1))
+    for row in rows:
+        weights[row - 1] = inside
+    return weights.ravel()/weights.sum()
+
+
+class BarrierSpace:
+    """The design space of the new barrier of one street.
+
+    Maps points of the unit cube to designs (gi_loc, height, obstruction)
+    and lays designs out as scenarios.
+    """
+
+    def __init__(self, content, zones=barrier_zone_names, height=None, obstruction=(0, 100)):
+        self.content = content
+        self.objects = json.loads(content["objects"])
+        if not any(item.get("gi4raq_barrier") for item in self.objects):
+            raise ValueError("The street has no new barrier to place")
+
+        extents = zone_extents(self.objects)
+        self.zones = [(extents[name][0] + zone_margin, extents[name][1] - zone_margin) for name in zones
+                      if name in extents and extents[name][1] - extents[name][0] > 2*zone_margin]
+        if not self.zones:
+            raise ValueError("None of the zones %s can hold a barrier" % zones)
+
+        if height is None:
+            buildings = [float(item["height"]) for item in self.objects if item["type"] == "building"]
+            height = (min_barrier_height, min(buildings))
+        self.height = height
+        self.obstruction = obstruction
+
+    def designs(self, unit):
+        """Designs (n, 3) for points of the unit cube (n, 3)."""
+
+        unit = np.atleast_2d(unit)
+        lengths = np.array([end - start for start, end in self.zones])
+        along = unit[:,0]*lengths.sum()
+        k = np.minimum(np.searchsorted(np.cumsum(lengths), along, side="right"), len(lengths) - 1)
+        starts = np.array([start for start, _ in self.zones])
+        gi_loc = np.round(starts[k] + along - (np.cumsum(lengths) - lengths)[k], 4)
+
+        height = self.height[0] + unit[:,1]*(self.height[1] - self.height[0])
+        obstruction = self.obstruction[0] + unit[:,2]*(self.obstruction[1] - self.obstruction[0])
+        return np.stack((gi_loc, np.round(height, 4), np.round(obstruction, 4)), axis=-1)
+
+    def scenario(self, height, obstruction):
+        # the base scenario with the barrier's height and obstruction changed
+        objects = json.loads(self.content["objects"])
+        barrier = next(item for item in objects if item.get("gi4raq_barrier"))["gi4raq_barrier"][0]
+        barrier["height"] = str(float(height))
+        barrier["obst"] = str(float(obstruction))
+        return dict(self.content, objects=json.dumps(objects))
+
+
+# ___________ evaluating designs ___________
+
+def evaluate_designs(space, designs, no2_weight=1, pm25_weight=1, zones=None, rows=(1,)):
+    """NO2 and PM2.5 receptor changes and the objective of a batch of designs.
+
+    designs is (n, 3): gi_loc, height, obstruction. zones are the names of
+    the receptor zones averaged over (default: all of them) and rows the
+    rows of boxes. Returns a DataFrame with one row per design: the design,
+    "feasible", "error", "no2", "pm25" and "objective" (no2_weight*no2 +
+    pm25_weight*pm25; NaN for infeasible designs).
+    """
+
+    extents = zone_extents(space.objects)
+    if zones is None:
+        zones = [item["name"] for item in space.objects if item["type"] == "receptor_zone"]
+    receptors = [extents[name] for name in zones]
+
+    results = pd.DataFrame(designs, columns=design_variables)
+    results["feasible"] = False
+    results["error"] = None
+    results["no2"] = np.nan
+    results["pm25"] = np.nan
+
+    # lay every design out; those failing the checks stop before their flows
+    prepared = []
+    for i, (gi_loc, height, obstruction) in enumerate(designs):
+        try:
+            state, message = prepare_street(space.scenario(height, obstruction), gi_loc)
+        except Exception as e:
+            message = "%s: %s" % (type(e).__name__, e)
+        if message is not None:
+            results.at[i, "error"] = message
+        else:
+            prepared.append((i, state))
+
+    # the rest solved in one stacked call
+    if prepared:
+        try:
+            all_concs = solve_systems_many([state for _, state in prepared])
+        except ValueError:
+            # a singular matrix or one with infs or NaNs: design by design
+            all_concs = [None]*len(prepared)
+        for (i, state), concs in zip(prepared, all_concs):
+            street = run_solve_street(state, concs)
+            if "error" in street:
+                results.at[i, "error"] = street["error"]
+                continue
+            weights = receptor_weights(street, receptors, rows)
+            results.at[i, "feasible"] = True
+            results.at[i, "no2"] = weights @ np.asarray(street["per_change_no2"])
+            results.at[i, "pm25"] = weights @ np.asarray(street["per_change_pm25"])
+
+    results["objective"] = no2_weight*results["no2"] + pm25_weight*results["pm25"]
+    return results
+
+
+def pareto_front(no2, pm25):
+    # designs no other design beats on both NO2 and PM2.5 (NaN never are)
+    no2 = np.asarray(no2, dtype=float)
+    pm25 = np.asarray(pm25, dtype=float)
+    front = ~(np.isnan(no2) | np.isnan(pm25))
+    for i in np.flatnonzero(front):
+        beaten = (no2 <= no2[i]) & (pm25 <= pm25[i]) & ((no2 < no2[i]) | (pm25 < pm25[i]))
+        front[i] = not beaten.any()
+    return front
+
+
+# ___________ the search ___________
+
+def optimise_barrier(content, rounds=8, batch_size=256, no2_weight=1, pm25_weight=1, zones=None, rows=(1,),
+                     barrier_zones=barrier_zone_names, height=None, obstruction=(0, 100), elite_fraction=0.1,
+                     n_best=10, seed=None):
+    """Search the new barrier's position, height and obstruction for a street.
+
+    content is the decoded scenario (as for compute_street), with a new
+    barrier. Runs rounds batches of batch_size designs (see the top of this
+    file) and returns (best, surface): the n_best feasible designs with the
+    lowest objective, and every design evaluated with its round and whether
+    it is on the NO2/PM2.5 Pareto front (see evaluate_designs for the other
+    columns).
+    """
+
+    space = BarrierSpace(content, barrier_zones, height, obstruction)
+    rng = np.random.default_rng(seed)
+
+    surface = []
+    unit_points = []
+    for n in range(rounds):
+        if n == 0:
+            unit = qmc.Sobol(d=len(design_variables), seed=rng).random(batch_size)
+        else:
+            # sample around the elite designs so far
+            evaluated = pd.concat(surface, ignore_index=True)
+            feasible = evaluated["feasible"].to_numpy()
+            if not feasible.any():
+                unit = rng.random((batch_size, len(design_variables)))
+            else:
+                points = np.concatenate(unit_points)[feasible]
+                order = np.argsort(evaluated["objective"].to_numpy()[feasible])
+                elite = points[order[:max(2, int(np.ceil(elite_fraction*len(order))))]]
+                spread = np.maximum(elite.std(axis=0), 0.01)
+                unit = np.clip(rng.normal(elite.mean(axis=0), spread, (batch_size, len(design_variables))), 0, 1)
+
+        results = evaluate_designs(space, space.designs(unit), no2_weight, pm25_weight, zones, rows)
+        results["round"] = n
+        surface.append(results)
+        unit_points.append(unit)
+
+    surface = pd.concat(surface, ignore_index=True)
+    surface["pareto"] = pareto_front(surface["no2"], surface["pm25"])
+    best = surface[surface["feasible"]].sort_values("objective").head(n_best)
+    return best, surface
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Optimise the position, height and obstruction of a new barrier.")
+    parser.add_argument("base", help="scenario file (JSON or base64) with a new barrier")
+    parser.add_argument("--rounds", type=int, default=8, help="batches of designs to evaluate")
+    parser.add_argument("--batch-size", type=int, default=256, help="designs per batch")
+    parser.add_argument("--no2-weight", type=float, default=1, help="weight of the NO2 %% change")
+    parser.add_argument("--pm25-weight", type=float, default=1, help="weight of the PM2.5 %% change")
+    parser.add_argument("--zones", default=None,
+                        help="receptor zones to average over, comma separated (default: all)")
+    parser.add_argument("--rows", default="1", help="rows of boxes to average over, comma separated")
+    parser.add_argument("--best", type=int, default=10, help="number of best designs to print")
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    parser.add_argument("--surface", default=None, help="CSV file for every design evaluated")
+    parser.add_argument("--met-store", default=None,
+                        help="local met store file (see air_quality_met.py) instead of downloading the met data")
+    args = parser.parse_args(argv)
+
+    if args.met_store is not None:
+        air_quality_code.use_met_store(args.met_store)
+    with open(args.base, encoding="utf8") as f:
+        content = decode_scenario(f.read())
+
+    zones = args.zones.split(",") if args.zones else None
+    rows = tuple(int(r) for r in args.rows.split(","))
+    best, surface = optimise_barrier(content, args.rounds, args.batch_size, args.no2_weight, args.pm25_weight,
+                                     zones, rows, n_best=args.best, seed=args.seed)
+
+    print(best[design_variables + ["no2", "pm25", "objective"]].to_string(index=False))
+    print("%d designs evaluated, %d feasible" % (len(surface), surface["feasible"].sum()), file=sys.stderr)
+    if args.surface is not None:
+        surface.to_csv(args.surface, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+###############################################################################
+# GLOBAL SENSITIVITY ANALYSIS
+###############################################################################
+
+# Which of the model's constants and inputs drive the results of a street?
+# Each factor below is varied over a range, all of them together, and the
+# variance of every box's percentage change is split between them.
+#
+#   python air_quality_sensitivity.py base.json --method sobol --samples 1024 \
+#       -o indices.csv
+#   python air_quality_sensitivity.py base.json --method morris \
+#       --trajectories 100 -o screening.csv
+#
+# The factors, with their default ranges (default_bounds):
+#   horizontal_dispersion         ue_ratio    } of the flow patterns, see
+#   vertical_dispersion           we_ratio    } air_quality_code's
+#   recirculation                 recirc_ratio} pattern_constants (0.1 each)
+#   deciduous                     share of the obstruction a deciduous hedge
+#                                 or tree crown keeps (0.5: halved)
+#   tree_spacing                  factor on tfact, the share of the street
+#                                 the tree crowns cover
+#   new_barrier_obstruction       factor on the new barrier's obstruction
+#   existing_barrier_obstruction  factor on the existing barriers' one
+#   emissions                     factor on the NO2 and PM2.5 emissions
+#   background                    factor on the NO2 and PM2.5 backgrounds
+#   wind_speed                    factor on the background wind speeds
+# A JSON file of {factor: [low, high]} replaces the ranges it names; a factor
+# given as [value, value] is held fixed. The deciduous and tree spacing
+# factors only matter for streets with such barriers.
+#
+# sobol: a Saltelli design (n base samples of a scrambled Sobol sequence,
+# n*(factors + 2) evaluations) and, per box and pollutant, the first-order
+# index S1 (Saltelli et al, 2010) and the total index ST (Jansen, 1999).
+# morris: r trajectories of one-at-a-time steps on a grid of levels (r*(factors
+# + 1) evaluations) and the elementary effects' mean (mu), mean of absolute
+# values (mu_star) and standard deviation (sigma), in % per whole range of
+# the factor.
+#
+# The evaluations are split into chunks across a process pool; each chunk is
+# evaluated as one batch (see air_quality_uncertainty.SampledStreet).
+
+import argparse
+import functools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.stats import qmc
+
+import air_quality_code
+from air_quality_batch import decode_scenario, warm_worker
+from air_quality_code import barrier_obstruction
+from air_quality_uncertainty import SampledStreet
+
+
+sensitivity_factors = ["horizontal_dispersion", "vertical_dispersion", "recirculation", "deciduous", "tree_spacing",
+                       "new_barrier_obstruction", "existing_barrier_obstruction", "emissions", "background",
+                       "wind_speed"]
+
+default_bounds = {
+    "horizontal_dispersion": (0.05, 0.15),
+    "vertical_dispersion": (0.05, 0.15),
+    "recirculation": (0.05, 0.15),
+    "deciduous": (0.25, 0.75),
+    "tree_spacing": (0.5, 1.5),
+    "new_barrier_obstruction": (0.8, 1.2),
+    "existing_barrier_obstruction": (0.8, 1.2),
+    "emissions": (0.7, 1.3),
+    "background": (0.8, 1.2),
+    "wind_speed": (0.8, 1.2),
+}
+
+# columns of the indices of each method
+index_columns = {"sobol": ["S1", "ST"], "morris": ["mu", "mu_star", "sigma"]}
+
+
+# ___________ factors ___________
+
+def factor_bounds(bounds=None):
+    """(names, lows, highs) of the factors varied; fixed ones are left out."""
+
+    bounds = dict(default_bounds, **(bounds or {}))
+    for name in bounds:
+        if name not in sensitivity_factors:
+            raise ValueError("Unknown sensitivity factor: %s" % name)
+    names = [name for name in sensitivity_factors if bounds[name][1] != bounds[name][0]]
+    if not names:
+        raise ValueError("No factor is varied")
+    fixed = {name: float(bounds[name][0]) for name in sensitivity_factors if name not in names}
+    lows = np.array([bounds[name][0] for name in names], dtype=float)
+    highs = np.array([bounds[name][1] for name in names], dtype=float)
+    return names, lows, highs, fixed
+
+
+def street_samples(street, names, values, fixed):
+    """Samples to evaluate (see SampledStreet.evaluate) for factor values (n, factors)."""
+
+    n = len(values)
+    factor = dict({name: np.full(n, value) for name, value in fixed.items()},
+                  **{name: values[:,k] for k, name in enumerate(names)})
+
+    samples = street.nominal(n)
+    obs = np.zeros((n, 4))
+    for i in range(n):
+        obs[i] = barrier_obstruction(street.state, (factor["deciduous"][i], factor["tree_spacing"][i]))[0]
+    obs[:,[0, 2]] *= factor["existing_barrier_obstruction"][:,None]
+    obs[:,[1, 3]] *= factor["new_barrier_obstruction"][:,None]
+    samples["obs_original"] = np.minimum(obs, 0.99)
+    samples["constants"] = np.stack([factor["horizontal_dispersion"], factor["vertical_dispersion"],
+                                     factor["recirculation"]], axis=-1)
+    samples["emissions"] = samples["emissions"]*factor["emissions"][:,None]
+    samples["background"] = samples["background"]*factor["background"][:,None]
+    samples["ubg"] = samples["ubg"]*factor["wind_speed"][:,None]
+    return samples
+
+
+# ___________ designs and indices ___________
+
+def saltelli_design(n, d, seed=None):
+    """Points of the unit cube (n*(d + 2), d): A, B, then A with column i of B for each i."""
+
+    base = qmc.Sobol(d=2*d, seed=seed).random(n)
+    a, b = base[:,:d], base[:,d:]
+    ab = np.repeat(a[None], d, axis=0)
+    for i in range(d):
+        ab[i,:,i] = b[:,i]
+    return np.concatenate((a, b, ab.reshape(-1, d)))
+
+
+def sobol_indices(f, n, d):
+    # first-order and total indices (d, ...) from the outputs f of a Saltelli
+    # design; NaN for outputs that do not vary
+    f_a, f_b = f[:n], f[n:2*n]
+    f_ab = f[2*n:].reshape((d, n) + f.shape[1:])
+    variance = np.var(np.concatenate((f_a, f_b)), axis=0)
+    variance = np.where(variance > 0, variance, np.nan)
+    first = np.mean(f_b*(f_ab - f_a), axis=1)/variance
+    total = 0.5*np.mean((f_a - f_ab)**2, axis=1)/variance
+    return {"S1": first, "ST": total}
+
+
+def morris_design(r, d, levels=4, seed=None):
+    """r Morris trajectories in the unit cube.
+
+    Returns (points, order, signs, delta): points (r*(d + 1), d), each
+    trajectory stepping one factor at a time in the given order (r, d) by
+    delta up or down (signs, (r, d)).
+    """
+
+    rng = np.random.default_rng(seed)
+    delta = levels/(2*(levels - 1))
+    grid = np.arange(levels)/(levels - 1)
+
+    signs = rng.choice([-1, 1], size=(r, d))
+    # start where the step stays inside the cube
+    start = np.where(signs > 0, rng.choice(grid[grid <= 1 - delta + 1e-12], size=(r, d)),
+                     rng.choice(grid[grid >= delta - 1e-12], size=(r, d)))
+    order = np.argsort(rng.random((r, d)), axis=1)
+
+    points = np.repeat(start[:,None], d + 1, axis=1)
+    for j in range(d):
+        step = np.zeros((r, d))
+        step[np.arange(r),order[:,j]] = signs[np.arange(r),order[:,j]]*delta
+        points[:,j + 1:] += step[:,None]
+    return np.clip(points, 0, 1).reshape(-1, d), order, signs, delta
+
+
+def morris_indices(f, order, signs, delta):
+    # mean, mean absolute and standard deviation (d, ...) of the elementary
+    # effects of the outputs f of a Morris design
+    r, d = order.shape
+    f = f.reshape((r, d + 1) + f.shape[1:])
+    effects = np.zeros((r, d) + f.shape[2:])
+    for j in range(d):
+        rows = np.arange(r)
+        step = (signs[rows,order[:,j]]*delta).reshape((r,) + (1,)*(f.ndim - 2))
+        effects[rows,order[:,j]] = (f[:,j + 1] - f[:,j])/step
+    return {"mu": effects.mean(axis=0), "mu_star": np.abs(effects).mean(axis=0), "sigma": effects.std(axis=0, ddof=1)}
+
+
+# ___________ evaluation ___________
+
+@functools.lru_cache(maxsize=8)
+def worker_street(text):
+    # the batched street, laid out once per process
+    return SampledStreet(json.loads(text))
+
+
+def evaluate_chunk(text, backend, samples):
+    no2, pm25 = worker_street(text).evaluate(samples, backend)
+    return np.stack((no2, pm25), axis=1)
+
+
+def evaluate_design(content, street, unit, bounds=None, workers=None, chunksize=None, met_store=None,
+                    backend="interpreted"):
+    """Percentage changes (n, 2, boxes), NO2 then PM2.5, for points of the unit cube.
+
+    The points are mapped onto the factor ranges and evaluated in chunks
+    across a process pool.
+    """
+
+    names, lows, highs, fixed = factor_bounds(bounds)
+    samples = street_samples(street, names, lows + unit*(highs - lows), fixed)
+
+    n = len(unit)
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, min(2000, -(-n//workers)))
+    chunks = [{k: v[i:i + chunksize] for k, v in samples.items()} for i in range(0, n, chunksize)]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_worker, initargs=(met_store,)) as pool:
+        results = list(pool.map(functools.partial(evaluate_chunk, json.dumps(content), backend), chunks))
+    return np.concatenate(results)
+
+
+def indices_table(street, names, indices):
+    """One row per factor, pollutant and box with its indices."""
+
+    x = street["columns"]
+    z = street["rows"]
+    n_cells = len(x) - 1
+    rows = []
+    for k, name in enumerate(names):
+        for p, pollutant in enumerate(("no2", "pm25")):
+            for b in range(len(street["per_change_no2"])):
+                r, c = divmod(b, n_cells)
+                row = {"factor": name, "pollutant": pollutant, "row": r + 1, "cell": c + 1, "x_min": x[c],
+                       "x_max": x[c + 1], "z_min": z[r], "z_max": z[r + 1]}
+                row.update({column: values[k,p,b] for column, values in indices.items()})
+                rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def sensitivity_analysis(content, method="sobol", samples=1024, trajectories=100, levels=4, bounds=None, seed=None,
+                         workers=None, chunksize=None, met_store=None, backend="interpreted"):
+    """Sensitivity indices of every box's percentage change for a street.
+
+    content is the decoded scenario (as for compute_street); bounds replaces
+    default_bounds for the factors it names. method is "sobol" (samples
+    base samples, a power of 2) or "morris" (trajectories on a grid of
+    levels). Returns (indices, n): the indices table (see indices_table and
+    the top of this file) and the number of evaluations.
+    """
+
+    if method not in index_columns:
+        raise ValueError("Unknown method: %s" % method)
+    street = SampledStreet(content)
+    names = factor_bounds(bounds)[0]
+    d = len(names)
+
+    if method == "sobol":
+        unit = saltelli_design(samples, d, seed)
+    else:
+        unit, order, signs, delta = morris_design(trajectories, d, levels, seed)
+    f = evaluate_design(content, street, unit, bounds, workers, chunksize, met_store, backend)
+
+    if method == "sobol":
+        indices = sobol_indices(f, samples, d)
+    else:
+        indices = morris_indices(f, order, signs, delta)
+    return indices_table(street.street, names, indices), len(unit)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Global sensitivity analysis of a GI4RAQ street.")
+    parser.add_argument("base", help="scenario file (JSON or base64)")
+    parser.add_argument("--method", choices=sorted(index_columns), default="sobol", help="sobol or morris")
+    parser.add_argument("--samples", type=int, default=1024, help="base samples of the Sobol design (a power of 2)")
+    parser.add_argument("--trajectories", type=int, default=100, help="trajectories of the Morris design")
+    parser.add_argument("--levels", type=int, default=4, help="grid levels of the Morris design")
+    parser.add_argument("--bounds", default=None, help="JSON file of {factor: [low, high]} replacing the defaults")
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--chunksize", type=int, default=None, help="evaluations handed to a worker at a time")
+    parser.add_argument("--backend", choices=["compiled", "interpreted"], default="interpreted",
+                        help="flow pattern kernels; compiling them takes a while in every worker process")
+    parser.add_argument("--output", "-o", default="-", help="indices CSV (default: stdout)")
+    parser.add_argument("--met-store", default=None,
+                        help="local met store file (see air_quality_met.py) instead of downloading the met data")
+    args = parser.parse_args(argv)
+
+    if args.met_store is not None:
+        air_quality_code.use_met_store(args.met_store)
+    with open(args.base, encoding="utf8") as f:
+        content = decode_scenario(f.read())
+    bounds = None
+    if args.bounds is not None:
+        with open(args.bounds, encoding="utf8") as f:
+            bounds = json.load(f)
+
+    start = time.perf_counter()
+    indices, n = sensitivity_analysis(content, args.method, args.samples, args.trajectories, args.levels, bounds,
+                                      args.seed, args.workers, args.chunksize, args.met_store, args.backend)
+    seconds = time.perf_counter() - start
+
+    indices.to_csv(sys.stdout if args.output == "-" else args.output, index=False)
+    print("%d evaluations in %.2f s: %.0f evaluations/s" % (n, seconds, n/seconds if seconds > 0 else 0),
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+###############################################################################
+# LOCAL HTTP SERVICE FOR THE AIR QUALITY CODE
+###############################################################################
+
+# Serves street analyses over HTTP from a pool of pre-forked worker processes.
+# Each worker imports the air quality code (numpy, scipy, pandas) and reads
+# the met station locations, the wind data of every station and its wind
+# climatology for every street direction once when the pool starts, so a
+# request only pays for the calculation itself.
+#
+#   python air_quality_server.py --port 8000 --workers 4 --queue-size 16
+#   python air_quality_server.py --met-store meteorology/met_store.bin
+#
+# POST the same scenario JSON the user interface builds (lat, lng, wind,
+# objects, no2_bg_concentration, pm2p5_bg_concentration) to "/". The response
+# body is the street dictionary, or {"error": message}. The X-Latency-Ms header
+# gives the time spent on the request (queue wait included).
+
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import air_quality_code
+from air_quality_met import compass_points
+
+
+# ___________ worker processes ___________
+
+def warm_worker(met_store=None):
+    if met_store is not None:
+        air_quality_code.use_met_store(met_store)
+    # the met data are shared by every request, so read them up front: the
+    # station locations, and the wind data and climatology of every station
+    for station_id in air_quality_code.load_sites()["station"]:
+        air_quality_code.read_station(int(station_id))
+        for point in compass_points:
+            air_quality_code.station_climatology(int(station_id), air_quality_code.street_direction(point))
+    air_quality_code.station_index()
+
+def analyse(content):
+    return air_quality_code.run_scenario(content)
+
+
+# ___________ pool with a bounded queue ___________
+
+# seconds a request waits for its result before answering 504
+default_timeout = 120
+
+class StreetPool:
+    """Pre-forked worker processes with a limit on the requests waiting for them.
+    
+    At most workers + queue_size tasks are queued or running at once; submit
+    returns None straight away when that limit is reached. A task keeps its
+    slot until it is done, even if its request has timed out. If a worker
+    dies, its tasks fail with BrokenProcessPool (freeing their slots) and the
+    next request starts a new set of workers.
+    """
+    
+    def __init__(self, workers, queue_size, met_store=None):
+        self.workers = workers
+        self.met_store = met_store
+        self.lock = threading.Lock()
+        self.executor = self.start()
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+    
+    def start(self):
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("fork"),
+                                       initializer=warm_worker, initargs=(self.met_store,))
+        # fork and warm the workers now rather than on the first request
+        executor.submit(int).result()
+        return executor
+    
+    def submit(self, content, timeout=default_timeout):
+        if not self.slots.acquire(blocking=False):
+            return None
+        try:
+            executor = self.executor
+            try:
+                future = executor.submit(analyse, content)
+            except BrokenProcessPool:
+                with self.lock:
+                    if self.executor is executor:
+                        executor.shutdown(wait=False)
+                        self.executor = self.start()
+                future = self.executor.submit(analyse, content)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(self.done)
+        return future.result(timeout)
+    
+    def done(self, future):
+        # called when a task finishes, raises or is lost with its worker
+        self.slots.release()
+    
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# ___________ HTTP handler ___________
+
+class StreetHandler(BaseHTTPRequestHandler):
+    
+    # set on the class by serve()
+    pool = None
+    timeout_s = default_timeout
+    
+    def send_json(self, status, body, start):
+        data = json.dumps(body).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-Latency-Ms", "%.1f" % ((time.perf_counter() - start)*1000))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def do_GET(self):
+        start = time.perf_counter()
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok"}, start)
+        else:
+            self.send_json(404, {"error": "Not found"}, start)
+    
+    def do_POST(self):
+        start = time.perf_counter()
+        if self.path != "/":
+            self.send_json(404, {"error": "Not found"}, start)
+            return
+        
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            content = json.loads(self.rfile.read(length).decode("utf8"))
+        except ValueError as e:
+            self.send_json(400, {"error": "Invalid scenario JSON: %s" % e}, start)
+            return
+        
+        try:
+            street = self.pool.submit(content, timeout=self.timeout_s)
+        except TimeoutError:
+            self.send_json(504, {"error": "Timed out"}, start)
+            return
+        except BrokenProcessPool:
+            self.send_json(500, {"error": "Worker process died"}, start)
+            return
+        
+        if street is None:
+            self.send_json(503, {"error": "Server busy, queue is full"}, start)
+        else:
+            self.send_json(200, street, start)
+
+
+def serve(host, port, workers, queue_size, timeout_s=default_timeout, met_store=None):
+    pool = StreetPool(workers, queue_size, met_store)
+    StreetHandler.pool = pool
+    StreetHandler.timeout_s = timeout_s
+    server = ThreadingHTTPServer((host, port), StreetHandler)
+    print("Serving street analyses on http://%s:%d with %d workers" % (host, port, workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve GI4RAQ street analyses over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of pre-forked worker processes (default: number of CPUs)")
+    parser.add_argument("--queue-size", type=int, default=None,
+                        help="requests allowed to wait for a free worker (default: 2 x workers)")
+    parser.add_argument("--timeout", type=float, default=default_timeout,
+                        help="seconds to wait for a result before answering 504 (default: %d)" % default_timeout)
+    parser.add_argument("--met-store", default=None,
+                        help="local met store file (see air_quality_met.py) instead of downloading the met data")
+    args = parser.parse_args(argv)
+    
+    queue_size = args.queue_size if args.queue_size is not None else 2*args.workers
+    serve(args.host, args.port, args.workers, queue_size, args.timeout, args.met_store)
+
+
+if __name__ == "__main__":
+    main()
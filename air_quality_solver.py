@@ -0,0 +1,276 @@
+###############################################################################
+# SOLVING THE SYSTEMS OF EQUATIONS
+###############################################################################
+
+# Every street gives 8 A matrices (no barriers / with the new barrier, for wind
+# left to right, right to left and the two parallel dimensionings) and each is
+# solved for the NO2 and the PM2.5 right-hand sides. All 8 matrices (or those
+# of many streets) are stacked and solved in a single call, each with all of
+# its right-hand sides together as the columns of one block.
+#
+# Each box only exchanges with the boxes to its left/right and above/below, so
+# with the boxes numbered row by row (C11..C15, C21..C25, C31..C35) an A matrix
+# only has entries on the main diagonal and the diagonals 1 and 5 (one row of
+# boxes) either side of it. The banded solver stores and solves just those;
+# the dense stacked solve stays the reference. A street prepared with
+# banded=True (air_quality_code.prepare_street) has its A matrices assembled
+# straight into that storage; n x n ones are converted (band_storage). The
+# bandwidth comes from the street's number of columns (street_bandwidth).
+
+import numpy as np
+from scipy.linalg import lu_factor, lu_solve, solve_banded
+
+
+# each A matrix with its right-hand sides, and the name of the concentrations
+# each of those gives: (A matrix, [(NO2 rhs, C), (PM2.5 rhs, C)])
+systems = [
+    ("a1_orig", [("d1_orig", "C1_orig"), ("d3_orig", "C3_orig")]),
+    ("a2_orig", [("d2_orig", "C2_orig"), ("d4_orig", "C4_orig")]),
+    ("a1_mir", [("d1_mir", "C1_mir"), ("d3_mir", "C3_mir")]),
+    ("a2_mir", [("d2_mir", "C2_mir"), ("d4_mir", "C4_mir")]),
+    ("a1_par_1", [("d1_orig_par", "C1_par_1"), ("d3_orig_par", "C3_par_1")]),
+    ("a2_par_1", [("d2_orig_par", "C2_par_1"), ("d4_orig_par", "C4_par_1")]),
+    ("a1_par_2", [("d1_mir_par", "C1_par_2"), ("d3_mir_par", "C3_par_2")]),
+    ("a2_par_2", [("d2_mir_par", "C2_par_2"), ("d4_mir_par", "C4_par_2")]),
+]
+
+
+def solve_factorised(a, rhs):
+    """Solve a x = rhs with a single LU factorisation of a.
+
+    rhs is one right-hand side (n,) or several as the columns of an (n, k)
+    block; the solution has the same shape.
+    """
+
+    return lu_solve(lu_factor(a), rhs)
+
+
+def street_bandwidth(state):
+    # the furthest diagonal of a street's A matrices from the main one: the
+    # number of boxes in a row (columns)
+    return len(state["l_original"]) - 1
+
+
+def band_storage(a, bandwidth):
+    """Diagonal ordered form of an A matrix, as scipy.linalg.solve_banded takes it.
+
+    bandwidth is the number of boxes in a row (see street_bandwidth); only
+    the diagonals 0, 1 and bandwidth either side of the main one are copied
+    across, the others are left as zeros.
+    """
+
+    n = a.shape[0]
+    ab = np.zeros((2*bandwidth + 1, n))
+    for k in sorted({-bandwidth, -1, 0, 1, bandwidth}):
+        if k >= 0:
+            ab[bandwidth - k, k:] = np.diagonal(a, offset=k)
+        else:
+            ab[bandwidth - k, :n + k] = np.diagonal(a, offset=k)
+    return ab
+
+
+def as_bands(a, bandwidth):
+    # an A matrix in diagonal ordered form, converting it if it is n x n
+    if a.shape[0] == a.shape[1]:
+        return band_storage(a, bandwidth)
+    if a.shape[0] != 2*bandwidth + 1:
+        raise ValueError("Banded A matrix has %d diagonals, expected %d for %d columns"
+                         % (a.shape[0], 2*bandwidth + 1, bandwidth))
+    return a
+
+
+def solve_band(ab, rhs):
+    """Solve a banded system given in diagonal ordered form (see band_storage).
+
+    The bandwidth is that of ab: 2*bandwidth + 1 diagonals.
+    """
+
+    bandwidth = (ab.shape[0] - 1)//2
+    return solve_banded((bandwidth, bandwidth), ab, rhs)
+
+
+# existing conditions matrix each new barrier matrix is an update of
+barrier_updates = {"a2_orig": "a1_orig", "a2_mir": "a1_mir", "a2_par_1": "a1_par_1", "a2_par_2": "a1_par_2"}
+
+# most rows (or columns) a new barrier may change for its matrix to be solved
+# as an update of the existing conditions one; beyond that it is factorised
+max_update_rank = 5
+
+# capacitance matrices worse conditioned than this are not trusted
+max_update_condition = 1e10
+
+
+def low_rank_update(a, a_new):
+    """Write a_new - a as u @ v, with u (n, k) and v (k, n).
+
+    k is the number of rows, or of columns if fewer, in which the two
+    matrices differ; a new barrier usually only changes a couple of rows.
+    """
+
+    d = a_new - a
+    rows = np.flatnonzero((d != 0).any(axis=1))
+    cols = np.flatnonzero((d != 0).any(axis=0))
+    identity = np.eye(len(a))
+    if len(rows) <= len(cols):
+        return identity[:,rows], d[rows]
+    return d[:,cols], identity[cols]
+
+
+def solve_updated(lu, a, a_new, rhs, max_rank=max_update_rank):
+    """Solve a_new x = rhs reusing lu, the LU factorisation (lu_factor) of a.
+
+    a_new is taken as a low-rank update of a (see low_rank_update) and solved
+    with the Sherman-Morrison-Woodbury formula: one solve with lu for rhs and
+    the k update columns together, then a k x k system. Falls back to
+    factorising a_new when more than max_rank rows/columns change or the
+    update is near singular.
+    """
+
+    u, v = low_rank_update(a, a_new)
+    k = u.shape[1]
+    if k == 0:
+        return lu_solve(lu, rhs)
+    if k > max_rank:
+        return solve_factorised(a_new, rhs)
+
+    b = rhs.reshape(len(a), -1)
+    solved = lu_solve(lu, np.hstack((b, u)))
+    x, z = solved[:,:b.shape[1]], solved[:,b.shape[1]:]
+
+    capacitance = np.eye(k) + v @ z
+    if np.linalg.cond(capacitance) > max_update_condition:
+        return solve_factorised(a_new, rhs)
+    return (x - z @ np.linalg.solve(capacitance, v @ x)).reshape(rhs.shape)
+
+
+def solve_stacked(a, rhs):
+    """Solve a whole stack of systems a[i] x[i] = rhs[i] in one call.
+
+    a is (m, n, n) and rhs (m, n, k), e.g. (8, 15, 15) and (8, 15, 2) for
+    one street or (N*8, 15, 15) and (N*8, 15, k) for N streets. Like the
+    scipy solvers, raises a ValueError if a or rhs holds infs or NaNs (e.g. a
+    column of zero width), as np.linalg.solve would return NaNs for them.
+    """
+
+    if not (np.isfinite(a).all() and np.isfinite(rhs).all()):
+        raise ValueError("array must not contain infs or NaNs")
+    return np.linalg.solve(a, rhs)
+
+
+def solve_systems_many(states, extra_rhs=None, solver="dense"):
+    """Concentrations for all 8 systems of each of many streets, in one stacked solve.
+
+    states is a list of street states holding the A matrices and right-hand
+    sides (see systems), extra_rhs an optional list with one extra_rhs
+    dictionary (or None) per state, as for solve_systems. Returns one
+    concentrations dictionary per state.
+
+    solver is "dense" (one stacked solve, the reference), "banded" (each
+    matrix solved from its nonzero diagonals only) or "update" (each
+    existing conditions matrix factorised once and its new barrier matrix
+    solved as a low-rank update of it, see solve_updated).
+    """
+
+    if solver not in ("dense", "banded", "update"):
+        raise ValueError("Unknown solver: %s" % solver)
+
+    if extra_rhs is None:
+        extra_rhs = [None]*len(states)
+
+    # extra right-hand sides as (15, k) blocks; they go after the NO2 and
+    # PM2.5 columns, and systems with fewer of them are padded with zeros
+    extra_blocks = [{a_name: np.asarray(block, dtype=float).reshape(15, -1)
+                     for a_name, block in (extra or {}).items()} for extra in extra_rhs]
+    n_extra = max([block.shape[1] for blocks in extra_blocks for block in blocks.values()] or [0])
+
+    n = len(systems)
+    if solver == "banded":
+        bandwidth = street_bandwidth(states[0])
+        a = np.zeros((len(states)*n, 2*bandwidth + 1, 15))
+    else:
+        a = np.zeros((len(states)*n, 15, 15))
+    rhs = np.zeros((len(states)*n, 15, 2 + n_extra))
+    for i, (state, blocks) in enumerate(zip(states, extra_blocks)):
+        if solver == "banded" and street_bandwidth(state) != bandwidth:
+            raise ValueError("Streets with %d and %d columns cannot be solved together"
+                             % (bandwidth, street_bandwidth(state)))
+        for j, (a_name, rhs_names) in enumerate(systems):
+            a[i*n + j] = as_bands(state[a_name], bandwidth) if solver == "banded" else state[a_name]
+            for k, (d_name, _) in enumerate(rhs_names):
+                rhs[i*n + j,:,k] = state[d_name]
+            if a_name in blocks:
+                rhs[i*n + j,:,2:2 + blocks[a_name].shape[1]] = blocks[a_name]
+
+    if solver == "banded":
+        solution = np.stack([solve_band(a[m], rhs[m]) for m in range(len(a))])
+    elif solver == "update":
+        solution = np.zeros_like(rhs)
+        index = {a_name: j for j, (a_name, _) in enumerate(systems)}
+        for i in range(len(states)):
+            lus = {}
+            for j, (a_name, _) in enumerate(systems):
+                m = i*n + j
+                if a_name in barrier_updates:
+                    existing = i*n + index[barrier_updates[a_name]]
+                    solution[m] = solve_updated(lus[existing], a[existing], a[m], rhs[m])
+                else:
+                    lus[m] = lu_factor(a[m])
+                    solution[m] = lu_solve(lus[m], rhs[m])
+    else:
+        solution = solve_stacked(a, rhs)
+
+    all_concs = []
+    for i, (extra, blocks) in enumerate(zip(extra_rhs, extra_blocks)):
+        concs = {}
+        for j, (a_name, rhs_names) in enumerate(systems):
+            for k, (_, c_name) in enumerate(rhs_names):
+                concs[c_name] = solution[i*n + j,:,k]
+            if a_name in blocks:
+                concs.setdefault("extra", {})[a_name] = (
+                    solution[i*n + j,:,2:2 + blocks[a_name].shape[1]].reshape(np.shape(extra[a_name])))
+        all_concs.append(concs)
+
+    return all_concs
+
+
+def solve_systems(state, extra_rhs=None, solver="dense"):
+    """Concentrations for all 8 systems of a street.
+
+    state holds the A matrices and right-hand sides (see systems). Returns a
+    dictionary of concentration vectors keyed C1_orig, C3_orig, ... If
+    extra_rhs is given, it maps A matrix names to further right-hand sides,
+    (15,) or (15, k), e.g. for other species; these are solved with the same
+    matrices and returned under "extra", keyed by A matrix name. solver is
+    "dense", "banded" or "update", as for solve_systems_many.
+    """
+
+    return solve_systems_many([state], [extra_rhs], solver)[0]
+
+
+def solve_barrier_designs(state, designs, max_rank=max_update_rank):
+    """New barrier concentrations for many barrier designs on one street.
+
+    state is a street state and designs further states of the same street
+    with other new barriers. The existing conditions matrices of state are
+    factorised once and the new barrier matrices of each design solved as
+    low-rank updates of them (see solve_updated), so each extra design costs
+    a few small solves. Returns one dictionary per design with the new
+    barrier concentrations (C2_orig, C4_orig, ...).
+    """
+
+    lus = {existing: lu_factor(state[existing]) for existing in barrier_updates.values()}
+
+    all_concs = []
+    for design in designs:
+        concs = {}
+        for a_name, rhs_names in systems:
+            if a_name not in barrier_updates:
+                continue
+            existing = barrier_updates[a_name]
+            rhs = np.stack([design[d_name] for d_name, _ in rhs_names], axis=-1)
+            solution = solve_updated(lus[existing], state[existing], design[a_name], rhs, max_rank)
+            for k, (_, c_name) in enumerate(rhs_names):
+                concs[c_name] = solution[:,k]
+        all_concs.append(concs)
+
+    return all_concs
@@ -0,0 +1,245 @@
+###############################################################################
+# PARAMETER SWEEPS
+###############################################################################
+
+# Runs one street over every combination of a set of parameter values, as the
+# Gromke et al (2016) comparison in applied_case_studies/GROMKE.py does by
+# hand (editing the barrier height, position and obstruction, one run at a
+# time), and writes the results as one tidy table.
+#
+#   python air_quality_sweep.py base.json --barrier-height 1:3:0.25 \
+#       --obstruction 50,75,90 --position upwind,downwind -o sweep.csv
+#
+# base.json is a scenario as the user interface builds it (or its base64
+# string), with a new barrier if any of the barrier parameters are swept.
+# Values are given as a list (1,1.5,2) or a range start:stop:step, stop
+# included. The parameters are
+#   barrier_height         height of the new barrier (m)
+#   obstruction            obstruction of the new barrier (%)
+#   position               upwind (in RZ1) or downwind (in RZ2): the receptor
+#                          zone the new barrier stands in
+#   roadway_width          total width of the emission zones (m): every
+#                          emissions_zone is scaled by the same factor to
+#                          give it; other zones keep their widths
+#   left_building_height   height of BL1 (m)
+#   right_building_height  height of BL2 (m)
+#
+# The full Cartesian product is run across a process pool, in chunks that are
+# each solved in one stacked call (see air_quality_batch). One CSV row is
+# written per scenario and box, in order:
+#   scenario, <parameters>, status, error, row, cell, x_min, x_max, z_min,
+#   z_max, per_change_no2, per_change_pm25
+# Scenarios that fail the layout checks (or raise) get a single row with the
+# error and no box.
+
+import argparse
+import csv
+import functools
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import air_quality_code
+from air_quality_batch import decode_scenario, warm_worker
+
+
+sweep_parameters = ["barrier_height", "obstruction", "position", "roadway_width", "left_building_height",
+                    "right_building_height"]
+
+# receptor zone the new barrier stands in for each position
+barrier_zones = {"upwind": "RZ1", "downwind": "RZ2"}
+
+
+# ___________ sweep values ___________
+
+def parse_values(text, parameter=None):
+    """Values of a parameter from a list (a,b,c) or range (start:stop:step)."""
+
+    if parameter == "position":
+        values = [v.strip() for v in text.split(",")]
+        for v in values:
+            if v not in barrier_zones:
+                raise ValueError("Unknown position: %s (upwind or downwind)" % v)
+        return values
+
+    if ":" in text:
+        start, stop, step = (float(v) for v in text.split(":"))
+        if step <= 0 or stop < start:
+            raise ValueError("Invalid range: %s" % text)
+        # stop included, allowing for rounding in the step
+        n = int((stop - start)/step + 1e-9) + 1
+        return [round(start + k*step, 10) for k in range(n)]
+    return [float(v) for v in text.split(",")]
+
+
+def sweep_points(grid):
+    """Every combination of the values in grid ({parameter: values}), in order.
+
+    The last parameter varies fastest; each point is a dictionary.
+    """
+
+    for parameter in grid:
+        if parameter not in sweep_parameters:
+            raise ValueError("Unknown sweep parameter: %s" % parameter)
+    names = list(grid)
+    for values in itertools.product(*(grid[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+# ___________ building the scenarios ___________
+
+def number(value):
+    # numbers as the user interface writes them into the objects
+    return str(float(value))
+
+def sweep_content(base, point):
+    """The base scenario with the parameter values of point applied."""
+
+    objects = json.loads(base["objects"])
+    by_name = {item["name"]: item for item in objects}
+
+    if "left_building_height" in point:
+        by_name["BL1"]["height"] = number(point["left_building_height"])
+    if "right_building_height" in point:
+        by_name["BL2"]["height"] = number(point["right_building_height"])
+
+    if "roadway_width" in point:
+        zones = [item for item in objects if item["type"] == "emissions_zone"]
+        total = sum(float(item["width"]) for item in zones)
+        if point["roadway_width"] <= 0:
+            raise ValueError("Roadway width %s is not positive" % point["roadway_width"])
+        for item in zones:
+            item["width"] = number(round(float(item["width"])*point["roadway_width"]/total, 4))
+
+    barrier_keys = ("barrier_height", "obstruction", "position")
+    if any(key in point for key in barrier_keys):
+        zone = next((item for item in objects if item.get("gi4raq_barrier")), None)
+        if zone is None:
+            raise ValueError("The base scenario has no new barrier to sweep")
+        barrier = zone["gi4raq_barrier"][0]
+        if "barrier_height" in point:
+            barrier["height"] = number(point["barrier_height"])
+        if "obstruction" in point:
+            barrier["obst"] = number(point["obstruction"])
+        if "position" in point:
+            target = by_name[barrier_zones[point["position"]]]
+            if target is not zone:
+                target["gi4raq_barrier"], zone["gi4raq_barrier"] = zone["gi4raq_barrier"], []
+                # keep it within its new zone
+                barrier["where_in_zone"] = number(min(float(barrier["where_in_zone"]), float(target["width"])))
+
+    return dict(base, objects=json.dumps(objects))
+
+
+# ___________ running the sweep ___________
+
+def run_chunk(base, points):
+    # streets for a chunk of sweep points, solved in one stacked call
+    streets = [None]*len(points)
+    contents = []
+    for i, point in enumerate(points):
+        try:
+            contents.append((i, sweep_content(base, point)))
+        except Exception as e:
+            # a bad value or base scenario only fails its own point
+            streets[i] = {"error": "Sweep error: %s: %s" % (type(e).__name__, e)}
+    for (i, _), street in zip(contents, air_quality_code.run_scenarios([c for _, c in contents])):
+        streets[i] = street
+    return streets
+
+
+def table_rows(index, point, names, street):
+    """Rows of the results table for one scenario: one per box."""
+
+    values = [point.get(name, "") for name in names]
+    if "error" in street:
+        return [[index] + values + ["error", street["error"]] + [""]*8]
+
+    x = street["columns"]
+    z = street["rows"]
+    n_cells = len(x) - 1
+    rows = []
+    for r in range(len(z) - 1):
+        for c in range(n_cells):
+            k = r*n_cells + c
+            rows.append([index] + values + ["ok", "", r + 1, c + 1, x[c], x[c + 1], z[r], z[r + 1],
+                         street["per_change_no2"][k], street["per_change_pm25"][k]])
+    return rows
+
+
+def run_sweep(base, grid, output, workers=None, chunksize=None, met_store=None):
+    """Run base over every combination in grid across a process pool.
+
+    Writes the results table (see the top of this file) as CSV to output.
+    Returns (number of scenarios, number of errors, seconds taken).
+    """
+
+    start = time.perf_counter()
+    names = list(grid)
+    points = list(sweep_points(grid))
+
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, min(64, len(points)//(workers*4)))
+    chunks = [points[i:i + chunksize] for i in range(0, len(points), chunksize)]
+
+    writer = csv.writer(output)
+    writer.writerow(["scenario"] + names + ["status", "error", "row", "cell", "x_min", "x_max", "z_min", "z_max",
+                                            "per_change_no2", "per_change_pm25"])
+    n_errors = 0
+    index = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_worker, initargs=(met_store,)) as pool:
+        for chunk, streets in zip(chunks, pool.map(functools.partial(run_chunk, base), chunks)):
+            for point, street in zip(chunk, streets):
+                if "error" in street:
+                    n_errors += 1
+                writer.writerows(table_rows(index, point, names, street))
+                index += 1
+
+    return len(points), n_errors, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a GI4RAQ street over a grid of parameter values.")
+    parser.add_argument("base", help="scenario file (JSON or base64) to vary")
+    for parameter in sweep_parameters:
+        parser.add_argument("--" + parameter.replace("_", "-"), dest=parameter, default=None,
+                            help="values to sweep: a,b,c or start:stop:step"
+                            if parameter != "position" else "upwind, downwind or both")
+    parser.add_argument("--output", "-o", default="-", help="results CSV (default: stdout)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="scenarios handed to a worker at a time")
+    parser.add_argument("--met-store", default=None,
+                        help="local met store file (see air_quality_met.py) instead of downloading the met data")
+    args = parser.parse_args(argv)
+
+    with open(args.base, encoding="utf8") as f:
+        base = decode_scenario(f.read())
+    grid = {}
+    for parameter in sweep_parameters:
+        text = getattr(args, parameter)
+        if text is not None:
+            try:
+                grid[parameter] = parse_values(text, parameter)
+            except ValueError as e:
+                parser.error(str(e))
+    if not grid:
+        parser.error("give at least one parameter to sweep")
+
+    if args.output == "-":
+        n, n_errors, seconds = run_sweep(base, grid, sys.stdout, args.workers, args.chunksize, args.met_store)
+    else:
+        with open(args.output, "w", encoding="utf8", newline="") as output:
+            n, n_errors, seconds = run_sweep(base, grid, output, args.workers, args.chunksize, args.met_store)
+
+    print("%d scenarios (%d errors) in %.2f s: %.1f scenarios/s"
+          % (n, n_errors, seconds, n/seconds if seconds > 0 else 0), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+###############################################################################
+# MONTE CARLO UNCERTAINTY
+###############################################################################
+
+# The results of the model are "subject to large (unspecified) uncertainties"
+# (see the disclaimer in air_quality_code). This puts numbers on them for a
+# street: the uncertain inputs are sampled from their distributions thousands
+# of times and the percentage change of every box is given as percentile
+# bands.
+#
+#   python air_quality_uncertainty.py base.json --samples 2000 \
+#       --distributions distributions.json -o bands.csv
+#
+# The uncertain inputs are all factors on their nominal values:
+#   obstruction            obstruction of each barrier (one factor per
+#                          barrier, capped at 99 % as in barrier_obstruction)
+#   horizontal_dispersion  ue_ratio, we_ratio and recirc_ratio of the flow
+#   vertical_dispersion    patterns (see pattern_constants): dispersion as a
+#   recirculation          fraction of the advection, recirculation speed as
+#                          a fraction of the wind speed at roof level
+#   emission_factors       emission factor of each vehicle class and
+#                          pollutant (see emission_factors)
+#   background             NO2 and PM2.5 background concentrations
+#   wind_speed             wind speed of each sector of the met station
+# Each has a distribution: {"distribution": "uniform", "low": 0.8, "high":
+# 1.2}, "normal" (mean, default 1, and sd; negative values are cut to 0),
+# "lognormal" (sigma, median 1), "triangular" (low, mode, high) or "fixed"
+# (value, default 1). A JSON file of {input: distribution} replaces the
+# defaults (default_distributions) of the inputs it names.
+#
+# The samples are evaluated together rather than street by street: the flow
+# patterns of all of them in one call of the batched kernels (see
+# air_quality_kernels, compiled if Numba is installed) at 1 m/s, each system
+# solved for unit sources in one stacked call, and the concentrations then
+# put together for each sample's emissions, backgrounds and wind speeds (as
+# air_quality_code.unit_speed_concs does). The boxes of the street output are
+# weighted combinations of the percentage changes of the 4 wind cases (as in
+# air_quality_adjoint), which is one matrix product for all samples.
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import air_quality_code
+from air_quality_adjoint import receptor_weights, wind_cases
+from air_quality_batch import decode_scenario
+from air_quality_code import (a_matrix, emission_factors, fleet_shares, parallel_patterns, pattern_constants,
+                              prepare_street, ratios, read_station, select_station, solve_street, source_matrix,
+                              street_direction, system_cases, system_emissions, system_speeds)
+from air_quality_kernels import flow_names, stack_streets, street_patterns
+from air_quality_met import sector_climatology
+from air_quality_solver import solve_stacked
+
+
+uncertain_inputs = ["obstruction", "horizontal_dispersion", "vertical_dispersion", "recirculation",
+                    "emission_factors", "background", "wind_speed"]
+
+default_distributions = {
+    "obstruction": {"distribution": "uniform", "low": 0.8, "high": 1.2},
+    "horizontal_dispersion": {"distribution": "uniform", "low": 0.5, "high": 1.5},
+    "vertical_dispersion": {"distribution": "uniform", "low": 0.5, "high": 1.5},
+    "recirculation": {"distribution": "uniform", "low": 0.5, "high": 1.5},
+    "emission_factors": {"distribution": "lognormal", "sigma": 0.3},
+    "background": {"distribution": "normal", "sd": 0.1},
+    "wind_speed": {"distribution": "normal", "sd": 0.1},
+}
+
+# samples evaluated at a time (bounds the memory of the stacked systems)
+chunk_size = 1000
+
+# wind speeds of the systems, in the order of SampledStreet's ubg columns
+speed_names = ["ubg_orig", "ubg_mir", "ubg_parallel"]
+
+
+# ___________ sampling ___________
+
+def sample_factors(spec, rng, size):
+    """Factors drawn from a distribution (see the top of this file)."""
+
+    distribution = spec.get("distribution", "fixed")
+    if distribution == "uniform":
+        return rng.uniform(spec["low"], spec["high"], size)
+    if distribution == "normal":
+        return np.maximum(rng.normal(spec.get("mean", 1), spec["sd"], size), 0)
+    if distribution == "lognormal":
+        return rng.lognormal(0, spec["sigma"], size)
+    if distribution == "triangular":
+        return rng.triangular(spec["low"], spec["mode"], spec["high"], size)
+    if distribution == "fixed":
+        return np.full(size, float(spec.get("value", 1)))
+    raise ValueError("Unknown distribution: %s" % distribution)
+
+
+# ___________ the batched street ___________
+
+class SampledStreet:
+    """A street evaluated for many samples of its inputs at once.
+
+    Lays the street out once (prepare_street) and evaluates batches of
+    samples of the inputs the flows, emissions and wind speeds depend on
+    (see evaluate).
+    """
+
+    def __init__(self, content):
+        self.content = content
+        self.state, message = prepare_street(content)
+        if message is not None:
+            raise ValueError(message)
+
+        # the flows at 1 m/s, which all scale with the background wind speed
+        self.unit = dict(self.state, ubg_orig=1.0, ubg_mir=1.0, ubg_parallel=1.0)
+        self.inputs = stack_streets([self.unit])
+        self.ez_no2, self.ez_pm25 = system_emissions(self.state)
+        self.speeds = np.array([speed_names.index(system_speeds[case[0]]) for case in system_cases])
+
+        # each box of the street output from the percentage changes of the
+        # new barrier systems of the 4 wind cases
+        self.street = solve_street(self.state)
+        n_out = len(self.street["per_change_no2"])
+        weights = [receptor_weights(self.state, k) for k in range(n_out)]
+        index = {case[0]: k for k, case in enumerate(system_cases)}
+        self.cases = [(index[existing], index[new]) for existing, new, _, _ in wind_cases]
+        self.weights = np.stack([np.stack([w[new] for w in weights], axis=-1) for _, new, _, _ in wind_cases])
+
+        wind = read_station(select_station(content))
+        self.wind = {k: wind[k].to_numpy() for k in ("wind_direction", "fractional_occur", "wind_speed")}
+        self.street_dir = street_direction(content["wind"])
+
+    # ___________ inputs ___________
+
+    def nominal(self, n=1):
+        """n samples of the nominal inputs (see evaluate)."""
+
+        return {"obs_original": np.tile(self.state["obs_original"], (n, 1)),
+                "constants": np.tile(pattern_constants, (n, 1)),
+                "emissions": np.ones((n, 2)),
+                "background": np.tile([self.state["cB_no2"], self.state["cB_pm25"]], (n, 1)),
+                "ubg": np.tile([self.state[k] for k in speed_names], (n, 1))}
+
+    def obstruction(self, factors):
+        # obstruction of each barrier (n, 4) for factors (n, 4)
+        return np.minimum(self.state["obs_original"]*factors, 0.99)
+
+    def emission_scale(self, no2_factors, pm25_factors):
+        # total emission relative to the nominal (n, 2) for factors (n, 5) on
+        # the emission factors of each vehicle class
+        scales = []
+        for ef, factors in zip(emission_factors(), (no2_factors, pm25_factors)):
+            scales.append((fleet_shares*ef*factors).sum(axis=-1)/(fleet_shares*ef).sum())
+        return np.stack(scales, axis=-1)
+
+    def wind_speeds(self, factors):
+        # ubg_orig, ubg_mir, ubg_parallel (n, 3) for factors (n, sectors) on
+        # the wind speed of each sector (not the calm row)
+        speed = np.tile(self.wind["wind_speed"], (len(factors), 1))
+        speed[:,1:] = speed[:,1:]*factors
+        climatology = sector_climatology(self.wind["wind_direction"], self.wind["fractional_occur"], speed,
+                                         self.street_dir)
+        return np.stack([climatology[k] for k in speed_names], axis=-1)
+
+    # ___________ evaluation ___________
+
+    def flows(self, obs_original, constants, backend=None):
+        # u, U, w, W (n, 8, 5, 6) of all systems at 1 m/s
+        n = len(obs_original)
+        inputs = {k: np.repeat(v, n, axis=0) for k, v in self.inputs.items()}
+        inputs["obs"] = np.concatenate((obs_original, obs_original[:,[2, 3, 0, 1]]))
+        inputs["constants"] = np.concatenate((constants, constants))
+        _, patterns = street_patterns(inputs, backend)
+
+        # along the street: dispersion only, cheap enough street by street
+        parallel = np.zeros((n, 4, 4, 5, 6))
+        for i in range(n):
+            flows = parallel_patterns(dict(self.unit, obs_original=obs_original[i],
+                                           obs_mirror=obs_original[i][[2, 3, 0, 1]]), constants[i])
+            for p in range(4):
+                for f, name in enumerate(flow_names):
+                    parallel[i,p,f] = flows["%s%d_par" % (name, p + 1)]
+
+        sides = {"orig": patterns[:n], "mir": patterns[n:], "par": parallel}
+        u, U, w, W = (np.stack([sides[names[f].split("_")[1]][:,int(names[f][2]) - 1,f]
+                                for *_, names in system_cases], axis=1) for f in range(4))
+        return u, U, w, W
+
+    def evaluate(self, samples, backend=None):
+        """Percentage change of every box for each sample.
+
+        samples holds, for n samples: "obs_original" (n, 4), the obstruction
+        of the barriers; "constants" (n, 3), see pattern_constants;
+        "emissions" (n, 2), NO2 and PM2.5 emissions relative to the nominal;
+        "background" (n, 2), the NO2 and PM2.5 backgrounds; "ubg" (n, 3), the
+        background wind speeds (ubg_orig, ubg_mir, ubg_parallel). Returns
+        (no2, pm25), each (n, boxes) laid out as the street output.
+        """
+
+        n = len(samples["obs_original"])
+        changes = np.zeros((2, n, self.weights.shape[-1]))
+        for start in range(0, n, chunk_size):
+            part = {k: np.asarray(v, dtype=float)[start:start + chunk_size] for k, v in samples.items()}
+            changes[:,start:start + chunk_size] = self.evaluate_chunk(part, backend)
+        return changes[0], changes[1]
+
+    def evaluate_chunk(self, samples, backend=None):
+        u, U, w, W = self.flows(samples["obs_original"], samples["constants"], backend)
+        h = np.stack([self.unit["h_" + ("original" if case[3] == "orig" else "mirror")] for case in system_cases])
+        l = np.stack([self.unit["l_" + ("original" if case[3] == "orig" else "mirror")] for case in system_cases])
+        h = np.broadcast_to(h, u.shape[:2] + h.shape[-1:])
+        l = np.broadcast_to(l, u.shape[:2] + l.shape[-1:])
+
+        # each system solved for unit sources (emission into each ground box,
+        # background) at 1 m/s
+        responses = solve_stacked(a_matrix(r=ratios(h=h, l=l), u=u, U=U, w=w, W=W), source_matrix(l=l, w=w, W=W))
+
+        # emissions go as 1/ubg, the background part does not change with it
+        ubg = samples["ubg"][:,self.speeds]
+        emissions = np.stack((self.ez_no2[:,1:], self.ez_pm25[:,1:]), axis=-1)
+        emissions = emissions*samples["emissions"][:,None,None,:]/ubg[:,:,None,None]
+        concs = (np.einsum("nkij,nkjp->nkip", responses[...,:-1], emissions)
+                 + responses[...,-1:]*samples["background"][:,None,None,:])
+
+        changes = 0
+        for (existing, new), weights in zip(self.cases, self.weights):
+            change = 100*(concs[:,new] - concs[:,existing])/concs[:,existing]
+            changes = changes + np.einsum("nip,io->pno", change, weights)
+        return changes
+
+
+# ___________ Monte Carlo ___________
+
+def draw_samples(street, n_samples, distributions=None, seed=None):
+    """Sampled factors on the uncertain inputs and the samples they give.
+
+    Returns (factors, samples): the factors drawn for each uncertain input
+    and the samples to evaluate (see SampledStreet.evaluate).
+    """
+
+    specs = dict(default_distributions, **(distributions or {}))
+    for name in specs:
+        if name not in uncertain_inputs:
+            raise ValueError("Unknown uncertain input: %s" % name)
+    rng = np.random.default_rng(seed)
+    n_sectors = len(street.wind["wind_speed"]) - 1
+
+    factors = {"obstruction": sample_factors(specs["obstruction"], rng, (n_samples, 4)),
+               "horizontal_dispersion": sample_factors(specs["horizontal_dispersion"], rng, n_samples),
+               "vertical_dispersion": sample_factors(specs["vertical_dispersion"], rng, n_samples),
+               "recirculation": sample_factors(specs["recirculation"], rng, n_samples),
+               "emission_factors": sample_factors(specs["emission_factors"], rng, (n_samples, 2, 5)),
+               "background": sample_factors(specs["background"], rng, (n_samples, 2)),
+               "wind_speed": sample_factors(specs["wind_speed"], rng, (n_samples, n_sectors))}
+
+    samples = street.nominal(n_samples)
+    samples["obs_original"] = street.obstruction(factors["obstruction"])
+    samples["constants"] = samples["constants"]*np.stack([factors["horizontal_dispersion"],
+                                                          factors["vertical_dispersion"],
+                                                          factors["recirculation"]], axis=-1)
+    samples["emissions"] = street.emission_scale(factors["emission_factors"][:,0], factors["emission_factors"][:,1])
+    samples["background"] = samples["background"]*factors["background"]
+    samples["ubg"] = street.wind_speeds(factors["wind_speed"])
+    return factors, samples
+
+
+def percentile_bands(street, no2, pm25, percentiles=(5, 50, 95)):
+    """Percentiles of the percentage change of every box over the samples.
+
+    street is the nominal street output. One row per box and pollutant: the
+    box (as in air_quality_sweep's table), the nominal change, the mean and
+    standard deviation over the samples and the percentiles ("p5", ...).
+    """
+
+    x = street["columns"]
+    z = street["rows"]
+    n_cells = len(x) - 1
+    rows = []
+    for pollutant, changes in (("no2", no2), ("pm25", pm25)):
+        bands = np.percentile(changes, percentiles, axis=0)
+        for k in range(changes.shape[1]):
+            r, c = divmod(k, n_cells)
+            row = {"row": r + 1, "cell": c + 1, "x_min": x[c], "x_max": x[c + 1], "z_min": z[r], "z_max": z[r + 1],
+                   "pollutant": pollutant, "nominal": street["per_change_" + pollutant][k],
+                   "mean": changes[:,k].mean(), "std": changes[:,k].std()}
+            row.update({"p%g" % p: bands[j,k] for j, p in enumerate(percentiles)})
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def monte_carlo(content, n_samples=2000, distributions=None, percentiles=(5, 50, 95), seed=None, backend=None):
+    """Percentile bands of every box's percentage change for a street.
+
+    content is the decoded scenario (as for compute_street); distributions
+    replaces default_distributions for the inputs it names. Returns (bands,
+    draws): the bands (see percentile_bands) and a dictionary with the
+    sampled "factors" and the "no2" and "pm25" changes of every sample
+    (n_samples, boxes).
+    """
+
+    street = SampledStreet(content)
+    factors, samples = draw_samples(street, n_samples, distributions, seed)
+    no2, pm25 = street.evaluate(samples, backend)
+    bands = percentile_bands(street.street, no2, pm25, percentiles)
+    return bands, {"factors": factors, "no2": no2, "pm25": pm25}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monte Carlo uncertainty bands of a GI4RAQ street.")
+    parser.add_argument("base", help="scenario file (JSON or base64)")
+    parser.add_argument("--samples", type=int, default=2000, help="number of samples")
+    parser.add_argument("--distributions", default=None,
+                        help="JSON file of {input: distribution} replacing the defaults")
+    parser.add_argument("--percentiles", default="5,50,95", help="percentiles to report, comma separated")
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    parser.add_argument("--backend", choices=["compiled", "interpreted"], default="interpreted",
+                        help="flow pattern kernels; compiling them takes a while in every new process, so for "
+                        "one street the interpreted ones are quicker")
+    parser.add_argument("--output", "-o", default="-", help="bands CSV (default: stdout)")
+    parser.add_argument("--met-store", default=None,
+                        help="local met store file (see air_quality_met.py) instead of downloading the met data")
+    args = parser.parse_args(argv)
+
+    if args.met_store is not None:
+        air_quality_code.use_met_store(args.met_store)
+    with open(args.base, encoding="utf8") as f:
+        content = decode_scenario(f.read())
+    distributions = None
+    if args.distributions is not None:
+        with open(args.distributions, encoding="utf8") as f:
+            distributions = json.load(f)
+    percentiles = [float(p) for p in args.percentiles.split(",")]
+
+    start = time.perf_counter()
+    bands, _ = monte_carlo(content, args.samples, distributions, percentiles, args.seed, args.backend)
+    seconds = time.perf_counter() - start
+
+    bands.to_csv(sys.stdout if args.output == "-" else args.output, index=False)
+    print("%d samples in %.2f s: %.0f samples/s" % (args.samples, seconds, args.samples/seconds if seconds > 0 else 0),
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# The adjoint sensitivities of air_quality_adjoint against the model: the
+# receptor's value is that of the street output and the derivatives match
+# central finite differences of the whole model run.
+
+import numpy as np
+import pytest
+
+import air_quality_code
+from air_quality_adjoint import adjoint_sensitivities, barrier_height_content, obstruction_systems
+from air_quality_code import assemble_systems, prepare_street, solve_street
+from test_consistency import case_streets, met_store
+
+
+receptor = 2
+step = 1e-3
+
+# largest relative difference between the adjoint and the finite difference
+# derivatives
+adjoint_tolerance = 1e-4
+
+# streets whose new barrier stands inside its zone; at the edge of a zone the
+# columns are dimensioned from the barrier on one side only, so the model has
+# a kink in the barrier's position
+interior_barriers = ["hedge upwind"]
+
+
+def receptor_value(street, pollutant):
+    return np.asarray(street["per_change_" + pollutant])[receptor]
+
+
+def finite_difference(solve):
+    # central difference of the receptor's value, both pollutants
+    plus, minus = solve(step), solve(-step)
+    return np.array([(receptor_value(plus, p) - receptor_value(minus, p))/(2*step) for p in ("no2", "pm25")])
+
+
+@pytest.fixture(scope="module")
+def states():
+    air_quality_code.use_met_store(met_store)
+    return {name: prepare_street(content)[0] for name, content in case_streets.items()}
+
+
+# (not the two carriageways street: its 1 m barrier is as high as the bottom
+# row of boxes, where the model jumps with the barrier's height)
+@pytest.mark.parametrize("name", ["example", "hedge upwind", "grey barrier", "existing barrier", "south west wind"])
+def test_adjoint_sensitivities(states, name):
+    content = case_streets[name]
+    state = states[name]
+    sensitivities = adjoint_sensitivities(content, receptor, step)
+
+    street = solve_street(state)
+    for p in ("no2", "pm25"):
+        assert np.isclose(sensitivities[p]["value"], receptor_value(street, p), rtol=1e-10)
+
+    def check(adjoint, fd):
+        np.testing.assert_allclose(adjoint, fd, rtol=adjoint_tolerance, atol=adjoint_tolerance*np.abs(fd).max())
+
+    for k in range(len(state["obs_original"])):
+        def obstruction(e):
+            obs = state["obs_original"].copy()
+            obs[k] += e
+            return solve_street(dict(state, **obstruction_systems(state, obs)))
+        check([sensitivities[p]["obs_original"][k] for p in ("no2", "pm25")], finite_difference(obstruction))
+
+    check([sensitivities[p]["barrier_height"] for p in ("no2", "pm25")],
+          finite_difference(lambda e: solve_street(prepare_street(barrier_height_content(content, e))[0])))
+
+    emissions = ["ez_tot_no2_orig", "ez_tot_no2_mir", "ez_tot_pm25_orig", "ez_tot_pm25_mir"]
+    check([sensitivities[p]["emissions"] for p in ("no2", "pm25")],
+          finite_difference(lambda e: solve_street(dict(state, **assemble_systems(
+              dict(state, **{k: state[k]*(1 + e) for k in emissions}))))))
+    check([sensitivities[p]["background"] for p in ("no2", "pm25")],
+          finite_difference(lambda e: solve_street(dict(state, **assemble_systems(
+              dict(state, cB_no2=state["cB_no2"] + e, cB_pm25=state["cB_pm25"] + e))))))
+
+    if name in interior_barriers:
+        check([sensitivities[p]["gi_loc"] for p in ("no2", "pm25")],
+              finite_difference(lambda e: solve_street(prepare_street(content, state["gi_loc"] + e)[0])))
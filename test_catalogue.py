@@ -0,0 +1,61 @@
+# The barrier catalogue of air_quality_catalogue: the designs, grouped and
+# solved as updates of their shared existing conditions, give the same
+# street output as running each design on its own.
+
+import numpy as np
+import pytest
+
+import air_quality_code
+from air_quality_catalogue import design_content, rank_designs
+from air_quality_code import compute_street
+from test_consistency import case_streets, met_store
+
+
+designs = [
+    {"name": "hedge 90", "obst": "90"},
+    {"name": "hedge 50", "obst": "50"},
+    {"name": "deciduous hedge", "seasonality": "deciduous", "obst": "80"},
+    {"name": "tall hedge", "height": "3"},
+    {"name": "wall", "type": "grey-barrier", "height": "1.5", "obst": "100"},
+    {"name": "hedge upwind", "zone": "RZ1", "where_in_zone": "1.5"},
+    {"name": "too tall", "height": "20"},
+    {"name": "nowhere", "zone": "BL1"},
+]
+
+
+@pytest.fixture(scope="module")
+def ranked():
+    air_quality_code.use_met_store(met_store)
+    return rank_designs(case_streets["example"], designs)
+
+
+def test_rank_designs(ranked):
+    ranking, boxes = ranked
+    base = case_streets["example"]
+    for design in designs:
+        row = ranking[ranking["design"] == design["name"]].iloc[0]
+        try:
+            content = design_content(base, design)[0]
+        except ValueError:
+            assert not row["feasible"]
+            continue
+        street = compute_street(content)
+        if "error" in street:
+            assert not row["feasible"]
+            continue
+
+        assert row["feasible"]
+        design_boxes = boxes[boxes["rank"] == row["rank"]]
+        for pollutant in ("no2", "pm25"):
+            np.testing.assert_allclose(design_boxes["per_change_" + pollutant].to_numpy(dtype=float),
+                                       street["per_change_" + pollutant], rtol=1e-8, atol=1e-10)
+
+
+def test_ranking_order(ranked):
+    ranking, _ = ranked
+    feasible = ranking[ranking["feasible"]]
+    assert list(ranking["rank"]) == list(range(1, len(designs) + 1))
+    assert feasible["objective"].is_monotonic_increasing
+    # infeasible designs last
+    assert list(ranking["feasible"]) == [True]*len(feasible) + [False]*(len(ranking) - len(feasible))
+    assert set(ranking[~ranking["feasible"]]["design"]) == {"too tall", "nowhere"}
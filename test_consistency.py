@@ -0,0 +1,119 @@
+# Consistency checks of the batched code paths against the model itself:
+# unit-speed rescaling of the concentrations (air_quality_code.unit_speed_check),
+# the flow pattern / emission partition kernels (air_quality_kernels.
+# parity_check) and the banded solver. Run with pytest from this folder; the met data are read from
+# the bundled met store.
+#
+# The streets are variants of the example street of air_quality_code (Town
+# Road, BL1 8 m, EZ1 16 m, BL2 10 m) with the barrier types, positions,
+# seasonality, existing barriers, carriageways and wind directions the user
+# interface offers.
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+import air_quality_code
+from air_quality_code import prepare_street, unit_speed_check
+from air_quality_kernels import numba, parity_check
+from air_quality_solver import solve_systems
+
+
+met_store = os.path.join(os.path.dirname(os.path.abspath(__file__)), "meteorology", "met_store.bin")
+
+# largest relative difference allowed between the unit-speed and the direct
+# concentrations, and largest difference between kernels and the model
+unit_speed_tolerance = 1e-9
+parity_tolerance = 1e-9
+
+
+def barrier(type="green-barrier", height=2, obst=75, where_in_zone=0, seasonality="evergreen", trees=False,
+            tseas="evergreen"):
+    item = {"name": "GI", "type": type, "where_in_zone": str(where_in_zone), "height": str(height), "width": "1",
+            "obst": str(obst), "seasonality": seasonality, "tseas": tseas, "tcth": None, "tcbh": None, "tcw": None,
+            "tsp": None, "tobst": None, "order": 0}
+    if trees:
+        item.update(type=type + "-trees", tcbh=str(height + 0.5), tcth=str(height + 2.5), tcw="3", tsp="6",
+                    tobst="60")
+    return item
+
+
+def street(wind="N", gi_zone="RZ2", gi=None, existing=(), carriageways=1, bl1=8, bl2=10):
+    def emissions_zone(name, width):
+        return {"type": "emissions_zone", "name": name, "width": str(width), "vmovement": "600",
+                "current_emissions_no2": None, "current_emissions_PM2_5": None}
+
+    objects = [
+        {"type": "building", "name": "BL1", "height": str(bl1), "width": 2},
+        {"type": "receptor_zone", "name": "RZBL1", "width": "2",
+         "existing_barrier": [{"height": str(h), "obst": o} for h, o in existing]},
+        {"type": "marker", "name": "Street Boundary 1"},
+        {"type": "receptor_zone", "name": "RZ1", "width": "3", "gi4raq_barrier": []},
+        {"type": "marker", "name": "Kerb 1"},
+        emissions_zone("EZ1", 16 if carriageways == 1 else 8),
+    ]
+    if carriageways == 2:
+        objects += [{"type": "receptor_zone", "name": "RZ3", "width": "2", "gi4raq_barrier": []},
+                    emissions_zone("EZ2", 6)]
+    objects += [
+        {"type": "marker", "name": "Kerb 2"},
+        {"type": "receptor_zone", "name": "RZ2", "width": "5", "gi4raq_barrier": []},
+        {"type": "marker", "name": "Street Boundary 2"},
+        {"type": "receptor_zone", "name": "RZBL2", "width": "1", "existing_barrier": []},
+        {"type": "building", "name": "BL2", "height": str(bl2), "width": 2},
+    ]
+    if gi is not None:
+        next(item for item in objects if item["name"] == gi_zone)["gi4raq_barrier"] = [gi]
+    return {"lat": "52.467", "lng": "-1.928", "wind": wind, "objects": json.dumps(objects),
+            "no2_bg_concentration": 15, "pm2p5_bg_concentration": 11}
+
+
+case_streets = {
+    "example": street(gi=barrier()),
+    "hedge upwind": street(gi_zone="RZ1", gi=barrier(where_in_zone=1.5)),
+    "deciduous hedge": street(gi=barrier(seasonality="deciduous", obst=90)),
+    "grey barrier": street(gi=barrier(type="grey-barrier", height=1.5, obst=100, where_in_zone=5)),
+    "hedge with trees": street(gi=barrier(trees=True, tseas="deciduous")),
+    "wall with trees": street(gi_zone="RZ1", gi=barrier(type="grey-barrier", height=1, obst=100, trees=True)),
+    "existing barrier": street(gi=barrier(), existing=[(1.5, 80)]),
+    "two carriageways": street(gi=barrier(height=1), carriageways=2),
+    "east wind": street(wind="E", gi=barrier()),
+    "south west wind": street(wind="SW", gi=barrier(height=3), bl1=12, bl2=6),
+}
+
+
+@pytest.fixture(scope="module")
+def states():
+    air_quality_code.use_met_store(met_store)
+    states = {}
+    for name, content in case_streets.items():
+        state, message = prepare_street(content)
+        assert message is None, "%s: %s" % (name, message)
+        states[name] = state
+    return states
+
+
+@pytest.mark.parametrize("name", list(case_streets))
+def test_unit_speed(states, name):
+    assert unit_speed_check(states[name]) < unit_speed_tolerance
+
+
+@pytest.mark.parametrize("backend", ["interpreted",
+                                     pytest.param("compiled", marks=pytest.mark.skipif(numba is None,
+                                                                                       reason="numba not installed"))])
+def test_kernel_parity(states, backend):
+    differences = parity_check(list(states.values()), backend)
+    assert all(difference <= parity_tolerance for difference in differences.values()), differences
+
+
+@pytest.mark.parametrize("name", list(case_streets))
+def test_banded_solver(states, name):
+    # the banded solve, from the dense matrices and from matrices assembled
+    # straight into diagonal ordered form, against the dense one
+    direct = solve_systems(states[name])
+    banded_state, _ = prepare_street(case_streets[name], banded=True)
+    for concs in (solve_systems(states[name], solver="banded"), solve_systems(banded_state, solver="banded")):
+        for k, c in direct.items():
+            np.testing.assert_allclose(concs[k], c, rtol=1e-9)
@@ -0,0 +1,40 @@
+# The finer box grids of air_quality_grid: with no subdivision they are the
+# 3x5 model, and refining them converges.
+
+import numpy as np
+import pytest
+
+import air_quality_code
+from air_quality_code import prepare_street, system_geometry
+from air_quality_grid import coarsen, refine_street, solve_grid
+from air_quality_solver import solve_systems
+from test_consistency import case_streets, met_store
+
+
+@pytest.fixture(scope="module")
+def states():
+    air_quality_code.use_met_store(met_store)
+    return {name: prepare_street(content)[0] for name, content in case_streets.items()}
+
+
+@pytest.mark.parametrize("name", list(case_streets))
+def test_no_subdivision(states, name):
+    state = states[name]
+    h, l, _, _, u, U, w, W = refine_street(state, 1, 1)
+    for fine, original in zip((h, l, u, U, w, W), system_geometry(state)):
+        assert np.array_equal(fine, original)
+
+    direct = solve_systems(state)
+    concs = solve_grid(state, 1, 1)
+    for k, c in direct.items():
+        np.testing.assert_allclose(coarsen(concs[k], 1, 1), c, rtol=1e-10)
+
+
+@pytest.mark.parametrize("name", list(case_streets))
+def test_refinement_converges(states, name):
+    # each halving of the sub-boxes changes the box averages less
+    state = states[name]
+    coarse = [coarsen(solve_grid(state, k, k)["C1_orig"], k, k) for k in (2, 4, 8, 16)]
+    changes = [np.max(np.abs(b - a)/np.abs(a)) for a, b in zip(coarse[:-1], coarse[1:])]
+    assert changes[-1] < changes[0]
+    assert changes[-1] < 0.1
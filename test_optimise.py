@@ -0,0 +1,73 @@
+# The barrier placement optimiser of air_quality_optimise: its batches give
+# the same receptor changes as the street run design by design, and the
+# search and the Pareto front keep the best designs.
+
+import json
+
+import numpy as np
+import pytest
+
+import air_quality_code
+from air_quality_code import prepare_street, solve_street
+from air_quality_optimise import (BarrierSpace, evaluate_designs, optimise_barrier, pareto_front, receptor_weights,
+                                  zone_extents)
+from test_consistency import case_streets, met_store
+
+
+@pytest.fixture(scope="module")
+def space():
+    air_quality_code.use_met_store(met_store)
+    return BarrierSpace(case_streets["example"])
+
+
+def test_evaluate_designs(space):
+    unit = np.array([[0.1, 0.2, 0.9], [0.5, 0.5, 0.5], [0.8, 0.9, 0.1], [0.95, 0.3, 0.6]])
+    designs = space.designs(unit)
+    # a barrier as tall as the taller building fails the checks
+    designs = np.vstack((designs, [designs[0, 0], 12, 50]))
+    results = evaluate_designs(space, designs)
+
+    extents = zone_extents(space.objects)
+    receptors = [extents[item["name"]] for item in space.objects if item["type"] == "receptor_zone"]
+    for i, (gi_loc, height, obstruction) in enumerate(designs[:-1]):
+        state, message = prepare_street(space.scenario(height, obstruction), gi_loc)
+        assert message is None
+        street = solve_street(state)
+        weights = receptor_weights(street, receptors)
+        assert results.at[i, "feasible"]
+        assert np.isclose(results.at[i, "no2"], weights @ np.asarray(street["per_change_no2"]), rtol=1e-10)
+        assert np.isclose(results.at[i, "pm25"], weights @ np.asarray(street["per_change_pm25"]), rtol=1e-10)
+
+    assert not results.iloc[-1]["feasible"]
+    assert results.iloc[-1]["error"]
+    assert np.isnan(results.iloc[-1]["objective"])
+
+
+def test_designs_stay_in_zones(space):
+    designs = space.designs(np.random.default_rng(1).random((200, 3)))
+    assert all(any(start <= gi_loc <= end for start, end in space.zones) for gi_loc in designs[:,0])
+    assert (designs[:,1] >= space.height[0]).all() and (designs[:,1] <= space.height[1]).all()
+
+
+def test_pareto_front():
+    no2 = [-1, -2, -3, -1, np.nan, -3]
+    pm25 = [-3, -2, -1, -1, -5, -1]
+    assert list(pareto_front(no2, pm25)) == [True, True, True, False, False, True]
+
+
+def test_optimise_barrier(space):
+    best, surface = optimise_barrier(space.content, rounds=3, batch_size=32, seed=0)
+    feasible = surface[surface["feasible"]]
+    assert best["objective"].iloc[0] == feasible["objective"].min()
+    assert best["objective"].iloc[0] <= feasible[feasible["round"] == 0]["objective"].min()
+    # the best design is never beaten on both pollutants
+    assert surface.loc[best.index[0], "pareto"]
+
+
+def test_no_barrier():
+    content = dict(case_streets["example"])
+    objects = json.loads(content["objects"])
+    for item in objects:
+        item.pop("gi4raq_barrier", None)
+    with pytest.raises(ValueError):
+        BarrierSpace(dict(content, objects=json.dumps(objects)))
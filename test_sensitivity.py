@@ -0,0 +1,81 @@
+# The global sensitivity analysis of air_quality_sensitivity: the Sobol and
+# Morris estimators on test functions with known indices, and the factors
+# at their nominal values giving the street's own output.
+
+import numpy as np
+import pytest
+
+import air_quality_code
+from air_quality_code import compute_street
+from air_quality_sensitivity import (morris_design, morris_indices, saltelli_design, sensitivity_analysis,
+                                     sobol_indices, street_samples)
+from air_quality_uncertainty import SampledStreet
+from test_consistency import case_streets, met_store
+
+
+# nominal value of each factor: the model's own constants and inputs
+nominal_factors = {"horizontal_dispersion": 0.1, "vertical_dispersion": 0.1, "recirculation": 0.1, "deciduous": 0.5,
+                   "tree_spacing": 1, "new_barrier_obstruction": 1, "existing_barrier_obstruction": 1,
+                   "emissions": 1, "background": 1, "wind_speed": 1}
+
+
+def test_sobol_additive():
+    # f = 3 x1 + x2 (+ 0 x3) on the unit cube: S1 = ST = 9/10, 1/10 and 0
+    n, d = 4096, 3
+    x = saltelli_design(n, d, seed=0)
+    f = 3*x[:,0] + x[:,1]
+    indices = sobol_indices(f, n, d)
+    for index in ("S1", "ST"):
+        np.testing.assert_allclose(indices[index], [0.9, 0.1, 0], atol=0.02)
+
+
+def test_sobol_interaction():
+    # f = x1 x2 with x uniform on [0, 1]: var 7/144, of which x1 and x2 each
+    # explain 3/144 alone and 4/144 in total
+    n, d = 8192, 2
+    x = saltelli_design(n, d, seed=0)
+    indices = sobol_indices(x[:,0]*x[:,1], n, d)
+    np.testing.assert_allclose(indices["S1"], [3/7, 3/7], atol=0.03)
+    np.testing.assert_allclose(indices["ST"], [4/7, 4/7], atol=0.03)
+
+
+def test_morris_linear():
+    # the elementary effects of a linear function are its coefficients
+    coefficients = np.array([2, -1, 0.5, 0])
+    points, order, signs, delta = morris_design(20, len(coefficients), seed=0)
+    indices = morris_indices(points @ coefficients, order, signs, delta)
+    np.testing.assert_allclose(indices["mu"], coefficients)
+    np.testing.assert_allclose(indices["mu_star"], np.abs(coefficients))
+    np.testing.assert_allclose(indices["sigma"], 0, atol=1e-12)
+
+    # each trajectory steps every factor exactly once
+    steps = np.diff(points.reshape(20, len(coefficients) + 1, -1), axis=1)
+    assert ((steps != 0).sum(axis=2) == 1).all()
+    assert ((steps != 0).sum(axis=1) == 1).all()
+
+
+@pytest.mark.parametrize("name", ["deciduous hedge", "hedge with trees", "existing barrier"])
+def test_nominal_factors(name):
+    air_quality_code.use_met_store(met_store)
+    street = SampledStreet(case_streets[name])
+    names = list(nominal_factors)
+    samples = street_samples(street, names, np.array([[nominal_factors[k] for k in names]]), {})
+    no2, pm25 = street.evaluate(samples, "interpreted")
+
+    expected = compute_street(case_streets[name])
+    np.testing.assert_allclose(no2[0], expected["per_change_no2"], atol=1e-6)
+    np.testing.assert_allclose(pm25[0], expected["per_change_pm25"], atol=1e-6)
+
+
+def test_fixed_factors():
+    # factors held fixed are left out of the analysis
+    bounds = {name: (value, value) for name, value in nominal_factors.items()}
+    bounds.update(emissions=(0.7, 1.3), wind_speed=(0.8, 1.2))
+    indices, n = sensitivity_analysis(case_streets["example"], method="morris", trajectories=4, bounds=bounds,
+                                      seed=0, workers=2, met_store=met_store)
+    assert n == 4*3
+    assert set(indices["factor"]) == {"emissions", "wind_speed"}
+    assert np.isfinite(indices[["mu", "mu_star", "sigma"]].to_numpy(dtype=float)).all()
+
+    with pytest.raises(ValueError):
+        sensitivity_analysis(case_streets["example"], bounds={"traffic": (0, 1)})
@@ -0,0 +1,69 @@
+# The Monte Carlo of air_quality_uncertainty: with no spread every sample is
+# the street's own output, and a perturbed sample is the model run with those
+# inputs.
+
+import numpy as np
+import pytest
+
+import air_quality_code
+from air_quality_code import assemble_systems, compute_street, flow_patterns, parallel_patterns, solve_street
+from air_quality_uncertainty import SampledStreet, draw_samples, monte_carlo, uncertain_inputs
+from test_consistency import case_streets, met_store
+
+
+# largest difference between a sample and the model run with its inputs
+# (percentage points; the samples are solved at unit speed and scaled)
+sample_tolerance = 1e-6
+
+no_spread = {name: {"distribution": "fixed"} for name in uncertain_inputs}
+
+
+@pytest.fixture(scope="module", autouse=True)
+def stored_met():
+    air_quality_code.use_met_store(met_store)
+
+
+@pytest.mark.parametrize("name", ["example", "hedge with trees", "two carriageways"])
+def test_no_spread(name):
+    street = compute_street(case_streets[name])
+    bands, draws = monte_carlo(case_streets[name], n_samples=20, distributions=no_spread, seed=0,
+                               backend="interpreted")
+    for pollutant in ("no2", "pm25"):
+        np.testing.assert_allclose(draws[pollutant], np.tile(street["per_change_" + pollutant], (20, 1)),
+                                   atol=sample_tolerance)
+        rows = bands[bands["pollutant"] == pollutant]
+        np.testing.assert_allclose(rows["mean"], street["per_change_" + pollutant], atol=sample_tolerance)
+        np.testing.assert_allclose(rows["p5"], rows["p95"], atol=sample_tolerance)
+
+
+@pytest.mark.parametrize("name", ["example", "existing barrier", "east wind"])
+def test_samples(name):
+    # each sample against the model with the sampled obstruction, dispersion,
+    # emissions, backgrounds and wind speeds put into the street state
+    sampled = SampledStreet(case_streets[name])
+    _, samples = draw_samples(sampled, 3, seed=1)
+    no2, pm25 = sampled.evaluate(samples, "interpreted")
+    for i in range(3):
+        state = dict(sampled.state)
+        obs = samples["obs_original"][i]
+        obs_mirror = obs[[2, 3, 0, 1]]
+        constants = tuple(samples["constants"][i])
+        state.update(ubg_orig=samples["ubg"][i,0], ubg_mir=samples["ubg"][i,1], ubg_parallel=samples["ubg"][i,2])
+        state.update(flow_patterns(state, obs=(obs, obs_mirror), constants=constants))
+        state.update(obs_original=obs, obs_mirror=obs_mirror)
+        state.update(parallel_patterns(state, constants=constants))
+        for k, pollutant in enumerate(("no2", "pm25")):
+            for side in ("orig", "mir"):
+                key = "ez_tot_%s_%s" % (pollutant, side)
+                state[key] = state[key]*samples["emissions"][i,k]
+        state["cB_no2"], state["cB_pm25"] = samples["background"][i]
+        state.update(assemble_systems(state))
+        street = solve_street(state)
+
+        np.testing.assert_allclose(no2[i], street["per_change_no2"], atol=sample_tolerance)
+        np.testing.assert_allclose(pm25[i], street["per_change_pm25"], atol=sample_tolerance)
+
+
+def test_unknown_input():
+    with pytest.raises(ValueError):
+        monte_carlo(case_streets["example"], n_samples=2, distributions={"traffic": {"distribution": "fixed"}})